@@ -1,15 +1,26 @@
+import time
+from contextlib import contextmanager
+
 import pvaccess
 
+from malcolm.compat import OrderedDict
 from malcolm.core.loggable import Loggable
 from malcolm.comms.pva.pvautil import PvaUtil
 from malcolm.core import ClientComms, Request
-from malcolm.core.request import Get, Put, Post, Subscribe
+from malcolm.core.request import Get, Put, Post, Subscribe, Unsubscribe, \
+    PutMany
 from malcolm.core.response import Update, Return, Error
 
 
+# Seconds a pooled Channel or RpcClient can be unused before it is dropped
+IDLE_TIMEOUT = 60.0
+
+
 class PvaClientComms(ClientComms, PvaUtil):
     """A class for a client to communicate with the server"""
 
+    put_many_supported = True
+
     def __init__(self, process, _=None):
         """
         Args:
@@ -20,6 +31,12 @@ class PvaClientComms(ClientComms, PvaUtil):
         self.name = "PvaClientComms"
         self.set_logger_name(self.name)
         self._monitors = {}
+        self._pool = PvaConnectionPool()
+
+    def send_loop(self):
+        """Service self.q in a thread, as the pvaccess calls that send the
+        requests block, so it mustn't run on an event loop"""
+        ClientComms.send_loop(self)
 
     def send_to_server(self, request):
         """Dispatch a request to the server
@@ -38,6 +55,11 @@ class PvaClientComms(ClientComms, PvaUtil):
                 self.log_debug("Put message with value: %s", request["value"])
                 return_object = self.execute_put(request)
 
+            elif isinstance(request, PutMany):
+                self.log_debug("PutMany message with endpoint: %s", request["endpoint"])
+                self.log_debug("PutMany message with values: %s", request["values"])
+                return_object = self.execute_put_many(request)
+
             elif isinstance(request, Post):
                 self.log_debug("Post message with endpoint: %s", request["endpoint"])
                 self.log_debug("Parameters: %s", request["parameters"])
@@ -46,7 +68,16 @@ class PvaClientComms(ClientComms, PvaUtil):
             elif isinstance(request, Subscribe):
                 self.log_debug("Subscribe message with endpoint: %s", request["endpoint"])
                 return_object = self.execute_monitor(request)
-            # TODO: Implement unsubscribe
+
+            elif isinstance(request, Unsubscribe):
+                self.log_debug("Unsubscribe message with id: %s", request["id"])
+                return_object = self.execute_unsubscribe(request)
+
+            else:
+                # Reply rather than leave the caller waiting forever
+                return_object = Error(
+                    id_=request["id"],
+                    message="%s not supported" % request.typeid)
             # TODO: Currently monitors always return updates, deltas are not available
 
         except:
@@ -58,16 +89,18 @@ class PvaClientComms(ClientComms, PvaUtil):
             self.send_to_caller(return_object)
 
     def execute_get(self, request):
-        # Connect to the channel
-        c = pvaccess.Channel(request["endpoint"][0])
+        # Get a connected channel from the pool
+        block = request["endpoint"][0]
+        c = self._pool.get_channel(block)
         # Create the path request from the endpoints (not including the block name endpoint)
         path = ".".join(request["endpoint"][1:])
         self.log_debug("path: %s", path)
         # Perform a get and record the response
-        response = c.get(path)
+        with self._pool.evict_on_error(block):
+            response = c.get(path)
         self.log_debug("Response: %s", response)
         # Now create the Return object and populate it with the response
-        value = response.toDict(True)
+        value = self.pv_object_to_dict(response)
         if 'typeid' in value:
             if value['typeid'] == 'malcolm:core/Error:1.0':
                 return_object = Error(id_=request["id"], message=value['message'])
@@ -78,30 +111,46 @@ class PvaClientComms(ClientComms, PvaUtil):
         return return_object
 
     def execute_put(self, request):
-        # Connect to the channel
-        c = pvaccess.Channel(request["endpoint"][0])
+        # Get a connected channel from the pool
+        block = request["endpoint"][0]
+        c = self._pool.get_channel(block)
         # Create the path request from the endpoints (not including the block name endpoint)
         path = ".".join(request["endpoint"][1:])
         self.log_debug("path: %s", path)
         # Perform a put, but there is no response available
-        c.put(request["value"], path)
+        with self._pool.evict_on_error(block):
+            c.put(request["value"], path)
         # Now create the Return object and populate it with the response
         return_object = Return(id_=request["id"], value="No return value from put")
         return return_object
 
+    def execute_put_many(self, request):
+        # Get a connected channel from the pool
+        block = request["endpoint"][0]
+        c = self._pool.get_channel(block)
+        # Put each attribute value through the same channel, there is no
+        # response available
+        with self._pool.evict_on_error(block):
+            for name, value in request["values"].items():
+                path = ".".join(request["endpoint"][1:] + [name, "value"])
+                self.log_debug("path: %s", path)
+                c.put(value, path)
+        return_object = Return(id_=request["id"], value="No return value from put")
+        return return_object
+
     def execute_rpc(self, request):
-        method = pvaccess.PvObject({'method': pvaccess.STRING})
-        method.set({'method': request["endpoint"][1]})
-        # Connect to the channel and create the RPC client
-        rpc = pvaccess.RpcClient(request["endpoint"][0], method)
+        # Get an RPC client for this method from the pool
+        block, method = request["endpoint"][:2]
+        rpc = self._pool.get_rpc_client(block, method)
         # Construct the pv object from the parameters
         params = self.dict_to_pv_object(request["parameters"])
         self.log_debug("PvObject parameters: %s", params)
         # Call the method on the RPC object
-        response = rpc.invoke(params)
+        with self._pool.evict_on_error((block, method)):
+            response = rpc.invoke(params)
         self.log_debug("Response: %s", response)
         # Now create the Return object and populate it with the response
-        value = response.toDict(True)
+        value = self.pv_object_to_dict(response)
         if 'typeid' in value:
             if value['typeid'] == 'malcolm:core/Error:1.0':
                 return_object = Error(id_=request["id"], message=value['message'])
@@ -112,14 +161,14 @@ class PvaClientComms(ClientComms, PvaUtil):
         return return_object
 
     def execute_monitor(self, request):
-        # Connect to the channel
+        # A channel can only have one monitor, so don't use the pool
         c = pvaccess.Channel(request["endpoint"][0])
-        # Store the connection within the monitor set
-        mon = MonitorHandler(request["id"], c, self)
-        self._monitors[request["id"]] = mon
         # Create the path request from the endpoints (not including the block name endpoint)
         path = ".".join(request["endpoint"][1:])
         self.log_debug("Monitor path: %s", path)
+        # Store the connection within the monitor set
+        mon = MonitorHandler(request["id"], c, self, path)
+        self._monitors[request["id"]] = mon
         # Perform a put, but there is no response available
         c.subscribe(path, mon.monitor_update)
         self.log_debug("Created subscription")
@@ -127,18 +176,120 @@ class PvaClientComms(ClientComms, PvaUtil):
         self.log_debug("Started monitor")
         return None
 
+    def execute_unsubscribe(self, request):
+        mon = self._monitors.pop(request["id"], None)
+        if mon is None:
+            return Error(id_=request["id"],
+                         message="No subscription found for id %s" % request["id"])
+        mon.stop()
+        self.log_debug("Stopped monitor")
+        return Return(id_=request["id"])
+
+
+class PvaConnectionPool(Loggable):
+    """Channels and RpcClients kept connected between requests, so each one
+    doesn't pay for a channel search and connection. Channels that have
+    disconnected are replaced, and anything unused for idle_timeout seconds is
+    dropped"""
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.set_logger_name("PvaConnectionPool")
+        self.idle_timeout = idle_timeout
+        # {key: (connection, last_used)}, least recently used first
+        self._connections = OrderedDict()
+
+    def get_channel(self, block):
+        """Get a connected Channel to block
+
+        Args:
+            block (str): The name of the block
+
+        Returns:
+            pvaccess.Channel: The channel
+        """
+        return self._get(block, self._channel_connected, pvaccess.Channel, block)
+
+    def get_rpc_client(self, block, method):
+        """Get an RpcClient for calling method on block
+
+        Args:
+            block (str): The name of the block
+            method (str): The name of the method
+
+        Returns:
+            pvaccess.RpcClient: The client
+        """
+        return self._get((block, method), None, self._create_rpc_client,
+                         block, method)
+
+    def _create_rpc_client(self, block, method):
+        request = pvaccess.PvObject({'method': pvaccess.STRING})
+        request.set({'method': method})
+        return pvaccess.RpcClient(block, request)
+
+    def _channel_connected(self, channel):
+        return channel.isConnected()
+
+    def _get(self, key, check, create, *args):
+        now = time.time()
+        self.evict_idle(now)
+        try:
+            connection, _ = self._connections.pop(key)
+        except KeyError:
+            self.log_debug("Connecting %s", key)
+            connection = create(*args)
+        else:
+            if check and not check(connection):
+                self.log_debug("Reconnecting %s", key)
+                connection = create(*args)
+        # Put it at the end as it is now the most recently used
+        self._connections[key] = (connection, now)
+        return connection
+
+    def evict_idle(self, now=None):
+        """Drop the connections that haven't been used for idle_timeout"""
+        if now is None:
+            now = time.time()
+        while self._connections:
+            key, (_, last_used) = next(iter(self._connections.items()))
+            if now - last_used < self.idle_timeout:
+                break
+            self.log_debug("Dropping idle connection %s", key)
+            self._connections.pop(key)
+
+    def evict(self, key):
+        """Drop the connection for key so the next request makes a new one"""
+        self._connections.pop(key, None)
+
+    @contextmanager
+    def evict_on_error(self, key):
+        """Context manager that drops the connection for key if the block
+        inside raises, then re-raises"""
+        try:
+            yield
+        except Exception:
+            self.log_debug("Dropping connection %s after error", key)
+            self.evict(key)
+            raise
+
 
 class MonitorHandler(Loggable):
-    def __init__(self, id, channel, client):
+    def __init__(self, id, channel, client, path=""):
         self.set_logger_name("MonitorHandler")
         self._id = id
         self._channel = channel
         self._client = client
+        self._path = path
+
+    def stop(self):
+        """Stop the monitor and release the subscription"""
+        self._channel.stopMonitor()
+        self._channel.unsubscribe(self._path)
 
     def monitor_update(self, response):
         self.log_debug("Monitor Update called: %s", response)
         # Create the Update object and populate it with the response
-        value = response.toDict(True)
+        value = self._client.pv_object_to_dict(response)
         if 'typeid' in value:
             if value['typeid'] == 'malcolm:core/Error:1.0':
                 return_object = Error(id_=self._id, message=value['message'])
@@ -1,23 +1,56 @@
+import time
+import weakref
 from threading import Event, Lock, RLock
 
 import pvaccess
 
 from malcolm.compat import OrderedDict
 from malcolm.comms.pva.pvautil import PvaUtil
+from malcolm.core.cache import Cache, collapse_changes
 from malcolm.core.loggable import Loggable
 from malcolm.core.servercomms import ServerComms
 from malcolm.core.methodmeta import method_takes
-from malcolm.core.request import Error, Get, Post, Put, Subscribe
+from malcolm.core.request import Error, Get, Post, Put, Subscribe, \
+    Unsubscribe
 from malcolm.core.response import Return, Update, Delta
+from malcolm.core.vmetas import NumberMeta
 
 
-@method_takes()
+# Default maximum number of monitor updates per second for each block, 0 for
+# no limit. Faster changes are conflated rather than sent to every client
+MAX_UPDATE_RATE = 10
+# Default number of seconds a PVA RPC waits for its method to finish, 0 for
+# no limit. Each waiting RPC holds a pvaccess thread, so this stops slow
+# methods from using them all up
+RPC_TIMEOUT = 300
+
+
+@method_takes(
+    "maxUpdateRate", NumberMeta(
+        "float64", "Max monitor updates per second for each block, 0 for no "
+        "limit"), MAX_UPDATE_RATE,
+    "rpcTimeout", NumberMeta(
+        "float64", "Seconds a PVA RPC waits for its method to finish before "
+        "replying with an Error, 0 for no limit"), RPC_TIMEOUT)
 class PvaServerComms(ServerComms, PvaUtil):
     """A class for communication between pva client and server"""
     CACHE_UPDATE = 0
 
-    def __init__(self, process, _=None):
+    def __init__(self, process, params=None):
         super(PvaServerComms, self).__init__(process)
+        if params:
+            max_update_rate = params["maxUpdateRate"]
+            rpc_timeout = params["rpcTimeout"]
+        else:
+            max_update_rate = MAX_UPDATE_RATE
+            rpc_timeout = RPC_TIMEOUT
+        if max_update_rate > 0:
+            self._min_update_period = 1.0 / max_update_rate
+        else:
+            self._min_update_period = 0
+        # Each RPC holds a pvaccess thread until it replies, so this limits
+        # how long a slow method can keep one
+        self.rpc_timeout = rpc_timeout if rpc_timeout > 0 else None
 
         self.name = "PvaServerComms"
         self.set_logger_name(self.name)
@@ -34,12 +67,18 @@ class PvaServerComms(ServerComms, PvaUtil):
         self._server = None
         self._endpoints = {}
         self._cb = None
+        # {block_name: PvaBlockCache}
+        self._block_caches = {}
+        # {subscription_id: PvaBlockCache}
+        self._block_cache_ids = {}
+        # {PvaBlockCache} with monitor updates held back by the rate limit
+        self._held_back_caches = set()
 
         self._gets = {}
         self._rpcs = {}
         self._puts = {}
-        self._monitors = {}
-        self._dead_rpcs = []
+        # Only hold monitors weakly, as pvaccess can't tell us when they die
+        self._monitors = weakref.WeakValueDictionary()
 
         # Create the V4 PVA server object
         self.create_pva_server()
@@ -76,6 +115,7 @@ class PvaServerComms(ServerComms, PvaUtil):
             # Now loop over any remaining old blocks and remove their subscriptions
             for name in old_blocks:
                 self.log_debug("Removing stale malcolm block: %s", name)
+                self._remove_block_cache(name)
 
     def _update_remote_block_list(self, block_list):
         with self._lock:
@@ -92,6 +132,71 @@ class PvaServerComms(ServerComms, PvaUtil):
             # Now loop over any remaining old blocks and remove their subscriptions
             for name in old_blocks:
                 self.log_debug("Removing stale malcolm block: %s", name)
+                self._remove_block_cache(name)
+
+    def _add_block_cache(self, block):
+        """Subscribe to the whole of block so Gets can be served from memory
+
+        Args:
+            block (str): The name of the block to cache
+        """
+        with self._lock:
+            block_cache = PvaBlockCache(
+                self.name, block, self, self._min_update_period)
+            sub_id = self._get_unique_id()
+            self._block_caches[block] = block_cache
+            self._block_cache_ids[sub_id] = block_cache
+        request = Subscribe(None, self.q, [block], True)
+        request.set_id(sub_id)
+        self.send_to_process(request)
+
+    def _remove_block_cache(self, block):
+        with self._lock:
+            block_cache = self._block_caches.pop(block, None)
+            if block_cache is None:
+                return
+            block_cache.close()
+            for sub_id, cache in list(self._block_cache_ids.items()):
+                if cache is block_cache:
+                    self._block_cache_ids.pop(sub_id)
+                    self._send_unsubscribe(sub_id)
+
+    def _send_unsubscribe(self, sub_id):
+        request = Unsubscribe(None, self.q)
+        request.set_id(sub_id)
+        self.send_to_process(request)
+
+    def get_cached_pv_object(self, block, path):
+        """Return a PvObject for path within block from the block cache
+
+        Args:
+            block (str): The name of the block
+            path (list): The path within the block, e.g. ["attr", "value"]
+
+        Returns:
+            PvObject: The structure, or None if the block is not cached yet
+        """
+        block_cache = self._block_caches.get(block, None)
+        if block_cache is not None:
+            return block_cache.get_pv_object(path)
+
+    def add_block_monitor(self, block, monitor):
+        """Add a monitor to be updated from the block cache
+
+        Args:
+            block (str): The name of the block
+            monitor (PvaMonitorImplementation): The monitor to add
+
+        Returns:
+            PvObject: The monitor's structure, or None if the block is not
+            cached yet
+        """
+        return self._block_caches[block].add_monitor(monitor)
+
+    def send_loop(self):
+        """Service self.q in a thread, as sending responses takes locks that
+        the pvaccess threads hold, so it mustn't run on an event loop"""
+        ServerComms.send_loop(self)
 
     def send_to_client(self, response):
         """Abstract method to dispatch response to a client
@@ -104,7 +209,7 @@ class PvaServerComms(ServerComms, PvaUtil):
             if response["id"] in self._gets:
                 self._gets[response["id"]].notify_reply(response)
             elif response["id"] in self._rpcs:
-                self._rpcs[response["id"]].notify_reply(response)
+                self._reply_rpc(response)
             elif response["id"] in self._puts:
                 self._puts[response["id"]].notify_reply(response)
             elif response["id"] in self._monitors:
@@ -113,15 +218,25 @@ class PvaServerComms(ServerComms, PvaUtil):
             if response["id"] in self._gets:
                 self._gets[response["id"]].notify_reply(response)
             elif response["id"] in self._rpcs:
-                self._rpcs[response["id"]].notify_reply(response)
+                self._reply_rpc(response)
             elif response["id"] in self._puts:
                 self._puts[response["id"]].notify_reply(response)
             elif response["id"] in self._monitors:
                 self._monitors[response["id"]].notify_reply(response)
         elif isinstance(response, Delta):
-            # Check for any monitors registered for this delta
-            if response["id"] in self._monitors:
-                self._monitors[response["id"]].update(response["changes"])
+            # Block caches update any monitors on their block
+            if response["id"] in self._block_cache_ids:
+                block_cache = self._block_cache_ids[response["id"]]
+                if block_cache.apply_changes(response["changes"]):
+                    self._held_back_caches.add(block_cache)
+            else:
+                # Monitors with a period or deadband have their own
+                # subscription, which we stop if the monitor has gone
+                monitor = self._monitors.get(response["id"], None)
+                if monitor is None:
+                    self._send_unsubscribe(response["id"])
+                else:
+                    monitor.update(response["changes"])
         elif isinstance(response, Update):
             # Check if the message contains block names
             if response["id"] == self._local_block_id:
@@ -129,6 +244,24 @@ class PvaServerComms(ServerComms, PvaUtil):
             if response["id"] == self._remote_block_id:
                 self._update_remote_block_list(response["value"])
 
+    def send_held_back(self):
+        """Send the monitor updates held back by block caches that are due
+
+        Returns:
+            float: Seconds until the next ones are due, None if there aren't
+            any
+        """
+        next_due = None
+        now = time.time()
+        for block_cache in list(self._held_back_caches):
+            due = block_cache.flush_if_due(now)
+            if due is None:
+                self._held_back_caches.discard(block_cache)
+            elif next_due is None or due < next_due:
+                next_due = due
+        if next_due is not None:
+            return max(next_due - now, 0)
+
     def _add_new_pva_channel(self, block):
         """Create a new PVA endpoint for the block name
 
@@ -137,6 +270,7 @@ class PvaServerComms(ServerComms, PvaUtil):
         """
         self.log_debug("Creating PVA endpoint for %s", block)
         self._endpoints[block] = PvaEndpoint(self.name, block, self._server, self)
+        self._add_block_cache(block)
 
     def create_pva_server(self):
         #self.log_debug("Creating PVA server object")
@@ -156,6 +290,20 @@ class PvaServerComms(ServerComms, PvaUtil):
             self.log_debug("Registering RPC object with ID %d", id)
             self._rpcs[id] = rpc
 
+    def remove_rpc(self, id):
+        """Forget about an RPC, returning it if it was still waiting for its
+        reply, or None if it has already had one"""
+        with self._lock:
+            self.log_debug("Removing RPC object with ID %d", id)
+            return self._rpcs.pop(id, None)
+
+    def _reply_rpc(self, response):
+        # The RPC has had its reply, so we can forget about it. If it timed
+        # out first then it has already been removed and replied with an Error
+        rpc = self.remove_rpc(response["id"])
+        if rpc is not None:
+            rpc.notify_reply(response)
+
     def register_monitor(self, id, monitor):
         with self._lock:
             self.log_debug("Registering monitor object with ID %d", id)
@@ -183,26 +331,213 @@ class PvaServerComms(ServerComms, PvaUtil):
             if id in self._puts:
                 self._puts.pop(id, None)
 
-    def register_dead_rpc(self, id):
+
+class PvaBlockCache(Loggable):
+    """A copy of a block kept current by a delta subscription, with a PvObject
+    cached for each path that has been asked for. A cached PvObject is shared
+    by every Get of its path until something below it changes. It is never
+    modified, as pvaccess may still be sending it, but dropped so the next Get
+    builds a new one.
+
+    It also holds the monitor state for the block, so every monitor client is
+    fed from the one subscription. Changes are collected and sent to the
+    monitors at most once every min_period seconds, with changes to the same
+    field conflated, and each monitor only has the fields that changed set.
+    """
+
+    def __init__(self, name, block, server, min_period=0):
+        """
+        Args:
+            name (str): Name of the server, for logging
+            block (str): The name of the block to cache
+            server (PvaServerComms): The server, for PvObject conversions
+            min_period (float): Minimum time between monitor updates
+        """
+        self.set_logger_name("%s.%s" % (name, block))
+        self._block = block
+        self._server = server
+        self._min_period = min_period
+        self._lock = Lock()
+        self._cache = Cache()
+        # Whether we have had the first Delta with the whole block in it
+        self._ready = False
+        # {path_tuple: PvObject}
+        self._pv_objects = {}
+        # {PvaMonitorImplementation}, dropped when nothing else refers to them
+        self._monitors = weakref.WeakSet()
+        # Changes that haven't been sent to the monitors yet
+        self._pending = []
+        self._last_flush = 0
+        # When the held back changes should be flushed, None if there are none
+        self._flush_due = None
+
+    def apply_changes(self, changes):
+        """Apply a Delta from the block subscription
+
+        Args:
+            changes (list): [[path, value]] changes relative to the block
+
+        Returns:
+            bool: True if the monitor updates have been held back, and
+            flush_if_due() needs to be called to send them
+        """
         with self._lock:
-            self.log_debug("Notifying server that RPC [%d] can be tested for purging", id)
-            self._dead_rpcs.append(id)
+            self._cache.apply_changes(*changes)
+            self._ready = True
+            for path in list(self._pv_objects):
+                if any(self._affects(path, c[0]) for c in changes):
+                    self._pv_objects.pop(path)
+            if not self._monitors:
+                return False
+            self._pending += changes
+            if self._flush_due is not None:
+                # The changes will be conflated into the pending flush
+                return True
+            due = self._last_flush + self._min_period
+            if due > time.time():
+                self._flush_due = due
+                return True
+        self.flush_monitors()
+        return False
+
+    def flush_if_due(self, now):
+        """Flush the held back changes to the monitors if they are due
 
-    def purge_rpcs(self):
+        Args:
+            now (float): The current time
+
+        Returns:
+            float: The time they will be due, None if there are none left
+        """
         with self._lock:
-            rpc_list = list(self._dead_rpcs)
-            for id in rpc_list:
-                self.log_debug("Testing for purge RPC [%d]", id)
-                if id in self._rpcs:
-                    if self._rpcs[id].check_lock():
-                        # We've gained the lock, so we are OK to purge this RPC
-                        self.log_debug("Purging dead RPC [%d]", id)
-                        self._rpcs.pop(id, None)
-                        self._dead_rpcs.remove(id)
-                else:
-                    self.log_debug("RPC [%d] was not present (already purged?)", id)
-                    if id in self._dead_rpcs:
-                        self._dead_rpcs.remove(id)
+            due = self._flush_due
+        if due is not None and now >= due:
+            self.flush_monitors()
+            due = None
+        return due
+
+    def flush_monitors(self):
+        """Set the changes since the last flush into each monitor's structure
+        and tell the monitors that have changed to send an update"""
+        with self._lock:
+            self._flush_due = None
+            self._last_flush = time.time()
+            changes = collapse_changes(self._pending)
+            self._pending = []
+            # [PvaMonitorImplementation] that have had a field set
+            updated = []
+            for monitor in list(self._monitors):
+                fields = [self._set_monitor_value(monitor, change)
+                          for change in changes
+                          if self._affects(monitor.path, change[0])]
+                if any(fields):
+                    updated.append(monitor)
+        for monitor in updated:
+            monitor.notify_updates()
+
+    def _affects(self, path, change_path):
+        n = min(len(path), len(change_path))
+        return tuple(change_path[:n]) == path[:n]
+
+    def _set_value(self, path, pv_object, change):
+        """Set a value change below path into pv_object
+
+        Returns:
+            str: The name of the field that was set, or None if the change
+            alters the structure so can't be set in place
+        """
+        change_path = change[0]
+        if len(change) == 1 or len(change_path) <= len(path):
+            # Deletion, or replacement of the whole path or one of its parents
+            return None
+        value = change[1]
+        if value is None or isinstance(value, dict):
+            # Might have added or removed fields
+            return None
+        field = ".".join(change_path)
+        if not pv_object.hasField(field):
+            return None
+        try:
+            pv_object[field] = self._server.value_for_pva_set(value)
+        except Exception:  # pylint:disable=broad-except
+            self.log_debug("Can't set %s to %r in place", field, value)
+            return None
+        return field
+
+    def _set_monitor_value(self, monitor, change):
+        """Set change into the monitor's structure
+
+        Returns:
+            str: The name of the field that was set, or None on failure
+        """
+        pv_object = monitor.getPVStructure()
+        field = self._set_value(monitor.path, pv_object, change)
+        if field is None:
+            # A monitor can't change its structure, so set all of its fields
+            field = ".".join(monitor.path)
+            try:
+                value = self._cache.walk_path(monitor.path)
+                pv_object.set(self._server.value_for_pva_set(
+                    self._wrap(monitor.path, value)))
+            except Exception:  # pylint:disable=broad-except
+                self.log_exception("Can't update monitor of %s", field)
+                return None
+        return field
+
+    def _wrap(self, path, value):
+        for ep in reversed(path):
+            value = {ep: value}
+        return value
+
+    def _make_pv_object(self, path):
+        return self._server.dict_to_pv_object(
+            self._wrap(path, self._cache.walk_path(path)))
+
+    def get_pv_object(self, path):
+        """Get a PvObject for path, building and caching it if necessary
+
+        Args:
+            path (list): The path within the block, e.g. ["attr", "value"]
+
+        Returns:
+            PvObject: The structure, or None if the first Delta hasn't arrived
+        """
+        path = tuple(path)
+        with self._lock:
+            if not self._ready:
+                return None
+            try:
+                return self._pv_objects[path]
+            except KeyError:
+                pass
+            pv_object = self._make_pv_object(path)
+            self._pv_objects[path] = pv_object
+            return pv_object
+
+    def add_monitor(self, monitor):
+        """Add a monitor to be updated from this block
+
+        Args:
+            monitor (PvaMonitorImplementation): The monitor to add. Its path
+                attribute is the path within the block it is monitoring
+
+        Returns:
+            PvObject: A new structure for the monitor to own, or None if the
+            first Delta hasn't arrived
+        """
+        with self._lock:
+            self._monitors.add(monitor)
+            if self._ready:
+                return self._make_pv_object(monitor.path)
+
+    def close(self):
+        """Forget our PvObjects and monitors as the block has gone"""
+        with self._lock:
+            self._ready = False
+            self._pv_objects.clear()
+            self._monitors.clear()
+            self._pending = []
+            self._flush_due = None
 
 
 class PvaEndpoint(Loggable):
@@ -219,7 +554,6 @@ class PvaEndpoint(Loggable):
         # TODO: There is no way to eliminate dead RPC connections
         self._endpoint.registerEndpointRPC(self.rpc_callback)
         # TODO: There is no way to eliminate dead monitors
-        # TODO: Monitors do not support deltas
         self._endpoint.registerEndpointMonitor(self.monitor_callback)
         self._pva_server.registerEndpoint(self._block, self._endpoint)
 
@@ -228,8 +562,6 @@ class PvaEndpoint(Loggable):
         self.log_debug("Request structure: %s", request.toDict())
         mon_id = self._server._get_unique_id()
         pva_impl = PvaMonitorImplementation(mon_id, request, self._block, self._server)
-        pva_impl.send_get_request()
-        self._server.register_monitor(mon_id, pva_impl)
         pva_impl.send_subscription()
         return pva_impl
 
@@ -252,16 +584,16 @@ class PvaEndpoint(Loggable):
     def rpc_callback(self, request):
         self.log_debug("Rpc callback called for %s", self._block)
         self.log_debug("Request structure: %s", request)
-        # Purge old RPCs
-        self._server.purge_rpcs()
         rpc_id = self._server._get_unique_id()
         self.log_debug("RPC ID: %d", rpc_id)
         rpc = PvaRpcImplementation(rpc_id, request, self._block, self._server)
-        self._server.register_rpc(rpc_id, rpc)
         return rpc.execute
 
 
 class PvaImplementation(Loggable):
+    # Whether send_get_request can use a PvObject shared with other requests
+    _use_cache = True
+
     def __init__(self, id, request, block, server):
         self._id = id
         self._block = block
@@ -273,10 +605,6 @@ class PvaImplementation(Loggable):
         self._lock = Lock()
         self._pv_structure = None
 
-    def check_lock(self):
-        # Check the lock to see if it is still acquired
-        return self._lock.acquire(False)
-
     def wait_for_reply(self, timeout=2.0):
         # wait on the reply event
         self._event.wait(timeout)
@@ -289,8 +617,14 @@ class PvaImplementation(Loggable):
     def send_get_request(self):
         self.log_debug("send_get_request called with request: %s", self._request)
         try:
-            self._server.register_get(self._id, self)
             endpoints = [self._block] + self.dict_to_path(self._request.toDict())
+            if self._use_cache:
+                pv_object = self._server.get_cached_pv_object(
+                    self._block, endpoints[1:])
+                if pv_object is not None:
+                    self._pv_structure = pv_object
+                    return
+            self._server.register_get(self._id, self)
             msg = Get(response_queue=self._server.q, endpoint=endpoints)
             msg.set_id(self._id)
             with self._lock:
@@ -402,60 +736,145 @@ class PvaRpcImplementation(PvaImplementation):
             return item_in
 
     def execute(self, args):
+        """Called by pvaccess to run the method. Sends a Post to the process,
+        then waits for notify_reply() to make the reply from its Return.
+
+        pvaccess needs the reply returned from here, so this holds a pvaccess
+        thread until the method finishes, or until the server's rpc_timeout
+        when it replies with an Error. The method carries on running in the
+        process, and its Return is dropped"""
         self.log_debug("Execute %s method called on [%s] with: %s", self._method, self._block, args)
         self.log_debug("Structure: %s", args.getStructureDict())
-        # Acquire the lock
-        with self._lock:
-            try:
-                # We now need to create the Post message and execute it
-                endpoint = [self._block, self._method]
-                request = Post(None, self._server.q, endpoint, self.parse_variants(args.toDict(True)))
-                request.set_id(self._id)
-                self._server.process.q.put(request)
-
-                # Now wait for the Post reply
-                self.log_debug("Waiting for reply")
-                self.wait_for_reply(timeout=None)
-                self.log_debug("Reply received %s %s", type(self._response), self._response)
-                response_dict = OrderedDict()
-                if isinstance(self._response, Return):
-                    response_dict = self._response["value"]
-                    self.log_debug("Response value : %s", response_dict)
-                elif isinstance(self._response, Error):
-                    response_dict = self._response.to_dict()
-                    response_dict.pop("id")
-
-                if not response_dict:
-                    pv_object = pvaccess.PvObject(OrderedDict(), 'malcolm:core/Map:1.0')
-                else:
-                    #pv_object = self._server.dict_to_structure(response_dict)
-                    #self.log_debug("Pv Object structure created")
-                    #self.log_debug("%s", self._server.strip_type_id(response_dict))
-                    #pv_object.set(self._server.strip_type_id(response_dict))
-                    pv_object = self._server.dict_to_pv_object(response_dict)
-                self.log_debug("Pv Object value set: %s", pv_object)
-                # Add this RPC to the purge list
-                #self._server.register_dead_rpc(self._id)
-                return pv_object
-            except Exception:
-                self.log_exception("Request %s failed", self._request)
+        try:
+            # We now need to create the Post message and execute it
+            endpoint = [self._block, self._method]
+            request = Post(None, self._server.q, endpoint, self.parse_variants(self._server.pv_object_to_dict(args)))
+            request.set_id(self._id)
+            # Registered until the reply arrives, then dropped by the server
+            self._server.register_rpc(self._id, self)
+            self._server.send_to_process(request)
+        except Exception:
+            self.log_exception("Request %s failed", self._request)
+            return
+        # No locks are held while we wait, the reply is converted on the
+        # server's thread
+        self.log_debug("Waiting for reply")
+        timeout = self._server.rpc_timeout
+        if not self._event.wait(timeout) and \
+                self._server.remove_rpc(self._id) is not None:
+            message = "Timed out after %ss waiting for %s.%s to return" % (
+                timeout, self._block, self._method)
+            self.log_warning(message)
+            self.notify_reply(Error(id_=self._id, message=message))
+        # Either we or the server thread have replied, so this won't block
+        self._event.wait()
+        self.log_debug("Pv Object value set: %s", self._pv_structure)
+        return self._pv_structure
+
+    def notify_reply(self, response):
+        """Called on the server's thread with the Return or Error for our
+        Post. Makes the PvObject to reply with and wakes up execute()"""
+        self.log_debug("Reply received %s %s", type(response), response)
+        self._response = response
+        try:
+            self._pv_structure = self.response_to_pv_object(response)
+        except Exception:
+            self.log_exception("Can't make reply from %s", response)
+        self._event.set()
+
+    def response_to_pv_object(self, response):
+        response_dict = OrderedDict()
+        if isinstance(response, Return):
+            response_dict = response["value"]
+            self.log_debug("Response value : %s", response_dict)
+        elif isinstance(response, Error):
+            response_dict = response.to_dict()
+            response_dict.pop("id")
+
+        if not response_dict:
+            pv_object = pvaccess.PvObject(OrderedDict(), 'malcolm:core/Map:1.0')
+        else:
+            pv_object = self._server.dict_to_pv_object(response_dict)
+        return pv_object
 
 
 class PvaMonitorImplementation(PvaImplementation):
+    # Our structure is modified by the block cache, so we need our own
+    _use_cache = False
+
     def __init__(self, id, request, block, server):
         super(PvaMonitorImplementation, self).__init__(id, request, block, server)
         self.set_logger_name("PvaMonitorImplementation")
         self.mu = pvaccess.MonitorServiceUpdater()
-        self._update_required = False
-        self._first_update = True
+        request_dict = request.toDict()
+        # Rate limiting from the request, e.g. "record[period=0.1,deadband=1]"
+        options = request_dict.pop("record", {}).get("_options", {})
+        # The path within the block that we are monitoring
+        self.path = tuple(self.dict_to_path(request_dict))
+        self.period = float(options.get("period", 0))
+        self.deadband = float(options.get("deadband", 0))
 
     def send_subscription(self):
-        endpoints = [self._block]
-        endpoints = endpoints + self.dict_to_path(self._request.toDict())
-        self.log_debug("Endpoints: %s", endpoints)
-        msg = Subscribe(response_queue=self._server.q, endpoint=endpoints, delta=True)
+        self.log_debug("Monitoring %s %s", self._block, self.path)
+        if self.period or self.deadband:
+            self.send_throttled_subscription()
+            return
+        pv_structure = self._server.add_block_monitor(self._block, self)
+        if pv_structure is None:
+            # Block cache not filled yet, so ask the process. The first Delta
+            # to the block cache will then set all our fields
+            self.send_get_request()
+        else:
+            self._pv_structure = pv_structure
+
+    def send_throttled_subscription(self):
+        """Subscribe with our own period and deadband, so the process merges
+        and drops changes before they get to us, and wait for the first
+        Delta to make our structure"""
+        self.log_debug("Subscribing with period %s, deadband %s",
+                       self.period, self.deadband)
+        msg = Subscribe(None, self._server.q,
+                        [self._block] + list(self.path), delta=True,
+                        period=self.period, deadband=self.deadband)
         msg.set_id(self._id)
-        self._server.send_to_process(msg)
+        self._server.register_monitor(self._id, self)
+        with self._lock:
+            self._server.send_to_process(msg)
+            self.wait_for_reply()
+
+    def update(self, changes):
+        """Set a Delta from our own subscription into our structure and send
+        an update to the client
+
+        Args:
+            changes (list): [[path, value]] changes relative to self.path
+        """
+        if self._pv_structure is None:
+            # The first Delta holds the whole structure
+            self._pv_structure = self._server.dict_to_pv_object(
+                self._wrap(self.path, changes[0][1]))
+            self._event.set()
+            return
+        updated = False
+        for change in changes:
+            if len(change) == 1:
+                # A monitor can't change its structure
+                continue
+            path = self.path + tuple(change[0])
+            try:
+                self._pv_structure.set(self._server.value_for_pva_set(
+                    self._wrap(path, change[1])))
+            except Exception:  # pylint:disable=broad-except
+                self.log_exception("Can't update monitor of %s", path)
+            else:
+                updated = True
+        if updated:
+            self.notify_updates()
+
+    def _wrap(self, path, value):
+        for ep in reversed(path):
+            value = {ep: value}
+        return value
 
     def get_block(self):
         return self._block
@@ -468,27 +887,10 @@ class PvaMonitorImplementation(PvaImplementation):
         self.log_debug("getUpdater called")
         return self.mu
 
-    def update(self, changes):
-        self.log_debug("update called: %s", changes)
-        for change in changes:
-            endpoints = self.dict_to_path(self._request.toDict()) + change[0]
-            path = ".".join(endpoints)
-            # TODO: hasField() shouldn't be called if not path, but
-            # the code below might still need to be executed...
-            if path and self._pv_structure.hasField(path):
-                new_value = self._server.value_for_pva_set(change[1])
-                self._pv_structure[path] = new_value
-                self.log_debug("PV updated structure: %s", self._pv_structure)
-                self._update_required = True
-
-        # The first update is automatically returned so for the subscription there is no need to update
-        if self._first_update:
-            self._first_update = False
-            self._update_required = False
-
-        self.notify_updates()
-
     def notify_updates(self):
-        if self._update_required:
-            self._update_required = False
-            self.mu.update()
+        """Send our structure to the client now that fields have been set in
+        it. pvaccess doesn't give us a changed field BitSet to fill in, as
+        MonitorServiceUpdater.update() takes no arguments, so the whole
+        structure is sent"""
+        self.log_debug("Sending update for %s", self.path)
+        self.mu.update()
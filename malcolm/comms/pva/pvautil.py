@@ -7,6 +7,20 @@ from malcolm.compat import str_, OrderedDict, long_
 from malcolm.core import StringArray
 
 
+def pvaccess_supports_numpy():
+    """Whether pvaccess was built with NumPy support, so scalar arrays can be
+    set from numpy arrays and read back as numpy arrays without being turned
+    into lists"""
+    try:
+        pv = pvaccess.PvObject({"value": [pvaccess.INT]})
+        pv.set({"value": np.arange(2, dtype=np.int32)})
+        pv.useNumPyArrays = True
+    except Exception:  # pylint:disable=broad-except
+        return False
+    else:
+        return True
+
+
 class PvaUtil(object):
     """A utility class for PvAccess conversions"""
     pva_dtypes = {
@@ -22,6 +36,8 @@ class PvaUtil(object):
         np.float32: pvaccess.FLOAT,
         np.float64: pvaccess.DOUBLE
     }
+    # Whether numeric arrays are handed to and from pvaccess as numpy arrays
+    numpy_arrays = pvaccess_supports_numpy()
 
     def dict_to_pv_object(self, dict_in, empty_allowed=True):
         structure = self.pva_structure_from_value(dict_in, empty_allowed)
@@ -31,11 +47,24 @@ class PvaUtil(object):
             structure.set(set_value)
             return structure
 
+    def pv_object_to_dict(self, pv_object):
+        """Convert a PvObject to a dict, with numeric scalar arrays as numpy
+        arrays if pvaccess supports it"""
+        if self.numpy_arrays:
+            pv_object.useNumPyArrays = True
+        return pv_object.toDict(True)
+
     def value_for_pva_set(self, value):
         # Turn it into something that pvaccess can just set
         if isinstance(value, StringArray):
             value = list(value)
-        elif isinstance(value, (np.number, np.ndarray)):
+        elif isinstance(value, np.ndarray):
+            if self.numpy_arrays and value.dtype.type in self.pva_dtypes:
+                # pvaccess can copy straight from the buffer
+                value = np.ascontiguousarray(value)
+            else:
+                value = value.tolist()
+        elif isinstance(value, np.number):
             value = value.tolist()
         elif isinstance(value, dict):
             dict_set = OrderedDict()
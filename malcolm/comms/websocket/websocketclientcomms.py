@@ -1,16 +1,22 @@
 from tornado import gen
+from tornado.httpclient import HTTPRequest
 from tornado.ioloop import IOLoop
 from tornado.websocket import websocket_connect
 
 from malcolm.core import ClientComms, Request, Subscribe, Response, \
     deserialize_object, method_takes
 from malcolm.core.jsonutils import json_decode, json_encode
-from malcolm.core.vmetas import StringMeta, NumberMeta
+from malcolm.core.vmetas import StringMeta, NumberMeta, BooleanMeta
+from malcolm.comms.websocket.websocketservercomms import JSON_SUBPROTOCOL, \
+    MSGPACK_SUBPROTOCOL, msgpack_decode, msgpack_encode
 
 
 @method_takes(
     "hostname", StringMeta("Hostname of malcolm websocket server"), "localhost",
-    "port", NumberMeta("int32", "Port number to run up under"), 8080)
+    "port", NumberMeta("int32", "Port number to run up under"), 8080,
+    "msgpack", BooleanMeta(
+        "Ask the server for msgpack binary messages if msgpack is installed"),
+    True)
 class WebsocketClientComms(ClientComms):
     """A class for a client to communicate with the server"""
 
@@ -23,34 +29,85 @@ class WebsocketClientComms(ClientComms):
         super(WebsocketClientComms, self).__init__(process)
         self.url = "ws://%(hostname)s:%(port)d/ws" % params
         self.set_logger_name(self.url)
-        # TODO: Are we starting one or more IOLoops here?
         self.conn = None
-        self.loop = IOLoop.current()
-        self.loop.add_callback(self.recv_loop)
-        self.add_spawn_function(self.loop.start, self.stop_recv_loop)
+        self._stopping = False
+        # Whether we will ask for msgpack, and whether the server agreed
+        self.ask_binary = bool(params.get("msgpack", True) and msgpack_encode)
+        self.binary = False
+        self.loop = self.process.get_ioloop()
+        self._own_loop = self.loop is None
+        if self._own_loop:
+            # TODO: Are we starting one or more IOLoops here?
+            self.loop = IOLoop.current()
+            self.loop.add_callback(self.recv_loop)
+            self.add_spawn_function(self.loop.start, self.stop_recv_loop)
+        else:
+            # The SyncFactory runs the loop, so we only need to connect on it
+            self.add_spawn_function(
+                self.loop.add_callback, self.stop_recv_loop, self.recv_loop)
 
     @gen.coroutine
     def recv_loop(self):
         message = None
         while True:
             if message is None:
-                # TODO: cleanup old subscriptions here
+                if self._stopping:
+                    break
+                reconnecting = self.conn is not None
                 self.conn = None
-                self.conn = yield websocket_connect(self.url, self.loop)
+                self.conn = yield websocket_connect(
+                    self.make_request(), self.loop)
+                self.set_subprotocol(
+                    self.conn.headers.get("Sec-WebSocket-Protocol"))
                 self.subscribe_server_blocks()
+                if reconnecting:
+                    # Our subscriptions were made on the old connection, so
+                    # resume them on this one
+                    self.resubscribe()
             message = yield self.conn.read_message()
             self.on_message(message)
 
+    def set_subprotocol(self, subprotocol):
+        """Set what we can send from the subprotocol the server picked
+
+        Args:
+            subprotocol (str): The server's Sec-WebSocket-Protocol, None if
+                it didn't pick one
+        """
+        self.binary = self.ask_binary and subprotocol == MSGPACK_SUBPROTOCOL
+        # Servers that don't pick one of ours only know version 1 messages,
+        # so we have to send a Put for each attribute. They don't send Delta
+        # versions either, so we can't resume delta subscriptions with them
+        self.put_many_supported = subprotocol in (
+            JSON_SUBPROTOCOL, MSGPACK_SUBPROTOCOL)
+
+    def make_request(self):
+        """Make the HTTPRequest to connect with, asking for our protocol
+        version, in msgpack if we can
+
+        Returns:
+            HTTPRequest: The request for self.url
+        """
+        subprotocols = [JSON_SUBPROTOCOL]
+        if self.ask_binary:
+            subprotocols.insert(0, MSGPACK_SUBPROTOCOL)
+        headers = {"Sec-WebSocket-Protocol": ", ".join(subprotocols)}
+        return HTTPRequest(self.url, headers=headers)
+
     def on_message(self, message):
         """
         Pass response from server to process receive queue
 
         Args:
-            message(str): Received message
+            message(str): Received message, bytes if it is msgpack
         """
         try:
-            self.log_debug("Got message %s", message)
-            d = json_decode(message)
+            if isinstance(message, bytes) and self.binary:
+                self.log_debug("Got %d byte msgpack message", len(message))
+                d = msgpack_decode(message)
+            else:
+                self.log_debug("Got message %s", message)
+                d = json_decode(message)
             response = deserialize_object(d, Response)
             self.send_to_caller(response)
         except Exception as e:
@@ -64,14 +121,27 @@ class WebsocketClientComms(ClientComms):
         Args:
             request (Request): The message to pass to the server
         """
-        message = json_encode(request)
-        self.log_debug("Sending message %s", message)
-        self.conn.write_message(message)
+        if self.binary:
+            message = msgpack_encode(request)
+            self.log_debug("Sending %d byte msgpack message for %s",
+                           len(message), request.id)
+        else:
+            message = json_encode(request)
+            self.log_debug("Sending message %s", message)
+        self.conn.write_message(message, binary=self.binary)
 
     def stop_recv_loop(self):
         # This is the only thing that is safe to do from outside the IOLoop
         # thread
-        self.loop.add_callback(self.loop.stop)
+        if self._own_loop:
+            self.loop.add_callback(self.loop.stop)
+        else:
+            self._stopping = True
+            self.loop.add_callback(self.close_connection)
+
+    def close_connection(self):
+        if self.conn is not None:
+            self.conn.close()
 
     def subscribe_server_blocks(self):
         """Subscribe to process blocks"""
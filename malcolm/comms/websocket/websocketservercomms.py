@@ -1,27 +1,235 @@
+from threading import Lock
+
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
 from tornado.web import Application, RequestHandler, asynchronous
 from tornado.websocket import WebSocketHandler, WebSocketError
 
+from malcolm.compat import OrderedDict
 from malcolm.core import ServerComms, deserialize_object, \
-    Request, Get, Return, Error, Post, method_takes
+    Request, Get, Return, Error, Post, Delta, Update, method_takes, \
+    GetMany, PutMany
+from malcolm.core.cache import collapse_changes
 from malcolm.core.jsonutils import json_decode, json_encode
 from malcolm.core.vmetas import NumberMeta
 
+try:
+    from malcolm.core.msgpackutil import msgpack_decode, msgpack_encode
+except ImportError:
+    msgpack_decode, msgpack_encode = None, None
+
+
+# Version of the messages that a server understands. 2 adds GetMany,
+# PutMany and versioned Deltas for Subscribe.since
+PROTOCOL_VERSION = 2
+# Subprotocols a client can ask for to say it knows PROTOCOL_VERSION. The
+# server picks the first in the client's list that it supports. With
+# MSGPACK_SUBPROTOCOL messages are msgpack binary, with numpy arrays sent as
+# raw buffers, rather than JSON. Servers that pick neither only understand
+# version 1 JSON messages
+JSON_SUBPROTOCOL = "malcolm-%d" % PROTOCOL_VERSION
+MSGPACK_SUBPROTOCOL = "malcolm-%d-msgpack" % PROTOCOL_VERSION
+
+# Pending messages for a connection before Deltas and Updates are merged
+HIGH_WATER_MARK = 100
+# Pending messages for a connection before it is closed
+MAX_PENDING = 10000
+
+
+class SendQueue(object):
+    """The responses waiting to be written to one websocket connection.
+
+    Responses are written in batches from the IOLoop, and the next batch isn't
+    started until the last one has been flushed to the socket. If a slow
+    client lets more than high_water_mark build up, new Deltas are merged into
+    the last pending Delta for the same subscription, and new Updates replace
+    the last pending Update. If it still reaches max_pending the connection is
+    closed and its subscriptions dropped.
+    """
+
+    def __init__(self, handler, servercomms, high_water_mark=HIGH_WATER_MARK,
+                 max_pending=MAX_PENDING):
+        """
+        Args:
+            handler (MalcWebSocketHandler): The connection to write to
+            servercomms (WebsocketServerComms): The comms that owns the loop
+            high_water_mark (int): Pending messages before merging starts
+            max_pending (int): Pending messages before the connection is closed
+        """
+        self.handler = handler
+        self.servercomms = servercomms
+        self.high_water_mark = high_water_mark
+        self.max_pending = max_pending
+        self._lock = Lock()
+        # {key: response} in the order they should be sent
+        self._pending = OrderedDict()
+        self._next_key = 0
+        # {response.id: key} of the last pending response for that id
+        self._latest = {}
+        # True if a flush is scheduled or its write hasn't finished
+        self._flushing = False
+        self._closed = False
+        # Metrics
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def put(self, response):
+        """Queue a response to be written. Can be called from any thread
+
+        Args:
+            response (Response): The response to send
+        """
+        dropped = []
+        flush = False
+        with self._lock:
+            if self._closed:
+                self.dropped += 1
+                dropped.append(response)
+            elif len(self._pending) >= self.high_water_mark and \
+                    self._merge(response):
+                self.merged += 1
+            elif len(self._pending) >= self.max_pending:
+                # Client has stopped reading, give up on it
+                dropped = list(self._pending.values()) + [response]
+                self.dropped += len(dropped)
+                self._pending.clear()
+                self._latest.clear()
+                self._closed = True
+                self.servercomms.log_warning(
+                    "Closing connection with %d messages pending", len(dropped))
+                self.servercomms.loop.add_callback(self.handler.close)
+            else:
+                key = self._next_key
+                self._next_key += 1
+                self._pending[key] = response
+                self._latest[response.id] = key
+                self.max_depth = max(self.max_depth, len(self._pending))
+                if not self._flushing:
+                    self._flushing = True
+                    flush = True
+        if flush:
+            self.servercomms.loop.add_callback(self.flush)
+        self._unsubscribe(dropped)
+
+    def _merge(self, response):
+        """Merge response with the last pending response for its id
+
+        Returns:
+            bool: True if it was merged
+        """
+        key = self._latest.get(response.id, None)
+        if key is None:
+            return False
+        pending = self._pending[key]
+        if isinstance(response, Delta) and isinstance(pending, Delta):
+            changes = collapse_changes(pending.changes + response.changes)
+            self._pending[key] = Delta(
+                pending.id, pending.context, changes, response.version)
+        elif isinstance(response, Update) and isinstance(pending, Update):
+            self._pending[key] = response
+        else:
+            return False
+        return True
+
+    def _unsubscribe(self, dropped):
+        # Unsubscribe once from each subscription we dropped responses for
+        ids = set()
+        for response in dropped:
+            if isinstance(response, (Delta, Update)) and response.id not in ids:
+                ids.add(response.id)
+                self.servercomms.notify_closed_connection(response)
+
+    def flush(self):
+        """Write all pending responses. Must be called from the IOLoop"""
+        with self._lock:
+            responses = list(self._pending.values())
+            self._pending.clear()
+            self._latest.clear()
+        future = None
+        for response in responses:
+            future = self.servercomms._send_to_client(response)
+        with self._lock:
+            self.sent += len(responses)
+        if future is not None and not future.done():
+            # Don't write any more until the socket has taken this batch
+            future.add_done_callback(lambda _: self._written())
+        else:
+            self._written()
+
+    def _written(self):
+        with self._lock:
+            if self._pending and not self._closed:
+                flush = True
+            else:
+                flush = self._flushing = False
+        if flush:
+            self.servercomms.loop.add_callback(self.flush)
+
+    def close(self):
+        """Stop sending, the connection has gone"""
+        with self._lock:
+            self._closed = True
+            self.dropped += len(self._pending)
+            self._pending.clear()
+            self._latest.clear()
+
+    def stats(self):
+        """Return the statistics for this connection
+
+        Returns:
+            OrderedDict: with keys pending, max_depth, sent, merged, dropped
+        """
+        with self._lock:
+            return OrderedDict([
+                ("pending", len(self._pending)),
+                ("max_depth", self.max_depth),
+                ("sent", self.sent),
+                ("merged", self.merged),
+                ("dropped", self.dropped)])
+
 
 class MalcWebSocketHandler(WebSocketHandler):  # pylint:disable=abstract-method
 
     servercomms = None
+    # True if the client asked for msgpack
+    binary = False
+    # True if the client speaks PROTOCOL_VERSION, so wants the version of
+    # each Delta to resume its subscriptions from
+    versions = False
+    # The SendQueue for this connection, made when it is opened
+    send_queue = None
+
+    def open(self):
+        self.send_queue = self.servercomms.create_send_queue(self)
+
+    def on_close(self):
+        if self.send_queue is not None:
+            self.servercomms.remove_send_queue(self.send_queue)
+
+    def select_subprotocol(self, subprotocols):
+        for subprotocol in subprotocols:
+            if subprotocol == MSGPACK_SUBPROTOCOL and msgpack_encode:
+                self.binary = True
+                self.versions = True
+                return subprotocol
+            elif subprotocol == JSON_SUBPROTOCOL:
+                self.versions = True
+                return subprotocol
 
     def on_message(self, message):
         """
         Pass on received message to Process
 
         Args:
-            message(str): Received message
+            message(str): Received message, bytes if it is msgpack
         """
 
-        d = json_decode(message)
+        if isinstance(message, bytes) and self.binary:
+            d = msgpack_decode(message)
+        else:
+            d = json_decode(message)
         request = deserialize_object(d, Request)
         request.context = self
         self.servercomms.on_request(request)
@@ -36,10 +244,17 @@ class MalcBlockHandler(RequestHandler):
 
     servercomms = None
 
+    # curl http://localhost:8888/blocks/hello?endpoint=greet&endpoint=meta
     @asynchronous
     def get(self, endpoint_str):
         endpoint = endpoint_str.split("/")
-        request = Get(self, None, endpoint)
+        sub_endpoints = self.get_query_arguments("endpoint")
+        if sub_endpoints:
+            # Get each of the paths below endpoint in one go
+            paths = [endpoint + e.split("/") for e in sub_endpoints]
+            request = GetMany(self, None, paths)
+        else:
+            request = Get(self, None, endpoint)
         self.servercomms.on_request(request)
 
     # curl --data 'parameters={"name": "me"}' http://localhost:8888/blocks/hello/say_hello
@@ -50,14 +265,36 @@ class MalcBlockHandler(RequestHandler):
         request = Post(self, None, endpoint, parameters)
         self.servercomms.on_request(request)
 
+    # curl -X PUT --data 'values={"greeting": "hi"}' http://localhost:8888/blocks/hello
+    @asynchronous
+    def put(self, endpoint_str):
+        endpoint = endpoint_str.split("/")
+        values = json_decode(self.get_body_argument("values"))
+        request = PutMany(self, None, endpoint, values)
+        self.servercomms.on_request(request)
+
 
-@method_takes("port", NumberMeta("int32", "Port number to run up under"), 8080)
+@method_takes(
+    "port", NumberMeta("int32", "Port number to run up under"), 8080,
+    "highWaterMark", NumberMeta(
+        "int32", "Pending messages for a connection before Deltas are merged"),
+    HIGH_WATER_MARK,
+    "maxPending", NumberMeta(
+        "int32", "Pending messages for a connection before it is closed"),
+    MAX_PENDING)
 class WebsocketServerComms(ServerComms):
     """A class for communication between browser and server"""
 
     def __init__(self, process, params):
         super(WebsocketServerComms, self).__init__(process)
         self.set_logger_name("WebsocketServerComms(%(port)d)" % params)
+        self.high_water_mark = params.get("highWaterMark", HIGH_WATER_MARK)
+        self.max_pending = params.get("maxPending", MAX_PENDING)
+        self._send_queues_lock = Lock()
+        self._send_queues = set()
+        # Metrics from connections that have closed
+        self._closed_stats = OrderedDict(
+            [("sent", 0), ("merged", 0), ("dropped", 0)])
         MalcWebSocketHandler.servercomms = self
         MalcBlockHandler.servercomms = self
 
@@ -66,9 +303,17 @@ class WebsocketServerComms(ServerComms):
             (r"/ws", MalcWebSocketHandler)
         ])
         self.server = HTTPServer(application)
-        self.server.listen(int(params["port"]))
-        self.loop = IOLoop.current()
-        self.add_spawn_function(self.loop.start, self.stop_recv_loop)
+        self.loop = self.process.get_ioloop()
+        self._own_loop = self.loop is None
+        if self._own_loop:
+            self.server.listen(int(params["port"]))
+            self.loop = IOLoop.current()
+            self.add_spawn_function(self.loop.start, self.stop_recv_loop)
+        else:
+            # The SyncFactory runs the loop, so we only need to listen on it
+            self.add_spawn_function(self.loop.add_callback,
+                                    self.stop_recv_loop,
+                                    self.server.listen, int(params["port"]))
 
     def send_to_client(self, response):
         """Dispatch response to a client
@@ -76,14 +321,67 @@ class WebsocketServerComms(ServerComms):
         Args:
             response(Response): The message to pass to the client
         """
-        self.loop.add_callback(self._send_to_client, response)
+        if isinstance(response.context, MalcWebSocketHandler):
+            response.context.send_queue.put(response)
+        else:
+            self.loop.add_callback(self._send_to_client, response)
+
+    def create_send_queue(self, handler):
+        """Make a SendQueue for a newly opened websocket connection"""
+        send_queue = SendQueue(
+            handler, self, self.high_water_mark, self.max_pending)
+        with self._send_queues_lock:
+            self._send_queues.add(send_queue)
+        return send_queue
+
+    def remove_send_queue(self, send_queue):
+        """Close the SendQueue of a websocket connection that has closed"""
+        send_queue.close()
+        with self._send_queues_lock:
+            self._send_queues.discard(send_queue)
+            stats = send_queue.stats()
+            for k in self._closed_stats:
+                self._closed_stats[k] += stats[k]
+
+    def stats(self):
+        """Return the websocket send statistics summed over all connections
+
+        Returns:
+            OrderedDict: with keys connections, pending, max_depth (the most
+            that was ever pending on one connection), sent, merged and dropped
+        """
+        with self._send_queues_lock:
+            ret = OrderedDict([
+                ("connections", len(self._send_queues)),
+                ("pending", 0),
+                ("max_depth", 0)])
+            ret.update(self._closed_stats)
+            for send_queue in self._send_queues:
+                stats = send_queue.stats()
+                ret["max_depth"] = max(ret["max_depth"], stats["max_depth"])
+                for k in ("pending", "sent", "merged", "dropped"):
+                    ret[k] += stats[k]
+        return ret
 
     def _send_to_client(self, response):
+        """Write response to its context, returning the Future from
+        write_message if it was for a websocket"""
         if isinstance(response.context, MalcWebSocketHandler):
-            message = json_encode(response)
-            self.log_debug("Sending message %s", message)
+            if isinstance(response, Delta) and response.version is not None \
+                    and not response.context.versions:
+                # A version 1 client would reject a Delta with a version
+                response = Delta(
+                    response.id, response.context, response.changes)
+            binary = response.context.binary
+            if binary:
+                message = msgpack_encode(response)
+                self.log_debug("Sending %d byte msgpack message for %s",
+                               len(message), response.id)
+            else:
+                message = json_encode(response)
+                self.log_debug("Sending message %s", message)
             try:
-                response.context.write_message(message)
+                return response.context.write_message(message, binary=binary)
             except WebSocketError:
                 # Just close the connection
                 self.notify_closed_connection(response)
@@ -108,14 +406,21 @@ class WebsocketServerComms(ServerComms):
         """
 
         request.response_queue = self.q
-        if hasattr(request, "endpoint") and len(request.endpoint) > 0 and \
-                request.endpoint[0] == ".":
-            # We're talking about the process block, so fill in the right name
-            request.endpoint[0] = self.process.name
+        if isinstance(request, GetMany):
+            endpoints = request.paths
+        elif hasattr(request, "endpoint"):
+            endpoints = [request.endpoint]
+        else:
+            endpoints = []
+        for endpoint in endpoints:
+            if len(endpoint) > 0 and endpoint[0] == ".":
+                # We're talking about the process block, so fill in the name
+                endpoint[0] = self.process.name
         self.process.q.put(request)
 
     def stop_recv_loop(self):
         # This is the only thing that is safe to do from outside the IOLoop
         # thread
         self.loop.add_callback(self.server.stop)
-        self.loop.add_callback(self.loop.stop)
+        if self._own_loop:
+            self.loop.add_callback(self.loop.stop)
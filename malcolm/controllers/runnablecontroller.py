@@ -2,6 +2,7 @@ from malcolm.controllers.managercontroller import ManagerController
 from malcolm.core import RunnableStateMachine, REQUIRED, method_also_takes, \
     method_writeable_in, method_takes, MethodMeta, Task, Hook, method_returns, \
     Info, AbortedError, BadValueError
+from malcolm.core.preparedgenerator import prepared_generators
 from malcolm.core.vmetas import PointGeneratorMeta, NumberMeta, StringArrayMeta
 
 
@@ -268,8 +269,11 @@ class RunnableController(ManagerController):
         # Store the params for use in seek()
         self.configure_params = params
         # This will calculate what we need from the generator, possibly a long
-        # call
-        params.generator.prepare()
+        # call. If a generator with the same content has been prepared before
+        # then use that one, so parts in this process share its points. The
+        # generator we were configured with before is dropped if unused
+        params.generator = prepared_generators.get(
+            params.generator, owner=self.mri).generator
         # Set the steps attributes that we will do across many run() calls
         self.total_steps.set_value(params.generator.size)
         self.completed_steps.set_value(0)
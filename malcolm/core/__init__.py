@@ -21,7 +21,7 @@ from malcolm.core.ntunion import NTUnion
 from malcolm.core.part import Part
 from malcolm.core.process import Process
 from malcolm.core.request import Request, Get, Put, Post, Subscribe, \
-    Unsubscribe
+    Unsubscribe, GetMany, PutMany
 from malcolm.core.response import Response, Return, Error, Delta, Update
 from malcolm.core.serializable import Serializable, serialize_object, \
     deserialize_object
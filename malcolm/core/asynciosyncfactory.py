@@ -0,0 +1,224 @@
+import asyncio
+import time
+from concurrent import futures
+from multiprocessing import TimeoutError
+from threading import Thread, current_thread
+
+from malcolm.compat import queue
+from malcolm.core.syncfactory import SyncFactory, InterruptableQueue, \
+    make_service_loop
+
+
+class AsyncioSyncFactory(SyncFactory):
+    """SyncFactory with a single asyncio event loop. Service loops, like
+    those of the Process, ClientComms and ServerComms, are run on it as
+    coroutines rather than each blocking a thread, and tornado based comms
+    share it instead of each running their own IOLoop in a thread.
+
+    Other spawned functions may block, so they still run in the thread pools.
+    This includes Task, whose queue is serviced by wait_all() in the thread
+    of the hook that made it. Needs Python 3.5.2 or later.
+    """
+
+    def __init__(self, name, **kwargs):
+        """
+        Args:
+            name(str): Logger name e.g. "Sync"
+            **kwargs: Thread pool sizes, passed to SyncFactory
+        """
+        super(AsyncioSyncFactory, self).__init__(name, **kwargs)
+        self.loop = asyncio.new_event_loop()
+        self._ioloop = None
+        self._loop_thread = Thread(target=self._run_loop, name="%s.loop" % name)
+        self._loop_thread.daemon = True
+        self._loop_thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def call_in_loop(self, function, *args):
+        """Call function(*args) from the event loop thread
+
+        Returns:
+            concurrent.futures.Future: That will hold the return value
+        """
+        future = futures.Future()
+
+        def call():
+            try:
+                future.set_result(function(*args))
+            except Exception as e:  # pylint:disable=broad-except
+                future.set_exception(e)
+
+        if current_thread() is self._loop_thread:
+            call()
+        else:
+            self.loop.call_soon_threadsafe(call)
+        return future
+
+    def spawn(self, function, *args, **kwargs):
+        """Runs a service loop as a coroutine on the event loop, or any other
+        function in a worker thread, returning a Result object
+
+        Args:
+            function: Function to run
+            args: Positional arguments to run the function with
+            kwargs: Keyword arguments to run the function with
+
+        Returns:
+            object: Something you can call wait(timeout) on to see when it's
+            finished executing
+        """
+        loop = make_service_loop(function, args, kwargs)
+        if loop is None:
+            return super(AsyncioSyncFactory, self).spawn(
+                function, *args, **kwargs)
+        else:
+            return self._spawn_service_loop(function, loop)
+
+    def spawn_hook(self, function, *args, **kwargs):
+        """Like spawn(), but runs functions that aren't service loops in the
+        pool kept for long-running hook bodies"""
+        loop = make_service_loop(function, args, kwargs)
+        if loop is None:
+            return super(AsyncioSyncFactory, self).spawn_hook(
+                function, *args, **kwargs)
+        else:
+            return self._spawn_service_loop(function, loop)
+
+    def _spawn_service_loop(self, function, loop):
+        future = asyncio.run_coroutine_threadsafe(
+            self._run_service_loop(function, loop), self.loop)
+        return FutureSpawned(future)
+
+    async def _run_service_loop(self, function, loop):
+        """Run a service_loop generator, awaiting the queues it waits for"""
+        items = None
+        empty = None
+        while True:
+            try:
+                if empty is None:
+                    q, timeout = loop.send(items)
+                else:
+                    q, timeout = loop.throw(empty)
+            except StopIteration as e:
+                return e.value
+            except Exception:
+                self.log_exception("Exception in service loop %s", function)
+                raise
+            try:
+                items = await q.get_many_async(timeout=timeout)
+            except queue.Empty as e:
+                items = None
+                empty = e
+            else:
+                empty = None
+
+    def create_queue(self):
+        """Creates a new Queue object that coroutines on our loop can also
+        wait on"""
+        return LoopQueue(self.loop)
+
+    def get_ioloop(self):
+        """Return the tornado IOLoop wrapping our event loop"""
+        if self._ioloop is None:
+            # AsyncIOMainLoop wraps the asyncio loop of the thread that makes
+            # it on every tornado version, unlike IOLoop.current()
+            from tornado.platform.asyncio import AsyncIOMainLoop
+            self._ioloop = self.call_in_loop(AsyncIOMainLoop).result()
+        return self._ioloop
+
+    def __del__(self):
+        """When we get garbage collected, stop the loop and the threads"""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if current_thread() is not self._loop_thread:
+            self._loop_thread.join()
+        super(AsyncioSyncFactory, self).__del__()
+
+
+class LoopQueue(InterruptableQueue):
+    """InterruptableQueue that coroutines on an event loop can wait on with
+    get_many_async(), as well as threads with get() and get_many()"""
+
+    def __init__(self, loop):
+        super(LoopQueue, self).__init__()
+        self._loop = loop
+        # asyncio.Futures of the coroutines waiting for items
+        self._futures = []
+
+    def _wake(self):
+        # Must be called with self._lock held
+        super(LoopQueue, self)._wake()
+        if self._futures:
+            for future in self._futures:
+                self._loop.call_soon_threadsafe(_set_done, future)
+            self._futures = []
+
+    async def get_many_async(self, max_items=None, timeout=None):
+        """Like get_many(), but for a coroutine on our loop to await
+
+        Args:
+            max_items (int): Maximum number of items to return, None means
+                no limit
+            timeout (float): Maximum time to wait, None means forever
+
+        Returns:
+            list: The items
+        """
+        if timeout is not None:
+            until = time.time() + timeout
+        while True:
+            with self._lock:
+                if self._items:
+                    future = None
+                elif timeout is not None and time.time() >= until:
+                    raise queue.Empty()
+                else:
+                    future = self._loop.create_future()
+                    self._futures.append(future)
+            if future is None:
+                try:
+                    return self.get_many(max_items, timeout=0)
+                except queue.Empty:
+                    # Someone else got them first
+                    continue
+            if timeout is None:
+                wait = None
+            else:
+                wait = max(until - time.time(), 0)
+            try:
+                await asyncio.wait_for(future, wait)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    if future in self._futures:
+                        self._futures.remove(future)
+
+
+def _set_done(future):
+    # The waiter may have timed out and been cancelled already
+    if not future.done():
+        future.set_result(None)
+
+
+class FutureSpawned(object):
+    """Wraps a concurrent.futures.Future with the same interface as Spawned"""
+
+    def __init__(self, future):
+        self._future = future
+
+    def ready(self):
+        return self._future.done()
+
+    def wait(self, timeout=None):
+        futures.wait([self._future], timeout)
+
+    def successful(self):
+        assert self.ready(), "%r not ready" % self
+        return self._future.exception() is None
+
+    def get(self, timeout=None):
+        try:
+            return self._future.result(timeout)
+        except futures.TimeoutError:
+            raise TimeoutError()
@@ -4,7 +4,7 @@ from malcolm.core.attribute import Attribute
 from malcolm.core.blockmeta import BlockMeta
 from malcolm.core.elementmap import ElementMap
 from malcolm.core.methodmeta import MethodMeta
-from malcolm.core.request import Put, Post
+from malcolm.core.request import Put, Post, PutMany
 from malcolm.core.response import Return, Error
 from malcolm.core.serializable import Serializable
 
@@ -18,6 +18,7 @@ class Block(ElementMap):
     def __init__(self):
         super(Block, self).__init__()
         self._writeable_functions = {}
+        self._put_many_function = None
 
     def __setattr__(self, attr, value):
         if attr in self:
@@ -57,8 +58,28 @@ class Block(ElementMap):
                 (name, value)
         super(Block, self).set_endpoint_data(name, value, notify)
 
-    def set_writeable_functions(self, writeable_functions):
+    def set_writeable_functions(self, writeable_functions,
+                                put_many_function=None):
+        """
+        Args:
+            writeable_functions (dict): {child_name: function} to call with
+                (child_meta, *args) to put to an Attribute or call a Method
+            put_many_function (callable): If given, call this with
+                {attribute_name: value} to put a number of Attributes at once
+        """
         self._writeable_functions = writeable_functions
+        self._put_many_function = put_many_function
+
+    def put_many(self, attr_values):
+        """Put a number of Attribute values
+
+        Args:
+            attr_values (dict): {attribute_name: value} to put
+        """
+        if self._put_many_function is not None:
+            return self._put_many_function(attr_values)
+        for name, value in attr_values.items():
+            self._writeable_functions[name](self[name].meta, value)
 
     def handle_request(self, request):
         """
@@ -69,15 +90,22 @@ class Block(ElementMap):
         """
         self.log_debug("Received request %s", request)
         try:
-            assert isinstance(request, Post) or isinstance(request, Put), \
-                "Expected Post or Put request, received %s" % request.typeid
-            child_name = request.endpoint[1]
-            child = self[child_name]
-            writeable_function = self._writeable_functions[child_name]
-            result = child.handle_request(request, writeable_function)
+            assert isinstance(request, (Post, Put, PutMany)), \
+                "Expected Post, Put or PutMany request, received %s" % \
+                request.typeid
+            if isinstance(request, PutMany):
+                assert len(request.endpoint) == 1, \
+                    "Can only PutMany to a Block, not %s" % (request.endpoint,)
+                result = self.put_many(request.values)
+            else:
+                child_name = request.endpoint[1]
+                child = self[child_name]
+                writeable_function = self._writeable_functions[child_name]
+                result = child.handle_request(request, writeable_function)
             response = Return(request.id, request.context, result)
         except Exception as e:  # pylint:disable=broad-except
             self.log_info("Exception while handling %s" % request)
             response = Error(request.id, request.context, str(e))
         self.log_debug("Responding with %s", response)
-        self.process.block_respond(response, request.response_queue)
+        self.process.block_respond(
+            response, request.response_queue, request.endpoint[0])
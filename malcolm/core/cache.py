@@ -1,18 +1,87 @@
+from collections import deque
+import time
+
 from malcolm.compat import OrderedDict, str_
 
 
+def collapse_changes(changes):
+    """Drop any changes that are overwritten by a later change to the same
+    path or to one of its parents
+
+    Args:
+        changes (list): [[path, update]] for additions or changes and [[path]]
+            for deletions, in the order they should be applied
+
+    Returns:
+        list: The changes that still need to be applied, in the same order
+    """
+    # set of path tuples set by later changes
+    written = set()
+    collapsed = []
+    for change in reversed(changes):
+        path = tuple(change[0])
+        if not any(path[:i] in written for i in range(len(path) + 1)):
+            collapsed.append(change)
+            # A deletion can't supersede earlier additions as they may be
+            # the thing that created the path
+            if len(change) > 1:
+                written.add(path)
+    collapsed.reverse()
+    return collapsed
+
+
 class Leaf(object):
-    def __init__(self, parent=None):
-        self.subscriptions = []
+    """A node in the subscription trie, one per path element"""
+
+    def __init__(self, parent=None, key=None):
+        self.parent = parent
+        # The name of this leaf in parent.children
+        self.key = key
+        # Ordered set of the subscriptions at this path {Subscribe: None}
+        self.subscriptions = OrderedDict()
         # {name: Leaf}
         self.children = {}
-        self.parent = parent
+
+    def get_child(self, key):
+        """Return the child leaf called key, creating it if necessary"""
+        try:
+            return self.children[key]
+        except KeyError:
+            child = Leaf(self, key)
+            self.children[key] = child
+            return child
 
 
 class Cache(OrderedDict):
-    """OrderedDict subclass that supports delta changeset updates"""
+    """OrderedDict subclass that supports delta changeset updates.
+
+    The structures below the top level are treated as immutable: a change
+    replaces every container on its path with a shallow copy, leaving
+    unchanged siblings shared. This means anything returned from walk_path()
+    is a snapshot that is safe to hand out without copying, and will not be
+    modified by later changes. It must not be modified by its consumers either.
+
+    Each apply_changes() call increments version. If history_length is given,
+    that many of the most recent calls are kept so changes_since() can tell a
+    resuming subscriber what it missed.
+    """
     _subscription_tree = None
 
+    def __init__(self, history_length=0):
+        """
+        Args:
+            history_length (int): How many apply_changes() calls to remember
+        """
+        super(Cache, self).__init__()
+        # Start from the time so a version from a previous incarnation of the
+        # cache is very unlikely to be mistaken for one of ours
+        self.version = int(time.time() * 1e6)
+        # [(version, changes)] for the most recent apply_changes() calls
+        if history_length:
+            self._history = deque(maxlen=history_length)
+        else:
+            self._history = None
+
     def apply_changes(self, *changes):
         """Update dictionary from the given delta
 
@@ -24,6 +93,9 @@ class Cache(OrderedDict):
         """
         # {subscriber: [change]}
         subscription_changes = OrderedDict()
+        # {id: container} for the copies made during this call. They are not
+        # visible to anyone else yet, so can be modified in place
+        copies = {}
         for change in changes:
             assert len(change) in (1, 2), \
                 "Expected [path] for deletion or [path, update] for addition." \
@@ -40,7 +112,7 @@ class Cache(OrderedDict):
             else:
                 assert isinstance(path[0], str_), \
                     "Expected path to be list of strings, got %s" % (path,)
-                d = self.walk_path(path[:-1])
+                d = self._copy_path(path[:-1], copies)
                 if len(change) == 1:
                     # deletion
                     del d[path[-1]]
@@ -50,10 +122,71 @@ class Cache(OrderedDict):
                     value = change[1]
                     d[path[-1]] = value
                     self._notify_change(subscription_changes, change)
+        self.version += 1
+        if self._history is not None:
+            self._history.append((self.version, changes))
         return subscription_changes
 
+    def changes_since(self, version, path):
+        """Get the changes below path made after version
+
+        Args:
+            version (int): The version the subscriber last saw
+            path (list): The path the subscriber is interested in
+
+        Returns:
+            list: [[path, update]] and [[path]] changes relative to path that
+            will bring it up to date, or None if they are no longer all in
+            the history, or path was deleted or replaced by something
+            without it
+        """
+        if version == self.version:
+            return []
+        if not self._history or version > self.version or \
+                version < self._history[0][0] - 1:
+            return None
+        relative = []
+        n = len(path)
+        for v, changes in self._history:
+            if v <= version:
+                continue
+            for change in changes:
+                change_path = change[0]
+                if len(change_path) > n and \
+                        list(change_path[:n]) == list(path):
+                    # Below path
+                    relative.append([change_path[n:]] + list(change[1:]))
+                elif list(path[:len(change_path)]) == list(change_path):
+                    # Path or one of its parents was changed
+                    if len(change) == 1:
+                        return None
+                    value = change[1]
+                    try:
+                        for p in path[len(change_path):]:
+                            value = value[p]
+                    except (KeyError, TypeError):
+                        return None
+                    relative.append([[], value])
+        return collapse_changes(relative)
+
+    def _copy_path(self, path, copies):
+        """Walk the path, replacing each container with a shallow copy unless
+        it was copied in this batch, and return the last one"""
+        d = self
+        for p in path:
+            child = d[p]
+            if id(child) not in copies:
+                child = child.copy()
+                copies[id(child)] = child
+                d[p] = child
+            d = child
+        return d
+
     def walk_path(self, path):
         """Walk the path, and return the given endpoint"""
+        if not path:
+            # The top level is modified in place, so snapshot it
+            return OrderedDict(self)
         d = self
         for p in path:
             d = d[p]
@@ -64,50 +197,53 @@ class Cache(OrderedDict):
             subscription_changes.setdefault(subscription, []).append(change)
 
     def _notify_change(self, subscription_changes, change):
-        if self._subscription_tree is None:
-            return
         leaf = self._subscription_tree
-        self._add_changes(subscription_changes, leaf, change)
-        path = change[0]
-        value = change[1]
-        for node in path:
+        if leaf is None:
+            return
+        path, value = change
+        # Anyone subscribed on the way down gets the change relative to where
+        # they subscribed
+        for i, node in enumerate(path):
+            if leaf.subscriptions:
+                self._add_changes(
+                    subscription_changes, leaf, [path[i:], value])
             try:
                 leaf = leaf.children[node]
             except KeyError:
                 return
-            else:
-                path = path[1:]
-                self._add_changes(subscription_changes, leaf, [path, value])
+        if leaf.subscriptions:
+            self._add_changes(subscription_changes, leaf, [[], value])
 
         # Anyone downstream of this leaf needs notifying
-        self._notify_sub_leaves(subscription_changes, leaf, value)
+        if leaf.children:
+            self._notify_sub_leaves(subscription_changes, leaf, value)
 
     def _notify_sub_leaves(self, subscription_changes, leaf, d):
-        for node, leaf in leaf.children.items():
-            change = [[], d[node]]
-            self._add_changes(subscription_changes, leaf, change)
-            self._notify_sub_leaves(subscription_changes, leaf, d[node])
-
-    def _find_leaf(self, path):
-        leaf = self._subscription_tree
-        for node in path:
-            if node not in leaf.children:
-                leaf.children[node] = Leaf(leaf)
-            leaf = leaf.children[node]
-        return leaf
+        for node, child in leaf.children.items():
+            try:
+                value = d[node]
+            except (KeyError, TypeError):
+                # The new value doesn't have this subscribed path
+                continue
+            if child.subscriptions:
+                self._add_changes(subscription_changes, child, [[], value])
+            if child.children:
+                self._notify_sub_leaves(subscription_changes, child, value)
 
     def add_subscriber(self, subscription, path):
         if self._subscription_tree is None:
             self._subscription_tree = Leaf()
-        leaf = self._find_leaf(path)
-        leaf.subscriptions.append(subscription)
+        leaf = self._subscription_tree
+        for node in path:
+            leaf = leaf.get_child(node)
+        leaf.subscriptions[subscription] = None
 
     def remove_subscriber(self, subscription, path):
-        leaf = self._find_leaf(path)
-        leaf.subscriptions.remove(subscription)
+        leaf = self._subscription_tree
+        for node in path:
+            leaf = leaf.children[node]
+        del leaf.subscriptions[subscription]
+        # Prune the leaves that no longer lead to any subscriptions
         while leaf.parent and not leaf.subscriptions and not leaf.children:
-            node_name = [k for (k, v) in leaf.parent.children.items()
-                         if v == leaf][0]
-            leaf.parent.children.pop(node_name)
+            del leaf.parent.children[leaf.key]
             leaf = leaf.parent
-
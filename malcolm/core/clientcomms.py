@@ -1,7 +1,12 @@
 from malcolm.compat import OrderedDict
 from malcolm.core.loggable import Loggable
-from malcolm.core.response import Update
+from malcolm.core.request import Subscribe, Unsubscribe
+from malcolm.core.response import Update, Delta
 from malcolm.core.spawnable import Spawnable
+from malcolm.core.syncfactory import service_loop
+
+# Sentinel that asks send_loop to send the active subscriptions again
+RESUBSCRIBE = object()
 
 
 class ClientComms(Loggable, Spawnable):
@@ -9,31 +14,62 @@ class ClientComms(Loggable, Spawnable):
     a method"""
     # The id that will be use for subscriptions to the blocks the server has
     SERVER_BLOCKS_ID = 0
+    # Whether the server is known to understand PutMany requests. If not,
+    # ClientController sends a Put for each attribute instead
+    put_many_supported = False
 
     def __init__(self, process):
         self.process = process
         self.q = self.process.create_queue()
         self._current_id = 1
         self.requests = OrderedDict()
+        # {Subscribe.generate_key(): id we sent it with}
+        self._subscription_ids = {}
+        # {id: version of the last Delta} for delta subscriptions
+        self._subscription_versions = {}
         self.add_spawn_function(self.send_loop,
                                 self.make_default_stop_func(self.q))
 
+    @service_loop
     def send_loop(self):
         """Service self.q, sending requests to server"""
+        return self._send_requests()
+
+    def _send_requests(self):
         while True:
-            request = self.q.get()
-            if request is Spawnable.STOP:
-                break
-            try:
-                request.set_id(self._current_id)
-                self._current_id += 1
+            for request in (yield self.q, None):
+                if request is Spawnable.STOP:
+                    return
+                self._send_request(request)
 
-                # TODO: Move request store into new method?
-                self.requests[request.id] = request
-                self.send_to_server(request)
-            except Exception:  # pylint:disable=broad-except
-                self.log_exception(
-                    "Exception sending request %s", request.to_dict())
+    def _send_request(self, request):
+        if request is RESUBSCRIBE:
+            self._resubscribe()
+            return
+        try:
+            self._set_request_id(request)
+            # TODO: Move request store into new method?
+            self.requests[request.id] = request
+            self.send_to_server(request)
+        except Exception:  # pylint:disable=broad-except
+            self.log_exception(
+                "Exception sending request %s", request.to_dict())
+
+    def _set_request_id(self, request):
+        """Give request a unique id, or for an Unsubscribe the id that the
+        matching Subscribe was sent with"""
+        if isinstance(request, Unsubscribe):
+            key = request.generate_key()
+            if key in self._subscription_ids:
+                request.set_id(self._subscription_ids.pop(key))
+                self._subscription_versions.pop(request.id, None)
+                return
+        elif isinstance(request, Subscribe):
+            key = request.generate_key()
+        request.set_id(self._current_id)
+        self._current_id += 1
+        if isinstance(request, Subscribe):
+            self._subscription_ids[key] = request.id
 
     def send_to_server(self, request):
         """Abstract method to dispatch request to a server
@@ -44,11 +80,31 @@ class ClientComms(Loggable, Spawnable):
         raise NotImplementedError(
             "Abstract method that must be implemented by deriving class")
 
+    def resubscribe(self):
+        """Send all our active Subscribes to the server again after a
+        reconnect. Those with delta set ask for the changes since the version
+        of the last Delta they received if the server sent one, so only what was missed is sent. Safe to call
+        from any thread, as send_loop does the work"""
+        self.q.put(RESUBSCRIBE)
+
+    def _resubscribe(self):
+        for id_ in list(self._subscription_ids.values()):
+            request = self.requests[id_]
+            if id_ in self._subscription_versions:
+                request.set_since(self._subscription_versions[id_])
+            try:
+                self.send_to_server(request)
+            except Exception:  # pylint:disable=broad-except
+                self.log_exception(
+                    "Exception sending request %s", request.to_dict())
+
     def send_to_caller(self, response):
         if response.id == self.SERVER_BLOCKS_ID:
             assert isinstance(response, Update), \
                 "Expected server blocks Update, got %s" % response.type_
             self.process.update_block_list(self, response.value)
         else:
+            if isinstance(response, Delta) and response.version is not None:
+                self._subscription_versions[response.id] = response.version
             request = self.requests[response.id]
             request.response_queue.put(response)
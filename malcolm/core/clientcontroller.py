@@ -2,7 +2,7 @@ from malcolm.core.attribute import Attribute
 from malcolm.core.controller import Controller
 from malcolm.core.map import Map
 from malcolm.core.methodmeta import MethodMeta
-from malcolm.core.request import Post, Subscribe, Return, Put
+from malcolm.core.request import Post, Subscribe, Return, Put, PutMany
 from malcolm.core.response import Error
 
 
@@ -54,7 +54,8 @@ class ClientController(Controller):
                 # putting attribute forwards to server
                 writeable_functions[name] = self.put_server_attribute
 
-        self.block.set_writeable_functions(writeable_functions)
+        self.block.set_writeable_functions(
+            writeable_functions, self.put_server_attributes)
         self.block.replace_endpoints(d)
 
     def _subscribe_to_block(self, block_name):
@@ -66,16 +67,34 @@ class ClientController(Controller):
         self.client_comms.q.put(request)
 
     def _send_request(self, rtype, *args):
-        q = self.process.create_queue()
-        request = rtype(None, q, *args)
-        self.client_comms.q.put(request)
-        response = q.get()
-        if isinstance(response, Return):
-            return response.value
-        elif isinstance(response, Error):
-            raise ValueError(response.message)
-        else:
-            raise ValueError("Expected Return, got %s" % response.typeid)
+        return self._send_requests([(rtype, args)])[0]
+
+    def _send_requests(self, requests):
+        """Send a number of requests to the server at the same time and wait
+        for them all to complete
+
+        Args:
+            requests (list): [(request_type, args)] for each request
+
+        Returns:
+            list: The value of each Return, in the same order as requests
+        """
+        sent = []
+        for rtype, args in requests:
+            request = rtype(None, self.process.create_queue(), *args)
+            self.client_comms.q.put(request)
+            sent.append(request)
+        values = []
+        for request in sent:
+            response = request.response_queue.get()
+            if isinstance(response, Return):
+                values.append(response.value)
+            elif isinstance(response, Error):
+                raise ValueError(response.message)
+            else:
+                raise ValueError(
+                    "Expected Return, got %s" % response.typeid)
+        return values
 
     def put_server_attribute(self, attribute, value):
         """Put attribute value on the server
@@ -86,6 +105,21 @@ class ClientController(Controller):
         """
         self._send_request(Put, attribute.process_path + ["value"], value)
 
+    def put_server_attributes(self, attr_values):
+        """Put a number of attribute values on the server, in one PutMany
+        request if the server understands it
+
+        Args:
+            attr_values (dict): {attribute_name: value} to put
+        """
+        if self.client_comms.put_many_supported:
+            self._send_request(PutMany, self.block.process_path, attr_values)
+        else:
+            # The server may not know PutMany, so send a Put for each
+            self._send_requests([
+                (Put, (self.block[name].process_path + ["value"], value))
+                for name, value in attr_values.items()])
+
     def call_server_method(self, methodmeta, parameters=None, returns=None):
         """Call method_name on the server
 
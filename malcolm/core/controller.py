@@ -99,6 +99,8 @@ class Controller(Loggable):
 
         self.children_writeable = {}
         writeable_functions = {}
+        # {attribute_name: writeable_func} for put_many
+        self._put_functions = {}
         children = OrderedDict()
 
         for name, child, writeable_func in child_list:
@@ -122,9 +124,12 @@ class Controller(Loggable):
             if writeable_func:
                 writeable_functions[name] = functools.partial(
                     self.call_writeable_function, writeable_func)
+                if isinstance(child, Attribute):
+                    self._put_functions[name] = writeable_func
 
         self.block.replace_endpoints(children)
-        self.block.set_writeable_functions(writeable_functions)
+        self.block.set_writeable_functions(
+            writeable_functions, self.put_many)
 
     def call_writeable_function(self, function, child, *args):
         with self.lock:
@@ -134,6 +139,25 @@ class Controller(Loggable):
         result = function(*args)
         return result
 
+    def put_many(self, attr_values):
+        """Put a number of Attribute values, checking they are all writeable
+        with one lock acquisition, then calling their put functions in turn
+        in this thread
+
+        Args:
+            attr_values (dict): {attribute_name: value} to put
+        """
+        calls = []
+        with self.lock:
+            for name, value in attr_values.items():
+                attr = self.block[name]
+                if not attr.meta.writeable or name not in self._put_functions:
+                    raise ValueError(
+                        "Child %r is not writeable" % (attr.process_path,))
+                calls.append((self._put_functions[name], value))
+        for function, value in calls:
+            function(value)
+
     def create_meta(self):
         self.meta = BlockMeta()
         return "meta", self.meta, None
@@ -1,7 +1,7 @@
 from malcolm.compat import str_, OrderedDict
-from malcolm.core.monitorable import Monitorable
-from malcolm.core.serializable import serialize_object, Serializable, \
-    deserialize_object
+from malcolm.core.monitorable import Monitorable, serialize_shared
+from malcolm.core.serializable import Serializable, \
+    deserialize_object, check_camel_case
 from malcolm.core.vmeta import VMeta
 
 
@@ -23,6 +23,7 @@ class ElementMap(Monitorable):
                 assert v == self.typeid, \
                     "Dict has typeid %s but Class has %s" % (v, self.typeid)
             else:
+                check_camel_case(k)
                 try:
                     object.__getattribute__(self, k)
                 except AttributeError:
@@ -32,10 +33,11 @@ class ElementMap(Monitorable):
                         "Setting child %r would shadow an attribute" % (k,))
 
         self.endpoints = list(children)
+        self.invalidate_dict()
 
         for k, v in children.items():
             self.set_endpoint_data(k, v, notify=False)
 
         if self.process:
             self.process.report_changes(
-                [self.process_path, serialize_object(self)])
+                [self.process_path, serialize_shared(self)])
@@ -40,7 +40,7 @@ class HookRunner(Loggable):
         self.task.sentinel_stop = sentinel_stop
         # Say that we should only listen to stops after this point
         self.task.q.put(sentinel_stop)
-        self.task.start()
+        self.task.start(hook=True)
 
     def stop(self):
         self.task.stop()
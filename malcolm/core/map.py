@@ -49,6 +49,12 @@ class Map(Serializable):
         self._endpoint_data = {}
         self.endpoints = []
 
+    def get(self, key, default=None):
+        if key in self.endpoints:
+            return self[key]
+        else:
+            return default
+
     def keys(self):
         return self.endpoints
 
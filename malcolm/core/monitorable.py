@@ -1,10 +1,39 @@
+from malcolm.compat import OrderedDict
 from malcolm.core.loggable import Loggable
 from malcolm.core.serializable import Serializable, serialize_object
 
 
+def serialize_shared(o):
+    """Like serialize_object(), but Monitorables give their cached dict
+    rather than a copy of it. Only for publishing to the Process, as the
+    result is shared and must not be modified"""
+    if isinstance(o, Monitorable):
+        return o._to_shared_dict()
+    else:
+        return serialize_object(o)
+
+
+def _copy_containers(o):
+    # Copy the dicts and lists of a serialized object so the caller can modify
+    # them. Other values like numpy arrays are shared with the cached dict
+    if isinstance(o, dict):
+        copied = OrderedDict()
+        for k, v in o.items():
+            copied[k] = _copy_containers(v)
+        return copied
+    elif isinstance(o, list):
+        return [_copy_containers(v) for v in o]
+    else:
+        return o
+
+
 class Monitorable(Loggable, Serializable):
     process = None
     process_path = []
+    # The Monitorables we are an endpoint of, usually just one
+    _parents = ()
+    # The result of _make_dict(), or None if we or a child has changed since
+    _cached_dict = None
 
     def set_process_path(self, process, process_path):
         """Sets the path from the Process
@@ -29,10 +58,42 @@ class Monitorable(Loggable, Serializable):
         process_path = self.process_path + [name]
         if hasattr(value, "set_process_path") and self.process:
             value.set_process_path(self.process, process_path)
+        if isinstance(value, Monitorable) and \
+                not any(parent is self for parent in value._parents):
+            value._parents += (self,)
         super(Monitorable, self).set_endpoint_data(name, value)
+        self.invalidate_dict()
         if notify and self.process:
             self.process.report_changes(
-                [process_path, serialize_object(value)])
+                [process_path, serialize_shared(value)])
+
+    def to_dict(self):
+        """Return a serialized version of self that the caller may modify,
+        copied from the cached one"""
+        return _copy_containers(self._to_shared_dict())
+
+    def _to_shared_dict(self):
+        # Return the cached serialized version of self, making it if we or any
+        # child have changed since it was last made
+        d = self._cached_dict
+        if d is None:
+            d = self._make_dict()
+            self._cached_dict = d
+        return d
+
+    def _make_dict(self):
+        # Serialize ourself, sharing the cached dicts of our children
+        return self.serialize_endpoints(serialize_shared)
+
+    def invalidate_dict(self):
+        """Throw away the cached to_dict() result of ourself and our parents"""
+        obs = [self]
+        while obs:
+            ob = obs.pop()
+            # If ob has no cached dict then none of its parents can have one
+            if ob._cached_dict is not None:
+                ob._cached_dict = None
+                obs += ob._parents
 
     def apply_changes(self, *changes):
         serialized_changes = []
@@ -43,7 +104,7 @@ class Monitorable(Loggable, Serializable):
             attr = path[-1]
             setter = getattr(ob, "set_%s" % attr)
             setter(value, notify=False)
-            serialized = serialize_object(ob[attr])
+            serialized = serialize_shared(ob[attr])
             serialized_changes.append([self.process_path + path, serialized])
         if self.process:
             self.process.report_changes(*serialized_changes)
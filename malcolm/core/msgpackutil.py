@@ -0,0 +1,50 @@
+import struct
+
+import msgpack
+import numpy as np
+
+from malcolm.core.serializable import serialize_object
+from malcolm.compat import OrderedDict
+
+
+# msgpack extension type code for a numpy array carried as its raw buffer
+NDARRAY_EXT = 1
+# numpy dtype kinds that can be sent as raw buffers
+RAW_KINDS = "biuf"
+
+
+def msgpack_encode(o):
+    return msgpack.packb(o, default=serialize_hook, use_bin_type=True)
+
+
+def msgpack_decode(s):
+    o = msgpack.unpackb(s, object_pairs_hook=OrderedDict, ext_hook=ext_hook,
+                        raw=False)
+    return o
+
+
+def serialize_hook(o):
+    o = serialize_object(o)
+    if isinstance(o, (np.number, np.bool_)):
+        return o.tolist()
+    elif isinstance(o, np.ndarray):
+        assert len(o.shape) == 1, "Expected 1d array, got {}".format(o.shape)
+        if o.dtype.kind in RAW_KINDS:
+            # Payload is dtype string length, dtype string, then array data
+            dtype = o.dtype.str.encode("ascii")
+            data = b"".join((struct.pack("B", len(dtype)), dtype, o.tobytes()))
+            return msgpack.ExtType(NDARRAY_EXT, data)
+        else:
+            return o.tolist()
+    else:
+        return o
+
+
+def ext_hook(code, data):
+    if code == NDARRAY_EXT:
+        # The array is a read-only view on the message data
+        header_len = bytearray(data[:1])[0] + 1
+        dtype = data[1:header_len].decode("ascii")
+        return np.frombuffer(data, dtype=dtype, offset=header_len)
+    else:
+        return msgpack.ExtType(code, data)
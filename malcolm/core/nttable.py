@@ -5,7 +5,7 @@ from malcolm.core.serializable import Serializable
 
 @Serializable.register_subclass("epics:nt/NTTable:1.0")
 class NTTable(Attribute):
-    def to_dict(self):
+    def _make_dict(self):
         d = OrderedDict()
         d["typeid"] = self.typeid
         # Add labels for compatibility with epics normative types
@@ -17,7 +17,7 @@ class NTTable(Attribute):
             else:
                 labels.append(column_name)
         d["labels"] = labels
-        d.update(super(NTTable, self).to_dict())
+        d.update(super(NTTable, self)._make_dict())
         return d
 
     @classmethod
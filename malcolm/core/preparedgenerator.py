@@ -0,0 +1,286 @@
+from collections import namedtuple, OrderedDict
+import json
+import threading
+
+import numpy as np
+
+from malcolm.core.jsonutils import serialize_hook
+
+# How many points to get from the generator each time the arrays are filled
+POINTS_PER_FILL = 10000
+
+# Most points to keep filled for each prepared generator. The least recently
+# used fills past this are dropped, and got from the generator again if they
+# are asked for
+MAX_FILLED_POINTS = 1000000
+
+# How many prepared generators with different content to keep
+MAX_PREPARED_GENERATORS = 8
+
+
+# Read only views of the arrays for a range of points. positions, lower and
+# upper are {axis_name: np.array}, indexes is a 2D np.array of the dataset
+# index of each point in each dimension and durations is an np.array
+PointArrays = namedtuple(
+    "PointArrays", "positions, lower, upper, indexes, durations")
+
+
+def generator_key(generator):
+    """Make a key from the serialized content of a generator
+
+    Args:
+        generator (CompoundGenerator): The generator
+
+    Returns:
+        str: The same string for any generators with the same content
+    """
+    return serialized_generator_key(generator.to_dict())
+
+
+def serialized_generator_key(d):
+    """Make the key of generator_key() from an already serialized generator
+
+    Args:
+        d (dict): The serialized CompoundGenerator
+
+    Returns:
+        str: The key of the generator d was serialized from
+    """
+    return json.dumps(d, default=serialize_hook, sort_keys=True)
+
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+
+class PreparedGenerator(object):
+    """A prepared CompoundGenerator with its points as numpy arrays. The arrays
+    are made and filled POINTS_PER_FILL points at a time as they are asked
+    for, so each point is only got from the generator once while its fill is
+    kept, and at most MAX_FILLED_POINTS are held"""
+
+    def __init__(self, generator):
+        """
+        Args:
+            generator (CompoundGenerator): The generator, which will be
+                prepared if it hasn't been already
+        """
+        generator.prepare()
+        self.generator = generator
+        self.size = generator.size
+        self.axes = list(generator.axes)
+        # {fill: PointArrays} of the filled points with the most recently
+        # used last
+        self._fills = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _make_fill(self, fill):
+        start_index = fill * POINTS_PER_FILL
+        end_index = min(start_index + POINTS_PER_FILL, self.size)
+        num = end_index - start_index
+        positions = {}
+        lower = {}
+        upper = {}
+        for axis in self.axes:
+            positions[axis] = np.empty(num)
+            lower[axis] = np.empty(num)
+            upper[axis] = np.empty(num)
+        indexes = np.empty(
+            (num, len(self.generator.dimensions)), dtype=np.int64)
+        durations = np.empty(num)
+        for j, i in enumerate(range(start_index, end_index)):
+            point = self.generator.get_point(i)
+            for axis in self.axes:
+                positions[axis][j] = point.positions[axis]
+                lower[axis][j] = point.lower[axis]
+                upper[axis][j] = point.upper[axis]
+            indexes[j] = point.indexes
+            durations[j] = point.duration
+        for axis in self.axes:
+            _read_only(positions[axis])
+            _read_only(lower[axis])
+            _read_only(upper[axis])
+        return PointArrays(positions, lower, upper, _read_only(indexes),
+                           _read_only(durations))
+
+    def _get_fill(self, fill):
+        with self._lock:
+            points = self._fills.pop(fill, None)
+            if points is not None:
+                self._fills[fill] = points
+                return points
+        # Getting the points may be slow, so only hold the lock to look in and
+        # add to the fills
+        points = self._make_fill(fill)
+        with self._lock:
+            # Another thread may have filled it while we were getting them
+            points = self._fills.pop(fill, points)
+            self._fills[fill] = points
+            while len(self._fills) * POINTS_PER_FILL > MAX_FILLED_POINTS \
+                    and len(self._fills) > 1:
+                self._fills.popitem(last=False)
+        return points
+
+    def get_points(self, start_index, end_index):
+        """Get the arrays for a range of points
+
+        Args:
+            start_index (int): The first point to get
+            end_index (int): One past the last point to get
+
+        Returns:
+            PointArrays: Read only arrays, which are views of the shared
+                arrays if the points are all in one fill
+        """
+        assert 0 <= start_index <= end_index <= self.size, \
+            "Can't get points %d to %d of %d" % (
+                start_index, end_index, self.size)
+        if start_index == end_index:
+            empty = _read_only(np.empty(0))
+            return PointArrays(
+                {axis: empty for axis in self.axes},
+                {axis: empty for axis in self.axes},
+                {axis: empty for axis in self.axes},
+                _read_only(np.empty(
+                    (0, len(self.generator.dimensions)), dtype=np.int64)),
+                empty)
+        parts = []
+        for fill in range(start_index // POINTS_PER_FILL,
+                          (end_index - 1) // POINTS_PER_FILL + 1):
+            points = self._get_fill(fill)
+            offset = fill * POINTS_PER_FILL
+            s = slice(max(start_index - offset, 0), end_index - offset)
+            parts.append(PointArrays(
+                {axis: points.positions[axis][s] for axis in self.axes},
+                {axis: points.lower[axis][s] for axis in self.axes},
+                {axis: points.upper[axis][s] for axis in self.axes},
+                points.indexes[s], points.durations[s]))
+        if len(parts) == 1:
+            return parts[0]
+
+        # The points span fills, so join them into new arrays
+        def join(arrays):
+            return _read_only(np.concatenate(arrays))
+
+        return PointArrays(
+            {axis: join([p.positions[axis] for p in parts])
+             for axis in self.axes},
+            {axis: join([p.lower[axis] for p in parts]) for axis in self.axes},
+            {axis: join([p.upper[axis] for p in parts]) for axis in self.axes},
+            join([p.indexes for p in parts]),
+            join([p.durations for p in parts]))
+
+
+class PreparedGeneratorCache(object):
+    """Process wide cache of PreparedGenerators keyed by generator content, so
+    every part in every block of the process shares the same arrays"""
+
+    def __init__(self):
+        # {generator_key: PreparedGenerator} with the most recently used last
+        self._prepared = OrderedDict()
+        # {owner: generator_key} of the generator each owner is using
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def _find_same(self, generator):
+        # Must be called with the lock held
+        for key, prepared in self._prepared.items():
+            if prepared.generator is generator:
+                return key, prepared
+        return None, None
+
+    def _use(self, key, prepared, owner):
+        # Must be called with the lock held. Make prepared the most recently
+        # used, dropping the least recently used if there are too many, and
+        # the one owner used before if nothing else owns it
+        self._prepared.pop(key, None)
+        self._prepared[key] = prepared
+        if owner is not None:
+            old_key = self._owners.get(owner, key)
+            self._owners[owner] = key
+            if old_key != key and old_key not in self._owners.values():
+                self._prepared.pop(old_key, None)
+        while len(self._prepared) > MAX_PREPARED_GENERATORS:
+            self._prepared.popitem(last=False)
+
+    def find(self, generator):
+        """Find a PreparedGenerator with the same content as generator
+
+        Args:
+            generator (CompoundGenerator): The generator to look for
+
+        Returns:
+            PreparedGenerator: The cached one, or None if there isn't one
+        """
+        with self._lock:
+            if not self._prepared:
+                return None
+            _, prepared = self._find_same(generator)
+        if prepared is None:
+            # Serializing the generator may be slow, so don't hold the lock
+            key = generator_key(generator)
+            with self._lock:
+                prepared = self._prepared.get(key, None)
+        return prepared
+
+    def find_serialized(self, d):
+        """Find a PreparedGenerator whose generator serializes to d, without
+        making a generator from d
+
+        Args:
+            d (dict): The serialized CompoundGenerator to look for
+
+        Returns:
+            PreparedGenerator: The cached one, or None if there isn't one
+        """
+        with self._lock:
+            if not self._prepared:
+                return None
+        # Serializing the key may be slow, so don't hold the lock
+        key = serialized_generator_key(d)
+        with self._lock:
+            return self._prepared.get(key, None)
+
+    def get(self, generator, owner=None):
+        """Get the PreparedGenerator with the same content as generator,
+        preparing generator and adding it to the cache if there isn't one
+
+        Args:
+            generator (CompoundGenerator): The generator
+            owner (str): If given, the name of the block that is now using
+                generator. The generator it used before is dropped from the
+                cache if no other block owns it
+
+        Returns:
+            PreparedGenerator: The shared PreparedGenerator
+        """
+        with self._lock:
+            key, prepared = self._find_same(generator)
+            if prepared is not None:
+                self._use(key, prepared, owner)
+                return prepared
+        # Serializing and preparing the generator may be slow, so only hold
+        # the lock to look in and add to the cache
+        key = generator_key(generator)
+        with self._lock:
+            prepared = self._prepared.get(key, None)
+            if prepared is not None:
+                self._use(key, prepared, owner)
+                return prepared
+        prepared = PreparedGenerator(generator)
+        with self._lock:
+            # Another thread may have added one while we were preparing
+            prepared = self._prepared.get(key, prepared)
+            self._use(key, prepared, owner)
+        return prepared
+
+    def clear(self):
+        """Forget all the PreparedGenerators"""
+        with self._lock:
+            self._prepared.clear()
+            self._owners.clear()
+
+
+# The cache for the whole process
+prepared_generators = PreparedGeneratorCache()
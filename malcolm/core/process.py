@@ -1,47 +1,368 @@
-from collections import namedtuple
+from collections import namedtuple, deque
+import numbers
+import time
 
-from malcolm.compat import OrderedDict
+from malcolm.compat import OrderedDict, queue
 from malcolm.core.block import Block
-from malcolm.core.cache import Cache
+from malcolm.core.cache import Cache, collapse_changes
 from malcolm.core.clientcontroller import ClientController
 from malcolm.core.loggable import Loggable
-from malcolm.core.request import Post, Put, Subscribe, Unsubscribe, Get
+from malcolm.core.monitorable import serialize_shared
+from malcolm.core.request import Post, Put, Subscribe, Unsubscribe, Get, \
+    GetMany, PutMany
+from malcolm.core.syncfactory import service_loop, is_service_loop
 from malcolm.core.vmetas import StringArrayMeta
 
 # Sentinel object that when received stops the recv_loop
 PROCESS_STOP = object()
 
+# Maximum number of changes to merge into a single BlockChanges
+MAX_BATCH_CHANGES = 10000
+
+# Default number of BlockChanges to keep for resuming subscriptions
+CHANGE_HISTORY = 1000
+
+# Methods whose Posts jump ahead of all other queued requests
+CONTROL_METHODS = ("abort", "pause", "disable")
+
+# How many requests to handle between checks for newly queued ones
+PRIORITY_POLL = 32
+
+# Priority lanes of the dispatch queue, highest first
+CONTROL_LANE, REQUEST_LANE, CHANGE_LANE = range(3)
+
 # Internal update messages
 BlockChanges = namedtuple("BlockChanges", "changes")
-BlockRespond = namedtuple("BlockRespond", "response, response_queue")
+BlockRespond = namedtuple(
+    "BlockRespond", "response, response_queue, block_name")
+# block_name is optional
+BlockRespond.__new__.__defaults__ = (None,)
 BlockAdd = namedtuple("BlockAdd", "block, name, controller")
 BlockList = namedtuple("BlockList", "client_comms, blocks")
 AddSpawned = namedtuple("AddSpawned", "spawned, function")
+# The paths of a GetMany that one shard owns, and where they are in paths
+GetManyPart = namedtuple("GetManyPart", "gather, indexes, paths")
+
+# Requests that go in REQUEST_LANE. Client reads and writes share a lane so
+# they are handled in the order they arrived, ahead of change fan-out. The
+# responses that blocks send back for them go with them
+REQUEST_TYPES = (Post, Put, PutMany, Get, GetMany, GetManyPart, Subscribe,
+                 Unsubscribe, BlockAdd, BlockList, BlockRespond)
+
+# Requests that wait for earlier changes to their blocks. Reads so they never
+# see an older value than FIFO order would give, and responses so they arrive
+# after the changes that the request made
+READ_TYPES = (Get, GetMany, GetManyPart, Subscribe, BlockRespond)
+
+# Requests that control Posts wait for if they are earlier and to their block
+WRITE_TYPES = (Post, Put, PutMany)
+
+
+class DispatchShard(object):
+    """A worker queue that owns the cached state of a subset of the blocks"""
+
+    def __init__(self, q, change_history=0):
+        self.q = q
+        self.cache = Cache(change_history)
+        # {Subscribe: SubscriptionThrottle}
+        self.throttles = OrderedDict()
+
+
+class DispatchLanes(object):
+    """The requests a dispatch loop has taken off its queue but not handled
+    yet, sorted into priority lanes. A request only overtakes those for other
+    blocks: a read or block response waits for the BlockChanges to its
+    blocks that arrived before it, and a control Post for the earlier Posts
+    and Puts to its block"""
+
+    def __init__(self):
+        # [deque((seq, request, blocks))], highest priority lane first
+        self._lanes = [deque() for _ in range(CHANGE_LANE + 1)]
+        # Arrival number of the next request
+        self._seq = 0
+        # {block_name: deque(seq)} of the WRITE_TYPES in REQUEST_LANE
+        self._write_seqs = {}
+        # {block_name: deque(seq)} of the BlockChanges in CHANGE_LANE, with
+        # None for all of them
+        self._change_seqs = {}
+
+    def empty(self):
+        return not any(self._lanes)
+
+    def fill(self, requests):
+        """Sort requests into their priority lanes, keeping their order"""
+        for request in requests:
+            typ = type(request)
+            blocks = ()
+            if typ is Post and request.endpoint and \
+                    request.endpoint[-1] in CONTROL_METHODS:
+                lane = CONTROL_LANE
+                blocks = request.endpoint[:1]
+            elif typ in REQUEST_TYPES:
+                lane = REQUEST_LANE
+                if typ in WRITE_TYPES:
+                    blocks = request.endpoint[:1]
+                    self._add_seqs(self._write_seqs, blocks)
+                elif typ in READ_TYPES:
+                    blocks = _read_blocks(request)
+            else:
+                lane = CHANGE_LANE
+                if typ is BlockChanges:
+                    blocks = set(c[0][0] for c in request.changes if c[0])
+                    blocks.add(None)
+                    self._add_seqs(self._change_seqs, blocks)
+            self._lanes[lane].append((self._seq, request, blocks))
+            self._seq += 1
+
+    def _add_seqs(self, seqs, blocks):
+        for block in blocks:
+            seqs.setdefault(block, deque()).append(self._seq)
+
+    def popleft(self):
+        """Take the next request from the highest priority lane with one, or
+        if it must wait for an earlier one in a lower lane, from that lane"""
+        lane = CONTROL_LANE
+        while not self._lanes[lane]:
+            lane += 1
+        while True:
+            seq, request, blocks = self._lanes[lane][0]
+            if lane == CONTROL_LANE:
+                wait_for, seqs = REQUEST_LANE, self._write_seqs
+            elif type(request) in READ_TYPES:
+                wait_for, seqs = CHANGE_LANE, self._change_seqs
+            else:
+                break
+            if any(seqs.get(block, (seq,))[0] < seq for block in blocks):
+                # Handle the lower lane until the earlier ones are done
+                lane = wait_for
+            else:
+                break
+        return self._take(lane)
+
+    def popleft_block_changes(self):
+        """Take the BlockChanges at the front of the change lane
+
+        Returns:
+            BlockChanges: The changes, or None if the next request in the
+            change lane is not a BlockChanges, or it is empty
+        """
+        requests = self._lanes[CHANGE_LANE]
+        if requests and type(requests[0][1]) is BlockChanges:
+            return self._take(CHANGE_LANE)
+
+    def _take(self, lane):
+        _, request, blocks = self._lanes[lane].popleft()
+        if lane == REQUEST_LANE and type(request) in WRITE_TYPES:
+            self._remove_seqs(self._write_seqs, blocks)
+        elif lane == CHANGE_LANE and type(request) is BlockChanges:
+            self._remove_seqs(self._change_seqs, blocks)
+        return request
+
+    def _remove_seqs(self, seqs, blocks):
+        # The request was the earliest in its lane, so is first in each deque
+        for block in blocks:
+            block_seqs = seqs[block]
+            block_seqs.popleft()
+            if not block_seqs:
+                del seqs[block]
+
+
+def _read_blocks(request):
+    """Find the blocks that a READ_TYPES request reads, None for all of
+    them"""
+    if type(request) is BlockRespond:
+        return set([request.block_name])
+    elif type(request) in (Get, Subscribe):
+        paths = [request.endpoint]
+    else:
+        paths = request.paths
+    return set(path[0] if path else None for path in paths)
+
+
+class GetManyGather(object):
+    """Collects the values that each shard gets for a GetMany whose paths are
+    spread over several shards, responding when the last one is in"""
+
+    def __init__(self, request, lock, num_parts, num_values):
+        self.request = request
+        self.values = [None] * num_values
+        self._lock = lock
+        self._remaining = num_parts
+
+    def add_values(self, indexes, values):
+        for i, value in zip(indexes, values):
+            self.values[i] = value
+        if self._finish_part():
+            self.respond()
+
+    def respond(self):
+        self.request.respond_with_return(self.values)
+
+    def fail(self, message):
+        # The other parts will find there is nothing left to do
+        with self._lock:
+            remaining = self._remaining
+            self._remaining = 0
+        if remaining:
+            self.request.respond_with_error(message)
+
+    def _finish_part(self):
+        with self._lock:
+            if self._remaining:
+                self._remaining -= 1
+                return self._remaining == 0
+            return False
+
+
+class GetRootGather(GetManyGather):
+    """Collects the blocks that each shard owns for a Get of the root of a
+    sharded Process, responding with all of them when the last one is in"""
+
+    def __init__(self, request, lock, num_parts, block_names):
+        super(GetRootGather, self).__init__(
+            request, lock, num_parts, len(block_names))
+        self.block_names = block_names
+
+    def respond(self):
+        self.request.respond_with_return(
+            OrderedDict(zip(self.block_names, self.values)))
+
+
+class SubscriptionThrottle(object):
+    """Holds back the changes for a Subscribe with a period or deadband so
+    they can be merged before they are serialized and sent"""
+
+    def __init__(self, subscription):
+        self.subscription = subscription
+        # When we last sent a response
+        self.sent = 0
+        # Changes not sent yet, None if there aren't any
+        self.pending = None
+        # {path tuple: number} of the last numeric values sent
+        self.sent_values = {}
+
+    def due(self):
+        """Return when the pending changes can be sent"""
+        return self.sent + self.subscription.period
+
+    def add_changes(self, changes, now):
+        """Add changes to the pending ones
+
+        Returns:
+            list: The changes to send now, empty if they should be held back
+        """
+        if self.pending is None:
+            self.pending = list(changes)
+        else:
+            self.pending += changes
+        if now >= self.due():
+            return self.flush(now)
+        else:
+            return []
+
+    def flush(self, now):
+        """Merge the pending changes and drop those within the deadband
+
+        Returns:
+            list: The changes to send, marked as sent at now
+        """
+        if len(self.pending) > 1:
+            changes = collapse_changes(self.pending)
+        else:
+            changes = self.pending
+        self.pending = None
+        if self.subscription.deadband:
+            changes = self._apply_deadband(changes)
+        if changes:
+            self.sent = now
+        return changes
+
+    def _apply_deadband(self, changes):
+        deadband = self.subscription.deadband
+        filtered = []
+        for change in changes:
+            path = tuple(change[0])
+            if len(change) > 1 and _is_number(change[1]):
+                last = self.sent_values.get(path)
+                if last is not None and abs(change[1] - last) < deadband:
+                    continue
+                self.sent_values[path] = change[1]
+            else:
+                # Anything we sent below here has been replaced or deleted
+                for sent_path in list(self.sent_values):
+                    if sent_path[:len(path)] == path:
+                        self.sent_values.pop(sent_path)
+            filtered.append(change)
+        return filtered
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
 
 
 class Process(Loggable):
     """Hosts a number of Blocks, distributing requests between them"""
 
-    def __init__(self, name, sync_factory):
+    def __init__(self, name, sync_factory, dispatch_shards=0,
+                 change_batch_window=None, change_history=CHANGE_HISTORY):
+        """
+        Args:
+            name (str): Name of the Process, also used for the process block
+            sync_factory (SyncFactory): Factory for thread primitives
+            dispatch_shards (int): If >0, blocks are spread over this many
+                worker loops that each own their block's cached state and
+                subscriptions, so changes to independent blocks can be fanned
+                out in parallel. 0 means service everything in recv_loop.
+                A Get of the root gathers the blocks from every shard, but a
+                Subscribe to the root or a GetMany with an empty path gets an
+                Error as no one shard has all the blocks
+            change_batch_window (float): If not None, merge consecutive
+                BlockChanges into one batch before notifying subscribers,
+                waiting up to this many seconds for more to arrive. 0 means
+                only merge those already queued. Note that non-delta
+                subscribers will then not see values that are overwritten
+                within a batch
+            change_history (int): How many BlockChanges batches to remember
+                so a delta Subscribe with since set can be sent just the
+                changes it missed
+        """
         self.set_logger_name(name)
         self.name = name
         self.sync_factory = sync_factory
+        self.change_batch_window = change_batch_window
         self.q = self.create_queue()
         self._blocks = OrderedDict()  # block_name -> Block
         self._controllers = OrderedDict()  # block_name -> Controller
-        self._block_state_cache = Cache()
+        self._block_state_cache = Cache(change_history)
+        # {Subscribe: SubscriptionThrottle} for the blocks in _block_state_cache
+        self._throttles = OrderedDict()
         self._recv_spawned = None
         self._other_spawned = []
+        # [DispatchShard], empty if everything is done in recv_loop
+        self._shards = [
+            DispatchShard(self.create_queue(), change_history)
+            for _ in range(dispatch_shards)]
+        self._shard_spawned = []
+        # {block_name: DispatchShard}, only changed by recv_loop, which
+        # replaces it with an updated copy so the shards can read it unlocked
+        self._block_shards = {}
+        # {Request.generate_key(): DispatchShard}, only touched by recv_loop
+        self._subscription_shards = {}
         # lookup of all Subscribe requests, ordered to guarantee subscription
         # notification ordering
         # {Request.generate_key(): Subscribe}
         self._subscriptions = OrderedDict()
+        # The shards all add and remove _subscriptions, so hold this to do it
+        self._subscriptions_lock = self.create_lock()
         self.comms = []
         self._client_comms = OrderedDict()  # client comms -> list of blocks
         self._handle_functions = {
             Post: self._forward_block_request,
             Put: self._forward_block_request,
+            PutMany: self._forward_block_request,
             Get: self._handle_get,
+            GetMany: self._handle_get_many,
+            GetManyPart: self._handle_get_many_part,
             Subscribe: self._handle_subscribe,
             Unsubscribe: self._handle_unsubscribe,
             BlockChanges: self._handle_block_changes,
@@ -50,24 +371,132 @@ class Process(Loggable):
             BlockList: self._handle_block_list,
             AddSpawned: self._add_spawned,
         }
+        # Requests that recv_loop passes on to a shard if we have any
+        self._route_functions = {
+            Get: self._route_get,
+            GetMany: self._route_get_many,
+            Subscribe: self._route_subscribe,
+            Unsubscribe: self._route_unsubscribe,
+            BlockChanges: self._route_block_changes,
+            BlockRespond: self._route_block_respond,
+        }
         self.create_process_block()
 
+    @service_loop
     def recv_loop(self):
-        """Service self.q, distributing the requests to the right block"""
+        """Service self.q, distributing the requests to the right block. Any
+        shards are stopped with it"""
+        if self._shards:
+            handle_functions = self._handle_functions.copy()
+            handle_functions.update(self._route_functions)
+        else:
+            handle_functions = self._handle_functions
+        return self._service_queue(self.q, handle_functions, self._throttles,
+                                   [shard.q for shard in self._shards])
+
+    @service_loop
+    def shard_loop(self, shard):
+        """Service the queue of a DispatchShard, in order"""
+        return self._service_queue(
+            shard.q, self._handle_functions, shard.throttles, [])
+
+    def _service_queue(self, q, handle_functions, throttles, stop_queues):
+        """Generator that handles requests from q until PROCESS_STOP, then
+        passes it on to stop_queues. It merges consecutive BlockChanges into
+        one apply and notify pass if change_batch_window is set, and sends
+        the held back changes of throttles when they are due. Posts to
+        CONTROL_METHODS are handled first, then other client requests, then
+        everything else in the order it arrived, except that a request never
+        overtakes those for the same block that DispatchLanes says it should
+        wait for"""
+        # Requests we have taken off q but not handled yet
+        lanes = DispatchLanes()
+        handled = 0
         while True:
-            request = self.q.get()
+            if lanes.empty():
+                timeout = self._flush_throttles(throttles)
+                try:
+                    lanes.fill((yield q, timeout))
+                except queue.Empty:
+                    continue
+            elif handled >= PRIORITY_POLL:
+                # Look for newly arrived control requests so they don't wait
+                # behind the rest of the backlog
+                handled = 0
+                if q.qsize():
+                    lanes.fill(q.get_many(timeout=0))
+            request = lanes.popleft()
+            handled += 1
             self.log_debug("Received request %s", request)
             if request is PROCESS_STOP:
                 # Got the sentinel, stop immediately
-                break
+                for stop_q in stop_queues:
+                    stop_q.put(PROCESS_STOP)
+                return
+            if type(request) is BlockChanges and \
+                    self.change_batch_window is not None:
+                # Merge any more that arrive within change_batch_window
+                changes = list(request.changes)
+                until = time.time() + self.change_batch_window
+                while self._take_queued_changes(lanes, changes):
+                    timeout = max(until - time.time(), 0)
+                    try:
+                        lanes.fill((yield q, timeout))
+                    except queue.Empty:
+                        break
+                request = BlockChanges(collapse_changes(changes))
+            self._handle_request(request, handle_functions)
+
+    def _take_queued_changes(self, lanes, changes):
+        """Move the changes of any BlockChanges from the front of the change
+        lane onto the end of changes
+
+        Returns:
+            bool: True if we should wait for more to arrive, False if the
+            batch is full or a request that isn't BlockChanges is waiting
+        """
+        while len(changes) < MAX_BATCH_CHANGES:
+            request = lanes.popleft_block_changes()
+            if request is None:
+                return lanes.empty()
+            changes += request.changes
+        return False
+
+    def _flush_throttles(self, throttles):
+        """Send the pending changes of any throttles that are due
+
+        Returns:
+            float: Seconds until the next pending changes are due, None if
+            there aren't any
+        """
+        next_due = None
+        if throttles:
+            now = time.time()
+            for throttle in throttles.values():
+                if throttle.pending is None:
+                    continue
+                due = throttle.due()
+                if now >= due:
+                    changes = throttle.flush(now)
+                    if changes:
+                        subscription = throttle.subscription
+                        self._respond_to_subscription(
+                            self._cache_for(subscription.endpoint),
+                            subscription, changes)
+                elif next_due is None or due < next_due:
+                    next_due = due
+        if next_due is not None:
+            return max(next_due - now, 0)
+
+    def _handle_request(self, request, handle_functions):
+        try:
+            handle_functions[type(request)](request)
+        except Exception as e:  # pylint:disable=broad-except
+            self.log_exception("Exception while handling %s", request)
             try:
-                self._handle_functions[type(request)](request)
-            except Exception as e:  # pylint:disable=broad-except
-                self.log_exception("Exception while handling %s", request)
-                try:
-                    request.respond_with_error(str(e))
-                except Exception:
-                    pass
+                request.respond_with_error(str(e))
+            except Exception:
+                pass
 
     def add_comms(self, comms):
         assert not self._recv_spawned, \
@@ -76,6 +505,8 @@ class Process(Loggable):
 
     def start(self):
         """Start the process going"""
+        self._shard_spawned = [self.sync_factory.spawn(self.shard_loop, shard)
+                               for shard in self._shards]
         self._recv_spawned = self.sync_factory.spawn(self.recv_loop)
         for comms in self.comms:
             comms.start()
@@ -91,8 +522,10 @@ class Process(Loggable):
         self.q.put(PROCESS_STOP)
         for comms in self.comms:
             comms.stop()
-        # Wait for recv_loop to complete first
+        # Wait for recv_loop to complete first, it will stop the shards
         self._recv_spawned.wait(timeout=timeout)
+        for s in self._shard_spawned:
+            s.wait(timeout=timeout)
         # Now wait for anything it spawned to complete
         for s, _ in self._other_spawned:
             s.wait(timeout=timeout)
@@ -129,16 +562,34 @@ class Process(Loggable):
         """
         return self.sync_factory.create_lock()
 
+    def get_ioloop(self):
+        """Calls SyncFactory.get_ioloop()"""
+        return self.sync_factory.get_ioloop()
+
     def spawn(self, function, *args, **kwargs):
         """Calls SyncFactory.spawn()"""
+        return self._spawn(self.sync_factory.spawn, function, args, kwargs)
+
+    def spawn_hook(self, function, *args, **kwargs):
+        """Calls SyncFactory.spawn_hook()"""
+        return self._spawn(
+            self.sync_factory.spawn_hook, function, args, kwargs)
+
+    def _spawn(self, sync_spawn, function, args, kwargs):
+        if is_service_loop(function):
+            # Pass it on as it is so the SyncFactory can choose how to run it
+            spawned = sync_spawn(function, *args, **kwargs)
+            self.q.put(AddSpawned(spawned, function))
+            return spawned
+
         def catching_function():
             try:
-                function(*args, **kwargs)
+                return function(*args, **kwargs)
             except Exception:
                 self.log_exception(
                     "Exception calling %s(*%s, **%s)", function, args, kwargs)
                 raise
-        spawned = self.sync_factory.spawn(catching_function)
+        spawned = sync_spawn(catching_function)
         request = AddSpawned(spawned, function)
         self.q.put(request)
         return spawned
@@ -181,29 +632,165 @@ class Process(Loggable):
             remotes += [b for b in blocks if b not in remotes]
         self.process_block["remoteBlocks"].set_value(remotes)
 
+    def _allocate_shard(self, block_name):
+        """Give block_name a DispatchShard, allocating them round robin. Only
+        called from recv_loop"""
+        # The shards read _block_shards while we do this, so never change
+        # the dict they might be looking at
+        block_shards = self._block_shards.copy()
+        block_shards[block_name] = \
+            self._shards[len(block_shards) % len(self._shards)]
+        self._block_shards = block_shards
+
+    def _shard_for(self, block_name):
+        """Find the DispatchShard that owns block_name. Only called from
+        recv_loop"""
+        try:
+            return self._block_shards[block_name]
+        except KeyError:
+            raise ValueError("No block called %r" % (block_name,))
+
+    def _shard_for_path(self, path):
+        if not path:
+            raise ValueError(
+                "A sharded Process needs a block name in the path")
+        return self._shard_for(path[0])
+
+    def _cache_for(self, path):
+        """Find the Cache that holds the structure at path"""
+        if self._shards:
+            # recv_loop allocated the shard when it routed the request to us
+            return self._block_shards[path[0]].cache
+        else:
+            return self._block_state_cache
+
+    def _throttles_for(self, path):
+        """Find the throttles of the subscriptions in _cache_for(path)"""
+        if self._shards:
+            return self._block_shards[path[0]].throttles
+        else:
+            return self._throttles
+
+    def _split_paths(self, paths):
+        """Find which paths each shard owns
+
+        Returns:
+            OrderedDict: {DispatchShard: ([index], [path])} of the paths each
+            shard owns and where they are in paths
+        """
+        shard_paths = OrderedDict()
+        for i, path in enumerate(paths):
+            indexes, shard_path_list = shard_paths.setdefault(
+                self._shard_for_path(path), ([], []))
+            indexes.append(i)
+            shard_path_list.append(path)
+        return shard_paths
+
+    def _put_parts(self, gather, shard_paths):
+        # Each shard gets its own paths from its cache, and the last one to
+        # finish responds. The paths may not all be from the same moment
+        for shard, (indexes, paths) in shard_paths.items():
+            shard.q.put(GetManyPart(gather, indexes, paths))
+
+    def _route_get(self, request):
+        if request.endpoint:
+            self._shard_for_path(request.endpoint).q.put(request)
+        else:
+            # No shard has all the blocks, so get each from its owner
+            block_names = list(self._blocks)
+            shard_paths = self._split_paths([[name] for name in block_names])
+            gather = GetRootGather(
+                request, self.create_lock(), len(shard_paths), block_names)
+            self._put_parts(gather, shard_paths)
+
+    def _route_get_many(self, request):
+        if not all(request.paths):
+            request.respond_with_error(
+                "GetMany paths of a sharded Process need a block name")
+            return
+        shard_paths = self._split_paths(request.paths)
+        if len(shard_paths) == 1:
+            list(shard_paths)[0].q.put(request)
+        else:
+            gather = GetManyGather(request, self.create_lock(),
+                                   len(shard_paths), len(request.paths))
+            self._put_parts(gather, shard_paths)
+
+    def _route_subscribe(self, request):
+        if not request.endpoint:
+            request.respond_with_error(
+                "Can't subscribe to the root of a sharded Process, "
+                "subscribe to each block instead")
+            return
+        shard = self._shard_for_path(request.endpoint)
+        self._subscription_shards[request.generate_key()] = shard
+        shard.q.put(request)
+
+    def _route_unsubscribe(self, request):
+        try:
+            shard = self._subscription_shards.pop(request.generate_key())
+        except KeyError:
+            # Let _handle_unsubscribe produce the error response
+            self._handle_unsubscribe(request)
+        else:
+            shard.q.put(request)
+
+    def _route_block_changes(self, request):
+        # Split the changes so each shard gets those for its own blocks in
+        # the order they were reported
+        shard_changes = OrderedDict()
+        for change in request.changes:
+            shard = self._shard_for_path(change[0])
+            shard_changes.setdefault(shard, []).append(change)
+        for shard, changes in shard_changes.items():
+            shard.q.put(BlockChanges(changes=changes))
+
+    def _route_block_respond(self, request):
+        shard = self._block_shards.get(request.block_name, None)
+        if shard is None:
+            self._handle_block_respond(request)
+        else:
+            # Go via the shard so it arrives after any changes it made
+            shard.q.put(request)
+
     def _handle_block_changes(self, request):
         """Update subscribers with changes and applies stored changes to the
         cached structure"""
+        if not request.changes:
+            return
         # update cached dict
-        subscription_changes = self._block_state_cache.apply_changes(
-            *request.changes)
+        cache = self._cache_for(request.changes[0][0])
+        subscription_changes = cache.apply_changes(*request.changes)
 
         # Send out the changes
+        throttles = self._throttles_for(request.changes[0][0])
+        if throttles:
+            now = time.time()
         for subscription, changes in subscription_changes.items():
-            if subscription.delta:
-                # respond with the filtered changes
-                subscription.respond_with_delta(changes)
-            else:
-                # respond with the structure of everything
-                # below the endpoint
-                d = self._block_state_cache.walk_path(subscription.endpoint)
-                subscription.respond_with_update(d)
+            if throttles and subscription in throttles:
+                # hold the changes back until the period is up, only
+                # serializing what is left after merging
+                changes = throttles[subscription].add_changes(changes, now)
+                if not changes:
+                    continue
+            self._respond_to_subscription(cache, subscription, changes)
+
+    def _respond_to_subscription(self, cache, subscription, changes):
+        """Send changes relative to subscription.endpoint to subscription"""
+        if subscription.delta:
+            # respond with the filtered changes
+            subscription.respond_with_delta(changes, cache.version)
+        else:
+            # respond with the structure of everything
+            # below the endpoint
+            d = cache.walk_path(subscription.endpoint)
+            subscription.respond_with_update(d)
 
     def report_changes(self, *changes):
         self.q.put(BlockChanges(changes=list(changes)))
 
-    def block_respond(self, response, response_queue):
-        self.q.put(BlockRespond(response, response_queue))
+    def block_respond(self, response, response_queue, block_name=None):
+        self.q.put(BlockRespond(response, response_queue, block_name))
 
     def _handle_block_respond(self, request):
         """Push the response to the required queue"""
@@ -237,9 +824,13 @@ class Process(Loggable):
             "There is already a block called %r" % request.name
         self._blocks[request.name] = request.block
         self._controllers[request.name] = request.controller
-        serialized = request.block.to_dict()
+        serialized = serialize_shared(request.block)
         change_request = BlockChanges([[[request.name], serialized]])
-        self._handle_block_changes(change_request)
+        if self._shards:
+            self._allocate_shard(request.name)
+            self._route_block_changes(change_request)
+        else:
+            self._handle_block_changes(change_request)
         # Regenerate list of blocks
         self.process_block["blocks"].set_value(list(self._blocks))
 
@@ -265,14 +856,28 @@ class Process(Loggable):
         """Add a new subscriber and respond with the current
         sub-structure state"""
         key = request.generate_key()
-        assert key not in self._subscriptions, \
-            "Subscription on %s already exists" % (key,)
-        self._subscriptions[key] = request
-        self._block_state_cache.add_subscriber(request, request.endpoint)
-        d = self._block_state_cache.walk_path(request.endpoint)
-        self.log_debug("Initial subscription value %s", d)
+        with self._subscriptions_lock:
+            assert key not in self._subscriptions, \
+                "Subscription on %s already exists" % (key,)
+            self._subscriptions[key] = request
+        cache = self._cache_for(request.endpoint)
+        cache.add_subscriber(request, request.endpoint)
+        changes = None
+        if request.delta and request.since is not None:
+            # Resuming, so try to send only what they missed
+            changes = cache.changes_since(request.since, request.endpoint)
+            self.log_debug("Changes since version %s: %s",
+                           request.since, changes)
+        if changes is None:
+            d = cache.walk_path(request.endpoint)
+            self.log_debug("Initial subscription value %s", d)
+            changes = [[[], d]]
+        if request.period or request.deadband:
+            throttle = SubscriptionThrottle(request)
+            throttle.add_changes(changes, time.time())
+            self._throttles_for(request.endpoint)[request] = throttle
         if request.delta:
-            request.respond_with_delta([[[], d]])
+            request.respond_with_delta(changes, cache.version)
         else:
             request.respond_with_update(d)
 
@@ -280,15 +885,32 @@ class Process(Loggable):
         """Remove a subscriber and respond with success or error"""
         key = request.generate_key()
         try:
-            subscription = self._subscriptions.pop(key)
+            with self._subscriptions_lock:
+                subscription = self._subscriptions.pop(key)
         except KeyError:
             request.respond_with_error(
                 "No subscription found for %s" % (key,))
         else:
-            self._block_state_cache.remove_subscriber(
+            self._cache_for(subscription.endpoint).remove_subscriber(
                 subscription, subscription.endpoint)
+            self._throttles_for(subscription.endpoint).pop(subscription, None)
             request.respond_with_return()
 
     def _handle_get(self, request):
-        d = self._block_state_cache.walk_path(request.endpoint)
+        d = self._cache_for(request.endpoint).walk_path(request.endpoint)
         request.respond_with_return(d)
+
+    def _handle_get_many(self, request):
+        values = [self._cache_for(path).walk_path(path)
+                  for path in request.paths]
+        request.respond_with_return(values)
+
+    def _handle_get_many_part(self, request):
+        try:
+            values = [self._cache_for(path).walk_path(path)
+                      for path in request.paths]
+        except Exception as e:  # pylint:disable=broad-except
+            self.log_exception("Exception while handling %s", request)
+            request.gather.fail(str(e))
+        else:
+            request.gather.add_values(request.indexes, values)
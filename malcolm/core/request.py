@@ -129,6 +129,65 @@ class Put(Request):
         self.set_endpoint_data("value", serialize_object(value))
 
 
+@Serializable.register_subclass("malcolm:core/GetMany:1.0")
+class GetMany(Request):
+    """Create a GetMany Request object, that will Return a list of the
+    structures at each path"""
+
+    endpoints = ["id", "paths"]
+
+    def __init__(self, context=None, response_queue=None, paths=None):
+        """
+        Args:
+            context(): Context of GetMany
+            response_queue(Queue): Queue to return to
+            paths(list): [[`str`]] Paths to target Block substructures
+        """
+
+        super(GetMany, self).__init__(context, response_queue)
+        self.set_paths(paths)
+
+    def set_paths(self, paths):
+        if paths is not None:
+            paths = [[deserialize_object(e, str_) for e in path]
+                     for path in paths]
+        self.set_endpoint_data("paths", paths)
+
+
+@Serializable.register_subclass("malcolm:core/PutMany:1.0")
+class PutMany(Request):
+    """Create a PutMany Request object, that sets the values of a number of
+    Attributes of a Block in one go"""
+
+    endpoints = ["id", "endpoint", "values"]
+
+    def __init__(self, context=None, response_queue=None,
+                 endpoint=None, values=None):
+        """
+        Args:
+            context(): Context of PutMany
+            response_queue(Queue): Queue to return to
+            endpoint(list): [`str`] Path to target Block
+            values(dict): {attribute_name: value} to put to the Block
+        """
+
+        super(PutMany, self).__init__(context, response_queue)
+        self.set_endpoint(endpoint)
+        self.set_values(values)
+
+    def set_endpoint(self, endpoint):
+        if endpoint is not None:
+            endpoint = [deserialize_object(e, str_) for e in endpoint]
+        self.set_endpoint_data("endpoint", endpoint)
+
+    def set_values(self, values):
+        if values is not None:
+            values = OrderedDict(
+                (deserialize_object(k, str_), serialize_object(v))
+                for k, v in values.items())
+        self.set_endpoint_data("values", values)
+
+
 @Serializable.register_subclass("malcolm:core/Post:1.0")
 class Post(Request):
     """Create a Post Request object"""
@@ -167,21 +226,47 @@ class Post(Request):
 class Subscribe(Request):
     """Create a Subscribe Request object"""
 
-    endpoints = ["id", "endpoint", "delta"]
+    endpoints = ["id", "endpoint", "delta", "period", "deadband", "since"]
+
+    # Endpoints added since Subscribe:1.0 was released, with the values that
+    # mean they aren't used. They are left out of to_dict() when they have
+    # these values so peers that don't know them can still read it
+    optional_endpoints = OrderedDict(
+        [("period", 0.0), ("deadband", 0.0), ("since", None)])
 
     def __init__(self, context=None, response_queue=None, endpoint=None,
-                 delta=False):
+                 delta=False, period=0, deadband=0, since=None):
         """
         Args:
             context: Context of Subscribe
             response_queue (Queue): Queue to return to
             endpoint (list): [`str`] Path to target
             delta (bool): Notify of differences only (default False)
+            period (float): Minimum time in seconds between notifications,
+                changes in between are merged into the next one. 0 or None
+                means notify every change (default 0)
+            deadband (float): Don't notify of changes to numeric values that
+                are smaller than this since the last notification. 0 or None
+                means notify every change (default 0)
+            since (int): If delta, the version of the last Delta received by
+                a previous subscription. The first Delta will then only
+                contain the changes made after it if the server still has
+                them (default None)
         """
 
         super(Subscribe, self).__init__(context, response_queue)
         self.set_endpoint(endpoint)
         self.set_delta(delta)
+        self.set_period(period)
+        self.set_deadband(deadband)
+        self.set_since(since)
+
+    def to_dict(self):
+        d = super(Subscribe, self).to_dict()
+        for endpoint, default in self.optional_endpoints.items():
+            if d[endpoint] == default:
+                d.pop(endpoint)
+        return d
 
     def respond_with_update(self, value):
         """
@@ -193,14 +278,17 @@ class Subscribe(Request):
         response = Update(self.id, self.context, value=value)
         self._respond(response)
 
-    def respond_with_delta(self, changes):
+    def respond_with_delta(self, changes, version=None):
         """
         Create a Delta Response object to handle the request
 
         Args:
             changes (list): list of [[path], value] pairs for changed values
+            version (int): Version of the cache after the changes, None if
+                the cache doesn't keep versions
         """
-        response = Delta(self.id, self.context, changes=changes)
+        response = Delta(self.id, self.context, changes=changes,
+                         version=version)
         self._respond(response)
 
     def set_endpoint(self, endpoint):
@@ -212,6 +300,25 @@ class Subscribe(Request):
         delta = deserialize_object(delta, bool)
         self.set_endpoint_data("delta", delta)
 
+    def set_period(self, period):
+        if period is None:
+            period = 0
+        period = float(period)
+        assert period >= 0, "Expected period >= 0, got %s" % period
+        self.set_endpoint_data("period", period)
+
+    def set_deadband(self, deadband):
+        if deadband is None:
+            deadband = 0
+        deadband = float(deadband)
+        assert deadband >= 0, "Expected deadband >= 0, got %s" % deadband
+        self.set_endpoint_data("deadband", deadband)
+
+    def set_since(self, since):
+        if since is not None:
+            since = deserialize_object(since, int)
+        self.set_endpoint_data("since", since)
+
 
 @Serializable.register_subclass("malcolm:core/Unsubscribe:1.0")
 class Unsubscribe(Request):
@@ -87,19 +87,35 @@ class Update(Response):
 class Delta(Response):
     """Create a Delta Response object with the provided parameters"""
 
-    endpoints = ["id", "changes"]
+    endpoints = ["id", "changes", "version"]
 
-    def __init__(self, id_=None, context=None, changes=None):
+    def __init__(self, id_=None, context=None, changes=None, version=None):
         """
         Args:
             id_ (int): id from initial message
             context: Context associated with id
             changes (list): list of [[path], value] pairs for changed values
+            version (int): Version of the server's cache these changes bring
+                the subscriber up to, to resume from with Subscribe.since
         """
 
         super(Delta, self).__init__(id_, context)
         self.set_changes(changes)
+        self.set_version(version)
+
+    def to_dict(self):
+        d = super(Delta, self).to_dict()
+        # version was added after Delta:1.0 was released, so leave it out
+        # when it isn't used so peers that don't know it can still read it
+        if d["version"] is None:
+            d.pop("version")
+        return d
 
     def set_changes(self, changes):
         # TODO: validate this
         self.set_endpoint_data("changes", changes)
+
+    def set_version(self, version):
+        if version is not None:
+            version = deserialize_object(version, int)
+        self.set_endpoint_data("version", version)
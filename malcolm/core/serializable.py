@@ -15,21 +15,101 @@ def check_camel_case(name):
         logging.warning("String %r is not camelCase", name)
 
 
-def serialize_object(o):
-    if hasattr(o, "to_dict"):
+def _serialize_dict(o):
+    # Need to recurse down
+    d = OrderedDict()
+    for k, v in o.items():
+        d[k] = serialize_object(v)
+    return d
+
+
+def _serialize_as_is(o):
+    # Hope it's serializable!
+    return o
+
+
+# {type: function that serializes instances of type}, filled in as we meet
+# new types
+_type_serializers = {}
+
+
+def _find_serializer(typ):
+    if hasattr(typ, "to_dict"):
         # This will do all the sub layers for us
+        return typ.to_dict
+    elif hasattr(typ, "__getattr__"):
+        # Instances may grow a to_dict, so we can't decide from the type
+        return None
+    elif issubclass(typ, dict):
+        return _serialize_dict
+    else:
+        return _serialize_as_is
+
+
+def serialize_object(o):
+    typ = type(o)
+    try:
+        serializer = _type_serializers[typ]
+    except KeyError:
+        serializer = _find_serializer(typ)
+        if serializer is not None:
+            _type_serializers[typ] = serializer
+    if serializer is not None:
+        return serializer(o)
+    elif hasattr(o, "to_dict"):
         return o.to_dict()
-    elif isinstance(o, (dict, OrderedDict)):
-        # Need to recurse down
-        d = OrderedDict()
-        for k, v in o.items():
-            d[k] = serialize_object(v)
-        return d
+    elif isinstance(o, dict):
+        return _serialize_dict(o)
     else:
-        # Hope it's serializable!
         return o
 
 
+# {cls: to_dict function made for cls.endpoints}
+_compiled_to_dicts = {}
+
+
+def make_to_dict(endpoints):
+    """Make a to_dict function for the given endpoints
+
+    Args:
+        endpoints (list): The endpoint names to serialize, in order
+
+    Returns:
+        function: Taking an instance and a function to serialize each
+        endpoint value with, and returning the instance's serialized dict
+    """
+    endpoints = tuple(endpoints)
+
+    def to_dict(self, serialize=serialize_object):
+        data = self._endpoint_data
+        d = OrderedDict()
+        d["typeid"] = self.typeid
+        for endpoint in endpoints:
+            d[endpoint] = serialize(data[endpoint])
+        return d
+
+    return to_dict
+
+
+def compile_to_dict(cls):
+    """Make a to_dict function for the endpoints listed on cls, checking that
+    they are camelCase once here rather than on every call
+
+    Args:
+        cls: Serializable subclass
+
+    Returns:
+        function: As returned by make_to_dict(), or None if the endpoints are
+        calculated per instance
+    """
+    endpoints = cls.endpoints or []
+    if not isinstance(endpoints, (list, tuple)):
+        return None
+    for endpoint in endpoints:
+        check_camel_case(endpoint)
+    return make_to_dict(endpoints)
+
+
 def deserialize_object(ob, type_check=None):
     if isinstance(ob, dict):
         subclass = Serializable.lookup_subclass(ob)
@@ -94,16 +174,28 @@ class Serializable(object):
         Returns:
             dict: Serialised version of self
         """
+        return self.serialize_endpoints(serialize_object)
 
-        d = OrderedDict()
-        d["typeid"] = self.typeid
+    def serialize_endpoints(self, serialize):
+        """Make the to_dict() result of self with the function of its class
+        made by compile_to_dict()
 
-        for endpoint in self:
-            check_camel_case(endpoint)
-            value = self._endpoint_data[endpoint]
-            d[endpoint] = serialize_object(value)
+        Args:
+            serialize (function): Called to serialize each endpoint value
 
-        return d
+        Returns:
+            dict: Serialised version of self
+        """
+        cls = type(self)
+        try:
+            to_dict = _compiled_to_dicts[cls]
+        except KeyError:
+            to_dict = _compiled_to_dicts[cls] = compile_to_dict(cls)
+        if to_dict is None or "endpoints" in self.__dict__:
+            # Endpoints are set on the instance, whatever set them should have
+            # checked they are camelCase
+            to_dict = make_to_dict(self.endpoints or [])
+        return to_dict(self, serialize)
 
     @classmethod
     def from_dict(cls, d):
@@ -161,6 +253,7 @@ class Serializable(object):
         def decorator(subclass):
             cls._subcls_lookup[typeid] = subclass
             subclass.typeid = typeid
+            _compiled_to_dicts[subclass] = compile_to_dict(subclass)
             return subclass
         return decorator
 
@@ -1,5 +1,7 @@
+from malcolm.compat import queue
 from malcolm.core.loggable import Loggable
 from malcolm.core.spawnable import Spawnable
+from malcolm.core.syncfactory import service_loop
 from malcolm.core.response import Delta, Update
 from malcolm.core.request import Unsubscribe
 
@@ -14,17 +16,35 @@ class ServerComms(Loggable, Spawnable):
         self.add_spawn_function(self.send_loop,
                                 self.make_default_stop_func(self.q))
 
+    @service_loop
     def send_loop(self):
         """Service self.q, sending responses to client"""
+        return self._send_responses()
+
+    def _send_responses(self):
         while True:
-            response = self.q.get()
-            if response is Spawnable.STOP:
-                break
+            timeout = self.send_held_back()
             try:
-                self.send_to_client(response)
-            except Exception:  # pylint:disable=broad-except
-                self.log_exception(
-                    "Exception sending response %s", response.to_dict())
+                responses = yield self.q, timeout
+            except queue.Empty:
+                continue
+            for response in responses:
+                if response is Spawnable.STOP:
+                    return
+                try:
+                    self.send_to_client(response)
+                except Exception:  # pylint:disable=broad-except
+                    self.log_exception(
+                        "Exception sending response %s", response.to_dict())
+
+    def send_held_back(self):
+        """Send anything that was held back until now. Called by send_loop
+        before it waits for more responses
+
+        Returns:
+            float: Seconds until more will be due, None if nothing is held back
+        """
+        return None
 
     def send_to_client(self, response):
         """Abstract method to dispatch response to a client
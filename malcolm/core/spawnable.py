@@ -16,19 +16,25 @@ class Spawnable(object):
         if self._spawned is None:
             self._spawned = []
 
-    def start(self, process=None):
+    def start(self, process=None, hook=False):
         """Spawn registered functions
 
         Args:
             process: Process to use for spawning (default self.process)
+            hook (bool): If True then spawn them with process.spawn_hook()
+                as they are long-running hook bodies
         """
         if process is None:
             process = self.process
+        if hook:
+            spawn = process.spawn_hook
+        else:
+            spawn = process.spawn
         self._initialize()
         self._spawned = []
         for (func, args, _) in self._spawn_functions:
             assert func is not None, "Spawned function is None"
-            self._spawned.append(process.spawn(func, *args))
+            self._spawned.append(spawn(func, *args))
 
     def stop(self):
         """Call registered stop functions"""
@@ -1,21 +1,120 @@
-from threading import Lock
-from multiprocessing.pool import ThreadPool
+import errno
+import fcntl
+import functools
+import math
+import os
+import select
+import sys
+import time
+import types
+from collections import OrderedDict, deque
+from threading import Lock, Event, Thread, current_thread
+from multiprocessing import TimeoutError
 
 from malcolm.compat import queue
 from malcolm.core.loggable import Loggable
 
 
+# Threads started up front for short request handlers and service loops
+REQUEST_WORKERS = 16
+# Threads started up front for long-running hook bodies
+HOOK_WORKERS = 8
+# Most threads that each pool will grow to
+MAX_WORKERS = 128
+# Warn if a spawned function has to wait longer than this to start
+WARN_WAIT = 1.0
+# What to write to an InterruptableQueue's eventfd or pipe to wake it up
+WAKEUP_BYTES = b"\x01\x00\x00\x00\x00\x00\x00\x00"
+
+
+def service_loop(generator_function):
+    """Decorator for a service loop written as a function that returns a
+    generator. Each time the generator wants more items from a queue it
+    yields (queue, timeout), and is
+    sent the list that queue.get_many(timeout=timeout) returns, or has
+    queue.Empty thrown into it if that times out.
+
+    Calling the decorated function runs the loop in the calling thread. A
+    SyncFactory that spawns it may run the generator some other way, like
+    AsyncioSyncFactory which runs it as a coroutine on its event loop
+    """
+    @functools.wraps(generator_function)
+    def run_in_thread(*args, **kwargs):
+        return run_service_loop(generator_function(*args, **kwargs))
+
+    run_in_thread.service_loop_generator = generator_function
+    return run_in_thread
+
+
+def _service_loop_generator(function):
+    generator_function = getattr(
+        getattr(function, "__func__", function), "service_loop_generator",
+        None)
+    if isinstance(generator_function, types.FunctionType):
+        return generator_function
+
+
+def is_service_loop(function):
+    """Return True if function was decorated with service_loop"""
+    return _service_loop_generator(function) is not None
+
+
+def make_service_loop(function, args, kwargs):
+    """Make the generator of a function decorated with service_loop
+
+    Returns:
+        generator: The service loop, or None if function isn't one
+    """
+    generator_function = _service_loop_generator(function)
+    if generator_function is None:
+        return None
+    if hasattr(function, "__func__"):
+        # Bound method, so pass self too
+        args = (function.__self__,) + tuple(args)
+    return generator_function(*args, **kwargs)
+
+
+def run_service_loop(loop):
+    """Run a service_loop generator until it returns, blocking this thread
+    on the queues it waits for"""
+    items = None
+    empty = None
+    while True:
+        try:
+            if empty is None:
+                q, timeout = loop.send(items)
+            else:
+                q, timeout = loop.throw(empty)
+        except StopIteration as e:
+            return getattr(e, "value", None)
+        try:
+            items = q.get_many(timeout=timeout)
+        except queue.Empty as e:
+            items = None
+            empty = e
+        else:
+            empty = None
+
+
 class SyncFactory(Loggable):
     """Create thread primitives and schedule tasks"""
 
-    def __init__(self, name):
+    def __init__(self, name, request_workers=REQUEST_WORKERS,
+                 hook_workers=HOOK_WORKERS, max_workers=MAX_WORKERS):
         """
         Args:
             name(str): Logger name e.g. "Sync"
+            request_workers (int): Number of threads to start with for
+                request handlers and service loops
+            hook_workers (int): Number of threads to start with for hook
+                bodies
+            max_workers (int): Maximum number of threads each pool will grow
+                to if all its threads are busy
         """
         self.set_logger_name(name)
-        # Need at least as many threads as concurrent blocks...
-        self.pool = ThreadPool(128)
+        self.pool = WorkerPool(
+            "%s.request" % name, request_workers, max_workers)
+        self.hook_pool = WorkerPool("%s.hook" % name, hook_workers, max_workers)
 
     def spawn(self, function, *args, **kwargs):
         """Runs the function in a worker thread, returning a Result object
@@ -31,6 +130,25 @@ class SyncFactory(Loggable):
         """
         return self.pool.apply_async(function, args, kwargs)
 
+    def spawn_hook(self, function, *args, **kwargs):
+        """Like spawn(), but runs the function in the pool kept for
+        long-running hook bodies so they can't starve request handlers"""
+        return self.hook_pool.apply_async(function, args, kwargs)
+
+    def stats(self):
+        """Return the statistics of each pool
+
+        Returns:
+            OrderedDict: {pool_name: WorkerPool.stats()}
+        """
+        return OrderedDict(
+            [("request", self.pool.stats()), ("hook", self.hook_pool.stats())])
+
+    def get_ioloop(self):
+        """Return the tornado IOLoop that comms should share, or None if they
+        should each run their own"""
+        return None
+
     def create_queue(self):
         """Creates a new Queue object"""
         return InterruptableQueue()
@@ -42,18 +160,312 @@ class SyncFactory(Loggable):
     def __del__(self):
         """When we get garbage collected, clean up the threads we created"""
         self.pool.close()
+        self.hook_pool.close()
         self.pool.join()
+        self.hook_pool.join()
+
+
+class Spawned(object):
+    """The result of a function run by a WorkerPool, with the same interface
+    as multiprocessing.pool.AsyncResult"""
+
+    def __init__(self):
+        self._event = Event()
+        self._value = None
+        self._exc_info = None
+
+    def ready(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+
+    def successful(self):
+        assert self.ready(), "%r not ready" % self
+        return self._exc_info is None
+
+    def get(self, timeout=None):
+        self.wait(timeout)
+        if not self.ready():
+            raise TimeoutError()
+        if self._exc_info is not None:
+            raise self._exc_info[1]
+        return self._value
+
+    def _set(self, value, exc_info=None):
+        self._value = value
+        self._exc_info = exc_info
+        self._event.set()
+
+
+class WorkerPool(Loggable):
+    """Pool of threads that grows when all of them are busy, up to a limit"""
+
+    def __init__(self, name, size, max_size=MAX_WORKERS, warn_wait=WARN_WAIT):
+        """
+        Args:
+            name (str): Logger name e.g. "Sync.request"
+            size (int): Number of threads to start with
+            max_size (int): Maximum number of threads to grow to
+            warn_wait (float): Log a warning if a function waits longer than
+                this many seconds for a thread
+        """
+        self.set_logger_name(name)
+        self.name = name
+        self.max_size = max(size, max_size)
+        self.warn_wait = warn_wait
+        # (submit_time, function, args, kwargs, Spawned) or None to stop
+        self._q = queue.Queue()
+        self._lock = Lock()
+        self._threads = []
+        # The following are protected by self._lock
+        self._idle = 0
+        self._pending = 0
+        self._tasks_run = 0
+        self._total_wait = 0.
+        self._max_wait = 0.
+        self._saturated = False
+        with self._lock:
+            for _ in range(size):
+                self._add_worker()
+
+    def _add_worker(self):
+        # Must be called with the lock held. The thread counts as idle from
+        # now, so apply_async doesn't add more while it is starting up
+        self._idle += 1
+        thread = Thread(target=self._worker_loop,
+                        name="%s-%d" % (self.name, len(self._threads)))
+        thread.daemon = True
+        self._threads.append(thread)
+        thread.start()
 
+    def apply_async(self, function, args=(), kwargs=None):
+        """Run function(*args, **kwargs) in one of the threads
+
+        Returns:
+            Spawned: To wait on for the function to complete
+        """
+        if kwargs is None:
+            kwargs = {}
+        spawned = Spawned()
+        with self._lock:
+            self._pending += 1
+            self._q.put((time.time(), function, args, kwargs, spawned))
+            if self._pending > self._idle:
+                if len(self._threads) < self.max_size:
+                    self._add_worker()
+                    self.log_debug(
+                        "All threads busy, grew to %d", len(self._threads))
+                elif not self._saturated:
+                    self._saturated = True
+                    self.log_warning(
+                        "All %d threads busy, %d functions waiting",
+                        len(self._threads), self._pending - self._idle)
+        return spawned
+
+    def _worker_loop(self):
+        while True:
+            item = self._q.get()
+            if item is None:
+                return
+            submitted, function, args, kwargs, spawned = item
+            wait = time.time() - submitted
+            with self._lock:
+                self._idle -= 1
+                self._pending -= 1
+                self._tasks_run += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+                if self._pending <= self._idle:
+                    self._saturated = False
+            if wait > self.warn_wait:
+                self.log_warning("%s waited %.3fs for a thread", function, wait)
+            try:
+                value = function(*args, **kwargs)
+            except Exception:  # pylint:disable=broad-except
+                spawned._set(None, sys.exc_info())
+            else:
+                spawned._set(value)
+            # Don't keep the function's arguments alive while we are idle
+            del item, function, args, kwargs, spawned
+            with self._lock:
+                self._idle += 1
+
+    def stats(self):
+        """Return the current pool statistics
+
+        Returns:
+            OrderedDict: with keys size, busy, queue_depth, tasks_run,
+            mean_wait and max_wait (in seconds)
+        """
+        with self._lock:
+            busy = len(self._threads) - self._idle
+            if self._tasks_run:
+                mean_wait = self._total_wait / self._tasks_run
+            else:
+                mean_wait = 0.
+            return OrderedDict([
+                ("size", len(self._threads)),
+                ("busy", busy),
+                ("queue_depth", max(self._pending - self._idle, 0)),
+                ("tasks_run", self._tasks_run),
+                ("mean_wait", mean_wait),
+                ("max_wait", self._max_wait)])
+
+    def close(self):
+        """Ask the threads to exit once they have run everything queued"""
+        with self._lock:
+            for _ in self._threads:
+                self._q.put(None)
+
+    def join(self, timeout=None):
+        """Wait for the threads to exit, call close() first"""
+        for thread in self._threads:
+            # We might be garbage collected from one of our own threads
+            if thread is not current_thread():
+                thread.join(timeout)
+
+
+class InterruptableQueue(object):
+    """Unbounded queue whose blocked getters sleep on a file descriptor, so
+    they need no polling timeout to stay interruptible by signals. Items can
+    be put and got in batches to save taking the lock for each one"""
+
+    def __init__(self):
+        self._items = deque()
+        self._lock = Lock()
+        # Number of getters waiting for the wakeup fd to become readable
+        self._waiting = 0
+        # True if we have written to the wakeup fd and not read it back
+        self._signalled = False
+        # Made the first time a getter has to wait
+        self._wakeup_fds = None
+        self._poller = None
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+    def put(self, item, block=True, timeout=None):
+        """Put item on the queue. The queue is unbounded so this never blocks,
+        block and timeout are accepted for compatibility with queue.Queue"""
+        with self._lock:
+            self._items.append(item)
+            self._wake()
+
+    def put_nowait(self, item):
+        self.put(item)
+
+    def put_many(self, items):
+        """Put all the items on the queue in order"""
+        with self._lock:
+            self._items.extend(items)
+            if self._items:
+                self._wake()
 
-class InterruptableQueue(queue.Queue):
-    # horrible horrible
-    # http://stackoverflow.com/a/212975
     def get(self, block=True, timeout=None):
-        if timeout is None:
-            while True:
-                try:
-                    return queue.Queue.get(self, block=block, timeout=1000)
-                except queue.Empty:
-                    pass
+        """Remove and return the next item
+
+        Args:
+            block (bool): If False then raise queue.Empty rather than wait
+            timeout (float): Maximum time to wait, None means forever
+
+        Returns:
+            object: The item
+        """
+        if not block:
+            timeout = 0
+        return self._get(1, timeout)[0]
+
+    def get_nowait(self):
+        return self.get(timeout=0)
+
+    def get_many(self, max_items=None, timeout=None):
+        """Wait for at least one item, then remove and return all the items
+        that are queued, up to max_items
+
+        Args:
+            max_items (int): Maximum number of items to return, None means
+                no limit
+            timeout (float): Maximum time to wait, None means forever
+
+        Returns:
+            list: The items
+        """
+        return self._get(max_items, timeout)
+
+    def _get(self, max_items, timeout):
+        if timeout is not None:
+            until = time.time() + timeout
+        while True:
+            with self._lock:
+                if self._items:
+                    if max_items is None or max_items >= len(self._items):
+                        items = list(self._items)
+                        self._items.clear()
+                    else:
+                        popleft = self._items.popleft
+                        items = [popleft() for _ in range(max_items)]
+                    if self._signalled and not self._items:
+                        self._drain()
+                    return items
+                if timeout is None:
+                    wait = None
+                else:
+                    wait = until - time.time()
+                    if wait <= 0:
+                        raise queue.Empty()
+                self._waiting += 1
+                if self._wakeup_fds is None:
+                    self._make_wakeup_fds()
+            try:
+                self._wait_for_wakeup(wait)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+
+    def _wake(self):
+        # Must be called with self._lock held
+        if self._waiting and not self._signalled:
+            self._signalled = True
+            os.write(self._wakeup_fds[1], WAKEUP_BYTES)
+
+    def _drain(self):
+        # Must be called with self._lock held
+        self._signalled = False
+        try:
+            os.read(self._wakeup_fds[0], 64)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _make_wakeup_fds(self):
+        # Must be called with self._lock held
+        if hasattr(os, "eventfd"):
+            fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+            self._wakeup_fds = (fd, fd)
         else:
-            return queue.Queue.get(self, block=block, timeout=timeout)
+            r, w = os.pipe()
+            fcntl.fcntl(r, fcntl.F_SETFL,
+                        fcntl.fcntl(r, fcntl.F_GETFL) | os.O_NONBLOCK)
+            self._wakeup_fds = (r, w)
+        self._poller = select.poll()
+        self._poller.register(self._wakeup_fds[0], select.POLLIN)
+
+    def _wait_for_wakeup(self, timeout):
+        if timeout is not None:
+            # poll takes milliseconds
+            timeout = int(math.ceil(timeout * 1000))
+        try:
+            self._poller.poll(timeout)
+        except select.error as e:
+            # Python 2 doesn't retry after a signal, our caller will
+            if e.args[0] != errno.EINTR:
+                raise
+
+    def __del__(self):
+        if self._wakeup_fds is not None:
+            for fd in set(self._wakeup_fds):
+                os.close(fd)
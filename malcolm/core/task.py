@@ -1,5 +1,6 @@
 import weakref
 import time
+from collections import deque
 
 from malcolm.core.attribute import Attribute
 from malcolm.core.errors import AbortedError, ResponseError, \
@@ -7,7 +8,7 @@ from malcolm.core.errors import AbortedError, ResponseError, \
 from malcolm.core.future import Future
 from malcolm.core.loggable import Loggable
 from malcolm.core.methodmeta import MethodMeta
-from malcolm.core.request import Subscribe, Unsubscribe, Post, Put
+from malcolm.core.request import Subscribe, Unsubscribe, Post, Put, PutMany
 from malcolm.core.response import Error, Return, Update
 from malcolm.core.map import Map
 from malcolm.core.spawnable import Spawnable
@@ -37,6 +38,8 @@ class Task(Loggable, Spawnable):
         self.name = name
         self.process = process
         self.q = self.process.create_queue()
+        # Responses taken off self.q but not serviced yet
+        self._responses = deque()
         # If not None, wait for this before listening to STOPs
         self.sentinel_stop = None
         self._next_id = 1
@@ -115,15 +118,15 @@ class Task(Loggable, Spawnable):
             attr_values (dict): Dictionary of {str: value} to set
 
         Returns:
-             a list of futures to monitor when each put completes
+             a list of one future to monitor when all the puts complete
         """
-        futures = []
+        for attr_name in attr_values:
+            assert isinstance(block[attr_name], Attribute), \
+                "Expected Attribute, got %r" % (block[attr_name],)
 
-        for attr_name, value in attr_values.items():
-            attr = block[attr_name]
-            futures += self.put_async(attr, value)
-
-        return futures
+        request = PutMany(None, self.q, block.process_path, attr_values)
+        future = self._dispatch_request(request)
+        return [future]
 
     def when_matches(self, attr, value, bad_values=None, timeout=None):
         """ Wait for an attribute to become a given value
@@ -256,7 +259,9 @@ class Task(Loggable, Spawnable):
             timeout = until - time.time()
             if timeout < 0:
                 timeout = 0
-        response = self.q.get(True, timeout)
+        if not self._responses:
+            self._responses.extend(self.q.get_many(timeout=timeout))
+        response = self._responses.popleft()
         if response is self.sentinel_stop:
             self.sentinel_stop = None
         elif response is Spawnable.STOP:
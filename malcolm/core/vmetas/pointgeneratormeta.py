@@ -1,6 +1,7 @@
 from scanpointgenerator import CompoundGenerator
 
 from malcolm.core.ntunion import NTUnion
+from malcolm.core.preparedgenerator import prepared_generators
 from malcolm.core.serializable import Serializable
 from malcolm.core.vmeta import VMeta
 
@@ -16,7 +17,13 @@ class PointGeneratorMeta(VMeta):
         elif isinstance(value, CompoundGenerator):
             return value
         elif isinstance(value, dict):
-            return CompoundGenerator.from_dict(value)
+            # If this process has already prepared a generator with the same
+            # content then use that rather than making and preparing another
+            prepared = prepared_generators.find_serialized(value)
+            if prepared is not None:
+                return prepared.generator
+            else:
+                return CompoundGenerator.from_dict(value)
         else:
             raise TypeError(
                 "Value %s must be a Generator object or dictionary" % value)
@@ -17,6 +17,10 @@ def make_process():
         '--log', default="INFO",
         help="Lowest level of logs to see. One of: ERROR, WARNING, INFO, DEBUG "
         "Default is INFO")
+    parser.add_argument(
+        '--asyncio', action="store_true",
+        help="Run the Process and comms service loops as coroutines on one "
+             "asyncio event loop. Python 3.5.2 or later")
     parser.add_argument(
         'yaml', nargs="?",
         help="The YAML file containing the blocks to be loaded"
@@ -33,7 +37,11 @@ def make_process():
     from malcolm.core import SyncFactory, Process
     from malcolm.yamlutil import make_include_creator
 
-    sf = SyncFactory("Sync")
+    if args.asyncio:
+        from malcolm.core.asynciosyncfactory import AsyncioSyncFactory
+        sf = AsyncioSyncFactory("Sync")
+    else:
+        sf = SyncFactory("Sync")
 
     if args.yaml:
         proc_name = os.path.basename(args.yaml).split(".")[-2]
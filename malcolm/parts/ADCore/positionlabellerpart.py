@@ -2,6 +2,7 @@ from xml.etree import cElementTree as ET
 
 from malcolm.compat import et_to_string
 from malcolm.core import method_takes, REQUIRED
+from malcolm.core.preparedgenerator import prepared_generators
 from malcolm.core.vmetas import PointGeneratorMeta
 from malcolm.parts.builtin.childpart import ChildPart
 from malcolm.controllers.runnablecontroller import RunnableController
@@ -48,14 +49,15 @@ class PositionLabellerPart(ChildPart):
         if end_index > self.steps_up_to:
             end_index = self.steps_up_to
 
-        for i in range(start_index, end_index):
-            point = self.generator.get_point(i)
+        points = prepared_generators.get(self.generator).get_points(
+            start_index, end_index)
+        for i, indexes in enumerate(points.indexes, start_index):
             if i == self.generator.size - 1:
                 do_close = True
             else:
                 do_close = False
             positions = dict(FilePluginClose="%d" % do_close)
-            for j, value in enumerate(point.indexes):
+            for j, value in enumerate(indexes):
                 positions["d%d" % j] = str(value)
             position_el = ET.Element("position", **positions)
             positions_el.append(position_el)
@@ -1,6 +1,8 @@
 import time
 
 from malcolm.core import REQUIRED, method_takes
+from malcolm.core.preparedgenerator import prepared_generators, \
+    POINTS_PER_FILL
 from malcolm.core.vmetas import PointGeneratorMeta, StringArrayMeta, NumberMeta
 from malcolm.parts.builtin.childpart import ChildPart
 from malcolm.controllers.runnablecontroller import RunnableController
@@ -44,19 +46,27 @@ class ScanTickerPart(ChildPart):
         # Start time so everything is relative
         point_time = time.time()
         if self.generator:
-            for i in range(self.completed_steps,
-                           self.completed_steps + self.steps_to_do):
-                # Get the point we are meant to be scanning
-                point = self.generator.get_point(i)
-                # Update the child counter to be the demand position
-                position = point.positions[self.name]
-                task.put(self.child["counter"], position)
-                # Wait until the next point is due
-                point_time += point.duration
-                wait_time = point_time - time.time()
-                task.sleep(wait_time)
-                # Update the point as being complete
-                update_completed_steps(i + 1, self)
-                # If this is the exception step then blow up
-                assert i +1 != self.exception_step, \
-                    "Raising exception at step %s" % self.exception_step
+            end_index = self.completed_steps + self.steps_to_do
+            prepared = prepared_generators.get(self.generator)
+            start_index = self.completed_steps
+            while start_index < end_index:
+                # Get the points we are meant to be scanning up to the end of
+                # this fill, rather than arrays for the whole scan
+                fill = start_index // POINTS_PER_FILL
+                fill_end = (fill + 1) * POINTS_PER_FILL
+                points = prepared.get_points(
+                    start_index, min(fill_end, end_index))
+                for j, position in enumerate(points.positions[self.name]):
+                    i = start_index + j
+                    # Update the child counter to be the demand position
+                    task.put(self.child["counter"], position)
+                    # Wait until the next point is due
+                    point_time += points.durations[j]
+                    wait_time = point_time - time.time()
+                    task.sleep(wait_time)
+                    # Update the point as being complete
+                    update_completed_steps(i + 1, self)
+                    # If this is the exception step then blow up
+                    assert i + 1 != self.exception_step, \
+                        "Raising exception at step %s" % self.exception_step
+                start_index = fill_end
@@ -1,6 +1,11 @@
 # Treat all division as float division even in python2
 from __future__ import division
+import atexit
 from collections import Counter
+import multiprocessing
+from multiprocessing import TimeoutError
+import threading
+import time
 
 import numpy as np
 from scanpointgenerator import CompoundGenerator
@@ -8,6 +13,7 @@ from scanpointgenerator import CompoundGenerator
 from malcolm.controllers.runnablecontroller import RunnableController, \
     ParameterTweakInfo
 from malcolm.core import method_takes, REQUIRED, Info, method_also_takes
+from malcolm.core.preparedgenerator import prepared_generators
 from malcolm.core.vmetas import StringArrayMeta, PointGeneratorMeta, NumberMeta
 from malcolm.parts.builtin.childpart import ChildPart
 
@@ -17,6 +23,9 @@ TICK_S = 0.000001
 # Minimum move time for any move
 MIN_TIME = 0.002
 
+# Longest time a single profile point can take
+MAX_MOVE_TIME = 4.0
+
 # Interval for interpolating velocity curves
 INTERPOLATE_INTERVAL = 0.02
 
@@ -33,9 +42,23 @@ TRIG_DEAD_FRAME = 2  # Capture 0, Frame 1, Detector 0
 TRIG_LIVE_FRAME = 3  # Capture 0, Frame 1, Detector 1
 TRIG_ZERO = 8        # Capture 0, Frame 0, Detector 0
 
-# How many generator points to load each time
+# How many generator points to load each time, at least
 POINTS_PER_BUILD = 4000
 
+# Most generator points to load each time
+MAX_POINTS_PER_BUILD = 40000
+
+# How many times longer than it takes to build and write the next points we
+# want the loaded points to last
+BUILD_AHEAD_FACTOR = 2.0
+
+# Longest time in seconds to wait for points being built in the background
+PREBUILD_TIMEOUT = 30.0
+
+# How many worker processes to build points in the background with. If 0 they
+# are built in a thread of the Process, holding the GIL while they are
+BUILD_PROCESSES = 1
+
 # All possible PMAC CS axis assignment
 cs_axis_names = list("ABCUVWXYZ")
 
@@ -62,8 +85,8 @@ class MotorInfo(Info):
         self.velocity_settle = velocity_settle
 
     def acceleration_time(self, v1, v2):
-        # The time taken to ramp from v1 to pad_velocity
-        ramp_time = abs(v2 - v1) / self.acceleration
+        # The time taken to ramp from v1 to v2
+        ramp_time = np.abs(v2 - v1) / self.acceleration
         return ramp_time
 
     def ramp_distance(self, v1, v2, ramp_time=None):
@@ -73,107 +96,117 @@ class MotorInfo(Info):
         ramp_distance = (v1 + v2) * ramp_time / 2
         return ramp_distance
 
-    def _make_padded_ramp(self, v1, v2, pad_velocity, total_time):
-        """Makes a ramp that looks like this:
+    def make_velocity_segments(self, v1, v2, distance, min_time):
+        """Calculate the velocity segments of moves within motor params. All
+        arguments can be numpy arrays of the same shape to do many moves at
+        once. Each move looks like one of these:
 
-        v1 \______ pad_velocity
-           |      |\
-           |      | \v2
-         t1   tp   t2
-        Such that whole section takes total_time
-        """
-        # The time taken to ramp from v1 to pad_velocity
-        t1 = self.acceleration_time(v1, pad_velocity)
-        # Then on to v2
-        t2 = self.acceleration_time(pad_velocity, v2)
-        # The distance during the pad
-        tp = total_time - t1 - t2
-        # Yield the points
-        yield t1, pad_velocity
-        yield tp, pad_velocity
-        yield t2, v2
-
-    def _calculate_hat_params(self, v1, v2, acceleration, distance):
-        # Calculate how long to spend at max velocity
-        if acceleration > 0:
-            vm = self.max_velocity
-        else:
-            vm = -self.max_velocity
-        t1 = self.acceleration_time(v1, vm)
-        d1 = self.ramp_distance(v1, vm, t1)
-        t2 = self.acceleration_time(vm, v2)
-        d2 = self.ramp_distance(v1, vm, t1)
-        dm = distance - d1 - d2
-        tm = dm / vm
-        return t1, tm, t2, vm
-
-    def _make_hat(self, v1, v2, acceleration, distance, min_time):
-        """Make a hat that looks like this:
-
-            ______ vm
-        v1 /|   | \
-          d1| dm|d2\ v2
-            |   |
-          t1  tm t2
-
-        Such that the area under the graph (d1+d2+d3) is distance and
-        t1+t2+t3 >= min_time
+        v1 \______ vm         ______ vm
+           |      |\     v1 /|   | \
+           |      | \v2     | |   |  \ v2
+         t1   tm   t2        t1 tm  t2
+
+        where vm is either the velocity the move needs to be padded at to
+        take min_time, or the top of a hat that doesn't exceed max_velocity.
+
+        Args:
+            v1 (float): Starting velocity in EGUs/s
+            v2 (float): Ending velocity in EGUs/s
+            distance (float): Relative distance to travel in EGUs
+            min_time (float): The minimum time the move should take
+
+        Returns:
+            tuple: (t1, vm, tm, t2) arrays, where the move ramps from v1 to vm
+                in t1, stays at vm for tm, then ramps to v2 in t2. This
+                doesn't include velocity_settle
         """
-        if min_time > 0:
-            # We are trying to meet time constraints
-            # Solve quadratic to give vm
+        v1, v2, distance, min_time = np.broadcast_arrays(
+            *[np.asarray(x, dtype=float) for x in (v1, v2, distance, min_time)])
+        # Take off the settle time and distance
+        min_time = np.where(min_time > 0, min_time - self.velocity_settle,
+                            min_time)
+        distance = distance - self.velocity_settle * v2
+        # The ramp time and distance of a continuous ramp from v1 to v2
+        ramp_time = self.acceleration_time(v1, v2)
+        ramp_distance = self.ramp_distance(v1, v2, ramp_time)
+        remaining_distance = distance - ramp_distance
+        # Check if we need to stretch in time, and how fast we would need to
+        # be going so that the total move completes in min_time
+        stretch = min_time > ramp_time
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pad_velocity = remaining_distance / (min_time - ramp_time)
+        padded = stretch & (pad_velocity <= np.maximum(v1, v2)) & \
+            (pad_velocity >= np.minimum(v1, v2))
+        # If we can't just pad the ramp, make a hat pointing up or down
+        up = np.where(stretch, pad_velocity > np.maximum(v1, v2),
+                      remaining_distance >= 0)
+        acceleration = np.where(up, self.acceleration, -self.acceleration)
+        t1, vm, tm, t2 = self._make_hats(
+            v1, v2, acceleration, distance, min_time)
+        # Padded ramps go to pad_velocity and stay there
+        pad_t1 = self.acceleration_time(v1, pad_velocity)
+        pad_t2 = self.acceleration_time(pad_velocity, v2)
+        t1 = np.where(padded, pad_t1, t1)
+        vm = np.where(padded, pad_velocity, vm)
+        tm = np.where(padded, min_time - pad_t1 - pad_t2, tm)
+        t2 = np.where(padded, pad_t2, t2)
+        return t1, vm, tm, t2
+
+    def _make_hats(self, v1, v2, acceleration, distance, min_time):
+        """Make hats with the area under the graph distance, taking at least
+        min_time if they can, accelerating with the sign of acceleration"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Solve quadratic to give the vm that takes min_time
             b = v1 + v2 + min_time * acceleration
-            c = distance * acceleration + (v1*v1 + v2*v2) / 2
-            op = b*b - 4 * c
-            if np.isclose(op, 0):
-                # Might have a negative number as rounding error...
-                op = 0
-            elif op < 0:
-                # Can't do this, set something massive to fail vm check...
-                op = 10000000000
-
-            def get_times(vm):
-                t1 = (vm - v1) / acceleration
-                t2 = (vm - v2) / acceleration
-                tm = min_time - t1 - t2
-                assert -self.max_velocity <= vm <= self.max_velocity
-                assert t1 >= 0 and t2 >= 0 and tm >= 0
-                return t1, tm, t2
-
-            try:
-                # Try negative root
-                vm = (b - np.sqrt(op)) / 2
-                t1, tm, t2 = get_times(vm)
-            except AssertionError:
-                try:
-                    # Try positive root
-                    vm = (b + np.sqrt(op)) / 2
-                    t1, tm, t2 = get_times(vm)
-                except AssertionError:
-                    # If vm is out of range or any segment takes negative time,
-                    # we can't do it in min_time, so act as if unconstrained
-                    t1, tm, t2, vm = self._calculate_hat_params(
-                        v1, v2, acceleration, distance)
-        else:
-            t1, tm, t2, vm = self._calculate_hat_params(
-                v1, v2, acceleration, distance)
-
-        # If middle segment needs to be negative time then we need to cap
-        # vm and spend no time at vm
-        if tm <= 0:
-            # Solve the quadratic to work out how long to spend accelerating
-            vm = np.sqrt(
-                (2 * acceleration * distance + v1 * v1 + v2 * v2) / 2)
-            if acceleration < 0:
-                vm = -vm
+            c = distance * acceleration + (v1 * v1 + v2 * v2) / 2
+            op = b * b - 4 * c
+            # Might have a negative number as rounding error...
+            op = np.where(np.isclose(op, 0), 0, op)
+            # If there is no solution, set something massive to fail vm check
+            op = np.where(op < 0, 10000000000, op)
+            # If vm is out of range or any segment takes negative time we
+            # can't do it in min_time, so act as if unconstrained
+            constrained = min_time > 0
+            vm = np.where(acceleration > 0, self.max_velocity,
+                          -self.max_velocity)
             t1 = self.acceleration_time(v1, vm)
             t2 = self.acceleration_time(vm, v2)
-            tm = 0
+            tm = (distance - self.ramp_distance(v1, vm, t1) -
+                  self.ramp_distance(vm, v2, t2)) / vm
+            # Prefer the negative root, so try it last
+            for sign in (1, -1):
+                root = (b + sign * np.sqrt(op)) / 2
+                root_t1 = (root - v1) / acceleration
+                root_t2 = (root - v2) / acceleration
+                root_tm = min_time - root_t1 - root_t2
+                valid = constrained & (np.abs(root) <= self.max_velocity) & \
+                    (root_t1 >= 0) & (root_t2 >= 0) & (root_tm >= 0)
+                vm = np.where(valid, root, vm)
+                t1 = np.where(valid, root_t1, t1)
+                t2 = np.where(valid, root_t2, t2)
+                tm = np.where(valid, root_tm, tm)
+            # If middle segment needs to be negative time then we need to cap
+            # vm and spend no time at vm
+            capped = tm <= 0
+            # Solve the quadratic to work out how long to spend accelerating
+            cap_vm = np.sqrt(
+                (2 * acceleration * distance + v1 * v1 + v2 * v2) / 2)
+            cap_vm = np.where(acceleration < 0, -cap_vm, cap_vm)
+        vm = np.where(capped, cap_vm, vm)
+        t1 = np.where(capped, self.acceleration_time(v1, cap_vm), t1)
+        t2 = np.where(capped, self.acceleration_time(cap_vm, v2), t2)
+        tm = np.where(capped, 0, tm)
+        return t1, vm, tm, t2
+
+    def min_profile_time(self, v1, v2, distance):
+        """Calculate how long the quickest move within motor params takes.
+        Arguments can be numpy arrays like make_velocity_segments
 
-        # Yield the result
-        yield t1, vm
-        yield tm, vm
-        yield t2, v2
+        Returns:
+            np.array: The time in seconds, including velocity_settle
+        """
+        t1, _, tm, t2 = self.make_velocity_segments(v1, v2, distance, 0)
+        return t1 + tm + t2 + self.velocity_settle
 
     def make_velocity_profile(self, v1, v2, distance, min_time):
         """Calculate PVT points that will perform the move within motor params
@@ -189,40 +222,21 @@ class MotorInfo(Info):
                 relative time points in seconds, and position_list is the
                 position in EGUs that the motor should be
         """
-        # Take off the settle time and distance
-        if min_time > 0:
-            min_time -= self.velocity_settle
-        distance -= self.velocity_settle * v2
-        # The ramp time and distance of a continuous ramp from v1 to v2
-        ramp_time = self.acceleration_time(v1, v2)
-        ramp_distance = self.ramp_distance(v1, v2, ramp_time)
-        remaining_distance = distance - ramp_distance
-        # Check if we need to stretch in time
-        if min_time > ramp_time:
-            # Check how fast we would need to be going so that the total move
-            # completes in min_time
-            pad_velocity = remaining_distance / (min_time - ramp_time)
-            if pad_velocity > max(v1, v2):
-                # Can't just pad the ramp, make a hat pointing up
-                it = self._make_hat(
-                    v1, v2, self.acceleration, distance, min_time)
-            elif pad_velocity < min(v1, v2):
-                # Can't just pad the ramp, make a hat pointing down
-                it = self._make_hat(
-                    v1, v2, -self.acceleration, distance, min_time)
-            else:
-                # Make a padded ramp
-                it = self._make_padded_ramp(v1, v2, pad_velocity, min_time)
-        elif remaining_distance < 0:
-            # Make a hat pointing down
-            it = self._make_hat(v1, v2, -self.acceleration, distance, min_time)
-        else:
-            # Make a hat pointing up
-            it = self._make_hat(v1, v2, self.acceleration, distance, min_time)
-        # Create the time and velocity arrays
+        t1, vm, tm, t2 = self.make_velocity_segments(
+            v1, v2, distance, min_time)
+        return self.profile_from_segments(
+            v1, v2, float(t1), float(vm), float(tm), float(t2))
+
+    def profile_from_segments(self, v1, v2, t1, vm, tm, t2):
+        """Turn the segments of one move from make_velocity_segments into
+        time and velocity lists, adding the settle time
+
+        Returns:
+            tuple: (time_list, position_list) like make_velocity_profile
+        """
         time_array = [0.0]
         velocity_array = [v1]
-        for t, v in it:
+        for t, v in ((t1, vm), (tm, vm), (t2, v2)):
             assert t >= 0, "Got negative t %s" % t
             if t == 0:
                 assert v == velocity_array[-1], \
@@ -243,10 +257,419 @@ class MotorInfo(Info):
         return time_array, velocity_array
 
 
+class ProfileBuilder(object):
+    """Builds trajectory profiles from generator points. Only reads what it
+    is passed, so can be used in a worker process as well as by
+    PMACTrajectoryPart"""
+    # {scannable_name: MotorInfo} used if axis_mapping is not passed
+    axis_mapping = None
+
+    def make_consistent_velocity_segments(self, v1s, v2s, distances,
+                                          min_time=MIN_TIME,
+                                          axis_mapping=None):
+        """Work out the velocity segments for a number of moves, where all the
+        axes take the same time for each move
+
+        Args:
+            v1s (dict): {axis_name: np.array} of starting velocities
+            v2s (dict): {axis_name: np.array} of ending velocities
+            distances (dict): {axis_name: np.array} of distances to travel
+            min_time (float): The minimum time any move should take
+            axis_mapping (dict): {axis_name: MotorInfo} of the axes to move,
+                self.axis_mapping if not given
+
+        Returns:
+            tuple: (move_times, segments) where move_times is an np.array of
+                how long each move takes, and segments is {axis_name: (t1,
+                vm, tm, t2)} from MotorInfo.make_velocity_segments
+        """
+        if axis_mapping is None:
+            axis_mapping = self.axis_mapping
+        # The slowest axis decides how long each move takes
+        quickest = np.max([
+            motor_info.min_profile_time(
+                v1s[axis_name], v2s[axis_name], distances[axis_name])
+            for axis_name, motor_info in axis_mapping.items()], axis=0)
+        move_times = np.where(
+            (quickest > min_time) & ~np.isclose(quickest, min_time),
+            quickest, min_time)
+        iterations = 5
+        while iterations > 0:
+            segments = {}
+            axis_times = []
+            for axis_name, motor_info in axis_mapping.items():
+                segments[axis_name] = motor_info.make_velocity_segments(
+                    v1s[axis_name], v2s[axis_name], distances[axis_name],
+                    move_times)
+                t1, _, tm, t2 = segments[axis_name]
+                axis_time = t1 + tm + t2 + motor_info.velocity_settle
+                too_quick = (axis_time < move_times) & \
+                    ~np.isclose(axis_time, move_times)
+                assert not too_quick.any(), \
+                    "Time %s for %s takes less time than %s" % (
+                        axis_time[too_quick], axis_name,
+                        move_times[too_quick])
+                axis_times.append(axis_time)
+            new_move_times = np.max(axis_times, axis=0)
+            if np.isclose(new_move_times, move_times).all():
+                # We've got our consistent set
+                return move_times, segments
+            else:
+                # Shouldn't happen, but if an axis couldn't do its move in
+                # the time then try again with the longer time
+                move_times = new_move_times
+                iterations -= 1
+        raise ValueError("Can't get a consistent time in 5 iterations")
+
+    def build_profile_from_velocities(self, time_arrays, velocity_arrays,
+                                      current_positions, axis_mapping=None):
+        if axis_mapping is None:
+            axis_mapping = self.axis_mapping
+        trajectory = {}
+
+        # Interpolate the velocity arrays at about 10ms
+        move_time = max(t[-1] for t in time_arrays.values())
+        # Make sure there are at least 2 of them
+        num_intervals = max(int(np.floor(move_time / INTERPOLATE_INTERVAL)), 2)
+        interval = move_time / num_intervals
+        time_array = [interval] * num_intervals
+        velocity_mode = [PREV_TO_NEXT] * (num_intervals - 1) + [CURRENT_TO_NEXT]
+        user_programs = [TRIG_ZERO] * num_intervals
+
+        # Do this for each velocity array
+        for axis_name, motor_info in axis_mapping.items():
+            trajectory[axis_name] = []
+            ts = time_arrays[axis_name]
+            vs = velocity_arrays[axis_name]
+            position = current_positions[axis_name]
+            for i in range(num_intervals):
+                time = interval * (i + 1)
+                # If we have exceeded the current segment by more than
+                # np.isclose() tolerance, pop it and add it's position in.
+                # This is called for every interval so avoid np.isclose()
+                # as it is slow on scalars
+                if time - ts[1] > 1e-8 + 1e-5 * abs(ts[1]):
+                    position += motor_info.ramp_distance(
+                        vs[0], vs[1], ts[1] - ts[0])
+                    vs = vs[1:]
+                    ts = ts[1:]
+                assert len(ts) > 1, \
+                   "Bad %s time %s velocity %s" % (time, ts, vs)
+                fraction = (time - ts[0]) / (ts[1] - ts[0])
+                velocity = fraction * (vs[1] - vs[0]) + vs[0]
+                part_position = motor_info.ramp_distance(
+                    vs[0], velocity, time - ts[0])
+                trajectory[axis_name].append(position + part_position)
+
+        profile = dict(time_array=time_array, velocity_mode=velocity_mode,
+                       trajectory=trajectory, user_programs=user_programs)
+        return profile
+
+    def get_point_arrays(self, generator, axis_mapping, start_index,
+                         end_index):
+        """Get the positions, bounds and durations of a range of points
+
+        Args:
+            generator (CompoundGenerator): The prepared generator to read
+            axis_mapping (dict): {axis_name: MotorInfo} of the axes to get
+            start_index (int): The first point to get
+            end_index (int): One past the last point to get
+
+        Returns:
+            tuple: (positions, lower, upper, durations) where positions, lower
+                and upper are {axis_name: np.array} for each axis in
+                axis_mapping and durations is an np.array. These are read only
+                views of the arrays shared by the process
+        """
+        points = prepared_generators.get(generator).get_points(
+            start_index, end_index)
+        positions = {}
+        lower = {}
+        upper = {}
+        for axis_name in axis_mapping:
+            positions[axis_name] = points.positions[axis_name]
+            lower[axis_name] = points.lower[axis_name]
+            upper[axis_name] = points.upper[axis_name]
+        durations = points.durations
+        return positions, lower, upper, durations
+
+    def check_velocities(self, axis_mapping, velocities):
+        """Check that {axis_name: np.array} of velocities are all within the
+        max_velocity of their motors in axis_mapping"""
+        for axis_name, motor_info in axis_mapping.items():
+            too_fast = np.abs(velocities[axis_name]) >= motor_info.max_velocity
+            assert not too_fast.any(), \
+                "Velocity %s invalid for %r with max_velocity %s" % (
+                    velocities[axis_name][too_fast][0], axis_name,
+                    motor_info.max_velocity)
+
+    def build_turnarounds(self, axis_mapping, gaps, velocities, lower, upper,
+                          min_turnaround):
+        """Work out the turnaround profiles to insert after the points in gaps
+
+        Args:
+            axis_mapping (dict): {axis_name: MotorInfo} of the axes to move
+            gaps (np.array): Indexes into the point arrays of the points that
+                need a turnaround between them and the next point
+            velocities (dict): {axis_name: np.array} of point velocities
+            lower (dict): {axis_name: np.array} of point lower bounds
+            upper (dict): {axis_name: np.array} of point upper bounds
+            min_turnaround (float): Min time for any turnaround
+
+        Returns:
+            list: A profile dict like build_profile_from_velocities for each
+                gap
+        """
+        axis_names = list(axis_mapping)
+        # Turnarounds with the same velocities and distances have the same
+        # velocity profiles, so only solve each of those once
+        keys = np.column_stack(
+            [velocities[a][gaps] for a in axis_names] +
+            [velocities[a][gaps + 1] for a in axis_names] +
+            [lower[a][gaps + 1] - upper[a][gaps] for a in axis_names])
+        # {key_row: index into unique_keys}
+        key_lookup = {}
+        unique_keys = []
+        key_indexes = []
+        for row in keys.tolist():
+            row = tuple(row)
+            if row not in key_lookup:
+                key_lookup[row] = len(unique_keys)
+                unique_keys.append(row)
+            key_indexes.append(key_lookup[row])
+        keys = np.array(unique_keys).reshape(-1, keys.shape[1])
+        n = len(axis_names)
+        v1s = dict(zip(axis_names, keys[:, :n].T))
+        v2s = dict(zip(axis_names, keys[:, n:2 * n].T))
+        _, segments = self.make_consistent_velocity_segments(
+            v1s, v2s, dict(zip(axis_names, keys[:, 2 * n:].T)),
+            min_turnaround, axis_mapping)
+        solved = []
+        for i in range(len(keys)):
+            time_arrays = {}
+            velocity_arrays = {}
+            for axis_name, motor_info in axis_mapping.items():
+                t1, vm, tm, t2 = [float(x[i]) for x in segments[axis_name]]
+                time_arrays[axis_name], velocity_arrays[axis_name] = \
+                    motor_info.profile_from_segments(
+                        v1s[axis_name][i], v2s[axis_name][i], t1, vm, tm, t2)
+            solved.append((time_arrays, velocity_arrays))
+        profiles = []
+        for gap, key_index in zip(gaps, key_indexes):
+            time_arrays, velocity_arrays = solved[key_index]
+            start_positions = {a: upper[a][gap] for a in axis_names}
+            profiles.append(self.build_profile_from_velocities(
+                time_arrays, velocity_arrays, start_positions, axis_mapping))
+        return profiles
+
+    def build_profile_between(self, generator, axis_mapping, start_index,
+                              end_index, is_last, do_run_up=False,
+                              min_turnaround=0.0):
+        """Build the profile for generator points start_index to end_index.
+        Only reads what it is passed, so can be run in the background while
+        configure() changes the part's state
+
+        Args:
+            generator (CompoundGenerator): The prepared generator to read
+            axis_mapping (dict): {axis_name: MotorInfo} of the axes to move
+            start_index (int): The first point to build
+            end_index (int): One past the last point to build
+            is_last (bool): Whether end_index is the end of the scan, so a
+                tail off is needed
+            do_run_up (bool): Whether a run up is needed before start_index
+            min_turnaround (float): Min time for any gaps between frames
+        """
+        num_points = end_index - start_index
+
+        # Get the points, and the next one if there is one so we can tell if
+        # we need a turnaround after the last point
+        positions, lower, upper, durations = self.get_point_arrays(
+            generator, axis_mapping, start_index, end_index + (not is_last))
+        velocities = {}
+        for axis_name in axis_mapping:
+            velocities[axis_name] = \
+                (upper[axis_name] - lower[axis_name]) / durations
+
+        # Find the points that aren't joined to the next point
+        not_joined = np.zeros(len(durations) - 1, dtype=bool)
+        for axis_name in axis_mapping:
+            not_joined |= upper[axis_name][:-1] != lower[axis_name][1:]
+        gaps = np.nonzero(not_joined)[0]
+        checked = [gaps, gaps + 1]
+        if do_run_up:
+            checked.append([0])
+        if is_last:
+            checked.append([num_points - 1])
+        checked = np.concatenate(checked).astype(int)
+        self.check_velocities(
+            axis_mapping, {a: v[checked] for a, v in velocities.items()})
+        if len(gaps):
+            turnarounds = self.build_turnarounds(
+                axis_mapping, gaps, velocities, lower, upper, min_turnaround)
+        else:
+            turnarounds = []
+
+        # Each point has a mid and upper entry, followed by a turnaround
+        # if it isn't joined to the next point
+        gap_lengths = np.zeros(num_points, dtype=int)
+        gap_lengths[gaps] = [len(t["time_array"]) for t in turnarounds]
+        run_up = int(do_run_up)
+        tail_off = int(is_last)
+        point_lengths = 2 + gap_lengths
+        mids = run_up + np.cumsum(point_lengths) - point_lengths
+        uppers = mids + 1
+        num_entries = run_up + point_lengths.sum() + tail_off
+        time_array = np.empty(num_entries)
+        velocity_mode = np.empty(num_entries, dtype=int)
+        user_programs = np.empty(num_entries, dtype=int)
+        completed_steps_lookup = np.empty(num_entries, dtype=int)
+        trajectory = {a: np.empty(num_entries) for a in axis_mapping}
+
+        indexes = np.arange(start_index, end_index)
+        half_durations = durations[:num_points] / 2.0
+        time_array[mids] = half_durations
+        time_array[uppers] = half_durations
+        velocity_mode[mids] = PREV_TO_NEXT
+        velocity_mode[uppers] = PREV_TO_NEXT
+        user_programs[mids] = TRIG_CAPTURE
+        user_programs[uppers] = TRIG_LIVE_FRAME
+        completed_steps_lookup[mids] = indexes
+        completed_steps_lookup[uppers] = indexes + 1
+        for axis_name, positions_array in trajectory.items():
+            positions_array[mids] = positions[axis_name][:num_points]
+            positions_array[uppers] = upper[axis_name][:num_points]
+
+        if len(gaps):
+            # Change the point before each turnaround to be dead frame
+            velocity_mode[uppers[gaps]] = PREV_TO_CURRENT
+            user_programs[uppers[gaps]] = TRIG_DEAD_FRAME
+            # The turnaround entries follow the upper entry of their point
+            lengths = gap_lengths[gaps]
+            firsts = np.repeat(uppers[gaps] + 1, lengths)
+            turnaround_indexes = firsts + np.arange(lengths.sum()) - \
+                np.repeat(np.cumsum(lengths) - lengths, lengths)
+            time_array[turnaround_indexes] = np.concatenate(
+                [t["time_array"] for t in turnarounds])
+            velocity_mode[turnaround_indexes] = np.concatenate(
+                [t["velocity_mode"] for t in turnarounds])
+            programs = np.concatenate(
+                [t["user_programs"] for t in turnarounds])
+            programs[np.cumsum(lengths) - 1] = TRIG_LIVE_FRAME
+            user_programs[turnaround_indexes] = programs
+            completed_steps_lookup[turnaround_indexes] = \
+                np.repeat(indexes[gaps] + 1, lengths)
+            for axis_name, positions_array in trajectory.items():
+                positions_array[turnaround_indexes] = np.concatenate(
+                    [t["trajectory"][axis_name] for t in turnarounds])
+
+        # If we are doing the first build, do_run_up will be passed to flag
+        # that we need a run up, else just continue from the previous point
+        if do_run_up:
+            # Calculate how long to leave for the run-up (at least MIN_TIME)
+            run_up_time = MIN_TIME
+            for axis_name, motor_info in axis_mapping.items():
+                trajectory[axis_name][0] = lower[axis_name][0]
+                run_up_time = max(run_up_time, motor_info.acceleration_time(
+                    0, velocities[axis_name][0]))
+            time_array[0] = run_up_time
+            velocity_mode[0] = CURRENT_TO_NEXT
+            user_programs[0] = TRIG_LIVE_FRAME
+            completed_steps_lookup[0] = start_index
+
+        # Add the last tail off point
+        if is_last:
+            # Change last point to be dead frame
+            velocity_mode[-2] = PREV_TO_CURRENT
+            user_programs[-2] = TRIG_DEAD_FRAME
+
+            # Calculate how long to leave for the tail-off (at least MIN_TIME)
+            tail_off_time = MIN_TIME
+            for axis_name, motor_info in axis_mapping.items():
+                velocity = velocities[axis_name][-1]
+                tail_off_time = max(tail_off_time,
+                                    motor_info.acceleration_time(0, velocity))
+                positions_array = trajectory[axis_name]
+                positions_array[-1] = positions_array[-2] + \
+                    motor_info.ramp_distance(velocity, 0)
+            time_array[-1] = tail_off_time
+            velocity_mode[-1] = ZERO_VELOCITY
+            user_programs[-1] = TRIG_ZERO
+            completed_steps_lookup[-1] = end_index
+
+        profile = dict(time_array=time_array, velocity_mode=velocity_mode,
+                       trajectory=trajectory, user_programs=user_programs,
+                       completed_steps_lookup=completed_steps_lookup)
+        return profile
+
+
+# The pool of BUILD_PROCESSES shared by every part in the process
+_build_pool = None
+_build_pool_lock = threading.Lock()
+
+
+def get_build_pool():
+    """Get the process wide pool of workers that build points in the
+    background, starting it the first time it is asked for. It is closed by
+    close_build_pool() when the interpreter exits
+
+    Returns:
+        multiprocessing.pool.Pool: The pool
+    """
+    global _build_pool
+    with _build_pool_lock:
+        if _build_pool is None:
+            if hasattr(multiprocessing, "get_context"):
+                # Start fresh interpreters rather than forking the threads
+                # and held locks of this one
+                context = multiprocessing.get_context("spawn")
+            else:
+                context = multiprocessing
+            _build_pool = context.Pool(BUILD_PROCESSES)
+            atexit.register(close_build_pool)
+    return _build_pool
+
+
+def close_build_pool():
+    """Stop the workers of get_build_pool() without waiting for the builds
+    they are running. The next get_build_pool() starts a new pool"""
+    global _build_pool
+    with _build_pool_lock:
+        if _build_pool is not None:
+            _build_pool.terminate()
+            _build_pool.join()
+            _build_pool = None
+
+
+def build_profile_in_worker(generator_dict, axis_mapping, start_index,
+                            end_index, is_last, min_turnaround):
+    """Build the profile for points start_index to end_index in a worker of
+    get_build_pool(). The worker keeps its own prepared_generators, so the
+    points of each generator are only got once in it
+
+    Args:
+        generator_dict (dict): The serialized CompoundGenerator to read
+        axis_mapping (dict): {axis_name: MotorInfo} of the axes to move
+        start_index (int): The first point to build
+        end_index (int): One past the last point to build
+        is_last (bool): Whether end_index is the end of the scan
+        min_turnaround (float): Min time for any gaps between frames
+
+    Returns:
+        tuple: (profile, build_time) where build_time is how many seconds
+            it took
+    """
+    start = time.time()
+    generator = CompoundGenerator.from_dict(generator_dict)
+    profile = ProfileBuilder().build_profile_between(
+        generator, axis_mapping, start_index, end_index, is_last,
+        min_turnaround=min_turnaround)
+    return profile, time.time() - start
+
+
 @method_also_takes(
     "minTurnaround", NumberMeta(
         "float64", "Min time for any gaps between frames"), 0.0)
-class PMACTrajectoryPart(ChildPart):
+class PMACTrajectoryPart(ChildPart, ProfileBuilder):
     # Axis information stored from validate
     # {scannable_name: MotorInfo}
     axis_mapping = None
@@ -262,6 +685,21 @@ class PMACTrajectoryPart(ChildPart):
     generator = None
     # Min turnaround time
     min_turnaround = None
+    # Seconds of loaded profile left to run
+    buffer_headroom = None
+    # Cumulative time in seconds at the end of each loaded profile point
+    profile_times = []
+    # How many generator points to load next time
+    points_per_build = POINTS_PER_BUILD
+    # Load the next points when fewer than this many are left to scan
+    reload_threshold = POINTS_PER_BUILD
+    # (end_index, Spawned) of the points being built in the background
+    prebuilt = None
+    # Incremented each time prebuilt is discarded, so a build that finishes
+    # after that is ignored
+    prebuild_generation = 0
+    # (time, completed_steps) of the first update_step of this run
+    scan_start = None
 
     def create_attributes(self):
         for data in super(PMACTrajectoryPart, self).create_attributes():
@@ -271,6 +709,10 @@ class PMACTrajectoryPart(ChildPart):
             self.params.minTurnaround)
         yield "minTurnaround", self.min_turnaround, \
               self.min_turnaround.set_value
+        self.buffer_headroom = NumberMeta(
+            "float64", "Seconds of loaded trajectory left to run"
+        ).make_attribute(0.0)
+        yield "bufferHeadroom", self.buffer_headroom, None
 
     @RunnableController.Reset
     def reset(self, task):
@@ -331,6 +773,11 @@ class PMACTrajectoryPart(ChildPart):
     @method_takes(*configure_args)
     def configure(self, task, completed_steps, steps_to_do, part_info, params):
         task.unsubscribe_all()
+        self.discard_prebuild()
+        if BUILD_PROCESSES:
+            # Start the workers now so they have imported everything by the
+            # time the first prebuild is sent to them
+            get_build_pool()
         task.put(self.child["numPoints"], 4000000)
         self.generator = params.generator
         cs_port, self.axis_mapping = self._make_axis_mapping(
@@ -340,16 +787,23 @@ class PMACTrajectoryPart(ChildPart):
         futures = self.move_to_start(task, completed_steps)
         self.steps_up_to = completed_steps + steps_to_do
         self.completed_steps_lookup = []
+        self.profile_times = []
+        self.points_per_build = POINTS_PER_BUILD
+        self.reload_threshold = POINTS_PER_BUILD
         profile = self.build_generator_profile(completed_steps, do_run_up=True)
         task.wait_all(futures)
         self.write_profile_points(task, **profile)
         # Max size of array
         task.post(self.child["buildProfile"])
+        self.buffer_headroom.set_value(self.profile_times[-1])
+        # Build the next points while these are running
+        self.start_prebuild()
 
     @RunnableController.Run
     @RunnableController.Resume
     def run(self, task, update_completed_steps):
         self.loading = False
+        self.scan_start = None
         task.subscribe(self.child["pointsScanned"], self.update_step,
                        update_completed_steps, task)
         task.post(self.child["executeProfile"])
@@ -357,6 +811,7 @@ class PMACTrajectoryPart(ChildPart):
     @RunnableController.Abort
     def abort(self, task):
         task.post(self.child["abortProfile"])
+        self.discard_prebuild()
 
     @RunnableController.Pause
     def pause(self, task):
@@ -368,14 +823,136 @@ class PMACTrajectoryPart(ChildPart):
         if scanned > 0:
             completed_steps = self.completed_steps_lookup[scanned - 1]
             update_completed_steps(completed_steps, self)
+            self.buffer_headroom.set_value(
+                self.profile_times[-1] - self.profile_times[scanned - 1])
+            if self.scan_start is None:
+                self.scan_start = (time.time(), completed_steps)
             if not self.loading and self.end_index < self.steps_up_to and \
-                    self.end_index - completed_steps < POINTS_PER_BUILD:
+                    self.end_index - completed_steps < self.reload_threshold:
                 self.loading = True
-                profile = self.build_generator_profile(self.end_index)
-                self.write_profile_points(task, **profile)
-                task.post(self.child["appendProfile"])
+                self.append_prebuilt_profile(task, completed_steps)
                 self.loading = False
 
+    def start_prebuild(self):
+        """Start building the points after end_index in the background"""
+        if self.end_index < self.steps_up_to:
+            end_index = min(
+                self.end_index + self.points_per_build, self.steps_up_to)
+            args = (self.axis_mapping, self.end_index, end_index,
+                    end_index == self.steps_up_to, self.min_turnaround.value)
+            if BUILD_PROCESSES:
+                # Building is CPU bound, so do it in another process where
+                # it doesn't hold our GIL
+                spawned = get_build_pool().apply_async(
+                    build_profile_in_worker,
+                    (self.generator.to_dict(),) + args)
+            else:
+                spawned = self.process.spawn(
+                    self.timed_build_profile, self.generator, *args)
+            self.prebuilt = (end_index, spawned)
+        else:
+            self.prebuilt = None
+
+    def discard_prebuild(self):
+        """Throw away any points being built in the background without
+        waiting for them. If the build is still running its result is ignored
+        when it finishes"""
+        self.prebuild_generation += 1
+        self.prebuilt = None
+
+    def timed_build_profile(self, generator, axis_mapping, start_index,
+                            end_index, is_last, min_turnaround):
+        """Build the profile for points start_index to end_index
+
+        Returns:
+            tuple: (profile, build_time) where build_time is how many seconds
+                it took
+        """
+        start = time.time()
+        profile = self.build_profile_between(
+            generator, axis_mapping, start_index, end_index, is_last,
+            min_turnaround=min_turnaround)
+        return profile, time.time() - start
+
+    def append_prebuilt_profile(self, task, completed_steps):
+        """Append the points built in the background, adapt points_per_build
+        and reload_threshold to how long that took, then start building the
+        next ones"""
+        generation = self.prebuild_generation
+        prebuilt = self.prebuilt
+        if prebuilt is None:
+            # Discarded by abort()
+            return
+        end_index, spawned = prebuilt
+        if not spawned.ready():
+            self.log_warning(
+                "Points %d to %d are not built yet, waiting up to %ss",
+                self.end_index, end_index, PREBUILD_TIMEOUT)
+        try:
+            profile, build_time = spawned.get(PREBUILD_TIMEOUT)
+        except TimeoutError:
+            if generation != self.prebuild_generation:
+                return
+            raise TimeoutError(
+                "Building points %d to %d took longer than %ss" % (
+                    self.end_index, end_index, PREBUILD_TIMEOUT))
+        if generation != self.prebuild_generation:
+            # Discarded while we waited, so the points are no longer wanted
+            return
+        start = time.time()
+        self.write_profile_points(task, **profile)
+        task.post(self.child["appendProfile"])
+        write_time = time.time() - start
+        num_points = end_index - self.end_index
+        self.end_index = end_index
+        scan_time = time.time() - self.scan_start[0]
+        if scan_time > 0 and completed_steps > self.scan_start[1]:
+            scan_rate = (completed_steps - self.scan_start[1]) / scan_time
+            self.points_per_build = self.calculate_points_per_build(
+                scan_rate, build_time / num_points, write_time)
+            self.reload_threshold = self.calculate_reload_threshold(
+                scan_rate, write_time)
+        self.start_prebuild()
+
+    def calculate_points_per_build(self, scan_rate, build_time, write_time):
+        """Work out how many points to load so that they last at least
+        BUILD_AHEAD_FACTOR times as long as building and writing them
+
+        Args:
+            scan_rate (float): Generator points scanned per second
+            build_time (float): Seconds it takes to build each point
+            write_time (float): Seconds it takes to write and append a profile
+
+        Returns:
+            int: Number of points between POINTS_PER_BUILD and
+                MAX_POINTS_PER_BUILD
+        """
+        # We need n / scan_rate >= factor * (write_time + n * build_time)
+        spare_time = 1.0 / scan_rate - BUILD_AHEAD_FACTOR * build_time
+        if spare_time <= 0:
+            # Can't build fast enough, so load as many as we can
+            return MAX_POINTS_PER_BUILD
+        points = int(np.ceil(BUILD_AHEAD_FACTOR * write_time / spare_time))
+        return min(max(points, POINTS_PER_BUILD), MAX_POINTS_PER_BUILD)
+
+    def calculate_reload_threshold(self, scan_rate, write_time):
+        """Work out how many loaded points need to be left to scan when we
+        append the next ones, so they last BUILD_AHEAD_FACTOR times as long
+        as writing the next points. This is never more than
+        calculate_points_per_build() gives, so appending them always takes
+        us back above it
+
+        Args:
+            scan_rate (float): Generator points scanned per second
+            write_time (float): Seconds it takes to write and append a profile
+
+        Returns:
+            int: Number of points between POINTS_PER_BUILD and
+                MAX_POINTS_PER_BUILD
+        """
+        points = int(np.ceil(BUILD_AHEAD_FACTOR * write_time * scan_rate))
+        return min(max(points, POINTS_PER_BUILD), MAX_POINTS_PER_BUILD)
+
     def point_velocities(self, point):
         velocities = {}
         for axis_name, motor_info in self.axis_mapping.items():
@@ -389,28 +966,16 @@ class PMACTrajectoryPart(ChildPart):
 
     def make_consistent_velocity_profiles(self, v1s, v2s, distances,
                                           min_time=MIN_TIME):
+        _, segments = self.make_consistent_velocity_segments(
+            v1s, v2s, distances, min_time)
         time_arrays = {}
         velocity_arrays = {}
-        iterations = 5
-        while iterations > 0:
-            for axis_name, motor_info in self.axis_mapping.items():
-                time_arrays[axis_name], velocity_arrays[axis_name] = \
-                    motor_info.make_velocity_profile(
-                        v1s[axis_name], v2s[axis_name], distances[axis_name],
-                        min_time)
-                assert time_arrays[axis_name][-1] >= min_time or np.isclose(
-                        time_arrays[axis_name][-1], min_time), \
-                    "Time %s velocity %s for %s takes less time than %s" % (
-                        time_arrays[axis_name], velocity_arrays[axis_name],
-                        axis_name, min_time)
-            new_min_time = max(t[-1] for t in time_arrays.values())
-            if np.isclose(new_min_time, min_time):
-                # We've got our consistent set
-                return time_arrays, velocity_arrays
-            else:
-                min_time = new_min_time
-                iterations -= 1
-        raise ValueError("Can't get a consistent time in 5 iterations")
+        for axis_name, motor_info in self.axis_mapping.items():
+            t1, vm, tm, t2 = [float(x) for x in segments[axis_name]]
+            time_arrays[axis_name], velocity_arrays[axis_name] = \
+                motor_info.profile_from_segments(
+                    v1s[axis_name], v2s[axis_name], t1, vm, tm, t2)
+        return time_arrays, velocity_arrays
 
     def move_to_start(self, task, start_index):
         """Move to the run up position ready to start the scan"""
@@ -449,11 +1014,13 @@ class PMACTrajectoryPart(ChildPart):
         """Build profile using part_tasks
 
         Args:
-            time_array (list): List of times in ms
-            velocity_mode (list): List of velocity modes like PREV_TO_NEXT
+            time_array (list): List or array of times in s
+            velocity_mode (list): List or array of velocity modes like
+                PREV_TO_NEXT
             trajectory (dict): {axis_name: [positions in EGUs]}
             task (Task): Task for running
-            user_programs (list): List of user programs like TRIG_LIVE_FRAME
+            user_programs (list): List or array of user programs like
+                TRIG_LIVE_FRAME
             completed_steps_lookup (list): If given, when we get to this index,
                 how many completed steps have we done?
         """
@@ -471,71 +1038,70 @@ class PMACTrajectoryPart(ChildPart):
             attr_dict["use%s" % cs_axis] = cs_axis in use
         task.put_many(self.child, attr_dict)
 
-        # Start adding points, padding if the move time exceeds 4s
-        i = 0
-        while i < len(time_array):
-            t = time_array[i]
-            if t > 4:
-                # split
-                nsplit = int(t / 4.0 + 1)
-                new_time_array = time_array[:i]
-                new_velocity_mode = velocity_mode[:i]
-                new_user_programs = user_programs[:i]
-                if completed_steps_lookup is not None:
-                    new_completed_steps_lookup = completed_steps_lookup[:i]
-                for _ in range(nsplit):
-                    new_time_array.append(t / nsplit)
-                    new_velocity_mode.append(PREV_TO_NEXT)
-                    new_user_programs.append(NO_PROGRAM)
-                    if completed_steps_lookup is not None:
-                        new_completed_steps_lookup.append(
-                            new_completed_steps_lookup[-1])
-                time_array = new_time_array + time_array[i+1:]
-                user_programs = new_user_programs[:-1] + user_programs[i:]
-                velocity_mode = new_velocity_mode[:-1] + velocity_mode[i:]
-                if completed_steps_lookup is not None:
-                    completed_steps_lookup = new_completed_steps_lookup[:-1] + \
-                                             completed_steps_lookup[i:]
-
-                for k, traj in trajectory.items():
-                    new_traj = traj[:i]
-                    per_section = float(traj[i] - traj[i-1]) / nsplit
-                    for j in range(1, nsplit+1):
-                        new_traj.append(traj[i-1] + j * per_section)
-                    trajectory[k] = new_traj + traj[i+1:]
-
-                i += nsplit
-            else:
-                i += 1
-
-        # Process the time in ticks
-        overflow = 0
-        time_array_ticks = []
-        for t in time_array:
-            ticks = t / TICK_S
-            overflow += (ticks % 1)
-            ticks = int(ticks)
-            if overflow > 0.5:
-                overflow -= 1
-                ticks += 1
-            time_array_ticks.append(ticks)
+        # Split any moves that take longer than MAX_MOVE_TIME into equal parts
+        time_array = np.asarray(time_array, dtype=float)
+        velocity_mode = np.asarray(velocity_mode)
+        user_programs = np.asarray(user_programs)
+        if completed_steps_lookup is not None:
+            completed_steps_lookup = np.asarray(completed_steps_lookup)
+        trajectory = {k: np.asarray(v, dtype=float)
+                      for k, v in trajectory.items()}
+        nsplits = np.ones(len(time_array), dtype=int)
+        long_moves = time_array > MAX_MOVE_TIME
+        if long_moves.any():
+            nsplits[long_moves] = \
+                (time_array[long_moves] / MAX_MOVE_TIME + 1).astype(int)
+            # The index of the move each new point comes from
+            src = np.repeat(np.arange(len(time_array)), nsplits)
+            src_nsplits = nsplits[src]
+            # Which of the nsplit parts of the move it is, starting from 1
+            part = np.arange(len(src)) + 1 - \
+                np.repeat(np.cumsum(nsplits) - nsplits, nsplits)
+            # All but the last part are padding that the PMAC moves through
+            padding = part < src_nsplits
+            time_array = time_array[src] / src_nsplits
+            velocity_mode = np.where(padding, PREV_TO_NEXT, velocity_mode[src])
+            user_programs = np.where(padding, NO_PROGRAM, user_programs[src])
+            if completed_steps_lookup is not None:
+                completed_steps_lookup = np.where(
+                    padding, completed_steps_lookup[src - 1],
+                    completed_steps_lookup[src])
+            # Split parts are spaced evenly from the previous position
+            split = src_nsplits > 1
+            for k, traj in trajectory.items():
+                prev = traj[src - 1]
+                per_section = (traj[src] - prev) / src_nsplits
+                trajectory[k] = np.where(
+                    split, prev + part * per_section, traj[src])
+
+        # Process the time in ticks, rounding the running total so the
+        # rounding errors don't accumulate
+        total_ticks = np.floor(np.cumsum(time_array / TICK_S) + 0.5)
+        time_array_ticks = np.diff(
+            np.concatenate([[0], total_ticks])).astype(int)
 
         # Set the trajectories
         attr_dict = dict(
-            timeArray=time_array_ticks,
-            velocityMode=velocity_mode,
-            userPrograms=user_programs,
+            timeArray=time_array_ticks.tolist(),
+            velocityMode=velocity_mode.tolist(),
+            userPrograms=user_programs.tolist(),
             pointsToBuild=len(time_array)
         )
         for axis_name in trajectory:
             motor_info = self.axis_mapping[axis_name]
             cs_axis = motor_info.cs_axis
-            attr_dict["positions%s" % cs_axis] = trajectory[axis_name]
+            attr_dict["positions%s" % cs_axis] = \
+                trajectory[axis_name].tolist()
         task.put_many(self.child, attr_dict)
 
-        # Set completed_steps
+        # Set completed_steps and when each point will finish
         if completed_steps_lookup is not None:
-            self.completed_steps_lookup += completed_steps_lookup
+            self.completed_steps_lookup += completed_steps_lookup.tolist()
+            if self.profile_times:
+                start_time = self.profile_times[-1]
+            else:
+                start_time = 0.0
+            self.profile_times += (start_time + total_ticks * TICK_S).tolist()
 
     def reset_triggers(self, task):
         """Just call a Move to the run up position ready to start the scan"""
@@ -549,168 +1115,12 @@ class PMACTrajectoryPart(ChildPart):
         task.post(self.child["buildProfile"])
         task.post(self.child["executeProfile"])
 
-    def build_profile_from_velocities(self, time_arrays, velocity_arrays,
-                                      current_positions):
-        trajectory = {}
-
-        # Interpolate the velocity arrays at about 10ms
-        move_time = max(t[-1] for t in time_arrays.values())
-        # Make sure there are at least 2 of them
-        num_intervals = max(int(np.floor(move_time / INTERPOLATE_INTERVAL)), 2)
-        interval = move_time / num_intervals
-        time_array = [interval] * num_intervals
-        velocity_mode = [PREV_TO_NEXT] * (num_intervals - 1) + [CURRENT_TO_NEXT]
-        user_programs = [TRIG_ZERO] * num_intervals
-
-        # Do this for each velocity array
-        for axis_name, motor_info in self.axis_mapping.items():
-            trajectory[axis_name] = []
-            ts = time_arrays[axis_name]
-            vs = velocity_arrays[axis_name]
-            position = current_positions[axis_name]
-            for i in range(num_intervals):
-                time = interval * (i + 1)
-                # If we have exceeded the current segment, pop it and add it's
-                # position in
-                if time > ts[1] and not np.isclose(time, ts[1]):
-                    position += motor_info.ramp_distance(
-                        vs[0], vs[1], ts[1] - ts[0])
-                    vs = vs[1:]
-                    ts = ts[1:]
-                assert len(ts) > 1, \
-                   "Bad %s time %s velocity %s" % (time, ts, vs)
-                fraction = (time - ts[0]) / (ts[1] - ts[0])
-                velocity = fraction * (vs[1] - vs[0]) + vs[0]
-                part_position = motor_info.ramp_distance(
-                    vs[0], velocity, time - ts[0])
-                trajectory[axis_name].append(position + part_position)
-
-        profile = dict(time_array=time_array, velocity_mode=velocity_mode,
-                       trajectory=trajectory, user_programs=user_programs)
-        return profile
-
     def build_generator_profile(self, start_index, do_run_up=False):
-        trajectory = {axis_name: [] for axis_name in self.axis_mapping}
-        time_array = []
-        velocity_mode = []
-        user_programs = []
-        completed_steps_lookup = []
-
         # Cap last point to steps_up_to
-        self.end_index = start_index + POINTS_PER_BUILD
+        self.end_index = start_index + self.points_per_build
         if self.end_index > self.steps_up_to:
             self.end_index = self.steps_up_to
-
-        # If we are doing the first build, do_run_up will be passed to flag
-        # that we need a run up, else just continue from the previous point
-        if do_run_up:
-            point = self.generator.get_point(start_index)
-
-            # Calculate how long to leave for the run-up (at least MIN_TIME)
-            run_up_time = MIN_TIME
-            for axis_name, velocity in self.point_velocities(point).items():
-                trajectory[axis_name].append(point.lower[axis_name])
-                motor_info = self.axis_mapping[axis_name]
-                run_up_time = max(run_up_time,
-                                  motor_info.acceleration_time(0, velocity))
-
-            # Add lower bound
-            time_array.append(run_up_time)
-            velocity_mode.append(CURRENT_TO_NEXT)
-            user_programs.append(TRIG_LIVE_FRAME)
-            completed_steps_lookup.append(start_index)
-
-        for i in range(start_index, self.end_index):
-            point = self.generator.get_point(i)
-
-            # Add position
-            time_array.append(point.duration / 2.0)
-            velocity_mode.append(PREV_TO_NEXT)
-            user_programs.append(TRIG_CAPTURE)
-            completed_steps_lookup.append(i)
-            for axis_name, positions in trajectory.items():
-                positions.append(point.positions[axis_name])
-
-            # Add upper bound
-            time_array.append(point.duration / 2.0)
-            velocity_mode.append(PREV_TO_NEXT)
-            user_programs.append(TRIG_LIVE_FRAME)
-            completed_steps_lookup.append(i + 1)
-            for axis_name, positions in trajectory.items():
-                positions.append(point.upper[axis_name])
-
-            # Check if we need to insert the upper bound point
-            if i + 1 < self.steps_up_to:
-                next_point = self.generator.get_point(i + 1)
-
-                # Check if we need no insert a gap
-                if not self.points_joined(point, next_point):
-                    # Change last point to be dead frame
-                    velocity_mode[-1] = PREV_TO_CURRENT
-                    user_programs[-1] = TRIG_DEAD_FRAME
-
-                    # Work out the start and end velocities for each axis
-                    start_velocities = self.point_velocities(point)
-                    end_velocities = self.point_velocities(next_point)
-                    start_positions = {}
-                    distances = {}
-                    for axis_name, motor_info in self.axis_mapping.items():
-                        start_positions[axis_name] = point.upper[axis_name]
-                        distances[axis_name] = \
-                            next_point.lower[axis_name] - point.upper[axis_name]
-
-                    # Work out the velocity profiles of how to move to the start
-                    time_arrays, velocity_arrays = \
-                        self.make_consistent_velocity_profiles(
-                            start_velocities, end_velocities, distances,
-                            self.min_turnaround.value)
-
-                    # Work out the Position trajectories from these profiles
-                    profile = self.build_profile_from_velocities(
-                        time_arrays, velocity_arrays, start_positions)
-
-                    # Append them
-                    time_array += profile["time_array"]
-                    velocity_mode += profile["velocity_mode"]
-                    user_programs += profile["user_programs"][:-1] + \
-                                     [TRIG_LIVE_FRAME]
-                    for axis_name in trajectory:
-                        trajectory[axis_name] += \
-                            profile["trajectory"][axis_name]
-                    completed_steps_lookup += [i + 1] * len(
-                        profile["time_array"])
-
-        # Add the last tail off point
-        if self.end_index == self.steps_up_to:
-            point = self.generator.get_point(self.end_index - 1)
-
-            # Change last point to be dead frame
-            velocity_mode[-1] = PREV_TO_CURRENT
-            user_programs[-1] = TRIG_DEAD_FRAME
-
-            # Calculate how long to leave for the tail-off (at least MIN_TIME)
-            tail_off_time = MIN_TIME
-            for axis_name, velocity in self.point_velocities(point).items():
-                motor_info = self.axis_mapping[axis_name]
-                tail_off_time = max(tail_off_time,
-                                    motor_info.acceleration_time(0, velocity))
-                positions = trajectory[axis_name]
-                tail_off = motor_info.ramp_distance(velocity, 0)
-                positions.append(positions[-1] + tail_off)
-
-            time_array.append(tail_off_time)
-            velocity_mode.append(ZERO_VELOCITY)
-            user_programs.append(TRIG_ZERO)
-            completed_steps_lookup.append(self.end_index)
-
-        profile = dict(time_array=time_array, velocity_mode=velocity_mode,
-                       trajectory=trajectory, user_programs=user_programs,
-                       completed_steps_lookup=completed_steps_lookup)
-        return profile
-
-    def points_joined(self, last_point, point):
-        # Check for axes that need to move within the space between points
-        for axis_name, motor_info in self.axis_mapping.items():
-            if last_point.upper[axis_name] != point.lower[axis_name]:
-                return False
-        return True
+        return self.build_profile_between(
+            self.generator, self.axis_mapping, start_index, self.end_index,
+            self.end_index == self.steps_up_to, do_run_up,
+            self.min_turnaround.value)
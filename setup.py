@@ -72,6 +72,7 @@ setup(
     install_requires=install_requires,
     extras_require={
         'websocket':  ['tornado'],
+        'msgpack': ['msgpack>=0.5.2'],
         'ca': ['cothread']
     },
     include_package_data=True,
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import setup_malcolm_paths
+
+import unittest
+
+# module imports
+from malcolm.core.cache import Cache
+
+
+# Microbenchmarks for the Cache subscription tree. Run them directly with
+#   python tests/benchmarks/benchmark_cache.py
+
+NUM_BLOCKS = 50
+NUM_ATTRIBUTES = 100
+# How many GUI/PVA style subscribers are attached to each attribute value
+SUBSCRIBERS_PER_ATTRIBUTE = 2
+NUM_CHANGES = 50000
+
+
+class Subscriber(object):
+    pass
+
+
+def make_cache():
+    c = Cache()
+    for b in range(NUM_BLOCKS):
+        block = {}
+        for a in range(NUM_ATTRIBUTES):
+            block["attr%d" % a] = {"value": 0, "meta": {"writeable": False}}
+        c.apply_changes([["block%d" % b], block])
+    return c
+
+
+def subscription_paths():
+    for b in range(NUM_BLOCKS):
+        for a in range(NUM_ATTRIBUTES):
+            for _ in range(SUBSCRIBERS_PER_ATTRIBUTE):
+                yield ["block%d" % b, "attr%d" % a, "value"]
+
+
+class BenchmarkCacheSubscriptions(unittest.TestCase):
+
+    def setUp(self):
+        self.c = make_cache()
+        self.subscriptions = []
+        for path in subscription_paths():
+            subscription = Subscriber()
+            self.subscriptions.append((subscription, path))
+
+    def test_add_remove(self):
+        start = time.time()
+        for subscription, path in self.subscriptions:
+            self.c.add_subscriber(subscription, path)
+        added = time.time()
+        for subscription, path in self.subscriptions:
+            self.c.remove_subscriber(subscription, path)
+        removed = time.time()
+        print("")
+        print("%d subscribers: add %.2fus, remove %.2fus each" % (
+            len(self.subscriptions),
+            (added - start) * 1e6 / len(self.subscriptions),
+            (removed - added) * 1e6 / len(self.subscriptions)))
+
+    def test_notify_value_change(self):
+        for subscription, path in self.subscriptions:
+            self.c.add_subscriber(subscription, path)
+        start = time.time()
+        for i in range(NUM_CHANGES):
+            path = ["block%d" % (i % NUM_BLOCKS),
+                    "attr%d" % (i % NUM_ATTRIBUTES), "value"]
+            self.c.apply_changes([path, i])
+        end = time.time()
+        print("")
+        print("%d subscribers: %.2fus per attribute value change" % (
+            len(self.subscriptions), (end - start) * 1e6 / NUM_CHANGES))
+
+    def test_notify_block_replace(self):
+        for subscription, path in self.subscriptions:
+            self.c.add_subscriber(subscription, path)
+        block = self.c["block0"]
+        num_changes = NUM_CHANGES // 100
+        start = time.time()
+        for i in range(num_changes):
+            self.c.apply_changes([["block%d" % (i % NUM_BLOCKS)], block])
+        end = time.time()
+        print("")
+        print("%d subscribers: %.2fus per whole block change" % (
+            len(self.subscriptions), (end - start) * 1e6 / num_changes))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
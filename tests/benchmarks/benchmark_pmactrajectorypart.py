@@ -0,0 +1,235 @@
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import setup_malcolm_paths
+
+import unittest
+from mock import MagicMock
+
+import numpy as np
+from scanpointgenerator import LineGenerator, SpiralGenerator, \
+    CompoundGenerator
+
+# module imports
+from malcolm.parts.pmac.pmactrajectorypart import PMACTrajectoryPart, \
+    MotorInfo, MIN_TIME, PREV_TO_NEXT, PREV_TO_CURRENT, CURRENT_TO_NEXT, \
+    ZERO_VELOCITY, TRIG_CAPTURE, TRIG_DEAD_FRAME, TRIG_LIVE_FRAME, TRIG_ZERO, \
+    POINTS_PER_BUILD
+
+
+# Benchmarks for building PMAC trajectory profiles from a generator. Run them
+# directly with
+#   python tests/benchmarks/benchmark_pmactrajectorypart.py
+
+NUM_POINTS = 100000
+# Rows in a snake scan with short rows, so turnarounds dominate
+NUM_ROWS = 3000
+# Points in a slow step scan where every move is split
+NUM_LONG_MOVES = 20000
+
+
+class PointByPointTrajectoryPart(PMACTrajectoryPart):
+    """The profile builder as it was before it used arrays, for comparison"""
+
+    def build_generator_profile(self, start_index, do_run_up=False):
+        trajectory = {axis_name: [] for axis_name in self.axis_mapping}
+        time_array = []
+        velocity_mode = []
+        user_programs = []
+        completed_steps_lookup = []
+        self.end_index = min(start_index + POINTS_PER_BUILD, self.steps_up_to)
+        if do_run_up:
+            point = self.generator.get_point(start_index)
+            run_up_time = MIN_TIME
+            for axis_name, velocity in self.point_velocities(point).items():
+                trajectory[axis_name].append(point.lower[axis_name])
+                motor_info = self.axis_mapping[axis_name]
+                run_up_time = max(run_up_time,
+                                  motor_info.acceleration_time(0, velocity))
+            time_array.append(run_up_time)
+            velocity_mode.append(CURRENT_TO_NEXT)
+            user_programs.append(TRIG_LIVE_FRAME)
+            completed_steps_lookup.append(start_index)
+        for i in range(start_index, self.end_index):
+            point = self.generator.get_point(i)
+            time_array.append(point.duration / 2.0)
+            velocity_mode.append(PREV_TO_NEXT)
+            user_programs.append(TRIG_CAPTURE)
+            completed_steps_lookup.append(i)
+            for axis_name, positions in trajectory.items():
+                positions.append(point.positions[axis_name])
+            time_array.append(point.duration / 2.0)
+            velocity_mode.append(PREV_TO_NEXT)
+            user_programs.append(TRIG_LIVE_FRAME)
+            completed_steps_lookup.append(i + 1)
+            for axis_name, positions in trajectory.items():
+                positions.append(point.upper[axis_name])
+            if i + 1 < self.steps_up_to:
+                next_point = self.generator.get_point(i + 1)
+                if not self.points_joined(point, next_point):
+                    velocity_mode[-1] = PREV_TO_CURRENT
+                    user_programs[-1] = TRIG_DEAD_FRAME
+                    start_velocities = self.point_velocities(point)
+                    end_velocities = self.point_velocities(next_point)
+                    start_positions = {}
+                    distances = {}
+                    for axis_name in self.axis_mapping:
+                        start_positions[axis_name] = point.upper[axis_name]
+                        distances[axis_name] = \
+                            next_point.lower[axis_name] - point.upper[axis_name]
+                    time_arrays, velocity_arrays = \
+                        self.make_consistent_velocity_profiles(
+                            start_velocities, end_velocities, distances,
+                            self.min_turnaround.value)
+                    profile = self.build_profile_from_velocities(
+                        time_arrays, velocity_arrays, start_positions)
+                    time_array += profile["time_array"]
+                    velocity_mode += profile["velocity_mode"]
+                    user_programs += profile["user_programs"][:-1] + \
+                        [TRIG_LIVE_FRAME]
+                    for axis_name in trajectory:
+                        trajectory[axis_name] += \
+                            profile["trajectory"][axis_name]
+                    completed_steps_lookup += [i + 1] * len(
+                        profile["time_array"])
+        if self.end_index == self.steps_up_to:
+            point = self.generator.get_point(self.end_index - 1)
+            velocity_mode[-1] = PREV_TO_CURRENT
+            user_programs[-1] = TRIG_DEAD_FRAME
+            tail_off_time = MIN_TIME
+            for axis_name, velocity in self.point_velocities(point).items():
+                motor_info = self.axis_mapping[axis_name]
+                tail_off_time = max(tail_off_time,
+                                    motor_info.acceleration_time(0, velocity))
+                positions = trajectory[axis_name]
+                positions.append(positions[-1] +
+                                 motor_info.ramp_distance(velocity, 0))
+            time_array.append(tail_off_time)
+            velocity_mode.append(ZERO_VELOCITY)
+            user_programs.append(TRIG_ZERO)
+            completed_steps_lookup.append(self.end_index)
+        return dict(time_array=time_array, velocity_mode=velocity_mode,
+                    trajectory=trajectory, user_programs=user_programs,
+                    completed_steps_lookup=completed_steps_lookup)
+
+    def points_joined(self, last_point, point):
+        # Check for axes that need to move within the space between points
+        for axis_name, motor_info in self.axis_mapping.items():
+            if last_point.upper[axis_name] != point.lower[axis_name]:
+                return False
+        return True
+
+
+def make_part(cls, generator):
+    process = MagicMock()
+    params = cls.MethodMeta.prepare_input_map(name="pmac", mri="TST-PMAC")
+    part = cls(process, params)
+    list(part.create_attributes())
+    part.axis_mapping = {}
+    for cs_axis, scannable in (("A", "x"), ("B", "y")):
+        part.axis_mapping[scannable] = MotorInfo(
+            cs_axis=cs_axis, cs_port="CS1", acceleration=50.0,
+            resolution=0.001, offset=0, max_velocity=100.0,
+            current_position=0.0, scannable=scannable, velocity_settle=0.0)
+    part.generator = generator
+    part.steps_up_to = generator.size
+    return part
+
+
+def build_all(part):
+    profiles = [part.build_generator_profile(0, do_run_up=True)]
+    while part.end_index < part.steps_up_to:
+        profiles.append(part.build_generator_profile(part.end_index))
+    return profiles
+
+
+def grid_generator():
+    num = int(np.sqrt(NUM_POINTS))
+    xs = LineGenerator("x", "mm", 0.0, 10.0, num, alternate=True)
+    ys = LineGenerator("y", "mm", 0.0, 10.0, num)
+    generator = CompoundGenerator([ys, xs], [], [], 0.01)
+    generator.prepare()
+    return generator
+
+
+def many_rows_generator():
+    xs = LineGenerator("x", "mm", 0.0, 1.0, 10, alternate=True)
+    ys = LineGenerator("y", "mm", 0.0, 30.0, NUM_ROWS)
+    generator = CompoundGenerator([ys, xs], [], [], 0.01)
+    generator.prepare()
+    return generator
+
+
+def spiral_generator():
+    # A spiral of radius r with scale s has about pi*r**2/s**2 points
+    scale = 0.1
+    radius = scale * np.sqrt(NUM_POINTS / np.pi)
+    spiral = SpiralGenerator(["x", "y"], "mm", [0.0, 0.0], radius, scale)
+    generator = CompoundGenerator([spiral], [], [], 0.01)
+    generator.prepare()
+    return generator
+
+
+class BenchmarkBuildGeneratorProfile(unittest.TestCase):
+
+    def compare(self, name, generator):
+        times = {}
+        results = {}
+        for cls in (PointByPointTrajectoryPart, PMACTrajectoryPart):
+            part = make_part(cls, generator)
+            start = time.time()
+            results[cls] = build_all(part)
+            times[cls] = time.time() - start
+        # Check they made the same profiles
+        for old, new in zip(results[PointByPointTrajectoryPart],
+                            results[PMACTrajectoryPart]):
+            for k in ("time_array", "velocity_mode", "user_programs",
+                      "completed_steps_lookup"):
+                self.assertEqual(old[k], list(new[k]))
+            for axis_name in old["trajectory"]:
+                self.assertEqual(old["trajectory"][axis_name],
+                                 list(new["trajectory"][axis_name]))
+        print("")
+        print("%s of %d points: point by point %.0fms, arrays %.0fms" % (
+            name, generator.size,
+            times[PointByPointTrajectoryPart] * 1000,
+            times[PMACTrajectoryPart] * 1000))
+
+    def test_grid(self):
+        self.compare("Snake grid", grid_generator())
+
+    def test_many_rows(self):
+        self.compare("Snake grid with %d rows" % NUM_ROWS,
+                     many_rows_generator())
+
+    def test_spiral(self):
+        self.compare("Spiral", spiral_generator())
+
+
+class BenchmarkWriteProfilePoints(unittest.TestCase):
+
+    def test_long_moves(self):
+        part = make_part(PMACTrajectoryPart, grid_generator())
+        part.completed_steps_lookup = []
+        task = MagicMock()
+        # A step scan that waits 10s at each point
+        time_array = np.full(NUM_LONG_MOVES, 10.0)
+        time_array[0] = 0.1
+        velocity_mode = np.full(NUM_LONG_MOVES, PREV_TO_NEXT)
+        user_programs = np.full(NUM_LONG_MOVES, TRIG_LIVE_FRAME)
+        completed_steps_lookup = np.arange(NUM_LONG_MOVES)
+        trajectory = dict(x=np.linspace(0, 10, NUM_LONG_MOVES),
+                          y=np.linspace(0, 10, NUM_LONG_MOVES))
+        start = time.time()
+        part.write_profile_points(task, time_array, velocity_mode, trajectory,
+                                  user_programs, completed_steps_lookup)
+        end = time.time()
+        print("")
+        print("%d moves of 10s split into %d points: %.0fms" % (
+            NUM_LONG_MOVES, task.put_many.call_args[0][1]["pointsToBuild"],
+            (end - start) * 1000))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
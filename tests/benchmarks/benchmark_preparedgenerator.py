@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import setup_malcolm_paths
+
+import unittest
+
+from scanpointgenerator import LineGenerator, CompoundGenerator
+
+# module imports
+from malcolm.core.preparedgenerator import PreparedGeneratorCache
+
+
+# Benchmarks for sharing the points of a generator between parts. Run them
+# directly with
+#   python tests/benchmarks/benchmark_preparedgenerator.py
+
+NUM_POINTS = 100000
+# PMACTrajectoryPart, PositionLabellerPart and ScanTickerPart in the top level
+# block and in a child block
+NUM_PARTS = 6
+
+
+def make_generator():
+    xs = LineGenerator("x", "mm", 0.0, 10.0, 1000, alternate=True)
+    ys = LineGenerator("y", "mm", 0.0, 10.0, NUM_POINTS // 1000)
+    return CompoundGenerator([ys, xs], [], [], 0.01)
+
+
+class BenchmarkPreparedGenerator(unittest.TestCase):
+
+    def test_parts_get_all_points(self):
+        start = time.time()
+        generator = make_generator()
+        generator.prepare()
+        for _ in range(NUM_PARTS):
+            for i in range(generator.size):
+                generator.get_point(i)
+        walked = time.time() - start
+        cache = PreparedGeneratorCache()
+        start = time.time()
+        for _ in range(NUM_PARTS):
+            # Each child block deserializes its own copy of the generator
+            cache.get(make_generator()).get_points(0, NUM_POINTS)
+        shared = time.time() - start
+        print("")
+        print("%d parts getting %d points: each walking the generator %.0fms, "
+              "sharing a PreparedGenerator %.0fms" % (
+                  NUM_PARTS, NUM_POINTS, walked * 1000, shared * 1000))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,143 @@
+import os
+import sys
+import threading
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import setup_malcolm_paths
+
+import unittest
+
+import numpy as np
+
+# module imports
+from malcolm.core.process import Process, BlockAdd
+from malcolm.core.request import Subscribe, Post, Put
+from malcolm.core.syncfactory import SyncFactory
+
+
+# Benchmarks for the Process dispatch loop. Run them directly with
+#   python tests/benchmarks/benchmark_process.py
+
+NUM_BLOCKS = 64
+# How many changes the chatty block produces, and how many GUIs watch it
+CHATTY_CHANGES = 20000
+CHATTY_SUBSCRIBERS = 20
+# How many changes each of the quiet blocks produce
+QUIET_CHANGES = 20
+# How many changes are queued up in front of each abort
+BACKLOG_CHANGES = 20000
+ABORT_REPEATS = 20
+
+
+class LatencyQueue(object):
+    """Response queue that records how long ago each change was reported"""
+
+    def __init__(self):
+        self.latencies = []
+
+    def put(self, response):
+        now = time.time()
+        if response.changes[0][1] is not None:
+            self.latencies.append(now - response.changes[0][1])
+
+
+class FakeBlock(object):
+
+    def to_dict(self):
+        return {"attr": None}
+
+
+def measure_latency(dispatch_shards):
+    p = Process("proc", SyncFactory("sched"), dispatch_shards)
+    names = ["block%02d" % i for i in range(NUM_BLOCKS)]
+    for name in names:
+        p._handle_block_add(BlockAdd(FakeBlock(), name, None))
+    quiet_queues = []
+    for i, name in enumerate(names):
+        if i == 0:
+            num_subscribers = CHATTY_SUBSCRIBERS
+        else:
+            num_subscribers = 1
+        for j in range(num_subscribers):
+            q = LatencyQueue()
+            request = Subscribe(None, q, [name, "attr"], delta=True)
+            request.set_id(j)
+            p.q.put(request)
+            if i > 0:
+                quiet_queues.append(q)
+    p.start()
+
+    def chatty():
+        for _ in range(CHATTY_CHANGES):
+            p.report_changes([[names[0], "attr"], time.time()])
+
+    chatty_thread = threading.Thread(target=chatty)
+    chatty_thread.start()
+    for _ in range(QUIET_CHANGES):
+        for name in names[1:]:
+            p.report_changes([[name, "attr"], time.time()])
+        time.sleep(0.005)
+    chatty_thread.join()
+    p.stop()
+    latencies = []
+    for q in quiet_queues:
+        latencies += q.latencies
+    return np.array(latencies) * 1000
+
+
+class RecordingBlock(FakeBlock):
+    """Block that records how long ago each request it handles was sent"""
+
+    def __init__(self):
+        self.latencies = []
+
+    def handle_request(self, request):
+        self.latencies.append(time.time() - request.context)
+
+
+def measure_request_latency(request_cls, endpoint):
+    p = Process("proc", SyncFactory("sched"))
+    block = RecordingBlock()
+    p._handle_block_add(BlockAdd(block, "block", None))
+    q = LatencyQueue()
+    request = Subscribe(None, q, ["block", "attr"], delta=True)
+    p.q.put(request)
+    p.start()
+    for _ in range(ABORT_REPEATS):
+        for _ in range(BACKLOG_CHANGES):
+            p.report_changes([["block", "attr"], None])
+        # Use the context to carry the send time
+        p.q.put(request_cls(time.time(), None, ["block", endpoint]))
+        # Let the backlog drain before the next one
+        while p.q.qsize():
+            time.sleep(0.01)
+    p.stop()
+    return np.array(block.latencies) * 1000
+
+
+class BenchmarkProcessDispatch(unittest.TestCase):
+
+    def test_change_to_subscriber_latency(self):
+        print("")
+        print("Quiet block change->subscriber latency with %d blocks, "
+              "%d changes on one chatty block" % (NUM_BLOCKS, CHATTY_CHANGES))
+        for dispatch_shards in (0, 1, 4, 8):
+            latencies = measure_latency(dispatch_shards)
+            print("dispatch_shards=%d: median %.2fms, 99%% %.2fms, max %.2fms"
+                  % (dispatch_shards, np.median(latencies),
+                     np.percentile(latencies, 99), latencies.max()))
+
+    def test_abort_latency(self):
+        print("")
+        print("Request->block latency behind %d queued changes"
+              % BACKLOG_CHANGES)
+        for request_cls, endpoint in (
+                (Post, "abort"), (Post, "configure"), (Put, "attr")):
+            latencies = measure_request_latency(request_cls, endpoint)
+            print("%s %s: median %.2fms, 99%% %.2fms, max %.2fms"
+                  % (request_cls.__name__, endpoint, np.median(latencies),
+                     np.percentile(latencies, 99), latencies.max()))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import unittest
+
+import numpy as np
+
+# This needs the real pvaccess, so don't use setup_malcolm_paths as it would
+# mock it out
+try:
+    import pvaccess
+except ImportError:
+    pvaccess = None
+else:
+    from malcolm.comms.pva.pvautil import PvaUtil
+
+
+# Benchmarks for passing numpy arrays to and from pvaccess. Run them directly
+# with
+#   python tests/benchmarks/benchmark_pvautil.py
+
+SIZES = (100000, 1000000)
+REPEATS = 10
+
+
+def best_of(function, *args):
+    times = []
+    for _ in range(REPEATS):
+        start = time.time()
+        function(*args)
+        times.append(time.time() - start)
+    return min(times) * 1000
+
+
+def to_lists(pv):
+    pv.useNumPyArrays = False
+    return pv.toDict(True)
+
+
+@unittest.skipIf(pvaccess is None, "pvaccess not available")
+class BenchmarkNumpyArrays(unittest.TestCase):
+
+    def setUp(self):
+        self.lists = PvaUtil()
+        self.lists.numpy_arrays = False
+        self.arrays = PvaUtil()
+
+    def make_value(self, size):
+        return {"typeid": "epics:nt/NTScalarArray:1.0",
+                "value": np.arange(size, dtype=np.float64)}
+
+    def test_set(self):
+        print("")
+        if not self.arrays.numpy_arrays:
+            print("pvaccess was built without NumPy support")
+            return
+        for size in SIZES:
+            value = self.make_value(size)
+            print("%d float64 to PvObject: lists %.2fms, numpy %.2fms" % (
+                size, best_of(self.lists.dict_to_pv_object, value),
+                best_of(self.arrays.dict_to_pv_object, value)))
+
+    def test_to_dict(self):
+        print("")
+        if not self.arrays.numpy_arrays:
+            print("pvaccess was built without NumPy support")
+            return
+        for size in SIZES:
+            pv = self.arrays.dict_to_pv_object(self.make_value(size))
+            print("%d float64 from PvObject: lists %.2fms, numpy %.2fms" % (
+                size, best_of(to_lists, pv),
+                best_of(self.arrays.pv_object_to_dict, pv)))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
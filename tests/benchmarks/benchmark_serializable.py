@@ -0,0 +1,143 @@
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import setup_malcolm_paths
+
+import unittest
+
+# module imports
+from malcolm.compat import OrderedDict
+from malcolm.core import Block
+from malcolm.core.monitorable import serialize_shared
+from malcolm.core.serializable import Serializable, check_camel_case
+from malcolm.core.vmetas import NumberMeta, StringMeta, ChoiceMeta
+
+
+# Benchmarks for Block serialization. Run them directly with
+#   python tests/benchmarks/benchmark_serializable.py
+
+NUM_ATTRIBUTES = 100
+NUM_BLOCK_SERIALIZATIONS = 200
+NUM_ATTRIBUTE_SERIALIZATIONS = 50000
+NUM_SET_VALUES = 50000
+
+
+class NullProcess(object):
+
+    def report_changes(self, *changes):
+        pass
+
+
+def generic_serialize(o):
+    # How every object was serialized before to_dict() was made per class and
+    # cached, checking camelCase on every call
+    if isinstance(o, Serializable):
+        d = OrderedDict()
+        d["typeid"] = o.typeid
+        for endpoint in o:
+            check_camel_case(endpoint)
+            d[endpoint] = generic_serialize(o._endpoint_data[endpoint])
+        return d
+    elif isinstance(o, dict):
+        d = OrderedDict()
+        for k, v in o.items():
+            d[k] = generic_serialize(v)
+        return d
+    else:
+        return o
+
+
+def compiled_serialize(o):
+    # Serialize with the to_dict() made per class, but without the cache
+    if isinstance(o, Serializable):
+        return o.serialize_endpoints(compiled_serialize)
+    elif isinstance(o, dict):
+        d = OrderedDict()
+        for k, v in o.items():
+            d[k] = compiled_serialize(v)
+        return d
+    else:
+        return o
+
+
+def make_block():
+    children = {}
+    for i in range(NUM_ATTRIBUTES):
+        if i % 3 == 0:
+            meta = NumberMeta("float64", "Number %d" % i, ["widget:textinput"])
+        elif i % 3 == 1:
+            meta = StringMeta("String %d" % i, ["widget:textupdate"])
+        else:
+            meta = ChoiceMeta("Choice %d" % i, ["a", "b", "c"])
+        children["attr%d" % i] = meta.make_attribute()
+    b = Block()
+    b.replace_endpoints(children)
+    return b
+
+
+class BenchmarkSerializable(unittest.TestCase):
+
+    def setUp(self):
+        self.b = make_block()
+
+    def test_block_to_dict(self):
+        start = time.time()
+        for _ in range(NUM_BLOCK_SERIALIZATIONS):
+            serialize_shared(self.b)
+        end = time.time()
+        print("")
+        print("%d attribute Block: %.2fms per serialization" % (
+            NUM_ATTRIBUTES,
+            (end - start) * 1e3 / NUM_BLOCK_SERIALIZATIONS))
+
+    def test_uncached_block_to_dict(self):
+        self.assertEqual(generic_serialize(self.b), compiled_serialize(self.b))
+        print("")
+        for name, serialize in (("generic", generic_serialize),
+                                ("per class", compiled_serialize)):
+            start = time.time()
+            for _ in range(NUM_BLOCK_SERIALIZATIONS):
+                serialize(self.b)
+            end = time.time()
+            print("%d attribute Block: %.2fms per uncached serialization with "
+                  "the %s to_dict()" % (
+                    NUM_ATTRIBUTES,
+                    (end - start) * 1e3 / NUM_BLOCK_SERIALIZATIONS, name))
+
+    def test_changed_block_to_dict(self):
+        attr = self.b["attr0"]
+        start = time.time()
+        for i in range(NUM_BLOCK_SERIALIZATIONS):
+            attr.set_value(i)
+            serialize_shared(self.b)
+        end = time.time()
+        print("")
+        print("%d attribute Block: %.2fms per serialization after one "
+              "attribute value change" % (
+                NUM_ATTRIBUTES,
+                (end - start) * 1e3 / NUM_BLOCK_SERIALIZATIONS))
+
+    def test_attribute_to_dict(self):
+        attr = self.b["attr0"]
+        start = time.time()
+        for _ in range(NUM_ATTRIBUTE_SERIALIZATIONS):
+            serialize_shared(attr)
+        end = time.time()
+        print("")
+        print("%.2fus per NumberMeta Attribute serialization" % (
+            (end - start) * 1e6 / NUM_ATTRIBUTE_SERIALIZATIONS))
+
+    def test_set_value(self):
+        self.b.set_process_path(NullProcess(), ["block"])
+        attr = self.b["attr0"]
+        start = time.time()
+        for i in range(NUM_SET_VALUES):
+            attr.set_value(i)
+        end = time.time()
+        print("")
+        print("%.2fus per NumberMeta Attribute set_value()" % (
+            (end - start) * 1e6 / NUM_SET_VALUES))
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -4,14 +4,16 @@ sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
 import setup_malcolm_paths
 
 import unittest
-from mock import MagicMock
+from mock import MagicMock, patch
 
 from malcolm.core.response import Error, Return
-from malcolm.core.request import Post, Get, Put, Subscribe
+from malcolm.core.request import Post, Get, Put, Subscribe, Unsubscribe, \
+    PutMany, GetMany
 import pvaccess
 import numpy as np
 
-from malcolm.comms.pva.pvaclientcomms import PvaClientComms
+from malcolm.comms.pva.pvaclientcomms import PvaClientComms, \
+    PvaConnectionPool
 
 
 class TestPVAClientComms(unittest.TestCase):
@@ -60,6 +62,30 @@ class TestPVAClientComms(unittest.TestCase):
         self.ch.put.assert_called_once()
         self.PVA.send_to_caller.assert_called_once()
 
+    def test_send_put_many_to_server(self):
+        self.PVA = PvaClientComms(self.p)
+        self.PVA.send_to_caller = MagicMock()
+        request = PutMany(endpoint=["ep1"], values=dict(a=1, b="two"))
+        request.set_id(3)
+        self.PVA.send_to_server(request)
+        pvaccess.Channel.assert_called_once_with("ep1")
+        puts = sorted(self.ch.put.call_args_list, key=lambda c: c[0][1])
+        self.assertEqual([c[0] for c in puts],
+                         [(1, "a.value"), ("two", "b.value")])
+        response = self.PVA.send_to_caller.call_args[0][0]
+        self.assertIsInstance(response, Return)
+        self.assertEqual(response.id, 3)
+
+    def test_unsupported_request_gets_error(self):
+        self.PVA = PvaClientComms(self.p)
+        self.PVA.send_to_caller = MagicMock()
+        request = GetMany(paths=[["ep1", "a"], ["ep1", "b"]])
+        request.set_id(4)
+        self.PVA.send_to_server(request)
+        response = self.PVA.send_to_caller.call_args[0][0]
+        self.assertIsInstance(response, Error)
+        self.assertEqual(response.id, 4)
+
     def test_send_post_to_server(self):
         self.PVA = PvaClientComms(self.p)
         self.PVA.send_to_caller = MagicMock()
@@ -98,3 +124,79 @@ class TestPVAClientComms(unittest.TestCase):
         mon.monitor_update(mon_val)
         self.PVA.send_to_caller.assert_called_once()
 
+    def test_send_unsubscribe_to_server(self):
+        self.PVA = PvaClientComms(self.p)
+        self.PVA.send_to_caller = MagicMock()
+        request = Subscribe(endpoint=["ep1", "ep2"])
+        request.set_id(1)
+        self.PVA.send_to_server(request)
+        request = Unsubscribe()
+        request.set_id(1)
+        self.PVA.send_to_server(request)
+        self.ch.stopMonitor.assert_called_once_with()
+        self.ch.unsubscribe.assert_called_once_with("ep2")
+        self.assertEqual(self.PVA._monitors, {})
+        response = self.PVA.send_to_caller.call_args[0][0]
+        self.assertIsInstance(response, Return)
+        self.assertEqual(response.id, 1)
+        # Second time there is nothing to unsubscribe
+        self.PVA.send_to_server(request)
+        response = self.PVA.send_to_caller.call_args[0][0]
+        self.assertIsInstance(response, Error)
+
+    def test_channels_are_pooled(self):
+        self.PVA = PvaClientComms(self.p)
+        self.PVA.send_to_caller = MagicMock()
+        for i in range(10):
+            self.PVA.send_to_server(Put(endpoint=["ep1", "ep2"], value=i))
+        for i in range(10):
+            self.PVA.send_to_server(
+                Post(endpoint=["ep1", "method1"], parameters={"arg1": i}))
+        pvaccess.Channel.assert_called_once_with("ep1")
+        self.assertEqual(self.ch.put.call_count, 10)
+        self.assertEqual(pvaccess.RpcClient.call_count, 1)
+        self.assertEqual(self.rpc.invoke.call_count, 10)
+
+    def test_failed_channel_is_dropped(self):
+        self.PVA = PvaClientComms(self.p)
+        self.PVA.send_to_caller = MagicMock()
+        self.ch.put.side_effect = [ValueError("Timeout"), None]
+        request = Put(endpoint=["ep1", "ep2"], value=1)
+        self.PVA.send_to_server(request)
+        self.assertIsInstance(self.PVA.send_to_caller.call_args[0][0], Error)
+        self.PVA.send_to_server(request)
+        self.assertIsInstance(self.PVA.send_to_caller.call_args[0][0], Return)
+        self.assertEqual(pvaccess.Channel.call_count, 2)
+
+
+class TestPvaConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        pvaccess.Channel = MagicMock(side_effect=lambda name: MagicMock())
+        self.pool = PvaConnectionPool(idle_timeout=10)
+
+    def test_reconnects_disconnected_channel(self):
+        c = self.pool.get_channel("ep1")
+        self.assertIs(self.pool.get_channel("ep1"), c)
+        c.isConnected.return_value = False
+        c2 = self.pool.get_channel("ep1")
+        self.assertIsNot(c2, c)
+        self.assertEqual(pvaccess.Channel.call_count, 2)
+
+    @patch("malcolm.comms.pva.pvaclientcomms.time")
+    def test_idle_eviction(self, time_mock):
+        time_mock.time.return_value = 100
+        c1 = self.pool.get_channel("ep1")
+        time_mock.time.return_value = 105
+        c2 = self.pool.get_channel("ep2")
+        time_mock.time.return_value = 112
+        self.assertIs(self.pool.get_channel("ep2"), c2)
+        self.assertEqual(list(self.pool._connections), ["ep2"])
+        self.assertIsNot(self.pool.get_channel("ep1"), c1)
+
+    def test_evict_on_error(self):
+        self.pool.get_channel("ep1")
+        with self.assertRaises(ValueError):
+            with self.pool.evict_on_error("ep1"):
+                raise ValueError("Bad")
+        self.assertEqual(len(self.pool._connections), 0)
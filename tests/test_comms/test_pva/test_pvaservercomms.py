@@ -3,11 +3,15 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
 import setup_malcolm_paths
 
+import gc
+import threading
+import time
 import unittest
 from mock import Mock, MagicMock, patch, call
 from collections import OrderedDict
 
 from malcolm.core.response import Error, Return, Delta, Update
+from malcolm.core.request import Get, Subscribe, Unsubscribe
 from malcolm.core import StringArray
 
 import pvaccess
@@ -40,7 +44,7 @@ class PvTempObject(object):
     def set(self, dict_in):
         self._dict = dict_in
 
-from malcolm.comms.pva.pvaservercomms import PvaServerComms, PvaGetImplementation, PvaPutImplementation, PvaRpcImplementation, PvaEndpoint, PvaMonitorImplementation
+from malcolm.comms.pva.pvaservercomms import PvaServerComms, PvaGetImplementation, PvaPutImplementation, PvaRpcImplementation, PvaEndpoint, PvaMonitorImplementation, PvaBlockCache
 
 
 class TestPVAServerComms(unittest.TestCase):
@@ -57,6 +61,8 @@ class TestPVAServerComms(unittest.TestCase):
         pva_server_mock = MagicMock()
         server_mock = MagicMock()
         server_mock._get_unique_id = MagicMock(return_value=1)
+        server_mock.get_cached_pv_object.return_value = None
+        server_mock.add_block_monitor.return_value = None
         pvaccess.Endpoint.registerEndpointGet = MagicMock()
         pvaccess.Endpoint.registerEndpointPut = MagicMock()
         pvaccess.Endpoint.registerEndpointRPC = MagicMock()
@@ -174,6 +180,7 @@ class TestPVAServerComms(unittest.TestCase):
 
     def test_pva_rpc_implementation(self):
         server = MagicMock()
+        server.rpc_timeout = None
         request = {"method": "test_method"}
         pva = PvaRpcImplementation(1, request, "test.block", server)
         self.assertEqual(pva._id, 1)
@@ -186,41 +193,306 @@ class TestPVAServerComms(unittest.TestCase):
         self.assertEqual(pva.parse_variants(pre_parse), post_parse)
         response = Return(id_=2, value="test.value")
         pva.notify_reply(response)
+        server.dict_to_pv_object.assert_called_once_with("test.value")
         pv = MagicMock()
-        pva.execute(pv)
-        server.process.q.put.assert_called_once()
-        pv.toDict.assert_called_once()
-        pva._lock = MagicMock()
-        pva.check_lock()
-        pva._lock.acquire.assert_has_calls([call(False)])
+        self.assertEqual(
+            pva.execute(pv), server.dict_to_pv_object.return_value)
+        server.register_rpc.assert_called_once_with(1, pva)
+        server.send_to_process.assert_called_once()
+        server.pv_object_to_dict.assert_called_once_with(pv)
         pva._event = MagicMock()
         pva.wait_for_reply()
         pva._event.wait.assert_called_once()
 
+    def test_pva_rpc_reply_from_server_thread(self):
+        self.PVA = PvaServerComms(self.p)
+        self.PVA.send_to_process = MagicMock()
+        self.PVA.dict_to_pv_object = MagicMock()
+        pva = PvaRpcImplementation(
+            3, {"method": "configure"}, "test.block", self.PVA)
+        returned = []
+        t = threading.Thread(target=lambda: returned.append(
+            pva.execute(MagicMock())))
+        t.start()
+        while not self.PVA.send_to_process.called:
+            time.sleep(0.001)
+        post = self.PVA.send_to_process.call_args[0][0]
+        self.assertEqual(post.endpoint, ["test.block", "configure"])
+        self.assertEqual(self.PVA._rpcs, {3: pva})
+        self.PVA.send_to_client(Error(id_=3, message="Bad"))
+        t.join(1)
+        self.assertFalse(t.is_alive())
+        self.assertEqual(self.PVA._rpcs, {})
+        self.PVA.dict_to_pv_object.assert_called_once_with(
+            dict(typeid="malcolm:core/Error:1.0", message="Bad"))
+        self.assertEqual(returned, [self.PVA.dict_to_pv_object.return_value])
+
+    def test_pva_rpc_timeout(self):
+        self.PVA = PvaServerComms(self.p, dict(maxUpdateRate=0, rpcTimeout=0.01))
+        self.PVA.send_to_process = MagicMock()
+        self.PVA.dict_to_pv_object = MagicMock()
+        pva = PvaRpcImplementation(
+            3, {"method": "configure"}, "test.block", self.PVA)
+        self.assertEqual(
+            pva.execute(MagicMock()), self.PVA.dict_to_pv_object.return_value)
+        self.assertEqual(self.PVA._rpcs, {})
+        self.PVA.dict_to_pv_object.assert_called_once_with(dict(
+            typeid="malcolm:core/Error:1.0",
+            message="Timed out after 0.01s waiting for test.block.configure "
+                    "to return"))
+        # The late Return is dropped
+        self.PVA.send_to_client(Return(id_=3, value=None))
+        self.assertEqual(self.PVA.dict_to_pv_object.call_count, 1)
+
     def test_pva_monitor_implementation(self):
         request = MagicMock()
         request.toDict = MagicMock(return_value={"item1": {"item2": {}}})
         server = MagicMock()
         structure = MagicMock()
+        server.add_block_monitor.return_value = structure
         pva = PvaMonitorImplementation(1, request, "test.block", server)
         self.assertEqual(pva._id, 1)
         self.assertEqual(pva._block, "test.block")
         self.assertEqual(pva._request, request)
         self.assertEqual(pva._server, server)
+        self.assertEqual(pva.path, ("item1", "item2"))
         self.assertEqual(pva.get_block(), "test.block")
-        pva._pv_structure = structure
-        self.assertEqual(pva.getPVStructure(), structure)
         pva.mu = MagicMock()
-        pva.mu.update = MagicMock()
         self.assertEqual(pva.getUpdater(), pva.mu)
         pva.send_subscription()
-        server.send_to_process.assert_called_once()
-        pva.update([[["a", "b", "c"], "val1"], [["d", "e", "f"], "val2"]])
-        #pva.notify_updates()
-        pva.mu.update.assert_not_called()
-        pva._pv_structure.hasField = MagicMock(return_value=True)
-        pva.update([[["a", "b", "c"], "val3"], [["d", "e", "f"], "val4"]])
-        pva.mu.update.assert_called_once()
+        server.add_block_monitor.assert_called_once_with("test.block", pva)
+        server.send_to_process.assert_not_called()
+        self.assertEqual(pva.getPVStructure(), structure)
+        pva.notify_updates()
+        pva.mu.update.assert_called_once_with()
+
+    def test_pva_monitor_implementation_before_cache_ready(self):
+        request = MagicMock()
+        request.toDict = MagicMock(return_value={"item1": {"item2": {}}})
+        server = MagicMock()
+        server.add_block_monitor.return_value = None
+        pva = PvaMonitorImplementation(1, request, "test.block", server)
+        pva.wait_for_reply = MagicMock()
+        pva.send_subscription()
+        server.get_cached_pv_object.assert_not_called()
+        server.register_get.assert_called_once_with(1, pva)
+        request = server.send_to_process.call_args[0][0]
+        self.assertIsInstance(request, Get)
+        self.assertEqual(request.endpoint, ["test.block", "item1", "item2"])
+
+    def test_pva_monitor_implementation_throttled(self):
+        request = MagicMock()
+        request.toDict = MagicMock(return_value={
+            "field": {"attr": {}},
+            "record": {"_options": {"period": "0.1", "deadband": "2"}}})
+        server = MagicMock()
+        server.dict_to_pv_object.side_effect = lambda d: MagicMock(d=d)
+        server.value_for_pva_set.side_effect = lambda v: v
+        pva = PvaMonitorImplementation(1, request, "test.block", server)
+        self.assertEqual(pva.path, ("attr",))
+        self.assertEqual(pva.period, 0.1)
+        self.assertEqual(pva.deadband, 2.0)
+        pva.wait_for_reply = MagicMock()
+        pva.send_subscription()
+        server.add_block_monitor.assert_not_called()
+        server.register_monitor.assert_called_once_with(1, pva)
+        subscribe = server.send_to_process.call_args[0][0]
+        self.assertIsInstance(subscribe, Subscribe)
+        self.assertEqual(subscribe.endpoint, ["test.block", "attr"])
+        self.assertEqual(subscribe.delta, True)
+        self.assertEqual(subscribe.period, 0.1)
+        self.assertEqual(subscribe.deadband, 2.0)
+        # First Delta makes the structure
+        pva.update([[[], {"value": 1}]])
+        self.assertEqual(pva.getPVStructure().d, {"attr": {"value": 1}})
+        pva.mu = MagicMock()
+        pva.update([[["value"], 4]])
+        pva.getPVStructure().set.assert_called_once_with(
+            {"attr": {"value": 4}})
+        pva.mu.update.assert_called_once_with()
+
+    def test_pva_get_implementation_uses_cache(self):
+        server = MagicMock()
+        request = MagicMock()
+        request.toDict = MagicMock(
+            return_value={"field": {"attr": {"value": {}}}})
+        pva = PvaGetImplementation(1, request, "test.block", server)
+        pva.send_get_request()
+        server.get_cached_pv_object.assert_called_once_with(
+            "test.block", ["attr", "value"])
+        self.assertEqual(
+            pva.getPVStructure(), server.get_cached_pv_object.return_value)
+        server.register_get.assert_not_called()
+        server.send_to_process.assert_not_called()
+
+    def make_block_cache(self, min_period=0):
+        server = MagicMock()
+        server.dict_to_pv_object.side_effect = lambda d: MagicMock(d=d)
+        server.value_for_pva_set.side_effect = lambda v: v
+        block_cache = PvaBlockCache("name", "test.block", server, min_period)
+        block = OrderedDict(typeid="malcolm:core/Block:1.0")
+        block["attr"] = OrderedDict(typeid="epics:nt/NTScalar:1.0")
+        block["attr"]["value"] = 32
+        block["other"] = OrderedDict(typeid="epics:nt/NTScalar:1.0")
+        block["other"]["value"] = "foo"
+        return block_cache, block
+
+    def test_block_cache_not_ready(self):
+        block_cache, block = self.make_block_cache()
+        self.assertIsNone(block_cache.get_pv_object(["attr"]))
+        block_cache.apply_changes([[[], block]])
+        pv = block_cache.get_pv_object(["attr"])
+        self.assertEqual(pv.d, {"attr": block["attr"]})
+
+    def test_block_cache_value_change_replaces(self):
+        block_cache, block = self.make_block_cache()
+        block_cache.apply_changes([[[], block]])
+        pv = block_cache.get_pv_object(["attr"])
+        self.assertIs(block_cache.get_pv_object(["attr"]), pv)
+        block_cache.apply_changes([[["attr", "value"], 33]])
+        # Clients may still be sending the one they got, so it isn't touched
+        pv.__setitem__.assert_not_called()
+        pv.set.assert_not_called()
+        pv2 = block_cache.get_pv_object(["attr"])
+        self.assertIsNot(pv2, pv)
+        self.assertEqual(pv2.d["attr"]["value"], 33)
+
+    def test_block_cache_unrelated_change_ignored(self):
+        block_cache, block = self.make_block_cache()
+        block_cache.apply_changes([[[], block]])
+        pv = block_cache.get_pv_object(["attr"])
+        block_cache.apply_changes([[["other", "value"], "bar"]])
+        pv.__setitem__.assert_not_called()
+        self.assertIs(block_cache.get_pv_object(["attr"]), pv)
+
+    def test_block_cache_structure_change_rebuilds(self):
+        block_cache, block = self.make_block_cache()
+        block_cache.apply_changes([[[], block]])
+        pv = block_cache.get_pv_object(["attr"])
+        new_attr = OrderedDict(typeid="epics:nt/NTScalar:1.0")
+        new_attr["value"] = 1.5
+        block_cache.apply_changes([[["attr"], new_attr]])
+        pv2 = block_cache.get_pv_object(["attr"])
+        self.assertIsNot(pv2, pv)
+        self.assertEqual(pv2.d, {"attr": new_attr})
+
+    def test_block_cache_missing_field_rebuilds(self):
+        block_cache, block = self.make_block_cache()
+        block_cache.apply_changes([[[], block]])
+        pv = block_cache.get_pv_object([])
+        pv.hasField.return_value = False
+        block_cache.apply_changes([[["attr", "value"], 33]])
+        pv2 = block_cache.get_pv_object([])
+        self.assertIsNot(pv2, pv)
+        self.assertEqual(pv2.d["attr"]["value"], 33)
+
+    def test_block_cache_close(self):
+        block_cache, block = self.make_block_cache()
+        block_cache.apply_changes([[[], block]])
+        block_cache.get_pv_object(["attr"])
+        monitor = self.make_monitor(block_cache, ("attr",))
+        block_cache.close()
+        self.assertEqual(block_cache._pv_objects, {})
+        self.assertEqual(len(block_cache._monitors), 0)
+        self.assertIsNone(block_cache.get_pv_object(["attr"]))
+
+    def test_block_cache_drops_dead_monitors(self):
+        block_cache, block = self.make_block_cache()
+        block_cache.apply_changes([[[], block]])
+        monitor = self.make_monitor(block_cache, ("attr",))
+        self.assertEqual(len(block_cache._monitors), 1)
+        del monitor
+        gc.collect()
+        self.assertEqual(len(block_cache._monitors), 0)
+
+    def make_monitor(self, block_cache, path):
+        monitor = MagicMock(path=path)
+        monitor.getPVStructure.return_value = block_cache.add_monitor(monitor)
+        return monitor
+
+    def test_block_cache_monitors_share_subscription(self):
+        block_cache, block = self.make_block_cache()
+        block_cache.apply_changes([[[], block]])
+        m1 = self.make_monitor(block_cache, ("attr",))
+        m2 = self.make_monitor(block_cache, ("other",))
+        m3 = self.make_monitor(block_cache, ("attr", "value"))
+        self.assertEqual(m1.getPVStructure().d, {"attr": block["attr"]})
+        self.assertIsNot(m1.getPVStructure(), m3.getPVStructure())
+        m1.getPVStructure().hasField.return_value = True
+        m3.getPVStructure().hasField.return_value = True
+        block_cache.apply_changes([[["attr", "value"], 33]])
+        m1.getPVStructure().__setitem__.assert_called_once_with(
+            "attr.value", 33)
+        m1.notify_updates.assert_called_once_with()
+        m2.notify_updates.assert_not_called()
+        # Monitoring the value itself, so have to set the whole structure
+        m3.getPVStructure().set.assert_called_once_with(
+            {"attr": {"value": 33}})
+        m3.notify_updates.assert_called_once_with()
+
+    def test_block_cache_monitor_before_ready(self):
+        block_cache, block = self.make_block_cache()
+        monitor = MagicMock(path=("attr",))
+        self.assertIsNone(block_cache.add_monitor(monitor))
+        block_cache.apply_changes([[[], block]])
+        monitor.getPVStructure().set.assert_called_once_with(
+            {"attr": block["attr"]})
+        monitor.notify_updates.assert_called_once_with()
+
+    @patch("malcolm.comms.pva.pvaservercomms.time")
+    def test_block_cache_monitor_rate_limited(self, time_mock):
+        time_mock.time.return_value = 100.0
+        block_cache, block = self.make_block_cache(min_period=0.1)
+        block_cache.apply_changes([[[], block]])
+        monitor = self.make_monitor(block_cache, ("attr",))
+        monitor.getPVStructure().hasField.return_value = True
+        # First change goes straight out
+        block_cache.apply_changes([[["attr", "value"], 33]])
+        monitor.notify_updates.assert_called_once_with()
+        monitor.reset_mock()
+        # Next ones are conflated until they are due
+        time_mock.time.return_value = 100.04
+        self.assertTrue(block_cache.apply_changes([[["attr", "value"], 34]]))
+        self.assertTrue(block_cache.apply_changes([[["attr", "value"], 35]]))
+        self.assertAlmostEqual(block_cache.flush_if_due(100.09), 100.1)
+        monitor.notify_updates.assert_not_called()
+        time_mock.time.return_value = 100.1
+        self.assertIsNone(block_cache.flush_if_due(100.1))
+        monitor.getPVStructure().__setitem__.assert_called_once_with(
+            "attr.value", 35)
+        monitor.notify_updates.assert_called_once_with()
+
+    @patch("malcolm.comms.pva.pvaservercomms.time")
+    def test_send_held_back(self, time_mock):
+        time_mock.time.return_value = 100.0
+        self.PVA = PvaServerComms(self.p)
+        cache_mock = MagicMock()
+        cache_mock.apply_changes.return_value = True
+        cache_mock.flush_if_due.return_value = 100.25
+        self.PVA._block_cache_ids[9] = cache_mock
+        self.assertIsNone(self.PVA.send_held_back())
+        self.PVA.send_to_client(Delta(id_=9, changes=[[["attr"], 1]]))
+        self.assertEqual(self.PVA.send_held_back(), 0.25)
+        cache_mock.flush_if_due.assert_called_once_with(100.0)
+        cache_mock.flush_if_due.return_value = None
+        self.assertIsNone(self.PVA.send_held_back())
+        self.assertEqual(self.PVA._held_back_caches, set())
+
+    def test_max_update_rate(self):
+        self.PVA = PvaServerComms(self.p)
+        self.assertEqual(self.PVA._min_update_period, 0.1)
+        self.PVA = PvaServerComms(self.p, dict(maxUpdateRate=20, rpcTimeout=0))
+        self.assertEqual(self.PVA._min_update_period, 0.05)
+        self.PVA = PvaServerComms(self.p, dict(maxUpdateRate=0, rpcTimeout=0))
+        self.assertEqual(self.PVA._min_update_period, 0)
+
+    def test_rpc_timeout(self):
+        self.PVA = PvaServerComms(self.p)
+        self.assertEqual(self.PVA.rpc_timeout, 300)
+        self.PVA = PvaServerComms(self.p, dict(maxUpdateRate=0, rpcTimeout=30))
+        self.assertEqual(self.PVA.rpc_timeout, 30)
+        self.PVA = PvaServerComms(self.p, dict(maxUpdateRate=0, rpcTimeout=0))
+        self.assertIsNone(self.PVA.rpc_timeout)
 
     def test_init(self):
         self.PVA = PvaServerComms(self.p)
@@ -328,11 +600,20 @@ class TestPVAServerComms(unittest.TestCase):
         mon_mock1.notify_reply.assert_has_calls([call(response1)])
         mon_mock2.notify_reply.assert_has_calls([call(response2)])
         # Delta
-        mon_mock3 = MagicMock()
-        self.PVA._monitors[9] = mon_mock3
+        cache_mock = MagicMock()
+        self.PVA._block_cache_ids[9] = cache_mock
         response3 = Delta(id_=9)
         self.PVA.send_to_client(response3)
-        mon_mock3.update.assert_has_calls([call(response3["changes"])])
+        cache_mock.apply_changes.assert_has_calls([call(response3["changes"])])
+        response4 = Delta(id_=7, changes=[[["value"], 1]])
+        self.PVA.send_to_client(response4)
+        mon_mock1.update.assert_called_once_with([[["value"], 1]])
+        # A Delta for a monitor that has gone stops its subscription
+        self.PVA.send_to_process = MagicMock()
+        self.PVA.send_to_client(Delta(id_=10, changes=[[["value"], 1]]))
+        unsubscribe = self.PVA.send_to_process.call_args[0][0]
+        self.assertIsInstance(unsubscribe, Unsubscribe)
+        self.assertEqual(unsubscribe.id, 10)
         # Updates
         self.PVA._update_local_block_list = MagicMock()
         self.PVA._update_remote_block_list = MagicMock()
@@ -343,6 +624,24 @@ class TestPVAServerComms(unittest.TestCase):
         self.PVA.send_to_client(response5)
         self.PVA._update_remote_block_list.assert_called_once()
 
+    def test_block_cache_subscription(self):
+        self.PVA = PvaServerComms(self.p)
+        self.PVA.send_to_process = MagicMock()
+        self.PVA._add_new_pva_channel("block1")
+        request = self.PVA.send_to_process.call_args[0][0]
+        self.assertIsInstance(request, Subscribe)
+        self.assertEqual(request.endpoint, ["block1"])
+        self.assertEqual(request.delta, True)
+        block_cache = self.PVA._block_caches["block1"]
+        block_cache.apply_changes = MagicMock()
+        self.PVA.send_to_client(Delta(request.id, changes=[[[], {}]]))
+        block_cache.apply_changes.assert_called_once_with([[[], {}]])
+        self.PVA._remove_block_cache("block1")
+        request = self.PVA.send_to_process.call_args[0][0]
+        self.assertIsInstance(request, Unsubscribe)
+        self.assertEqual(self.PVA._block_caches, {})
+        self.assertEqual(self.PVA._block_cache_ids, {})
+
     def test_create_pva_server(self):
         self.PVA = PvaServerComms(self.p)
         pvaccess.PvaServer.reset_mock()
@@ -373,6 +672,14 @@ class TestPVAServerComms(unittest.TestCase):
         self.PVA.register_rpc(1, self.rpc)
         self.assertEqual(self.PVA._rpcs, {1: self.rpc})
 
+    def test_remove_rpc(self):
+        self.PVA = PvaServerComms(self.p)
+        self.rpc = MagicMock()
+        self.PVA.register_rpc(1, self.rpc)
+        self.assertEqual(self.PVA.remove_rpc(1), self.rpc)
+        self.assertIsNone(self.PVA.remove_rpc(1))
+        self.assertEqual(self.PVA._rpcs, {})
+
     def test_register_monitor(self):
         self.PVA = PvaServerComms(self.p)
         self.mon = MagicMock()
@@ -407,25 +714,6 @@ class TestPVAServerComms(unittest.TestCase):
         self.PVA.remove_put(1)
         self.assertEqual(self.PVA._puts, {2: put2})
 
-    def test_register_dead_rpc(self):
-        self.PVA = PvaServerComms(self.p)
-        self.PVA.register_dead_rpc(1)
-        self.PVA.register_dead_rpc(2)
-        self.assertEqual(self.PVA._dead_rpcs, [1, 2])
-
-    def test_purge_rpcs(self):
-        self.PVA = PvaServerComms(self.p)
-        self.rpc1 = MagicMock()
-        self.rpc2 = MagicMock()
-        self.PVA.register_rpc(1, self.rpc1)
-        self.PVA.register_rpc(2, self.rpc2)
-        self.assertEqual(self.PVA._rpcs, {1: self.rpc1, 2: self.rpc2})
-        self.PVA.register_dead_rpc(1)
-        self.assertEqual(self.PVA._dead_rpcs, [1])
-        self.PVA.purge_rpcs()
-        self.assertEqual(self.PVA._rpcs, {2: self.rpc2})
-        self.assertEqual(self.PVA._dead_rpcs, [])
-
     def test_dict_to_stucture(self):
         self.PVA = PvaServerComms(self.p)
         val_dict = OrderedDict()
@@ -474,6 +762,7 @@ class TestPVAServerComms(unittest.TestCase):
 
     def test_dict_to_pv(self):
         self.PVA = PvaServerComms(self.p)
+        self.PVA.numpy_arrays = False
         val_dict = OrderedDict()
         val_dict["typeid"] = "type1"
         val_dict["val1"] = StringArray('', '')
@@ -493,6 +782,34 @@ class TestPVAServerComms(unittest.TestCase):
         self.assertEqual(actual._dict["val5"][1]._dict, dict(b=44))
         self.assertEqual(actual._dict["val6"], "s")
 
+    def test_dict_to_pv_numpy_arrays(self):
+        self.PVA = PvaServerComms(self.p)
+        self.PVA.numpy_arrays = True
+        val_dict = OrderedDict()
+        val_dict["typeid"] = "type1"
+        val_dict["val1"] = np.arange(100000, dtype=np.float64)
+        # Non contiguous, so must be copied
+        val_dict["val2"] = np.arange(10, dtype=np.int32)[::2]
+        val_dict["val3"] = StringArray("a", "b")
+        actual = self.PVA.dict_to_pv_object(val_dict)
+        self.assertIs(actual._dict["val1"], val_dict["val1"])
+        self.assertTrue(actual._dict["val2"].flags.c_contiguous)
+        np.testing.assert_array_equal(actual._dict["val2"], [0, 2, 4, 6, 8])
+        self.assertEqual(actual._dict["val3"], ["a", "b"])
+
+    def test_pv_object_to_dict(self):
+        self.PVA = PvaServerComms(self.p)
+        pv = MagicMock()
+        self.PVA.numpy_arrays = True
+        self.assertEqual(self.PVA.pv_object_to_dict(pv),
+                         pv.toDict.return_value)
+        pv.toDict.assert_called_once_with(True)
+        self.assertEqual(pv.useNumPyArrays, True)
+        pv = MagicMock(spec=["toDict"])
+        self.PVA.numpy_arrays = False
+        self.PVA.pv_object_to_dict(pv)
+        self.assertFalse(hasattr(pv, "useNumPyArrays"))
+
 
 
 
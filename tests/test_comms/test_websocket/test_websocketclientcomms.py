@@ -3,20 +3,26 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
 import setup_malcolm_paths
 
+import json
 import unittest
 from mock import MagicMock, patch, call
 
 from malcolm.comms.websocket import WebsocketClientComms
+from malcolm.comms.websocket.websocketservercomms import JSON_SUBPROTOCOL, \
+    MSGPACK_SUBPROTOCOL, \
+    msgpack_encode, msgpack_decode
 from malcolm.core.response import Return
-from malcolm.core.request import Get
+from malcolm.core.request import Get, Subscribe
+from malcolm.core.spawnable import Spawnable
 
-params = dict(hostname="test", port=1)
+params = dict(hostname="test", port=1, msgpack=False)
 
 
 class TestWSClientComms(unittest.TestCase):
 
     def setUp(self):
         self.p = MagicMock()
+        self.p.get_ioloop.return_value = None
 
     @patch('malcolm.comms.websocket.websocketclientcomms.IOLoop')
     def test_init(self, ioloop_mock):
@@ -71,7 +77,77 @@ class TestWSClientComms(unittest.TestCase):
         request.set_id(54)
         self.WS.send_to_server(request)
         self.WS.conn.write_message.assert_called_once_with(
-            '{"typeid": "malcolm:core/Get:1.0", "id": 54, "endpoint": ["block", "attr"]}')
+            '{"typeid": "malcolm:core/Get:1.0", "id": 54, "endpoint": ["block", "attr"]}',
+            binary=False)
+
+    @patch('malcolm.comms.websocket.websocketclientcomms.IOLoop')
+    def test_make_request_json(self, _):
+        self.WS = WebsocketClientComms(self.p, params)
+        request = self.WS.make_request()
+        self.assertEqual(request.url, "ws://test:1/ws")
+        self.assertEqual(
+            request.headers["Sec-WebSocket-Protocol"], JSON_SUBPROTOCOL)
+
+    @unittest.skipIf(msgpack_encode is None, "msgpack not available")
+    @patch('malcolm.comms.websocket.websocketclientcomms.IOLoop')
+    def test_make_request_msgpack(self, _):
+        self.WS = WebsocketClientComms(
+            self.p, dict(hostname="test", port=1, msgpack=True))
+        request = self.WS.make_request()
+        self.assertEqual(
+            request.headers["Sec-WebSocket-Protocol"],
+            "%s, %s" % (MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL))
+
+    @patch('malcolm.comms.websocket.websocketclientcomms.IOLoop')
+    def test_set_subprotocol(self, _):
+        self.WS = WebsocketClientComms(
+            self.p, dict(hostname="test", port=1, msgpack=True))
+        # A version 1 server
+        self.WS.set_subprotocol(None)
+        self.assertFalse(self.WS.binary)
+        self.assertFalse(self.WS.put_many_supported)
+        # A newer server and a JSON client still get the new requests
+        self.WS.set_subprotocol(JSON_SUBPROTOCOL)
+        self.assertFalse(self.WS.binary)
+        self.assertTrue(self.WS.put_many_supported)
+        self.WS.set_subprotocol(MSGPACK_SUBPROTOCOL)
+        self.assertEqual(self.WS.binary, self.WS.ask_binary)
+        self.assertTrue(self.WS.put_many_supported)
+
+    @unittest.skipIf(msgpack_encode is None, "msgpack not available")
+    @patch('malcolm.comms.websocket.websocketclientcomms.IOLoop')
+    def test_json_delta_subscribe_leaves_out_since(self, _):
+        self.WS = WebsocketClientComms(self.p, params)
+        self.WS.set_subprotocol(JSON_SUBPROTOCOL)
+        self.WS.conn = MagicMock()
+        self.WS.q = MagicMock()
+        self.WS.q.get_many.side_effect = [
+            [Subscribe(None, None, ["block"], delta=True), Spawnable.STOP]]
+        self.WS.send_loop()
+        message = self.WS.conn.write_message.call_args[0][0]
+        # Versions come from the protocol, not since
+        self.assertNotIn("since", json.loads(message))
+        self.assertEqual(
+            self.WS.conn.write_message.call_args[1], dict(binary=False))
+
+    @patch('malcolm.comms.websocket.websocketclientcomms.IOLoop')
+    def test_msgpack_send_and_receive(self, _):
+        self.WS = WebsocketClientComms(
+            self.p, dict(hostname="test", port=1, msgpack=True))
+        self.WS.binary = True
+        self.WS.conn = MagicMock()
+        request = Get(None, None, ["block", "attr"])
+        request.set_id(54)
+        self.WS.send_to_server(request)
+        message = self.WS.conn.write_message.call_args[0][0]
+        self.assertEqual(msgpack_decode(message)["endpoint"], ["block", "attr"])
+        self.assertEqual(
+            self.WS.conn.write_message.call_args[1], dict(binary=True))
+        caller = MagicMock()
+        self.WS.requests[11] = caller
+        self.WS.on_message(msgpack_encode(Return(11, None, "me")))
+        actual = caller.response_queue.put.call_args[0][0]
+        self.assertEqual(actual.value, "me")
 
     @patch('malcolm.comms.websocket.websocketclientcomms.IOLoop')
     def test_start(self, ioloop_mock):
@@ -98,6 +174,23 @@ class TestWSClientComms(unittest.TestCase):
             ioloop_mock.current().stop)
         self.WS.process.spawn.return_value.assert_not_called()
 
+    @patch('malcolm.comms.websocket.websocketclientcomms.IOLoop')
+    def test_shared_loop(self, ioloop_mock):
+        loop_mock = self.p.get_ioloop.return_value = MagicMock()
+        self.WS = WebsocketClientComms(self.p, params)
+        self.assertEqual(loop_mock, self.WS.loop)
+        ioloop_mock.current.assert_not_called()
+        self.WS.process.spawn = MagicMock()
+        self.WS.start()
+        self.assertEqual(
+            [call(self.WS.send_loop),
+             call(loop_mock.add_callback, self.WS.recv_loop)],
+            self.WS.process.spawn.call_args_list)
+        loop_mock.reset_mock()
+        self.WS.stop()
+        loop_mock.add_callback.assert_called_once_with(
+            self.WS.close_connection)
+
     @patch('malcolm.comms.websocket.websocketclientcomms.IOLoop')
     def test_wait(self, _):
         spawnable_mocks = [MagicMock(), MagicMock()]
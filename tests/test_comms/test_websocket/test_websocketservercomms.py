@@ -4,14 +4,17 @@ sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
 import setup_malcolm_paths
 
 import unittest
+import numpy as np
 from mock import MagicMock, patch, call
 
 from malcolm.compat import OrderedDict
 from malcolm.comms.websocket import WebsocketServerComms
 from malcolm.comms.websocket.websocketservercomms import MalcWebSocketHandler,\
-        MalcBlockHandler
-from malcolm.core.request import Request, Get, Post
-from malcolm.core.response import Return, Error
+        MalcBlockHandler, MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL, \
+        msgpack_encode, msgpack_decode, SendQueue
+from malcolm.core.request import Request, Get, Post, Subscribe, GetMany, \
+    PutMany
+from malcolm.core.response import Return, Error, Delta, Update
 from malcolm.core import json_encode, json_decode
 
 
@@ -19,6 +22,7 @@ class TestWSServerComms(unittest.TestCase):
 
     def setUp(self):
         self.p = MagicMock()
+        self.p.get_ioloop.return_value = None
 
     @patch('malcolm.comms.websocket.websocketservercomms.HTTPServer')
     @patch('malcolm.comms.websocket.websocketservercomms.IOLoop')
@@ -62,6 +66,23 @@ class TestWSServerComms(unittest.TestCase):
                 loop_mock.add_callback.call_args_list)
         self.p.spawn.return_value.wait.assert_not_called()
 
+    @patch('malcolm.comms.websocket.websocketservercomms.HTTPServer')
+    @patch('malcolm.comms.websocket.websocketservercomms.IOLoop')
+    def test_shared_loop(self, ioloop_mock, server_mock):
+        loop_mock = self.p.get_ioloop.return_value = MagicMock()
+        self.p.spawn = MagicMock()
+        self.WS = WebsocketServerComms(self.p, dict(port=1))
+        self.assertEqual(loop_mock, self.WS.loop)
+        ioloop_mock.current.assert_not_called()
+        self.WS.server.listen.assert_not_called()
+        self.WS.start()
+        self.assertEqual(
+            [call(self.WS.send_loop),
+             call(loop_mock.add_callback, self.WS.server.listen, 1)],
+            self.p.spawn.call_args_list)
+        self.WS.stop()
+        loop_mock.add_callback.assert_called_once_with(self.WS.server.stop)
+
     @patch('malcolm.comms.websocket.websocketservercomms.HTTPServer')
     @patch('malcolm.comms.websocket.websocketservercomms.IOLoop')
     def test_wait(self, ioloop_mock, server_mock):
@@ -93,6 +114,49 @@ class TestWSServerComms(unittest.TestCase):
         actual = MWSH.servercomms.on_request.call_args[0][0]
         self.assertEquals(actual.to_dict(), request.to_dict())
 
+    def test_MWSH_on_message_rate_limited_subscribe(self):
+        MWSH = MalcWebSocketHandler(MagicMock(), MagicMock())
+        MWSH.servercomms = MagicMock()
+        message = """{
+        "typeid": "malcolm:core/Subscribe:1.0",
+        "id": 55,
+        "endpoint": ["block", "arrayCounter", "value"],
+        "delta": true,
+        "period": 0.5,
+        "deadband": 10
+        }"""
+        MWSH.on_message(message)
+        actual = MWSH.servercomms.on_request.call_args[0][0]
+        self.assertIsInstance(actual, Subscribe)
+        self.assertEqual(actual.period, 0.5)
+        self.assertEqual(actual.deadband, 10.0)
+
+    @unittest.skipIf(msgpack_encode is None, "msgpack not available")
+    def test_MWSH_msgpack_negotiated(self):
+        MWSH = MalcWebSocketHandler(MagicMock(), MagicMock())
+        MWSH.servercomms = MagicMock()
+        self.assertEqual(
+            MWSH.select_subprotocol(["other", MSGPACK_SUBPROTOCOL]),
+            MSGPACK_SUBPROTOCOL)
+        self.assertTrue(MWSH.binary)
+        self.assertTrue(MWSH.versions)
+        request = Get(None, None, ["block", "attr"])
+        request.set_id(54)
+        MWSH.on_message(msgpack_encode(request))
+        actual = MWSH.servercomms.on_request.call_args[0][0]
+        self.assertEquals(actual.to_dict(), request.to_dict())
+
+    def test_MWSH_json_by_default(self):
+        MWSH = MalcWebSocketHandler(MagicMock(), MagicMock())
+        self.assertIsNone(MWSH.select_subprotocol(["other"]))
+        self.assertFalse(MWSH.binary)
+        self.assertFalse(MWSH.versions)
+        self.assertEqual(
+            MWSH.select_subprotocol(["other", JSON_SUBPROTOCOL]),
+            JSON_SUBPROTOCOL)
+        self.assertFalse(MWSH.binary)
+        self.assertTrue(MWSH.versions)
+
     @patch('malcolm.comms.websocket.websocketservercomms.HTTPServer')
     @patch('malcolm.comms.websocket.websocketservercomms.IOLoop')
     def test_on_request_with_process_name(self, _, _2):
@@ -101,15 +165,52 @@ class TestWSServerComms(unittest.TestCase):
         ws.on_request(request)
         self.p.q.put.assert_called_once_with(request)
         self.assertEqual(request.endpoint, [self.p.name, "blocks"])
+        request = GetMany(paths=[[".", "blocks"], ["block", "attr"]])
+        ws.on_request(request)
+        self.assertEqual(request.paths,
+                         [[self.p.name, "blocks"], ["block", "attr"]])
 
     @patch('malcolm.comms.websocket.websocketservercomms.HTTPServer.listen')
     @patch('malcolm.comms.websocket.websocketservercomms.IOLoop')
     def test_send_to_client(self, _, _2):
         ws = WebsocketServerComms(self.p, dict(port=1))
-        response = Return(11, MagicMock(spec=MalcWebSocketHandler), "me")
+        response = Return(
+            11, MagicMock(spec=MalcWebSocketHandler, binary=False), "me")
         ws._send_to_client(response)
         response.context.write_message.assert_called_once_with(
-            '{"typeid": "malcolm:core/Return:1.0", "id": 11, "value": "me"}')
+            '{"typeid": "malcolm:core/Return:1.0", "id": 11, "value": "me"}',
+            binary=False)
+
+    @patch('malcolm.comms.websocket.websocketservercomms.HTTPServer.listen')
+    @patch('malcolm.comms.websocket.websocketservercomms.IOLoop')
+    def test_send_to_client_delta_version(self, _, _2):
+        ws = WebsocketServerComms(self.p, dict(port=1))
+        for versions in (True, False):
+            response = Delta(11, MagicMock(
+                spec=MalcWebSocketHandler, binary=False, versions=versions),
+                [[["attr"], 1]], version=42)
+            ws._send_to_client(response)
+            d = json_decode(response.context.write_message.call_args[0][0])
+            # Only clients that speak our protocol version understand it
+            self.assertEqual("version" in d, versions)
+            self.assertEqual(d["changes"], [[["attr"], 1]])
+
+    @unittest.skipIf(msgpack_encode is None, "msgpack not available")
+    @patch('malcolm.comms.websocket.websocketservercomms.HTTPServer.listen')
+    @patch('malcolm.comms.websocket.websocketservercomms.IOLoop')
+    def test_send_to_client_msgpack(self, _, _2):
+        ws = WebsocketServerComms(self.p, dict(port=1))
+        value = np.arange(4, dtype=np.int32)
+        response = Return(
+            11, MagicMock(spec=MalcWebSocketHandler, binary=True), value)
+        ws._send_to_client(response)
+        message = response.context.write_message.call_args[0][0]
+        self.assertEqual(
+            response.context.write_message.call_args[1], dict(binary=True))
+        d = msgpack_decode(message)
+        self.assertEqual(d["typeid"], "malcolm:core/Return:1.0")
+        self.assertEqual(d["value"].dtype, np.int32)
+        self.assertEqual(list(d["value"]), [0, 1, 2, 3])
 
     @patch('malcolm.comms.websocket.websocketservercomms.HTTPServer.listen')
     @patch('malcolm.comms.websocket.websocketservercomms.IOLoop')
@@ -141,6 +242,114 @@ class TestWSServerComms(unittest.TestCase):
             500, "Unknown response %s" % type(response))
         response.context.write_error.assert_called_once_with(500)
 
+    @patch('malcolm.comms.websocket.websocketservercomms.HTTPServer.listen')
+    @patch('malcolm.comms.websocket.websocketservercomms.IOLoop')
+    def test_send_to_client_uses_send_queue(self, _, _2):
+        ws = WebsocketServerComms(self.p, dict(port=1))
+        handler = MagicMock(spec=MalcWebSocketHandler)
+        response = Return(11, handler, "me")
+        ws.send_to_client(response)
+        handler.send_queue.put.assert_called_once_with(response)
+        ws.loop.add_callback.assert_not_called()
+
+    @patch('malcolm.comms.websocket.websocketservercomms.HTTPServer.listen')
+    @patch('malcolm.comms.websocket.websocketservercomms.IOLoop')
+    def test_send_queue_open_close_and_stats(self, _, _2):
+        ws = WebsocketServerComms(self.p, dict(
+            port=1, highWaterMark=5, maxPending=50))
+        MWSH = MalcWebSocketHandler(MagicMock(), MagicMock())
+        MWSH.servercomms = ws
+        MWSH.open()
+        self.assertEqual(MWSH.send_queue.high_water_mark, 5)
+        self.assertEqual(MWSH.send_queue.max_pending, 50)
+        MWSH.send_queue.put(Return(1, MWSH))
+        self.assertEqual(list(ws.stats().items()), [
+            ("connections", 1), ("pending", 1), ("max_depth", 1),
+            ("sent", 0), ("merged", 0), ("dropped", 0)])
+        MWSH.on_close()
+        self.assertEqual(list(ws.stats().items()), [
+            ("connections", 0), ("pending", 0), ("max_depth", 0),
+            ("sent", 0), ("merged", 0), ("dropped", 1)])
+
+
+class TestSendQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.servercomms = MagicMock()
+        self.handler = MagicMock()
+        self.q = SendQueue(self.handler, self.servercomms, 3, 6)
+        self.written = []
+
+        def send_to_client(response):
+            self.written.append(response)
+            return self.future
+
+        self.servercomms._send_to_client.side_effect = send_to_client
+        self.future = None
+
+    def test_put_schedules_one_flush(self):
+        self.q.put(Return(1, self.handler))
+        self.q.put(Return(2, self.handler))
+        self.servercomms.loop.add_callback.assert_called_once_with(
+            self.q.flush)
+        self.q.flush()
+        self.assertEqual([r.id for r in self.written], [1, 2])
+        self.assertEqual(self.q.stats()["sent"], 2)
+        # Flushed, so next put schedules another
+        self.q.put(Return(3, self.handler))
+        self.assertEqual(self.servercomms.loop.add_callback.call_count, 2)
+
+    def test_waits_for_write_to_finish(self):
+        self.future = MagicMock()
+        self.future.done.return_value = False
+        self.q.put(Return(1, self.handler))
+        self.q.flush()
+        self.q.put(Return(2, self.handler))
+        # Write still in progress, so no new flush
+        self.servercomms.loop.add_callback.assert_called_once_with(
+            self.q.flush)
+        callback = self.future.add_done_callback.call_args[0][0]
+        callback(self.future)
+        self.assertEqual(self.servercomms.loop.add_callback.call_count, 2)
+
+    def test_merges_above_high_water_mark(self):
+        self.q.put(Delta(1, self.handler, [[["a"], 1]]))
+        self.q.put(Update(2, self.handler, "x"))
+        self.q.put(Delta(1, self.handler, [[["a"], 2]]))
+        # At high water mark, so merge with the last pending for each id
+        self.q.put(Delta(1, self.handler, [[["b"], 3]]))
+        self.q.put(Delta(1, self.handler, [[["a"], 4]]))
+        self.q.put(Update(2, self.handler, "y"))
+        self.q.put(Return(3, self.handler))
+        self.assertEqual(self.q.stats()["merged"], 3)
+        self.q.flush()
+        self.assertEqual([r.id for r in self.written], [1, 2, 1, 3])
+        self.assertEqual(self.written[0].changes, [[["a"], 1]])
+        self.assertEqual(self.written[1].value, "y")
+        self.assertEqual(self.written[2].changes, [[["b"], 3], [["a"], 4]])
+
+    def test_closes_at_max_pending(self):
+        self.q.put(Delta(0, self.handler, [[["a"], 0]]))
+        self.q.put(Update(1, self.handler, "x"))
+        self.q.put(Delta(0, self.handler, [[["a"], 1]]))
+        for i in range(3):
+            # Can't merge Returns
+            self.q.put(Return(i + 2, self.handler))
+        self.servercomms.notify_closed_connection.assert_not_called()
+        self.q.put(Return(7, self.handler))
+        self.servercomms.loop.add_callback.assert_called_with(
+            self.handler.close)
+        # Unsubscribed from each subscription once
+        self.assertEqual(
+            [c[0][0].id for c in
+             self.servercomms.notify_closed_connection.call_args_list],
+            [0, 1])
+        self.q.put(Return(8, self.handler))
+        self.assertEqual(self.q.stats()["dropped"], 8)
+        self.q.flush()
+        self.assertEqual(self.written, [])
+
+
 class TestMalcolmBlockHandler(unittest.TestCase):
 
     def test_get(self):
@@ -163,5 +372,28 @@ class TestMalcolmBlockHandler(unittest.TestCase):
         self.assertEqual({"test_json":12345}, request.parameters)
         self.assertIsNone(request.response_queue)
 
+    def test_get_many(self):
+        mbh = MalcBlockHandler(MagicMock(), MagicMock())
+        mbh.servercomms = MagicMock()
+        mbh.get_query_arguments = MagicMock(
+            return_value=["attr/value", "attr2"])
+        mbh.get("block")
+        mbh.get_query_arguments.assert_called_once_with("endpoint")
+        request = mbh.servercomms.on_request.call_args[0][0]
+        self.assertIsInstance(request, GetMany)
+        self.assertEqual(
+            [["block", "attr", "value"], ["block", "attr2"]], request.paths)
+
+    def test_put(self):
+        mbh = MalcBlockHandler(MagicMock(), MagicMock())
+        mbh.servercomms = MagicMock()
+        mbh.get_body_argument = MagicMock(return_value='{"attr": 1}')
+        mbh.put("block")
+        mbh.get_body_argument.assert_called_once_with("values")
+        request = mbh.servercomms.on_request.call_args[0][0]
+        self.assertIsInstance(request, PutMany)
+        self.assertEqual(["block"], request.endpoint)
+        self.assertEqual({"attr": 1}, request.values)
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -0,0 +1,106 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import setup_malcolm_paths
+
+import unittest
+from multiprocessing import TimeoutError
+from threading import current_thread
+
+# module imports
+from malcolm.compat import queue
+from malcolm.core.syncfactory import service_loop
+if sys.version_info >= (3, 5, 2):
+    import asyncio
+    from concurrent import futures
+    from malcolm.core.asynciosyncfactory import AsyncioSyncFactory
+else:
+    AsyncioSyncFactory = None
+
+
+class ServiceLoop(object):
+    """Records the items it gets and where it got them until it gets None"""
+
+    def __init__(self, q):
+        self.q = q
+        self.items = []
+        self.threads = set()
+        self.timeouts = 0
+
+    @service_loop
+    def loop(self, timeout):
+        return self._loop(timeout)
+
+    def _loop(self, timeout):
+        while True:
+            try:
+                items = yield self.q, timeout
+            except queue.Empty:
+                self.timeouts += 1
+                continue
+            self.threads.add(current_thread().name)
+            for item in items:
+                if item is None:
+                    return
+                self.items.append(item)
+
+
+@unittest.skipIf(AsyncioSyncFactory is None, "AsyncioSyncFactory needs Python 3.5.2 or later")
+class TestAsyncioSyncFactory(unittest.TestCase):
+
+    def setUp(self):
+        self.s = AsyncioSyncFactory("sched", request_workers=1, hook_workers=1)
+
+    def tearDown(self):
+        del self.s
+
+    def test_function_runs_in_pool(self):
+        r = self.s.spawn(sum, [1, 2])
+        self.assertEqual(r.get(timeout=1), 3)
+        self.assertEqual(self.s.pool.stats()["tasks_run"], 1)
+
+    def test_service_loop_runs_on_loop(self):
+        service = ServiceLoop(self.s.create_queue())
+        r = self.s.spawn(service.loop, None)
+        service.q.put(1)
+        service.q.put_many([2, 3, None])
+        self.assertIsNone(r.get(timeout=1))
+        self.assertTrue(r.successful())
+        self.assertEqual(service.items, [1, 2, 3])
+        self.assertEqual(service.threads, {"sched.loop"})
+        self.assertEqual(self.s.pool.stats()["tasks_run"], 0)
+
+    def test_service_loop_timeout(self):
+        service = ServiceLoop(self.s.create_queue())
+        r = self.s.spawn_hook(service.loop, 0.01)
+        self.assertRaises(TimeoutError, r.get, 0.05)
+        self.assertFalse(r.ready())
+        service.q.put(None)
+        self.assertIsNone(r.get(timeout=1))
+        self.assertEqual(service.items, [])
+        self.assertGreater(service.timeouts, 0)
+        self.assertEqual(self.s.hook_pool.stats()["tasks_run"], 0)
+
+    def test_service_loop_called_directly(self):
+        service = ServiceLoop(self.s.create_queue())
+        service.q.put_many([1, None])
+        service.loop(None)
+        self.assertEqual(service.items, [1])
+        self.assertEqual(service.threads, {current_thread().name})
+
+    def test_call_in_loop(self):
+        f = self.s.call_in_loop(asyncio.get_event_loop)
+        self.assertEqual(f.result(timeout=1), self.s.loop)
+
+    def test_ioloop_wraps_loop(self):
+        ioloop = self.s.get_ioloop()
+        self.assertIs(ioloop.asyncio_loop, self.s.loop)
+        self.assertIs(self.s.get_ioloop(), ioloop)
+        f = futures.Future()
+        ioloop.add_callback(
+            lambda: f.set_result(asyncio.get_event_loop()))
+        self.assertIs(f.result(timeout=1), self.s.loop)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
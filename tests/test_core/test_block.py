@@ -11,7 +11,7 @@ from mock import MagicMock, call, patch
 # module imports
 from malcolm.core import Block, Attribute
 from malcolm.core.vmetas import NumberMeta
-from malcolm.core.request import Put, Post
+from malcolm.core.request import Put, Post, PutMany
 from malcolm.core.response import Return, Error
 
 
@@ -80,6 +80,35 @@ class TestBlock(unittest.TestCase):
             child.handle_request.return_value.to_dict(), response.value)
         self.assertEquals(request.response_queue, calls[0][0][1])
 
+    def test_handle_put_many_request(self):
+        parent = MagicMock()
+        a = NumberMeta("int32").make_attribute()
+        b_attr = NumberMeta("int32").make_attribute()
+        func = MagicMock()
+        b = Block()
+        b.replace_endpoints(OrderedDict([("a", a), ("b", b_attr)]))
+        b.set_writeable_functions(dict(a=func, b=func))
+        b.set_process_path(parent, ("name",))
+        request = PutMany(MagicMock(), MagicMock(), ["name"],
+                          OrderedDict([("a", 1), ("b", 2)]))
+        b.handle_request(request)
+        self.assertEqual(func.call_args_list,
+                         [call(a.meta, 1), call(b_attr.meta, 2)])
+        response = parent.block_respond.call_args[0][0]
+        self.assertIsInstance(response, Return)
+
+    def test_handle_put_many_uses_put_many_function(self):
+        parent = MagicMock()
+        put_many = MagicMock(return_value=None)
+        b = Block()
+        b.set_writeable_functions({}, put_many)
+        b.set_process_path(parent, ("name",))
+        request = PutMany(MagicMock(), MagicMock(), ["name"], dict(a=1))
+        b.handle_request(request)
+        put_many.assert_called_once_with(dict(a=1))
+        response = parent.block_respond.call_args[0][0]
+        self.assertIsInstance(response, Return)
+
     def test_handle_request_fails(self):
         parent = MagicMock()
         child = MagicMock(spec=Attribute)
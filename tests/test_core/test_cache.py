@@ -11,7 +11,7 @@ import setup_malcolm_paths
 from mock import MagicMock
 
 # module imports
-from malcolm.core.cache import Cache
+from malcolm.core.cache import Cache, collapse_changes
 
 
 class TestProcess(unittest.TestCase):
@@ -51,5 +51,160 @@ class TestProcess(unittest.TestCase):
         walked = c.walk_path([1, 2, 3])
         self.assertEqual(walked, "end")
 
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.c = Cache()
+        self.c.apply_changes([["b"], {"a1": {"value": 1}, "a2": {"value": 2}}])
+
+    def test_earlier_snapshot_unchanged(self):
+        before = self.c.walk_path(["b"])
+        self.c.apply_changes([["b", "a1", "value"], 3], [["b", "a2"]])
+        self.assertEqual(before, {"a1": {"value": 1}, "a2": {"value": 2}})
+        self.assertEqual(self.c["b"], {"a1": {"value": 3}})
+
+    def test_unchanged_siblings_shared(self):
+        a2 = self.c["b"]["a2"]
+        self.c.apply_changes([["b", "a1", "value"], 3])
+        self.assertIs(self.c["b"]["a2"], a2)
+
+    def test_added_value_not_modified(self):
+        value = {"value": 4}
+        self.c.apply_changes([["b", "a3"], value], [["b", "a3", "value"], 5])
+        self.assertEqual(value, {"value": 4})
+        self.assertEqual(self.c["b"]["a3"], {"value": 5})
+
+    def test_batch_copies_path_once(self):
+        self.c.apply_changes([["b", "a1", "value"], 3])
+        b = self.c["b"]
+        self.c.apply_changes(
+            [["b", "a1", "value"], 4], [["b", "a2", "value"], 5])
+        self.assertIsNot(self.c["b"], b)
+        self.assertEqual(b["a1"], {"value": 3})
+        self.assertEqual(self.c["b"], {"a1": {"value": 4}, "a2": {"value": 5}})
+
+    def test_walk_root_is_snapshot(self):
+        before = self.c.walk_path([])
+        self.c.apply_changes([["c"], 1])
+        self.assertEqual(list(before), ["b"])
+
+
+class TestSubscriptions(unittest.TestCase):
+
+    def setUp(self):
+        self.c = Cache()
+        self.c.apply_changes([["block"], {"attr": {"value": 1}, "b": 2}])
+
+    def test_notify_relative_paths(self):
+        root = MagicMock()
+        block = MagicMock()
+        value = MagicMock()
+        self.c.add_subscriber(root, [])
+        self.c.add_subscriber(block, ["block"])
+        self.c.add_subscriber(value, ["block", "attr", "value"])
+        changes = self.c.apply_changes([["block", "attr"], {"value": 3}])
+        self.assertEqual(list(changes), [root, block, value])
+        self.assertEqual(changes[root], [[["block", "attr"], {"value": 3}]])
+        self.assertEqual(changes[block], [[["attr"], {"value": 3}]])
+        self.assertEqual(changes[value], [[[], 3]])
+
+    def test_unaffected_subscriber_not_notified(self):
+        b = MagicMock()
+        self.c.add_subscriber(b, ["block", "b"])
+        changes = self.c.apply_changes([["block", "attr", "value"], 4])
+        self.assertEqual(changes, {})
+
+    def test_missing_sub_path_not_notified(self):
+        value = MagicMock()
+        self.c.add_subscriber(value, ["block", "attr", "value"])
+        changes = self.c.apply_changes([["block"], {"b": 3}])
+        self.assertEqual(changes, {})
+
+    def test_remove_prunes_tree(self):
+        s1 = MagicMock()
+        s2 = MagicMock()
+        self.c.add_subscriber(s1, ["block", "attr", "value"])
+        self.c.add_subscriber(s2, ["block"])
+        self.c.remove_subscriber(s1, ["block", "attr", "value"])
+        leaf = self.c._subscription_tree.children["block"]
+        self.assertEqual(leaf.key, "block")
+        self.assertEqual(leaf.children, {})
+        self.assertEqual(list(leaf.subscriptions), [s2])
+        self.c.remove_subscriber(s2, ["block"])
+        self.assertEqual(self.c._subscription_tree.children, {})
+
+
+class TestChangesSince(unittest.TestCase):
+
+    def setUp(self):
+        self.c = Cache(history_length=3)
+        self.c.apply_changes([["block"], {"attr": {"value": 1}, "b": 2}])
+        self.start = self.c.version
+
+    def test_version_increments_per_batch(self):
+        self.c.apply_changes([["block", "b"], 3], [["block", "b"], 4])
+        self.assertEqual(self.c.version, self.start + 1)
+
+    def test_up_to_date(self):
+        self.assertEqual(self.c.changes_since(self.start, ["block"]), [])
+
+    def test_relative_changes(self):
+        self.c.apply_changes([["block", "attr", "value"], 2])
+        self.c.apply_changes([["block", "b"], 3])
+        self.c.apply_changes([["block", "attr", "value"], 4])
+        self.assertEqual(self.c.changes_since(self.start, ["block"]),
+                         [[["b"], 3], [["attr", "value"], 4]])
+        self.assertEqual(
+            self.c.changes_since(self.start, ["block", "attr"]),
+            [[["value"], 4]])
+        self.assertEqual(
+            self.c.changes_since(self.start + 2, ["block", "b"]), [])
+
+    def test_parent_replaced(self):
+        self.c.apply_changes([["block"], {"attr": {"value": 5}}])
+        self.assertEqual(
+            self.c.changes_since(self.start, ["block", "attr", "value"]),
+            [[[], 5]])
+        self.assertIsNone(self.c.changes_since(self.start, ["block", "b"]))
+
+    def test_deletion(self):
+        self.c.apply_changes([["block", "b"]])
+        self.assertEqual(self.c.changes_since(self.start, ["block"]),
+                         [[["b"]]])
+        self.assertIsNone(self.c.changes_since(self.start, ["block", "b"]))
+
+    def test_history_wrapped(self):
+        for i in range(3):
+            self.c.apply_changes([["block", "b"], i])
+        self.assertIsNone(self.c.changes_since(self.start - 1, ["block"]))
+        self.assertEqual(self.c.changes_since(self.start, ["block"]),
+                         [[["b"], 2]])
+
+    def test_unknown_version(self):
+        self.assertIsNone(self.c.changes_since(self.start + 1, ["block"]))
+        self.assertIsNone(Cache().changes_since(self.start - 1, ["block"]))
+
+
+class TestCollapseChanges(unittest.TestCase):
+
+    def test_overwritten_path_dropped(self):
+        changes = [[["a", "b"], 1], [["a", "c"], 2], [["a", "b"], 3]]
+        self.assertEqual(collapse_changes(changes),
+                         [[["a", "c"], 2], [["a", "b"], 3]])
+
+    def test_overwritten_parent_drops_children(self):
+        changes = [[["a", "b", "c"], 1], [["a", "b"], {"c": 2}],
+                   [["a", "b", "c"], 3]]
+        self.assertEqual(collapse_changes(changes),
+                         [[["a", "b"], {"c": 2}], [["a", "b", "c"], 3]])
+
+    def test_deletion_does_not_drop_addition(self):
+        changes = [[["a", "b"], 1], [["a", "b"]], [["a", "b"], 2]]
+        self.assertEqual(collapse_changes(changes), [[["a", "b"], 2]])
+        changes = [[["a", "b"], 1], [["a", "b"]]]
+        self.assertEqual(collapse_changes(changes), changes)
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
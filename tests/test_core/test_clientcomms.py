@@ -8,9 +8,10 @@ from collections import OrderedDict
 import unittest
 from mock import Mock, patch, call
 
-from malcolm.core.clientcomms import ClientComms
+from malcolm.core.clientcomms import ClientComms, RESUBSCRIBE
 from malcolm.core.syncfactory import SyncFactory
-from malcolm.core.response import Update
+from malcolm.core.response import Update, Delta
+from malcolm.core.request import Subscribe, Unsubscribe, Get
 
 
 class TestClientComms(unittest.TestCase):
@@ -35,7 +36,7 @@ class TestClientComms(unittest.TestCase):
         client.send_to_server = Mock(side_effect=Exception)
         request = Mock()
         request.to_dict = Mock(return_value = "<to_dict>")
-        client.q.get = Mock(side_effect = [request, client.STOP])
+        client.q.get_many = Mock(side_effect=[[request, client.STOP]])
         client.log_exception = Mock()
         client.send_loop()
         client.log_exception.assert_called_once_with(
@@ -49,7 +50,7 @@ class TestClientComms(unittest.TestCase):
             request.id = id_
         request.set_id.side_effect = f
         client.send_to_server = Mock()
-        client.q.get = Mock(side_effect = [request, client.STOP])
+        client.q.get_many = Mock(side_effect=[[request, client.STOP]])
         client.send_loop()
         expected = OrderedDict({1234 : request})
         self.assertEquals(expected, client.requests)
@@ -69,7 +70,7 @@ class TestClientComms(unittest.TestCase):
         client = ClientComms(Mock())
         client.send_to_server = Mock()
         request = Mock()
-        client.q.get = Mock(side_effect = [request, client.STOP])
+        client.q.get_many = Mock(side_effect=[[request, client.STOP]])
         client.log_exception = Mock()
         client.send_loop()
         client.send_to_server.assert_called_once_with(request)
@@ -81,11 +82,67 @@ class TestClientComms(unittest.TestCase):
         client.send_to_server = Mock()
         request_1 = Mock(id = None)
         request_2 = Mock(id = None)
-        client.q.get = Mock(side_effect = [request_1, request_2, client.STOP])
+        client.q.get_many = Mock(side_effect=[[request_1, request_2, client.STOP]])
         client.send_loop()
         request_1.set_id.assert_called_once_with(1234)
         request_2.set_id.assert_called_once_with(1235)
 
+    def test_unsubscribe_uses_subscribe_id(self):
+        client = ClientComms(Mock())
+        client._current_id = 1234
+        client.send_to_server = Mock()
+        q = Mock()
+        subscribe = Subscribe(None, q, ["block", "attr"])
+        subscribe.set_id(3)
+        get = Get(None, q, ["block", "attr"])
+        unsubscribe = Unsubscribe(None, q)
+        unsubscribe.set_id(3)
+        client.q.get_many = Mock(side_effect=[[subscribe, get, unsubscribe, client.STOP]])
+        client.send_loop()
+        self.assertEqual(subscribe.id, 1234)
+        self.assertEqual(get.id, 1235)
+        self.assertEqual(unsubscribe.id, 1234)
+        self.assertEqual(client.requests[1234], unsubscribe)
+        self.assertEqual(client._subscription_ids, {})
+
+    def test_resubscribe_since_last_version(self):
+        client = ClientComms(Mock())
+        client.send_to_server = Mock()
+        q = Mock()
+        delta = Subscribe(None, q, ["block"], delta=True)
+        delta.set_id(1)
+        update = Subscribe(None, q, ["block", "attr"])
+        update.set_id(2)
+        client.q.get_many = Mock(side_effect=[[delta, update, client.STOP]])
+        client.send_loop()
+        client.send_to_caller(Delta(delta.id, changes=[], version=42))
+        client.send_to_server.reset_mock()
+        client.q.put = Mock()
+        client.resubscribe()
+        # The work is done by send_loop so it doesn't race with it
+        client.send_to_server.assert_not_called()
+        client.q.get_many = Mock(
+            side_effect=[[client.q.put.call_args[0][0]], [client.STOP]])
+        client.send_loop()
+        self.assertEqual(client.send_to_server.call_args_list,
+                         [call(delta), call(update)])
+        self.assertEqual(delta.since, 42)
+        self.assertEqual(update.since, None)
+
+    def test_resubscribe_without_versions(self):
+        client = ClientComms(Mock())
+        client.send_to_server = Mock()
+        delta = Subscribe(None, Mock(), ["block"], delta=True)
+        client.q.get_many = Mock(side_effect=[[delta, client.STOP]])
+        client.send_loop()
+        self.assertEqual(delta.since, None)
+        # A server that doesn't send versions
+        client.send_to_caller(Delta(delta.id, changes=[]))
+        client.q.get_many = Mock(side_effect=[[RESUBSCRIBE], [client.STOP]])
+        client.send_loop()
+        self.assertEqual(client.send_to_server.call_count, 2)
+        self.assertEqual(delta.since, None)
+
     def test_send_to_caller(self):
         request = Mock(response_queue=Mock(), id_=1234)
         client = ClientComms(Mock())
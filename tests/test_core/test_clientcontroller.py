@@ -77,6 +77,41 @@ class TestClientController(unittest.TestCase):
         ret = self.b.greet(name="me")
         self.assertEqual(ret.greeting, "Hello me")
 
+    def test_put_many(self):
+        self.p.create_queue.side_effect = queue.Queue
+        def f(request):
+            request.respond_with_return()
+        self.comms.q.put.side_effect = f
+        self.comms.put_many_supported = True
+        self.b.put_many(dict(state="Ready", status="Ok"))
+        request = self.comms.q.put.call_args[0][0]
+        self.assertEqual(request.typeid, "malcolm:core/PutMany:1.0")
+        self.assertEqual(request.endpoint, ["blockname"])
+        self.assertEqual(request.values, dict(state="Ready", status="Ok"))
+
+    def test_put_many_falls_back_to_puts(self):
+        self.p.create_queue.side_effect = queue.Queue
+        def f(request):
+            request.respond_with_return()
+        self.comms.q.put.side_effect = f
+        self.comms.put_many_supported = False
+        self.b.put_many(OrderedDict([("state", "Ready"), ("status", "Ok")]))
+        requests = [c[0][0] for c in self.comms.q.put.call_args_list[1:]]
+        self.assertEqual([r.typeid for r in requests],
+                         ["malcolm:core/Put:1.0"] * 2)
+        self.assertEqual([r.endpoint for r in requests], [
+            ["blockname", "state", "value"], ["blockname", "status", "value"]])
+        self.assertEqual([r.value for r in requests], ["Ready", "Ok"])
+
+    def test_put_many_error(self):
+        self.p.create_queue.side_effect = queue.Queue
+        def f(request):
+            request.respond_with_error("Bad value")
+        self.comms.q.put.side_effect = f
+        self.comms.put_many_supported = False
+        with self.assertRaises(ValueError):
+            self.b.put_many(dict(state="Ready", status="Ok"))
+
     def test_put_update_response(self):
         m = MagicMock(spec=Attribute)
         self.b.replace_endpoints(dict(child=m))
@@ -6,12 +6,15 @@ import setup_malcolm_paths
 import unittest
 from mock import MagicMock, call, ANY
 
+from malcolm.compat import OrderedDict
+
 # logging
 # import logging
 # logging.basicConfig(level=logging.DEBUG)
 
 # module imports
 from malcolm.core.controller import Controller
+from malcolm.core.vmetas import NumberMeta
 
 
 class TestController(unittest.TestCase):
@@ -42,6 +45,38 @@ class TestController(unittest.TestCase):
         self.c.register_child_writeable(m, "Ready")
         self.assertEqual(self.c.children_writeable['Ready'][m], True)
 
+    def make_put_many_controller(self):
+        part = MagicMock()
+        part.name = "part"
+        part.method_metas = {}
+        self.attrs = {}
+        self.put_values = []
+        for name in ("a", "b", "c"):
+            attr = NumberMeta("int32").make_attribute()
+            self.attrs[name] = attr
+        part.create_attributes.return_value = [
+            (n, a, self.put_values.append) for n, a in
+            sorted(self.attrs.items())]
+        part.create_methods.return_value = []
+        params = Controller.MethodMeta.prepare_input_map(mri="mri2")
+        c = Controller(MagicMock(), [part], params)
+        for attr in self.attrs.values():
+            attr.meta.set_writeable(True)
+        return c
+
+    def test_put_many(self):
+        c = self.make_put_many_controller()
+        c.block.put_many(OrderedDict([("a", 1), ("b", 2), ("c", 3)]))
+        # All done in turn in this thread
+        self.assertEqual(self.put_values, [1, 2, 3])
+        c.process.spawn.assert_not_called()
+
+    def test_put_many_not_writeable(self):
+        c = self.make_put_many_controller()
+        self.attrs["b"].meta.set_writeable(False)
+        self.assertRaises(ValueError, c.block.put_many, dict(a=1, b=2))
+        self.assertEqual(self.put_values, [])
+
     def make_part_tasks(self, hook, func):
         task = MagicMock()
         func_name = "configure"
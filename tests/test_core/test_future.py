@@ -13,6 +13,7 @@ from mock import MagicMock, call, ANY
 #module imports
 from malcolm.compat import queue
 from malcolm.core.task import Task
+from malcolm.core.syncfactory import InterruptableQueue
 from malcolm.core.future import Future
 from malcolm.core import ResponseError
 from malcolm.core.response import Return, Error
@@ -24,7 +25,7 @@ class TestFuture(unittest.TestCase):
 
     def setUp(self):
         self.proc = MagicMock(q=queue.Queue())
-        self.proc.create_queue = MagicMock(return_value=queue.Queue())
+        self.proc.create_queue = MagicMock(return_value=InterruptableQueue())
         self.task = Task("testTask", self.proc)
 
     def test_set_result(self):
@@ -193,6 +193,12 @@ class TestMap(unittest.TestCase):
         m.b = 1
         self.assertEqual({"a", "b"}, set(m.keys()))
 
+    def test_get(self):
+        m = Map(self.nmeta, {"a": 1})
+        self.assertEqual(1, m.get("a"))
+        self.assertEqual(None, m.get("b"))
+        self.assertEqual(3, m.get("b", 3))
+
     def test_values(self):
         m = Map(self.nmeta, {"a":1})
         self.assertEqual([1], list(m.values()))
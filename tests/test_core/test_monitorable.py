@@ -7,7 +7,8 @@ import unittest
 from mock import Mock
 from collections import OrderedDict
 
-from malcolm.core.monitorable import Monitorable
+from malcolm.core.methodmeta import MethodMeta
+from malcolm.core.monitorable import Monitorable, serialize_shared
 
 
 class TestInit(unittest.TestCase):
@@ -76,5 +77,74 @@ class TestUpdates(unittest.TestCase):
         self.assertEqual(n.end, endpoint)
         self.assertEqual(parent.report_changes.called, False)
 
+
+class TestCachedDict(unittest.TestCase):
+
+    def setUp(self):
+        class MyMonitorable(Monitorable):
+            endpoints = ["child", "value"]
+            typeid = "my:1.0"
+
+        self.parent = MyMonitorable()
+        self.child = MyMonitorable()
+        self.child.set_endpoint_data("child", None)
+        self.child.set_endpoint_data("value", 1)
+        self.parent.set_endpoint_data("child", self.child)
+        self.parent.set_endpoint_data("value", 2)
+
+    def test_shared_dict_cached(self):
+        d = serialize_shared(self.parent)
+        self.assertEqual(d["child"]["value"], 1)
+        self.assertIs(serialize_shared(self.parent), d)
+        self.assertIs(serialize_shared(self.child), d["child"])
+
+    def test_to_dict_copies(self):
+        d = self.parent.to_dict()
+        self.assertEqual(d, serialize_shared(self.parent))
+        d["child"]["value"] = 3
+        self.assertEqual(serialize_shared(self.parent)["child"]["value"], 1)
+        self.assertEqual(self.parent.to_dict()["child"]["value"], 1)
+
+    def test_to_dict_copies_lists(self):
+        self.child.set_endpoint_data("value", [1, {"a": 2}])
+        d = self.parent.to_dict()
+        d["child"]["value"].append(3)
+        d["child"]["value"][1]["a"] = 4
+        self.assertEqual(
+            serialize_shared(self.parent)["child"]["value"], [1, {"a": 2}])
+
+    def test_child_change_invalidates_parent(self):
+        d = serialize_shared(self.parent)
+        self.child.set_endpoint_data("value", 3)
+        new_d = serialize_shared(self.parent)
+        self.assertEqual(new_d["child"]["value"], 3)
+        self.assertEqual(d["child"]["value"], 1)
+
+    def test_parent_change_reuses_child(self):
+        d = serialize_shared(self.parent)
+        self.parent.set_endpoint_data("value", 4)
+        new_d = serialize_shared(self.parent)
+        self.assertEqual(new_d["value"], 4)
+        self.assertIs(new_d["child"], d["child"])
+
+    def test_shared_child_invalidates_both_parents(self):
+        other = type(self.parent)()
+        other.set_endpoint_data("child", self.child)
+        other.set_endpoint_data("value", 5)
+        self.parent.to_dict()
+        other.to_dict()
+        self.child.set_endpoint_data("value", 6)
+        self.assertEqual(self.parent.to_dict()["child"]["value"], 6)
+        self.assertEqual(other.to_dict()["child"]["value"], 6)
+
+    def test_modifying_copied_method_meta(self):
+        from malcolm.controllers.runnablecontroller import RunnableController
+        mm = RunnableController.configure.MethodMeta
+        before = mm.to_dict()
+        copied = MethodMeta.from_dict(mm.to_dict())
+        copied.defaults["axesToMove"] = ["zzz"]
+        self.assertEqual(mm.to_dict()["defaults"], before["defaults"])
+        self.assertEqual(mm.to_dict()["defaults"], mm.defaults)
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -0,0 +1,56 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import setup_malcolm_paths
+
+import unittest
+
+import numpy as np
+
+# module imports
+try:
+    from malcolm.core.msgpackutil import msgpack_encode, msgpack_decode
+except ImportError:
+    msgpack_encode = None
+from malcolm.core.response import Return
+from malcolm.compat import OrderedDict
+
+
+@unittest.skipIf(msgpack_encode is None, "msgpack not available")
+class TestMsgpackUtil(unittest.TestCase):
+
+    def test_round_trip_keeps_order(self):
+        d = OrderedDict(typeid="malcolm:core/Return:1.0")
+        d["id"] = 3
+        d["value"] = OrderedDict([("b", 1), ("a", u"two"), ("c", None)])
+        actual = msgpack_decode(msgpack_encode(d))
+        self.assertIsInstance(actual["value"], OrderedDict)
+        self.assertEqual(list(actual["value"]), ["b", "a", "c"])
+        self.assertEqual(actual, d)
+
+    def test_numeric_array_sent_raw(self):
+        value = np.linspace(0, 1, 1000)
+        message = msgpack_encode(Return(1, None, value))
+        # 8 bytes per float64 plus a small header, nothing like a list
+        self.assertLess(len(message), 8100)
+        actual = msgpack_decode(message)["value"]
+        self.assertEqual(actual.dtype, np.float64)
+        np.testing.assert_array_equal(actual, value)
+
+    def test_arrays_of_each_kind(self):
+        for value in (np.array([True, False]),
+                      np.array([-1, 2], dtype=np.int8),
+                      np.array([1, 2 ** 40], dtype=np.uint64),
+                      np.array([1.5, 2.5], dtype=np.float32)):
+            actual = msgpack_decode(msgpack_encode(value))
+            self.assertEqual(actual.dtype, value.dtype)
+            np.testing.assert_array_equal(actual, value)
+
+    def test_string_array_and_scalars(self):
+        value = [np.array(["a", "bc"]), np.int32(3), np.float64(1.5)]
+        actual = msgpack_decode(msgpack_encode(value))
+        self.assertEqual(actual, [["a", "bc"], 3, 1.5])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,197 @@
+import os
+import sys
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import setup_malcolm_paths
+from mock import patch
+
+import numpy as np
+from scanpointgenerator import LineGenerator, CompoundGenerator
+
+# module imports
+from malcolm.core.preparedgenerator import PreparedGenerator, \
+    PreparedGeneratorCache, generator_key
+
+
+def make_generator(num=3):
+    xs = LineGenerator("x", "mm", 0.0, 0.5, num, alternate=True)
+    ys = LineGenerator("y", "mm", 0.0, 0.1, 2)
+    return CompoundGenerator([ys, xs], [], [], 0.1)
+
+
+class TestPreparedGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.generator = make_generator()
+        self.o = PreparedGenerator(self.generator)
+
+    def test_init(self):
+        self.assertEqual(self.o.size, 6)
+        self.assertEqual(sorted(self.o.axes), ["x", "y"])
+        self.assertEqual(self.o.get_points(0, 6).indexes.shape, (6, 2))
+
+    def test_get_points(self):
+        points = self.o.get_points(2, 5)
+        for j, i in enumerate(range(2, 5)):
+            point = self.generator.get_point(i)
+            for axis in ("x", "y"):
+                self.assertEqual(points.positions[axis][j],
+                                 point.positions[axis])
+                self.assertEqual(points.lower[axis][j], point.lower[axis])
+                self.assertEqual(points.upper[axis][j], point.upper[axis])
+            self.assertEqual(list(points.indexes[j]), point.indexes)
+            self.assertEqual(points.durations[j], 0.1)
+
+    def test_points_read_only(self):
+        points = self.o.get_points(0, 6)
+        with self.assertRaises(ValueError):
+            points.positions["x"][0] = 1.0
+        with self.assertRaises(ValueError):
+            points.durations[0] = 1.0
+
+    def test_get_no_points(self):
+        points = self.o.get_points(6, 6)
+        self.assertEqual(len(points.durations), 0)
+        self.assertEqual(points.indexes.shape, (0, 2))
+
+    def test_get_points_out_of_range(self):
+        with self.assertRaises(AssertionError):
+            self.o.get_points(4, 7)
+
+    @patch("malcolm.core.preparedgenerator.POINTS_PER_FILL", 4)
+    def test_points_got_once(self):
+        generator = make_generator(num=5)
+        o = PreparedGenerator(generator)
+        with patch.object(generator, "get_point",
+                          wraps=generator.get_point) as get_point:
+            o.get_points(1, 3)
+            self.assertEqual(get_point.call_count, 4)
+            o.get_points(0, 4)
+            self.assertEqual(get_point.call_count, 4)
+            positions = o.get_points(3, 10).positions["x"]
+            self.assertEqual(get_point.call_count, 10)
+        np.testing.assert_equal(
+            positions, [0.375, 0.5, 0.5, 0.375, 0.25, 0.125, 0])
+        with self.assertRaises(ValueError):
+            positions[0] = 1.0
+
+    @patch("malcolm.core.preparedgenerator.POINTS_PER_FILL", 4)
+    @patch("malcolm.core.preparedgenerator.MAX_FILLED_POINTS", 8)
+    def test_least_recently_used_fill_dropped(self):
+        generator = make_generator(num=6)
+        o = PreparedGenerator(generator)
+        with patch.object(generator, "get_point",
+                          wraps=generator.get_point) as get_point:
+            o.get_points(0, 8)
+            self.assertEqual(get_point.call_count, 8)
+            # Only 2 fills are kept, so the first is dropped for the third
+            o.get_points(8, 12)
+            self.assertEqual(get_point.call_count, 12)
+            self.assertEqual(list(o._fills), [1, 2])
+            o.get_points(4, 6)
+            self.assertEqual(get_point.call_count, 12)
+            o.get_points(0, 1)
+            self.assertEqual(get_point.call_count, 16)
+            self.assertEqual(list(o._fills), [1, 0])
+
+    def test_lock_not_held_while_filling(self):
+        locked = []
+
+        def get_point(i):
+            locked.append(self.o._lock.locked())
+            return original_get_point(i)
+
+        original_get_point = self.generator.get_point
+        with patch.object(self.generator, "get_point", side_effect=get_point):
+            self.o.get_points(0, 6)
+        self.assertEqual(locked, [False] * 6)
+
+
+class TestPreparedGeneratorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.o = PreparedGeneratorCache()
+
+    def test_generator_key(self):
+        self.assertEqual(generator_key(make_generator()),
+                         generator_key(make_generator()))
+        self.assertNotEqual(generator_key(make_generator(3)),
+                            generator_key(make_generator(4)))
+
+    def test_get_prepares(self):
+        generator = make_generator()
+        prepared = self.o.get(generator)
+        self.assertIs(prepared.generator, generator)
+        self.assertEqual(generator.size, 6)
+        self.assertIs(self.o.get(generator), prepared)
+
+    def test_lock_not_held_while_preparing(self):
+        generator = make_generator()
+        original_prepare = generator.prepare
+        locked = []
+
+        def prepare():
+            locked.append(self.o._lock.locked())
+            original_prepare()
+
+        def key(g):
+            locked.append(self.o._lock.locked())
+            return generator_key(g)
+
+        with patch.object(generator, "prepare", side_effect=prepare), \
+                patch("malcolm.core.preparedgenerator.generator_key", key):
+            self.o.get(generator)
+            self.o.find(make_generator())
+        self.assertEqual(locked, [False, False, False])
+
+    def test_same_content_shared(self):
+        prepared = self.o.get(make_generator())
+        other = make_generator()
+        self.assertIs(self.o.find(other), prepared)
+        self.assertIs(self.o.get(other), prepared)
+
+    def test_find_serialized(self):
+        self.assertIsNone(self.o.find_serialized(make_generator().to_dict()))
+        prepared = self.o.get(make_generator())
+        self.assertIs(
+            self.o.find_serialized(make_generator().to_dict()), prepared)
+        self.assertIsNone(self.o.find_serialized(make_generator(4).to_dict()))
+
+    def test_find_missing(self):
+        self.assertIsNone(self.o.find(make_generator()))
+        self.o.get(make_generator(3))
+        self.assertIsNone(self.o.find(make_generator(4)))
+
+    @patch("malcolm.core.preparedgenerator.MAX_PREPARED_GENERATORS", 2)
+    def test_least_recently_used_dropped(self):
+        first = self.o.get(make_generator(3))
+        self.o.get(make_generator(4))
+        # Use the first again so the second is the oldest
+        self.o.get(make_generator(3))
+        self.o.get(make_generator(5))
+        self.assertIs(self.o.find(make_generator(3)), first)
+        self.assertIsNone(self.o.find(make_generator(4)))
+        self.assertIsNotNone(self.o.find(make_generator(5)))
+
+    def test_owner_drops_old_generator(self):
+        first = self.o.get(make_generator(3), owner="BLOCK1")
+        self.o.get(make_generator(3), owner="BLOCK2")
+        self.o.get(make_generator(4), owner="BLOCK1")
+        # BLOCK2 still owns the first
+        self.assertIs(self.o.find(make_generator(3)), first)
+        self.o.get(make_generator(5), owner="BLOCK2")
+        self.assertIsNone(self.o.find(make_generator(3)))
+        self.assertIsNotNone(self.o.find(make_generator(4)))
+        # Using the same one again keeps it
+        second = self.o.get(make_generator(5), owner="BLOCK2")
+        self.assertIs(self.o.find(make_generator(5)), second)
+
+    def test_clear(self):
+        self.o.get(make_generator())
+        self.o.clear()
+        self.assertIsNone(self.o.find(make_generator()))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
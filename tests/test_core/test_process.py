@@ -5,18 +5,20 @@ sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 import setup_malcolm_paths
 
 from collections import OrderedDict
+from malcolm.compat import queue
 # import logging
 # logging.basicConfig(level=logging.DEBUG)
 
 import unittest
-from mock import MagicMock, ANY
+from mock import MagicMock, ANY, patch
 
 # module imports
 from malcolm.core.process import \
     Process, BlockChanges, PROCESS_STOP, BlockAdd, BlockRespond, \
-    BlockList
-from malcolm.core.syncfactory import SyncFactory
-from malcolm.core.request import Subscribe, Unsubscribe, Post, Get
+    BlockList, AddSpawned
+from malcolm.core.syncfactory import SyncFactory, InterruptableQueue
+from malcolm.core.request import Subscribe, Unsubscribe, Post, Put, Get, \
+    GetMany, PutMany
 from malcolm.core.response import Return, Update, Delta, Error
 from malcolm.core.ntscalararray import NTScalarArray
 from malcolm.core.vmetas import StringArrayMeta
@@ -104,6 +106,16 @@ class TestProcess(unittest.TestCase):
         self.assertEqual(p._other_spawned, [(spawned, f)])
         f.assert_called_once_with("fred", a=0.05)
 
+    def test_spawn_hook_uses_hook_pool(self):
+        s = MagicMock()
+        p = Process("proc", s)
+        f = MagicMock()
+        spawned = p.spawn_hook(f, "fred")
+        self.assertEqual(spawned, s.spawn_hook.return_value)
+        s.spawn.assert_not_called()
+        s.spawn_hook.call_args[0][0]()
+        f.assert_called_once_with("fred")
+
     def test_get(self):
         p = Process("proc", MagicMock())
         block = MagicMock()
@@ -112,7 +124,7 @@ class TestProcess(unittest.TestCase):
         request = Get(MagicMock(), MagicMock(), ["myblock", "path_1", "path_2"])
         request.response_queue.qsize.return_value = 0
         p._handle_block_add(BlockAdd(block, "myblock", None))
-        p.q.get = MagicMock(side_effect=[request, PROCESS_STOP])
+        p.q.get_many = MagicMock(side_effect=[[request, PROCESS_STOP]])
 
         p.recv_loop()
 
@@ -120,6 +132,36 @@ class TestProcess(unittest.TestCase):
         self.assertIsInstance(response, Return)
         self.assertEquals({"attr": "value"}, response.value)
 
+    def test_get_many(self):
+        p = Process("proc", MagicMock())
+        block = MagicMock()
+        block.to_dict = MagicMock(
+            return_value={"attr": {"value": 1}, "attr2": {"value": 2}})
+        request = GetMany(MagicMock(), MagicMock(), [
+            ["myblock", "attr", "value"], ["myblock", "attr2"]])
+        p._handle_block_add(BlockAdd(block, "myblock", None))
+        p.q.get_many = MagicMock(side_effect=[[request, PROCESS_STOP]])
+
+        p.recv_loop()
+
+        response = request.response_queue.put.call_args[0][0]
+        self.assertIsInstance(response, Return)
+        self.assertEqual([1, {"value": 2}], response.value)
+
+    def test_put_many_spawns_once(self):
+        p = Process("proc", MagicMock())
+        block = MagicMock()
+        block.to_dict = MagicMock(return_value={})
+        p._handle_block_add(BlockAdd(block, "myblock", None))
+        request = PutMany(
+            MagicMock(), MagicMock(), ["myblock"], dict(a=1, b=2))
+        p.q.get_many = MagicMock(side_effect=[[request, PROCESS_STOP]])
+
+        p.recv_loop()
+
+        p.sync_factory.spawn.assert_called_once_with(
+            block.handle_request, request)
+
     def test_block_respond(self):
         p = Process("proc", MagicMock())
         p.q.put = MagicMock()
@@ -134,8 +176,9 @@ class TestProcess(unittest.TestCase):
         p = Process("proc", MagicMock())
         response = MagicMock()
         response_queue = MagicMock()
-        p.q.get = MagicMock(
-            side_effect=[BlockRespond(response, response_queue), PROCESS_STOP])
+        p.q.get_many = MagicMock(
+            side_effect=[[BlockRespond(response, response_queue),
+                          PROCESS_STOP]])
 
         p.recv_loop()
 
@@ -174,6 +217,12 @@ class TestSubscriptions(unittest.TestCase):
         p.report_changes(change)
         p.q.put.assert_called_once_with(BlockChanges(changes=[change]))
 
+    def test_empty_block_changes(self):
+        p = Process("proc", MagicMock())
+        p.log_exception = MagicMock()
+        p._handle_request(BlockChanges([]), p._handle_functions)
+        p.log_exception.assert_not_called()
+
     def test_subscribe(self):
         block = MagicMock(
             to_dict=MagicMock(
@@ -185,7 +234,7 @@ class TestSubscriptions(unittest.TestCase):
         sub_2 = Subscribe(
             MagicMock(), MagicMock(), ["block", "inner"], True)
         sub_2.response_queue.qsize.return_value = 0
-        p.q.get = MagicMock(side_effect=[sub_1, sub_2, PROCESS_STOP])
+        p.q.get_many = MagicMock(side_effect=[[sub_1, sub_2, PROCESS_STOP]])
 
         p._handle_block_add(BlockAdd(block, "block", None))
         p.recv_loop()
@@ -223,9 +272,9 @@ class TestSubscriptions(unittest.TestCase):
         request_1 = BlockChanges(changes_1)
         request_2 = BlockChanges(changes_2)
         p = Process("proc", MagicMock())
-        p.q.get = MagicMock(side_effect=[
+        p.q.get_many = MagicMock(side_effect=[[
             sub_1, sub_2, sub_3, request_1, request_2,
-            PROCESS_STOP])
+            PROCESS_STOP]])
 
         p._handle_block_add(BlockAdd(block_1, "block_1", None))
         p._handle_block_add(BlockAdd(block_2, "block_2", None))
@@ -261,8 +310,10 @@ class TestSubscriptions(unittest.TestCase):
         unsub_1 = Unsubscribe(sub_1.context, sub_1.response_queue)
         unsub_1.set_id(sub_1.id)
 
-        p.q.get = MagicMock(side_effect=[sub_1, sub_2, change_1,
-                                         unsub_1, change_2, PROCESS_STOP])
+        # Unsubscribe would overtake change_1 if they arrived together
+        p.q.get_many = MagicMock(side_effect=[[sub_1, sub_2, change_1],
+                                              [unsub_1, change_2,
+                                               PROCESS_STOP]])
         p._handle_block_add(BlockAdd(block, "block", None))
         p.recv_loop()
 
@@ -284,7 +335,7 @@ class TestSubscriptions(unittest.TestCase):
         unsub = Unsubscribe(MagicMock(), MagicMock())
         unsub.set_id(1234)
         unsub.response_queue.qsize.return_value = 0
-        p.q.get = MagicMock(side_effect=[unsub, PROCESS_STOP])
+        p.q.get_many = MagicMock(side_effect=[[unsub, PROCESS_STOP]])
 
         p.recv_loop()
 
@@ -293,5 +344,475 @@ class TestSubscriptions(unittest.TestCase):
         response = responses[0][0][0]
         self.assertEquals(Error, type(response))
 
+class TestCoalescedChanges(unittest.TestCase):
+
+    def setUp(self):
+        self.p = Process("proc", MagicMock(), change_batch_window=0)
+        block = MagicMock(
+            to_dict=MagicMock(return_value={"attr": "0", "attr2": "a"}))
+        self.p._handle_block_add(BlockAdd(block, "block", None))
+        self.sub_delta = Subscribe(None, MagicMock(), ["block"], delta=True)
+        self.sub_delta.set_id(1)
+        self.sub_update = Subscribe(None, MagicMock(), ["block", "attr"])
+        self.sub_update.set_id(2)
+
+    def test_changes_merged(self):
+        respond = BlockRespond("response", MagicMock(), "block")
+        self.p.q.get_many = MagicMock(side_effect=[[
+            self.sub_delta, self.sub_update,
+            BlockChanges([[["block", "attr"], "1"]]),
+            BlockChanges([[["block", "attr2"], "b"]]),
+            BlockChanges([[["block", "attr"], "2"]]),
+            respond,
+            AddSpawned(MagicMock(), MagicMock()),
+            BlockChanges([[["block", "attr"], "3"]]),
+            PROCESS_STOP]])
+        self.p.recv_loop()
+        delta_responses = [
+            c[0][0] for c in self.sub_delta.response_queue.put.call_args_list]
+        self.assertEqual(len(delta_responses), 3)
+        self.assertEqual(delta_responses[1].changes,
+                         [[["attr2"], "b"], [["attr"], "2"]])
+        self.assertEqual(delta_responses[2].changes, [[["attr"], "3"]])
+        update_responses = [
+            c[0][0] for c in self.sub_update.response_queue.put.call_args_list]
+        self.assertEqual([r.value for r in update_responses], ["0", "2", "3"])
+        respond.response_queue.put.assert_called_once_with("response")
+
+    def test_batch_window_waits_for_changes(self):
+        self.p.change_batch_window = 0.1
+        self.p.q = InterruptableQueue()
+        self.p.q.put(self.sub_delta)
+        self.p.q.put(BlockChanges([[["block", "attr"], "1"]]))
+        s = SyncFactory("sched")
+        spawned = s.spawn(self.p.recv_loop)
+        time.sleep(0.05)
+        self.p.q.put(BlockChanges([[["block", "attr2"], "b"]]))
+        self.p.q.put(PROCESS_STOP)
+        spawned.wait(1)
+        responses = [
+            c[0][0] for c in self.sub_delta.response_queue.put.call_args_list]
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(responses[1].changes,
+                         [[["attr"], "1"], [["attr2"], "b"]])
+
+
+class TestPriorityLanes(unittest.TestCase):
+
+    def setUp(self):
+        self.p = Process("proc", MagicMock())
+        self.p.q = InterruptableQueue()
+        block = MagicMock(to_dict=MagicMock(return_value={"attr": 0}))
+        self.p._handle_block_add(BlockAdd(block, "block", None))
+        self.handled = []
+
+        def spawn(function, request):
+            self.handled.append(request.endpoint[-1])
+            return MagicMock(ready=MagicMock(return_value=True))
+
+        self.p.sync_factory.spawn.side_effect = spawn
+        self.sub = Subscribe(None, MagicMock(), ["block", "attr"], delta=True)
+        self.sub.set_id(1)
+        self.sub.response_queue.put.side_effect = \
+            lambda response: self.handled.append(response.changes[0][1])
+
+    def test_control_posts_first(self):
+        for request in [
+                self.sub,
+                BlockChanges([[["block", "attr"], 1]]),
+                Post(None, MagicMock(), ["block", "configure"]),
+                BlockChanges([[["block", "attr"], 2]]),
+                Post(None, MagicMock(), ["block", "abort"]),
+                PROCESS_STOP]:
+            self.p.q.put(request)
+        self.p.recv_loop()
+        # abort waits for the configure to its block that arrived first, which
+        # waits for the Subscribe before it, but none of them wait for changes
+        self.assertEqual(self.handled, [0, "configure", "abort", 1, 2])
+
+    def test_control_post_overtakes_posts_to_other_blocks(self):
+        block = MagicMock(to_dict=MagicMock(return_value={"attr": 0}))
+        self.p._handle_block_add(BlockAdd(block, "other", None))
+        for request in [
+                Post(None, MagicMock(), ["other", "configure"]),
+                Post(None, MagicMock(), ["block", "run"]),
+                Post(None, MagicMock(), ["block", "abort"]),
+                PROCESS_STOP]:
+            self.p.q.put(request)
+        self.p.recv_loop()
+        self.assertEqual(self.handled, ["configure", "run", "abort"])
+        self.handled[:] = []
+        for request in [
+                Post(None, MagicMock(), ["other", "configure"]),
+                Post(None, MagicMock(), ["block", "abort"]),
+                PROCESS_STOP]:
+            self.p.q.put(request)
+        self.p.recv_loop()
+        self.assertEqual(self.handled, ["abort", "configure"])
+
+    def test_get_waits_for_earlier_changes_to_its_block(self):
+        block = MagicMock(to_dict=MagicMock(return_value={"attr": 0}))
+        self.p._handle_block_add(BlockAdd(block, "other", None))
+        get = Get(None, MagicMock(), ["block", "attr"])
+        get.response_queue.put.side_effect = \
+            lambda response: self.handled.append(("get", response.value))
+        get_other = Get(None, MagicMock(), ["other", "attr"])
+        get_other.response_queue.put.side_effect = \
+            lambda response: self.handled.append(("other", response.value))
+        put = Put(None, MagicMock(), ["block", "attr", "value"], 5)
+        for request in [BlockChanges([[["block", "attr"], 1]]), get_other,
+                        get, BlockChanges([[["block", "attr"], 2]]), put,
+                        PROCESS_STOP]:
+            self.p.q.put(request)
+        self.p.recv_loop()
+        # The Get of other overtakes the change to block, the Get of block
+        # doesn't, and neither waits for the change that arrived after them
+        self.assertEqual(self.handled, [("other", 0), ("get", 1), "value"])
+
+    def test_get_after_put_return_sees_put(self):
+        get = Get(None, MagicMock(), ["block", "attr"])
+        put = Put(None, MagicMock(), ["block", "attr", "value"], 5)
+
+        def handle_put(function, request):
+            # The block sets the value then returns, like Block.handle_request
+            self.p.report_changes([["block", "attr"], request.value])
+            self.p.block_respond(
+                Return(request.id, request.context), request.response_queue,
+                "block")
+            return MagicMock(ready=MagicMock(return_value=True))
+
+        def get_response(response):
+            self.handled.append(("get", response.value))
+            self.p.q.put(PROCESS_STOP)
+
+        self.p.sync_factory.spawn.side_effect = handle_put
+        # The client sends its Get as soon as it has the Put's Return
+        put.response_queue.put.side_effect = \
+            lambda response: self.p.q.put(get)
+        get.response_queue.put.side_effect = get_response
+        self.p.q.put(put)
+        # A backlog of changes to the block from elsewhere
+        for i in range(100):
+            self.p.q.put(BlockChanges([[["block", "other"], i]]))
+            self.p.q.put(BlockChanges([[["block", "attr"], i]]))
+        self.p.recv_loop()
+        self.assertEqual(self.handled, [("get", 5)])
+        self.assertEqual(self.p._block_state_cache["block"]["other"], 99)
+
+    def test_return_overtakes_changes_to_other_blocks(self):
+        block = MagicMock(to_dict=MagicMock(return_value={"attr": 0}))
+        self.p._handle_block_add(BlockAdd(block, "other", None))
+        put = Put(None, MagicMock(), ["block", "attr", "value"], 5)
+        put.response_queue.put.side_effect = \
+            lambda response: self.handled.append(type(response))
+
+        def handle_put(function, request):
+            # A backlog of changes to another block builds up while the
+            # block sets the value then returns
+            for i in range(1, 201):
+                self.p.report_changes([["other", "attr"], i])
+            self.p.report_changes([["block", "attr"], request.value])
+            self.p.block_respond(
+                Return(request.id, request.context), request.response_queue,
+                "block")
+            self.p.q.put(PROCESS_STOP)
+            return MagicMock(ready=MagicMock(return_value=True))
+
+        self.p.sync_factory.spawn.side_effect = handle_put
+        self.p.q.put(self.sub)
+        self.p.q.put(put)
+        self.p.recv_loop()
+        # The Return waits for the change to its block, but not the ones to
+        # other that arrived before it
+        self.assertEqual(self.handled, [0, 5, Return])
+        self.assertEqual(self.p._block_state_cache["other"]["attr"], 200)
+
+    def test_control_post_overtakes_backlog(self):
+        abort = Post(None, MagicMock(), ["block", "abort"])
+
+        def put(response):
+            value = response.changes[0][1]
+            if value == 1:
+                # Arrives after the backlog is already taken off the queue
+                self.p.q.put(abort)
+            self.handled.append(value)
+
+        self.sub.response_queue.put.side_effect = put
+        self.p.q.put(self.sub)
+        for i in range(1, 201):
+            self.p.q.put(BlockChanges([[["block", "attr"], i]]))
+        self.p.q.put(PROCESS_STOP)
+        self.p.recv_loop()
+        self.assertLess(self.handled.index("abort"), 50)
+        changes = [v for v in self.handled if v != "abort"]
+        self.assertEqual(changes, list(range(201)))
+
+
+class TestResumedSubscriptions(unittest.TestCase):
+
+    def setUp(self):
+        self.p = Process("proc", MagicMock(), change_history=2)
+        block = MagicMock(
+            to_dict=MagicMock(return_value={"attr": 0, "attr2": "a"}))
+        self.p._handle_block_add(BlockAdd(block, "block", None))
+        self.version = self.p._block_state_cache.version
+
+    def subscribe(self, since):
+        sub = Subscribe(None, MagicMock(), ["block"], delta=True, since=since)
+        sub.set_id(1)
+        self.p.q.get_many = MagicMock(side_effect=[[sub, PROCESS_STOP]])
+        self.p.recv_loop()
+        return sub.response_queue.put.call_args[0][0]
+
+    def get_versions(self, since):
+        sub = Subscribe(None, MagicMock(), ["block"], delta=True, since=since)
+        sub.set_id(1)
+        self.p.q.get_many = MagicMock(side_effect=[[
+            sub, BlockChanges([[["block", "attr"], 1]]), PROCESS_STOP]])
+        self.p.recv_loop()
+        responses = [c[0][0] for c in sub.response_queue.put.call_args_list]
+        return [r.version for r in responses]
+
+    def test_deltas_have_version(self):
+        self.assertEqual(self.get_versions(0),
+                         [self.version, self.version + 1])
+
+    def test_deltas_have_version_without_since(self):
+        self.assertEqual(self.get_versions(None),
+                         [self.version, self.version + 1])
+
+    def test_resume_sends_missed_changes(self):
+        self.p._handle_block_changes(BlockChanges([[["block", "attr"], 1]]))
+        self.p._handle_block_changes(BlockChanges([[["block", "attr2"], "b"]]))
+        response = self.subscribe(self.version)
+        self.assertEqual(response.changes,
+                         [[["attr"], 1], [["attr2"], "b"]])
+        self.assertEqual(response.version, self.version + 2)
+
+    def test_resume_after_history_wrapped_sends_everything(self):
+        for i in range(3):
+            self.p._handle_block_changes(
+                BlockChanges([[["block", "attr"], i]]))
+        response = self.subscribe(self.version)
+        self.assertEqual(response.changes, [[[], {"attr": 2, "attr2": "a"}]])
+        self.assertEqual(response.version, self.version + 3)
+
+
+class TestThrottledSubscriptions(unittest.TestCase):
+
+    def setUp(self):
+        self.p = Process("proc", MagicMock())
+        block = MagicMock(
+            to_dict=MagicMock(return_value={"attr": 0, "attr2": "a"}))
+        self.p._handle_block_add(BlockAdd(block, "block", None))
+
+    def responses(self, sub):
+        return [c[0][0] for c in sub.response_queue.put.call_args_list]
+
+    @patch("malcolm.core.process.time")
+    def test_period_merges_changes(self, mock_time):
+        mock_time.time.return_value = 100.0
+        sub = Subscribe(None, MagicMock(), ["block"], delta=True, period=0.1)
+        sub.set_id(1)
+        batches = [[sub] + [
+            BlockChanges([[["block", "attr"], i]]) for i in range(1, 4)] + [
+            BlockChanges([[["block", "attr2"], "b"]])]]
+        # (timeout, number of responses sent) for each wait on the queue
+        waits = []
+
+        def get_many(timeout=None):
+            waits.append((timeout, len(self.responses(sub))))
+            if batches:
+                return batches.pop(0)
+            elif mock_time.time.return_value == 100.0:
+                # Nothing arrives before the period is up
+                mock_time.time.return_value = 100.1
+                raise queue.Empty()
+            else:
+                return [PROCESS_STOP]
+
+        self.p.q.get_many = MagicMock(side_effect=get_many)
+        self.p.recv_loop()
+        # Only the initial value was sent until the period was up, then the
+        # held back changes were merged into one Delta
+        self.assertEqual(len(waits), 3)
+        self.assertEqual(waits[0], (None, 0))
+        self.assertAlmostEqual(waits[1][0], 0.1)
+        self.assertEqual(waits[1][1], 1)
+        self.assertEqual(waits[2], (None, 2))
+        responses = self.responses(sub)
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(responses[1].changes,
+                         [[["attr"], 3], [["attr2"], "b"]])
+
+    def test_period_sends_update_of_latest_structure(self):
+        sub = Subscribe(None, MagicMock(), ["block", "attr"], period=10)
+        sub.set_id(1)
+        self.p.q.get_many = MagicMock(side_effect=[[
+            sub, BlockChanges([[["block", "attr"], 1]]), PROCESS_STOP]])
+        self.p.recv_loop()
+        self.assertEqual([r.value for r in self.responses(sub)], [0])
+        # Pretend the period is up
+        self.p._throttles[sub].sent = 0
+        self.p._flush_throttles(self.p._throttles)
+        self.assertEqual([r.value for r in self.responses(sub)], [0, 1])
+
+    def test_deadband_drops_small_changes(self):
+        sub = Subscribe(None, MagicMock(), ["block", "attr"], delta=True,
+                        deadband=1)
+        sub.set_id(1)
+        self.p.q.get_many = MagicMock(side_effect=[[
+            sub,
+            BlockChanges([[["block", "attr"], 0.5]]),
+            BlockChanges([[["block", "attr"], 1.5]]),
+            BlockChanges([[["block", "attr"], 2]]),
+            BlockChanges([[["block", "attr"], 0.4]]),
+            PROCESS_STOP]])
+        self.p.recv_loop()
+        self.assertEqual([r.changes for r in self.responses(sub)],
+                         [[[[], 0]], [[[], 1.5]], [[[], 0.4]]])
+
+    def test_deadband_passes_non_numeric_changes(self):
+        sub = Subscribe(None, MagicMock(), ["block"], delta=True, deadband=1)
+        sub.set_id(1)
+        self.p.q.get_many = MagicMock(side_effect=[[
+            sub,
+            BlockChanges([[["block", "attr"], 0.5]]),
+            BlockChanges([[["block", "attr"], 0.6],
+                          [["block", "attr2"], "b"]]),
+            PROCESS_STOP]])
+        self.p.recv_loop()
+        responses = self.responses(sub)
+        self.assertEqual(len(responses), 3)
+        self.assertEqual(responses[1].changes, [[["attr"], 0.5]])
+        self.assertEqual(responses[2].changes, [[["attr2"], "b"]])
+
+    def test_unsubscribe_removes_throttle(self):
+        sub = Subscribe(None, MagicMock(), ["block"], delta=True, period=10)
+        sub.set_id(1)
+        unsub = Unsubscribe(None, sub.response_queue)
+        unsub.set_id(1)
+        self.p.q.get_many = MagicMock(side_effect=[[
+            sub, BlockChanges([[["block", "attr"], 1]]), unsub,
+            PROCESS_STOP]])
+        self.p.recv_loop()
+        self.assertEqual(self.p._throttles, {})
+        # Initial value and unsubscribe return, the change was never sent
+        self.assertEqual([type(r) for r in self.responses(sub)],
+                         [Delta, Return])
+
+
+class TestShardedProcess(unittest.TestCase):
+
+    def setUp(self):
+        self.p = Process("proc", SyncFactory("sched"), dispatch_shards=2)
+        self.block_1 = MagicMock(
+            to_dict=MagicMock(return_value={"attr": "0"}))
+        self.block_2 = MagicMock(
+            to_dict=MagicMock(return_value={"attr": "a"}))
+        self.p._handle_block_add(BlockAdd(self.block_1, "block_1", None))
+        self.p._handle_block_add(BlockAdd(self.block_2, "block_2", None))
+
+    def test_blocks_allocated_round_robin(self):
+        self.assertEqual(self.p._block_shards["proc"], self.p._shards[0])
+        self.assertEqual(self.p._block_shards["block_1"], self.p._shards[1])
+        self.assertEqual(self.p._block_shards["block_2"], self.p._shards[0])
+        self.p.start()
+        self.p.stop()
+        self.assertEqual(list(self.p._shards[0].cache), ["proc", "block_2"])
+        self.assertEqual(list(self.p._shards[1].cache), ["block_1"])
+
+    def test_changes_go_to_owning_shard(self):
+        sub_1 = Subscribe(None, queue.Queue(), ["block_1", "attr"], delta=True)
+        sub_1.set_id(1)
+        sub_2 = Subscribe(None, queue.Queue(), ["block_2", "attr"])
+        sub_2.set_id(2)
+        self.p.start()
+        self.p.q.put(sub_1)
+        self.p.q.put(sub_2)
+        self.p.q.put(BlockChanges([[["block_1", "attr"], "1"],
+                                   [["block_2", "attr"], "b"]]))
+        self.p.stop()
+        self.assertEqual(sub_1.response_queue.get_nowait().changes,
+                         [[[], "0"]])
+        self.assertEqual(sub_1.response_queue.get_nowait().changes,
+                         [[[], "1"]])
+        self.assertEqual(sub_2.response_queue.get_nowait().value, "a")
+        self.assertEqual(sub_2.response_queue.get_nowait().value, "b")
+
+    def test_get_many_over_shards(self):
+        get_1 = GetMany(None, queue.Queue(), [["block_1", "attr"]])
+        get_2 = GetMany(None, queue.Queue(),
+                        [["block_1", "attr"], ["block_2", "attr"]])
+        self.p.start()
+        self.p.q.put(get_1)
+        self.p.q.put(get_2)
+        self.p.stop()
+        self.assertEqual(get_1.response_queue.get_nowait().value, ["0"])
+        self.assertEqual(get_2.response_queue.get_nowait().value, ["0", "a"])
+
+    def test_get_many_over_shards_error(self):
+        get = GetMany(None, queue.Queue(),
+                      [["block_1", "attr"], ["block_2", "missing"]])
+        self.p.start()
+        self.p.q.put(get)
+        self.p.stop()
+        self.assertIsInstance(get.response_queue.get_nowait(), Error)
+        self.assertTrue(get.response_queue.empty())
+
+    def test_get_root_over_shards(self):
+        get = Get(None, queue.Queue(), [])
+        self.p.start()
+        self.p.q.put(get)
+        self.p.stop()
+        value = get.response_queue.get_nowait().value
+        self.assertEqual(list(value), ["proc", "block_1", "block_2"])
+        self.assertEqual(value["block_1"], {"attr": "0"})
+        self.assertEqual(value["block_2"], {"attr": "a"})
+
+    def test_bad_paths_get_error(self):
+        requests = [Subscribe(None, queue.Queue(), []),
+                    GetMany(None, queue.Queue(), [["block_1"], []]),
+                    Get(None, queue.Queue(), ["missing", "attr"])]
+        self.p.start()
+        for request in requests:
+            self.p.q.put(request)
+        self.p.q.put(BlockChanges([]))
+        self.p.stop()
+        for request in requests:
+            self.assertIsInstance(request.response_queue.get_nowait(), Error)
+        # Nothing asking for an unknown block gives it a shard
+        self.assertNotIn("missing", self.p._block_shards)
+
+    def test_block_respond_after_changes(self):
+        sub = Subscribe(None, queue.Queue(), ["block_1", "attr"])
+        sub.set_id(1)
+        self.p.start()
+        self.p.q.put(sub)
+        self.p.report_changes([["block_1", "attr"], "1"])
+        self.p.block_respond("response", sub.response_queue, "block_1")
+        self.p.stop()
+        self.assertEqual(sub.response_queue.get_nowait().value, "0")
+        self.assertEqual(sub.response_queue.get_nowait().value, "1")
+        self.assertEqual(sub.response_queue.get_nowait(), "response")
+
+    def test_unsubscribe(self):
+        sub = Subscribe(None, queue.Queue(), ["block_2"])
+        sub.set_id(1)
+        unsub = Unsubscribe(None, sub.response_queue)
+        unsub.set_id(1)
+        self.p.start()
+        self.p.q.put(sub)
+        self.p.q.put(unsub)
+        self.p.q.put(unsub)
+        self.p.stop()
+        # The unknown Unsubscribe is answered by recv_loop, so can overtake
+        # the responses from the shard
+        responses = [sub.response_queue.get_nowait() for _ in range(3)]
+        self.assertEqual(sorted(type(r).__name__ for r in responses),
+                         ["Error", "Return", "Update"])
+        self.assertEqual(self.p._subscriptions, {})
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
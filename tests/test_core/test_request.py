@@ -3,7 +3,8 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 import setup_malcolm_paths
 
-from malcolm.core.request import Request, Get, Post, Subscribe, Unsubscribe, Put
+from malcolm.core.request import Request, Get, Post, Subscribe, Unsubscribe, Put, \
+    GetMany, PutMany
 from malcolm.core.response import Return, Error, Update, Delta
 
 import unittest
@@ -98,6 +99,33 @@ class TestPut(unittest.TestCase):
         self.assertEquals("7", self.put.value)
 
 
+class TestGetMany(unittest.TestCase):
+
+    def test_init(self):
+        paths = [["block", "attr", "value"], ["block", "attr2"]]
+        get_many = GetMany(MagicMock(), MagicMock(), paths)
+        self.assertEqual(paths, get_many.paths)
+        self.assertEqual("malcolm:core/GetMany:1.0", get_many.typeid)
+        self.assertEqual(get_many.to_dict()["paths"], paths)
+
+
+class TestPutMany(unittest.TestCase):
+
+    def test_init(self):
+        put_many = PutMany(
+            MagicMock(), MagicMock(), ["block"], dict(attr=1, attr2="b"))
+        self.assertEqual(["block"], put_many.endpoint)
+        self.assertEqual(dict(attr=1, attr2="b"), put_many.values)
+        self.assertEqual("malcolm:core/PutMany:1.0", put_many.typeid)
+
+    def test_from_dict(self):
+        d = dict(typeid="malcolm:core/PutMany:1.0", id=4, endpoint=["block"],
+                 values=dict(attr=1))
+        put_many = PutMany.from_dict(d)
+        self.assertEqual(4, put_many.id)
+        self.assertEqual(dict(attr=1), put_many.values)
+
+
 class TestPost(unittest.TestCase):
 
     def setUp(self):
@@ -139,8 +167,38 @@ class TestSubscribe(unittest.TestCase):
         self.assertEqual(self.response_queue, self.subscribe.response_queue)
         self.assertEqual(self.endpoint, self.subscribe.endpoint)
         self.assertEqual(self.delta, self.subscribe.delta)
+        self.assertEqual(0, self.subscribe.period)
+        self.assertEqual(0, self.subscribe.deadband)
         self.assertEqual("malcolm:core/Subscribe:1.0", self.subscribe.typeid)
 
+    def test_from_dict_without_rate_limit(self):
+        d = dict(typeid="malcolm:core/Subscribe:1.0", id=3,
+                 endpoint=["a", "b"], delta=True)
+        subscribe = Subscribe.from_dict(d)
+        self.assertEqual(0, subscribe.period)
+        self.assertEqual(0, subscribe.deadband)
+
+    def test_from_dict_with_null_rate_limit(self):
+        d = dict(typeid="malcolm:core/Subscribe:1.0", id=3,
+                 endpoint=["a", "b"], delta=True, period=None, deadband=None)
+        subscribe = Subscribe.from_dict(d)
+        self.assertEqual(0, subscribe.period)
+        self.assertEqual(0, subscribe.deadband)
+
+    def test_to_dict_leaves_out_unused_endpoints(self):
+        self.subscribe.set_id(3)
+        self.assertEqual(list(self.subscribe.to_dict()),
+                         ["typeid", "id", "endpoint", "delta"])
+        self.subscribe.set_period(0.1)
+        self.subscribe.set_since(1234)
+        d = self.subscribe.to_dict()
+        self.assertEqual(list(d), [
+            "typeid", "id", "endpoint", "delta", "period", "since"])
+        subscribe = Subscribe.from_dict(d)
+        self.assertEqual(0.1, subscribe.period)
+        self.assertEqual(0, subscribe.deadband)
+        self.assertEqual(1234, subscribe.since)
+
     def test_respond_with_update(self):
         value = MagicMock()
 
@@ -163,6 +221,12 @@ class TestSubscribe(unittest.TestCase):
 
         self.assertEqual(call_arg, expected_response)
 
+    def test_respond_with_delta_version(self):
+        # No since was given, but the version is still sent
+        self.subscribe.respond_with_delta([[["path"], "value"]], 42)
+        response = self.response_queue.put.call_args[0][0]
+        self.assertEqual(response.version, 42)
+
     def test_setters(self):
         self.subscribe.set_endpoint(["BL18I:XSPRESS3", "state", "value2"])
         self.assertEquals(["BL18I:XSPRESS3", "state", "value2"], self.subscribe.endpoint)
@@ -170,6 +234,14 @@ class TestSubscribe(unittest.TestCase):
         self.subscribe.set_delta(False)
         self.assertFalse(self.subscribe.delta)
 
+        self.subscribe.set_period(0.1)
+        self.assertEqual(0.1, self.subscribe.period)
+        self.assertRaises(AssertionError, self.subscribe.set_period, -1)
+
+        self.subscribe.set_deadband(2)
+        self.assertEqual(2.0, self.subscribe.deadband)
+        self.assertRaises(AssertionError, self.subscribe.set_deadband, -1)
+
 
 class TestUnsubscribe(unittest.TestCase):
 
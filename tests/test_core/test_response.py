@@ -64,6 +64,11 @@ class TestResponse(unittest.TestCase):
 
         r.set_changes([[["path"], "value2"]])
         self.assertEquals([[["path"], "value2"]], r.changes)
+        self.assertEqual(None, r.version)
+        self.assertNotIn("version", r.to_dict())
+
+        r.set_version(45)
+        self.assertEqual(45, r.to_dict()["version"])
 
     def test_repr(self):
         r = Response(123, Mock())
@@ -5,9 +5,9 @@ import setup_malcolm_paths
 
 from collections import OrderedDict
 import unittest
-from mock import Mock
+from mock import Mock, MagicMock, patch
 
-from malcolm.core.serializable import Serializable
+from malcolm.core.serializable import Serializable, serialize_object
 
 
 class TestSerialization(unittest.TestCase):
@@ -30,6 +30,53 @@ class TestSerialization(unittest.TestCase):
         n = DummySerializable.from_dict(expected)
         self.assertEqual(n.to_dict(), expected)
 
+    @patch("malcolm.core.serializable.logging")
+    def test_camel_case_checked_once(self, mock_logging):
+
+        @Serializable.register_subclass("foo:1.0")
+        class DummySerializable(Serializable):
+            endpoints = ["not_camel"]
+
+        self.assertEqual(mock_logging.warning.call_count, 1)
+        s = DummySerializable()
+        s.set_endpoint_data("not_camel", 3)
+        s.to_dict()
+        s.to_dict()
+        self.assertEqual(mock_logging.warning.call_count, 1)
+
+    def test_instance_endpoints(self):
+
+        @Serializable.register_subclass("foo:1.0")
+        class DummySerializable(Serializable):
+            pass
+
+        s = DummySerializable()
+        s.endpoints = ["boo"]
+        s.set_endpoint_data("boo", 3)
+        self.assertEqual(s.to_dict(), OrderedDict(typeid="foo:1.0", boo=3))
+
+    def test_serialize_endpoints(self):
+
+        @Serializable.register_subclass("foo:1.0")
+        class DummySerializable(Serializable):
+            endpoints = ["boo", "bar"]
+
+        s = DummySerializable()
+        s.set_endpoint_data("boo", 3)
+        s.set_endpoint_data("bar", 4)
+        expected = OrderedDict(typeid="foo:1.0")
+        expected["boo"] = 6
+        expected["bar"] = 8
+        self.assertEqual(s.serialize_endpoints(lambda v: v * 2), expected)
+
+    def test_serialize_object(self):
+        m = MagicMock()
+        self.assertEqual(serialize_object(m), m.to_dict.return_value)
+        d = {"a": m, "b": [1, 2]}
+        expected = OrderedDict(a=m.to_dict.return_value, b=[1, 2])
+        self.assertEqual(serialize_object(d), expected)
+        self.assertEqual(serialize_object(3), 3)
+
 
 
 if __name__ == "__main__":
@@ -34,7 +34,7 @@ class TestServerComms(unittest.TestCase):
     def test_send_to_client_called(self):
         request = Mock()
         dummy_queue = Mock()
-        dummy_queue.get = Mock(side_effect = [request, Spawnable.STOP])
+        dummy_queue.get_many = Mock(side_effect = [[request], [Spawnable.STOP]])
         self.process.create_queue = Mock(return_value = dummy_queue)
         server = ServerComms(self.process)
         server.send_to_client = Mock()
@@ -52,7 +52,7 @@ class TestServerComms(unittest.TestCase):
         server = ServerComms(self.process)
         request = Mock()
         request.to_dict = Mock()
-        server.q.get = Mock(side_effect = [request, server.STOP])
+        server.q.get_many = Mock(side_effect = [[request, server.STOP]])
         server.log_exception = Mock()
         server.send_loop()
         server.log_exception.assert_called_once_with(
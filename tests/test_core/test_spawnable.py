@@ -47,6 +47,17 @@ class TestSpawnable(unittest.TestCase):
         s.stop()
         f1_stop.assert_called_once_with()
 
+    def test_start_hook(self):
+        s = Spawnable()
+        process = Mock()
+        f1 = Mock()
+        s.add_spawn_function(f1)
+
+        s.start(process, hook=True)
+
+        process.spawn_hook.assert_called_once_with(f1)
+        process.spawn.assert_not_called()
+
     def test_wait_called(self):
         s = Spawnable()
         process = Mock()
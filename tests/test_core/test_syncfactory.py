@@ -4,19 +4,26 @@ sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 import setup_malcolm_paths
 
 import unittest
-from mock import patch
+from threading import Event, Timer
+from multiprocessing import TimeoutError
+from mock import patch, call
 
 # module imports
-from malcolm.core.syncfactory import SyncFactory
+from malcolm.compat import queue
+from malcolm.core.syncfactory import SyncFactory, WorkerPool, \
+    InterruptableQueue, service_loop, is_service_loop, make_service_loop
 
 
 class TestBlock(unittest.TestCase):
 
-    @patch("malcolm.core.syncfactory.ThreadPool")
+    @patch("malcolm.core.syncfactory.WorkerPool")
     def setUp(self, mock_pool):
-        self.s = SyncFactory("sched")
-        mock_pool.assert_called_once_with(128)
+        self.s = SyncFactory("sched", request_workers=4, hook_workers=2,
+                             max_workers=10)
+        self.assertEqual(mock_pool.call_args_list, [
+            call("sched.request", 4, 10), call("sched.hook", 2, 10)])
         self.assertEqual(self.s.pool, mock_pool.return_value)
+        self.assertEqual(self.s.hook_pool, mock_pool.return_value)
 
     def tearDown(self):
         del self.s
@@ -39,5 +46,151 @@ class TestBlock(unittest.TestCase):
             callable, ("fred",), dict(b=43))
         self.assertEqual(r, self.s.pool.apply_async.return_value)
 
+    def test_spawn_hook_calls_hook_pool_apply(self):
+        r = self.s.spawn_hook(callable, "fred")
+        self.s.hook_pool.apply_async.assert_called_once_with(
+            callable, ("fred",), {})
+        self.assertEqual(r, self.s.hook_pool.apply_async.return_value)
+
+
+class TestServiceLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.q = InterruptableQueue()
+        self.timeouts = []
+        self.stopped_at = None
+
+        @service_loop
+        def loop(q):
+            while True:
+                try:
+                    items = yield q, 0.01
+                except queue.Empty:
+                    self.timeouts.append(q)
+                    continue
+                if None in items:
+                    # Python 2 generators can't return a value, and
+                    # raising StopIteration is an error from Python 3.7
+                    self.stopped_at = items.index(None)
+                    return
+
+        self.loop = loop
+
+    def test_runs_in_calling_thread(self):
+        self.q.put_many([1, 2, None])
+        self.loop(self.q)
+        self.assertEqual(self.stopped_at, 2)
+        self.assertEqual(self.timeouts, [])
+
+    def test_timeouts_thrown_in(self):
+        Timer(0.05, self.q.put, (None,)).start()
+        self.loop(self.q)
+        self.assertEqual(self.stopped_at, 0)
+        self.assertIn(self.q, self.timeouts)
+
+    def test_make_service_loop(self):
+        self.assertTrue(is_service_loop(self.loop))
+        self.assertFalse(is_service_loop(callable))
+        self.assertIsNone(make_service_loop(callable, (), {}))
+        loop = make_service_loop(self.loop, (self.q,), {})
+        self.assertEqual(next(loop), (self.q, 0.01))
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.p = WorkerPool("pool", 1, 3)
+
+    def tearDown(self):
+        self.p.close()
+        self.p.join()
+
+    def test_result(self):
+        r = self.p.apply_async(lambda a, b: a + b, (1,), dict(b=2))
+        self.assertEqual(r.get(timeout=1), 3)
+        self.assertTrue(r.ready())
+        self.assertTrue(r.successful())
+
+    def test_exception(self):
+        r = self.p.apply_async(int, ("bad",))
+        r.wait(1)
+        self.assertFalse(r.successful())
+        self.assertRaises(ValueError, r.get)
+
+    def test_timeout(self):
+        e = Event()
+        r = self.p.apply_async(e.wait)
+        self.assertRaises(TimeoutError, r.get, 0.01)
+        e.set()
+        self.assertEqual(r.get(1), True)
+
+    def test_grows_when_busy(self):
+        e = Event()
+        rs = [self.p.apply_async(e.wait) for _ in range(3)]
+        stats = self.p.stats()
+        self.assertEqual(stats["size"], 3)
+        e.set()
+        for r in rs:
+            r.wait(1)
+            self.assertTrue(r.ready())
+        self.assertEqual(self.p.stats()["tasks_run"], 3)
+
+    def test_queues_and_warns_at_max_size(self):
+        e = Event()
+        with patch.object(self.p, "log_warning") as log_warning:
+            rs = [self.p.apply_async(e.wait) for _ in range(5)]
+        self.assertEqual(log_warning.call_count, 1)
+        stats = self.p.stats()
+        self.assertEqual(stats["size"], 3)
+        self.assertEqual(stats["queue_depth"], 2)
+        e.set()
+        for r in rs:
+            r.wait(1)
+            self.assertTrue(r.ready())
+        stats = self.p.stats()
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertEqual(stats["tasks_run"], 5)
+        self.assertGreater(stats["max_wait"], 0)
+
+
+
+class TestInterruptableQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.q = InterruptableQueue()
+
+    def test_put_get(self):
+        self.q.put(1)
+        self.q.put_many([2, 3])
+        self.assertEqual(self.q.qsize(), 3)
+        self.assertEqual(self.q.get(), 1)
+        self.assertEqual(self.q.get_many(), [2, 3])
+        self.assertTrue(self.q.empty())
+
+    def test_get_many_max_items(self):
+        self.q.put_many(range(5))
+        self.assertEqual(self.q.get_many(max_items=2), [0, 1])
+        self.assertEqual(self.q.get_many(max_items=5), [2, 3, 4])
+
+    def test_empty(self):
+        self.assertRaises(queue.Empty, self.q.get, block=False)
+        self.assertRaises(queue.Empty, self.q.get_nowait)
+        self.assertRaises(queue.Empty, self.q.get_many, timeout=0.01)
+
+    def test_wakes_blocked_getter(self):
+        t = Timer(0.05, self.q.put_many, ([1, 2],))
+        t.start()
+        self.assertEqual(self.q.get_many(timeout=1), [1, 2])
+        self.assertFalse(self.q._signalled)
+        t.join()
+        # Wakeup has been consumed, so we should wait again now
+        self.assertRaises(queue.Empty, self.q.get, timeout=0.01)
+
+    def test_no_wakeup_without_getters(self):
+        self.q.put(1)
+        self.assertIsNone(self.q._wakeup_fds)
+        self.assertFalse(self.q._signalled)
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
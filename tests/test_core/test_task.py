@@ -12,6 +12,7 @@ import time
 #module imports
 from malcolm.compat import queue
 from malcolm.core.task import Task
+from malcolm.core.syncfactory import InterruptableQueue
 from malcolm.core import AbortedError, ResponseError, UnexpectedError
 from malcolm.core.spawnable import Spawnable
 from malcolm.core.response import Error, Return, Update, Delta
@@ -36,7 +37,7 @@ class TestTask(unittest.TestCase):
         self.callback_value = ''
         meta = StringMeta("meta for unit tests")
         self.proc = MagicMock(q=queue.Queue())
-        self.proc.create_queue = MagicMock(side_effect=queue.Queue)
+        self.proc.create_queue = MagicMock(side_effect=InterruptableQueue)
         self.block = Block()
         self.block.set_process_path(self.proc, ("testBlock",))
         self.attr = meta.make_attribute()
@@ -52,7 +53,7 @@ class TestTask(unittest.TestCase):
     def test_init(self):
         t = Task("testTask", self.proc)
         self.assertIsInstance(t._logger, logging.Logger)
-        self.assertIsInstance(t.q, queue.Queue)
+        self.assertIsInstance(t.q, InterruptableQueue)
         self.assertEqual(t.process, self.proc)
 
     def test_put_async(self):
@@ -69,14 +70,13 @@ class TestTask(unittest.TestCase):
         t = Task("testTask", self.proc)
         t.put_many_async(self.block, dict(
             testAttr="testValue", testAttr2="testValue2"))
-        reqs = [self.proc.q.get(timeout=0), self.proc.q.get(timeout=0)]
+        req = self.proc.q.get(timeout=0)
         self.assertEqual(self.proc.q.qsize(), 0)
-        self.assertEqual(len(t._futures), 2)
-        values = list(sorted((req.endpoint, req.value) for req in reqs))
-        self.assertEqual(values[0][0], ['testBlock', 'testAttr', 'value'])
-        self.assertEqual(values[0][1], 'testValue')
-        self.assertEqual(values[1][0], ['testBlock', 'testAttr2', 'value'])
-        self.assertEqual(values[1][1], 'testValue2')
+        self.assertEqual(len(t._futures), 1)
+        self.assertEqual(req.typeid, "malcolm:core/PutMany:1.0")
+        self.assertEqual(req.endpoint, ['testBlock'])
+        self.assertEqual(req.values, dict(
+            testAttr="testValue", testAttr2="testValue2"))
 
     def test_put(self):
         # single attribute
@@ -94,17 +94,13 @@ class TestTask(unittest.TestCase):
         # many attributes
         t = Task("testTask", self.proc)
         resp1 = Return(1, None, None)
-        resp1.set_value('testVal1')
-        resp2 = Return(2, None, None)
-        resp2.set_value('testVal2')
         # cheat and add the response before the blocking call to put
         t.q.put(resp1)
-        t.q.put(resp2)
         t.stop()
         t.put_many(self.block, dict(
             testAttr="testValue", testAttr2="testValue2"))
         self.assertEqual(len(t._futures), 0)
-        self.assertEqual(self.proc.q.qsize(), 2)
+        self.assertEqual(self.proc.q.qsize(), 1)
 
     def test_post(self):
         t = Task("testTask", self.proc)
@@ -9,7 +9,7 @@ import setup_malcolm_paths
 from mock import MagicMock, patch
 
 from malcolm.core.vmetas import PointGeneratorMeta
-from scanpointgenerator import CompoundGenerator
+from scanpointgenerator import CompoundGenerator, LineGenerator
 
 
 class TestPointGeneratorMeta(unittest.TestCase):
@@ -25,15 +25,29 @@ class TestPointGeneratorMeta(unittest.TestCase):
         g = CompoundGenerator([MagicMock()], [], [])
         self.PGM.validate(g)
 
+    @patch('malcolm.core.vmetas.pointgeneratormeta.prepared_generators')
     @patch('malcolm.core.vmetas.pointgeneratormeta.CompoundGenerator.from_dict')
-    def test_validate_dict_then_create_and_return(self, from_dict_mock):
+    def test_validate_dict_then_create_and_return(self, from_dict_mock,
+                                                  prepared_mock):
         gen_mock = MagicMock()
         from_dict_mock.return_value = gen_mock
+        prepared_mock.find_serialized.return_value = None
         d = dict()
         response = self.PGM.validate(d)
+        prepared_mock.find_serialized.assert_called_once_with(d)
         from_dict_mock.assert_called_once_with(d)
         self.assertEqual(gen_mock, response)
 
+    @patch('malcolm.core.vmetas.pointgeneratormeta.prepared_generators')
+    @patch('malcolm.core.vmetas.pointgeneratormeta.CompoundGenerator.from_dict')
+    def test_validate_dict_returns_prepared(self, from_dict_mock,
+                                            prepared_mock):
+        g = CompoundGenerator([LineGenerator("x", "mm", 0, 1, 3)], [], [])
+        response = self.PGM.validate(g.to_dict())
+        self.assertEqual(
+            prepared_mock.find_serialized.return_value.generator, response)
+        from_dict_mock.assert_not_called()
+
     def test_validate_raises(self):
         with self.assertRaises(TypeError):
             self.PGM.validate(7)
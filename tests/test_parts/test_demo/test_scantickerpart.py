@@ -4,10 +4,11 @@ sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
 import setup_malcolm_paths
 
 import unittest
-from mock import Mock, MagicMock, call, ANY
+from mock import Mock, MagicMock, call, ANY, patch
 
 from scanpointgenerator import LineGenerator, CompoundGenerator
 
+from malcolm.core.preparedgenerator import PreparedGenerator
 from malcolm.parts.demo.scantickerpart import ScanTickerPart
 
 
@@ -60,6 +61,31 @@ class TestScanTickerPart(unittest.TestCase):
             call.put(self.child['counter'], 2),
             call.sleep(AlmostFloat(2.0, delta=0.1))])
 
+    @patch("malcolm.core.preparedgenerator.POINTS_PER_FILL", 2)
+    @patch("malcolm.parts.demo.scantickerpart.POINTS_PER_FILL", 2)
+    @patch("malcolm.parts.demo.scantickerpart.prepared_generators")
+    def test_run_gets_points_a_fill_at_a_time(self, prepared_generators):
+        line1 = LineGenerator('AxisOne', 'mm', 0, 2, 3)
+        line2 = LineGenerator('AxisTwo', 'mm', 0, 2, 2)
+        compound = CompoundGenerator([line1, line2], [], [], 1.0)
+        params = ScanTickerPart.configure.MethodMeta.prepare_input_map(
+            generator=compound, axesToMove=['AxisTwo'])
+        self.o.configure(MagicMock(), 1, 4, MagicMock(), params)
+        prepared = PreparedGenerator(compound)
+        prepared_generators.get.return_value = Mock(
+            wraps=prepared, get_points=Mock(wraps=prepared.get_points))
+        task = MagicMock()
+        update_completed_steps = MagicMock()
+        self.o.run(task, update_completed_steps)
+        self.assertEqual(
+            prepared_generators.get.return_value.get_points.call_args_list,
+            [call(1, 2), call(2, 4), call(4, 5)])
+        self.assertEqual(
+            [c[0][1] for c in task.put.call_args_list], [2, 0, 2, 0])
+        self.assertEqual(
+            update_completed_steps.call_args_list,
+            [call(i, self.o) for i in range(2, 6)])
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -7,9 +7,15 @@ import setup_malcolm_paths
 import unittest
 from mock import MagicMock, call, patch
 
+import numpy as np
+
 Mock = MagicMock
 
-from malcolm.parts.pmac.pmactrajectorypart import PMACTrajectoryPart, MotorInfo
+from multiprocessing import TimeoutError
+
+from malcolm.parts.pmac import pmactrajectorypart
+from malcolm.parts.pmac.pmactrajectorypart import PMACTrajectoryPart, \
+    MotorInfo, PREBUILD_TIMEOUT, build_profile_in_worker, close_build_pool
 from scanpointgenerator import LineGenerator, CompoundGenerator
 
 
@@ -233,6 +239,33 @@ class TestMotorPVT(unittest.TestCase):
         self.assertEqual(time_array, [0.0, 0.25, 0.75, 0.875, 1.375, 1.625])
         self.assertEqual(velocity_array, [v1, 0, 1, 1, 0, v2])
 
+    def test_hat_to_different_velocity(self):
+        #   |  ____
+        # 0_| /    \
+        v1 = 0.0
+        v2 = 0.5
+        distance = 2.0
+        time_array, velocity_array = self.o.make_velocity_profile(
+            v1, v2, distance, 0.0)
+        self.assertEqual(time_array, [0.0, 0.5, 2.0625, 2.3125])
+        self.assertEqual(velocity_array, [v1, 1, 1, v2])
+
+    def test_segments_for_many_moves(self):
+        v1 = np.array([0.1, 0.5, 0.0, -0.5])
+        v2 = np.array([-0.1, 0.5, 0.0, -0.5])
+        distance = np.array([0.0, 0.125, 0.5, 0.5])
+        min_time = np.array([2.0, 0.5, 0.0, 0.0])
+        segments = self.o.make_velocity_segments(v1, v2, distance, min_time)
+        for i in range(4):
+            t1, vm, tm, t2 = [x[i] for x in segments]
+            self.assertEqual(
+                self.o.profile_from_segments(v1[i], v2[i], t1, vm, tm, t2),
+                self.o.make_velocity_profile(
+                    v1[i], v2[i], distance[i], min_time[i]))
+        np.testing.assert_allclose(
+            self.o.min_profile_time(v1, v2, distance),
+            [0.1, np.sqrt(0.5) - 0.5, 1.0, 1.625])
+
 
 class TestPMACTrajectoryPart(unittest.TestCase):
     maxDiff = None
@@ -250,6 +283,17 @@ class TestPMACTrajectoryPart(unittest.TestCase):
             name="pmac", mri="TST-PMAC"
         )
         self.process.get_block.return_value = self.child
+
+        def spawn(function, *args):
+            # Build the next points straight away
+            return MagicMock(get=MagicMock(return_value=function(*args)))
+
+        self.process.spawn.side_effect = spawn
+        # Build in the Process rather than a pool of worker processes
+        patcher = patch(
+            "malcolm.parts.pmac.pmactrajectorypart.BUILD_PROCESSES", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.o = PMACTrajectoryPart(self.process, self.params)
         list(self.o.create_attributes())
 
@@ -394,11 +438,20 @@ class TestPMACTrajectoryPart(unittest.TestCase):
         self.assertEqual(positionsA[-1], 0.375)
         self.assertEqual(self.o.end_index, 4)
         self.assertEqual(len(self.o.completed_steps_lookup), 11)
+        # The next points are built straight after configure
+        self.assertEqual(self.o.prebuilt[0], 6)
+        time_array = task.put_many.call_args_list[3][0][1]["timeArray"]
+        self.assertAlmostEqual(
+            self.o.buffer_headroom.value, sum(time_array) * 1e-6)
         update_completed_steps = MagicMock()
         task = MagicMock()
         self.o.update_step(3, update_completed_steps, task)
         update_completed_steps.assert_called_once_with(1, self.o)
+        self.assertAlmostEqual(
+            self.o.buffer_headroom.value, sum(time_array[3:]) * 1e-6)
         self.assertEqual(self.o.loading, False)
+        self.assertEqual(self.o.end_index, 6)
+        self.assertEqual(self.o.prebuilt, None)
         self.assertEqual(task.put_many.call_count, 2)
         self.assertEqual(task.post.call_count, 1)
         self.check_resolutions_and_use(task.put_many.call_args_list[0][0][1])
@@ -417,6 +470,171 @@ class TestPMACTrajectoryPart(unittest.TestCase):
             positionsB=[
                 0.1, 0.1, 0.1, 0.1, 0.1]))
 
+    @patch("malcolm.parts.pmac.pmactrajectorypart.POINTS_PER_BUILD", 4)
+    @patch("malcolm.parts.pmac.pmactrajectorypart.INTERPOLATE_INTERVAL", 0.2)
+    def test_update_step_uses_reload_threshold(self):
+        self.do_configure(axes_to_scan=["x", "y"])
+        self.o.points_per_build = 100
+        self.o.reload_threshold = 2
+        task = MagicMock()
+        # 3 loaded points left to scan, more than reload_threshold
+        self.o.update_step(3, MagicMock(), task)
+        self.assertEqual(self.o.end_index, 4)
+        self.assertEqual(self.o.prebuilt[0], 6)
+        task.post.assert_not_called()
+
+    @patch("malcolm.parts.pmac.pmactrajectorypart.POINTS_PER_BUILD", 4)
+    @patch("malcolm.parts.pmac.pmactrajectorypart.INTERPOLATE_INTERVAL", 0.2)
+    def test_update_step_build_timeout(self):
+        self.do_configure(axes_to_scan=["x", "y"])
+        spawned = MagicMock()
+        spawned.ready.return_value = False
+        spawned.get.side_effect = TimeoutError()
+        self.o.prebuilt = (6, spawned)
+        self.o.log_warning = MagicMock()
+        with self.assertRaises(TimeoutError) as cm:
+            self.o.update_step(3, MagicMock(), MagicMock())
+        spawned.get.assert_called_once_with(PREBUILD_TIMEOUT)
+        self.assertEqual(
+            str(cm.exception),
+            "Building points 4 to 6 took longer than %ss" % PREBUILD_TIMEOUT)
+        self.o.log_warning.assert_called_once()
+
+    @patch("malcolm.parts.pmac.pmactrajectorypart.POINTS_PER_BUILD", 4)
+    @patch("malcolm.parts.pmac.pmactrajectorypart.INTERPOLATE_INTERVAL", 0.2)
+    def test_configure_discards_prebuild(self):
+        self.do_configure(axes_to_scan=["x", "y"])
+        spawned = MagicMock()
+        self.o.prebuilt = (6, spawned)
+        self.do_configure(axes_to_scan=["x", "y"])
+        # The old build was not waited for before the new one was started
+        spawned.get.assert_not_called()
+        self.assertIsNot(self.o.prebuilt[1], spawned)
+
+    def test_abort_discards_prebuild(self):
+        spawned = MagicMock()
+        self.o.prebuilt = (6, spawned)
+        self.o.abort(MagicMock())
+        spawned.get.assert_not_called()
+        self.assertIsNone(self.o.prebuilt)
+
+    @patch("malcolm.parts.pmac.pmactrajectorypart.POINTS_PER_BUILD", 4)
+    @patch("malcolm.parts.pmac.pmactrajectorypart.INTERPOLATE_INTERVAL", 0.2)
+    def test_update_step_ignores_build_discarded_while_waiting(self):
+        self.do_configure(axes_to_scan=["x", "y"])
+        spawned = MagicMock()
+        spawned.ready.return_value = False
+        profile, build_time = self.o.prebuilt[1].get()
+
+        def get(timeout):
+            # Aborted while we waited for the build to finish
+            self.o.abort(MagicMock())
+            return profile, build_time
+
+        spawned.get.side_effect = get
+        self.o.prebuilt = (6, spawned)
+        self.o.log_warning = MagicMock()
+        task = MagicMock()
+        self.o.update_step(3, MagicMock(), task)
+        task.put_many.assert_not_called()
+        task.post.assert_not_called()
+        self.assertEqual(self.o.end_index, 4)
+        self.assertIsNone(self.o.prebuilt)
+        self.assertEqual(self.o.loading, False)
+
+    @patch("malcolm.parts.pmac.pmactrajectorypart.POINTS_PER_BUILD", 4)
+    @patch("malcolm.parts.pmac.pmactrajectorypart.INTERPOLATE_INTERVAL", 0.2)
+    def test_update_step_after_abort(self):
+        self.do_configure(axes_to_scan=["x", "y"])
+        self.o.abort(MagicMock())
+        task = MagicMock()
+        self.o.update_step(3, MagicMock(), task)
+        task.put_many.assert_not_called()
+        self.assertEqual(self.o.end_index, 4)
+
+    @patch("malcolm.parts.pmac.pmactrajectorypart.BUILD_PROCESSES", 1)
+    @patch("malcolm.parts.pmac.pmactrajectorypart.get_build_pool")
+    @patch("malcolm.parts.pmac.pmactrajectorypart.POINTS_PER_BUILD", 4)
+    @patch("malcolm.parts.pmac.pmactrajectorypart.INTERPOLATE_INTERVAL", 0.2)
+    def test_prebuild_in_build_pool(self, get_build_pool):
+        def apply_async(function, args):
+            return MagicMock(get=MagicMock(return_value=function(*args)))
+
+        get_build_pool.return_value.apply_async.side_effect = apply_async
+        self.do_configure(axes_to_scan=["x", "y"])
+        self.process.spawn.assert_not_called()
+        # Once to start the workers early, once for the prebuild
+        self.assertEqual(get_build_pool.call_count, 2)
+        function, args = \
+            get_build_pool.return_value.apply_async.call_args[0]
+        self.assertIs(function, build_profile_in_worker)
+        # The generator is sent serialized
+        self.assertEqual(args[0], self.o.generator.to_dict())
+        self.assertEqual(args[2:], (4, 6, True, 0.0))
+        profile, _ = self.o.prebuilt[1].get()
+        expected, _ = self.o.timed_build_profile(
+            self.o.generator, self.o.axis_mapping, 4, 6, True, 0.0)
+        self.assertEqual(sorted(profile), sorted(expected))
+        for k, v in expected.items():
+            if k == "trajectory":
+                for axis_name, positions in v.items():
+                    np.testing.assert_allclose(
+                        profile[k][axis_name], positions)
+            else:
+                np.testing.assert_allclose(profile[k], v)
+
+    def test_close_build_pool(self):
+        pool = MagicMock()
+        with patch.object(pmactrajectorypart, "_build_pool", pool):
+            close_build_pool()
+            self.assertIsNone(pmactrajectorypart._build_pool)
+        pool.terminate.assert_called_once_with()
+        pool.join.assert_called_once_with()
+
+    @patch("malcolm.parts.pmac.pmactrajectorypart.POINTS_PER_BUILD", 100)
+    @patch("malcolm.parts.pmac.pmactrajectorypart.MAX_POINTS_PER_BUILD", 1000)
+    def test_calculate_reload_threshold(self):
+        # Writing takes 0.1s, so 20 points would do
+        self.assertEqual(self.o.calculate_reload_threshold(100.0, 0.1), 100)
+        # 100 points a second and 2s to write needs 400
+        self.assertEqual(self.o.calculate_reload_threshold(100.0, 2.0), 400)
+        # Never more than calculate_points_per_build gives
+        self.assertEqual(self.o.calculate_reload_threshold(1000.0, 2.0), 1000)
+        self.assertLessEqual(
+            self.o.calculate_reload_threshold(100.0, 0.5),
+            self.o.calculate_points_per_build(100.0, 0.001, 0.5))
+
+    @patch("malcolm.parts.pmac.pmactrajectorypart.POINTS_PER_BUILD", 100)
+    @patch("malcolm.parts.pmac.pmactrajectorypart.MAX_POINTS_PER_BUILD", 1000)
+    def test_calculate_points_per_build(self):
+        # Quick to build and write, so the minimum will do
+        self.assertEqual(
+            self.o.calculate_points_per_build(100.0, 0.0001, 0.1), 100)
+        # 100 points a second, each taking 1ms to build and 0.5s to write.
+        # We need n / 100 >= 2 * (0.5 + n * 0.001), so n >= 1 / 0.008
+        self.assertEqual(
+            self.o.calculate_points_per_build(100.0, 0.001, 0.5), 125)
+        # Can't build faster than we scan
+        self.assertEqual(
+            self.o.calculate_points_per_build(1000.0, 0.001, 0.1), 1000)
+
+    def test_consistent_segments_for_many_moves(self):
+        part_info = self.make_part_info()
+        _, self.o.axis_mapping = self.o._make_axis_mapping(
+            part_info, ["x", "y"])
+        v1s = dict(x=np.array([0.125, -0.125, 0.0]), y=np.zeros(3))
+        v2s = dict(x=np.array([-0.125, 0.125, 0.0]), y=np.zeros(3))
+        distances = dict(x=np.array([0.0, 0.0, 0.5]),
+                         y=np.array([0.05, 0.05, 0.0]))
+        move_times, segments = self.o.make_consistent_velocity_segments(
+            v1s, v2s, distances, 0.002)
+        # y limits the turnarounds, x gets to max_velocity in the step
+        np.testing.assert_allclose(
+            move_times, [2 * np.sqrt(0.05 / 2.5), 2 * np.sqrt(0.05 / 2.5),
+                         0.9])
+        for axis_name, (t1, vm, tm, t2) in segments.items():
+            np.testing.assert_allclose(t1 + tm + t2, move_times)
+
     def test_run(self):
         task = Mock()
         update = Mock()
@@ -479,6 +697,52 @@ class TestPMACTrajectoryPart(unittest.TestCase):
                          [3, 3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 6, 6])
 
 
+    @patch("malcolm.parts.pmac.pmactrajectorypart.INTERPOLATE_INTERVAL", 0.2)
+    def test_same_turnarounds_solved_once(self):
+        part_info = self.make_part_info(x_pos=-0.1375)
+        task = Mock()
+        params = Mock()
+        xs = LineGenerator("x", "mm", 0.0, 0.5, 3)
+        ys = LineGenerator("y", "mm", 0.0, 0.75, 4)
+        params.generator = CompoundGenerator([ys, xs], [], [], 1.0)
+        params.generator.prepare()
+        params.axesToMove = ["x", "y"]
+        with patch.object(self.o, "make_consistent_velocity_segments",
+                          wraps=self.o.make_consistent_velocity_segments) \
+                as make_segments:
+            self.o.configure(task, 0, 12, part_info, params)
+        # One for the move to start, one for all 3 turnarounds
+        self.assertEqual(make_segments.call_count, 2)
+        v1s = make_segments.call_args_list[1][0][0]
+        self.assertEqual(len(v1s["x"]), 1)
+        args = task.put_many.call_args_list[-1][0][1]
+        self.assertEqual(args["userPrograms"].count(2), 4)
+        self.assertEqual(args["positionsB"][-1], 0.75)
+        self.assertEqual(len(args["timeArray"]), len(args["positionsA"]))
+        self.assertEqual(self.o.completed_steps_lookup[-1], 12)
+
+    def test_time_ticks_rounding(self):
+        task = Mock()
+        self.o.write_profile_points(
+            task, [0.0000004] * 10 + [0.0000015], [0] * 11, {}, [0] * 11)
+        time_array = task.put_many.call_args_list[1][0][1]["timeArray"]
+        self.assertEqual(time_array, [0, 1, 0, 1, 0, 0, 1, 0, 1, 0, 2])
+
+    def test_consecutive_long_moves(self):
+        task = Mock()
+        self.o.axis_mapping = dict(x=self.make_part_info()["xpart"][0])
+        self.o.completed_steps_lookup = []
+        self.o.write_profile_points(
+            task, [0.5, 5.0, 9.0], [2, 0, 1], dict(x=[0.0, 1.0, 4.0]),
+            [3, 4, 2], [0, 1, 2])
+        args = task.put_many.call_args_list[1][0][1]
+        self.assertEqual(args["timeArray"], [
+            500000, 2500000, 2500000, 3000000, 3000000, 3000000])
+        self.assertEqual(args["velocityMode"], [2, 0, 0, 0, 0, 1])
+        self.assertEqual(args["userPrograms"], [3, 0, 4, 0, 0, 2])
+        self.assertEqual(args["positionsA"], [0.0, 0.5, 1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(self.o.completed_steps_lookup, [0, 0, 1, 1, 1, 2])
+
     @patch("malcolm.parts.pmac.pmactrajectorypart.INTERPOLATE_INTERVAL", 2.0)
     def test_long_move(self):
         task = self.do_configure(axes_to_scan=["x"], x_pos=-10.1375)